@@ -0,0 +1,239 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Estimating how long the deployment of an appstack takes - the critical path through the
+dependency graph of applications, the makespan of a parallel deployment and the applications
+whose dependencies stretch it the most.
+"""
+
+from collections import namedtuple
+import heapq
+import logging
+
+from .app_graph import add_order_barriers, get_deployment_graph, get_deployment_waves
+from .deployer import is_push_enabled
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+# seconds
+DEFAULT_APP_DURATION = 60.0
+
+LimitingApp = namedtuple('LimitingApp', ['name', 'makespan_reduction', 'dependencies', 'order'])
+
+AppstackAnalysis = namedtuple('AppstackAnalysis', [
+    'app_count', 'wave_count', 'parallel', 'total_duration', 'critical_path',
+    'critical_path_duration', 'makespan', 'makespan_lower_bound', 'limiting_apps'])
+
+
+def get_app_durations(apps, deployment_history, declared_durations,
+                      default_duration=DEFAULT_APP_DURATION):
+    """
+    Args:
+        apps (list[`apployer.appstack.AppConfig`]): Applications.
+        deployment_history (`apployer.history.DeploymentHistory`): Durations of previous
+            deployments.
+        declared_durations (dict[str,float]): Application names mapped to their expected
+            deployment durations. They take precedence over the history.
+        default_duration (float): Duration of applications that are neither in the history nor
+            declared.
+
+    Returns:
+        dict[str,float]: Application names mapped to their expected deployment durations
+            (in seconds).
+    """
+    durations = {}
+    unknown_app_names = []
+    for app in apps:
+        duration = declared_durations.get(app.name)
+        if duration is None:
+            duration = deployment_history.get_expected_duration(app.name)
+        if duration is None:
+            duration = default_duration
+            unknown_app_names.append(app.name)
+        durations[app.name] = float(duration)
+    if unknown_app_names:
+        _log.info('Durations of %s apps are unknown, assuming %s seconds for: %s',
+                  len(unknown_app_names), default_duration, ', '.join(unknown_app_names))
+    return durations
+
+
+def get_critical_path(app_graph, durations):
+    """Finds the longest (in time) chain of dependent applications. Even with unlimited
+    parallelism the deployment can't be shorter.
+
+    Args:
+        app_graph (`apployer.app_graph.AppGraph`): Dependency graph of applications, with
+            the barriers of applications pinned with "order" parameter
+            (see `apployer.app_graph.add_order_barriers`).
+        durations (dict[str,float]): Application names mapped to their deployment durations.
+
+    Returns:
+        list[`apployer.appstack.AppConfig`]: Applications on the critical path, in deployment
+            order.
+    """
+    finish_times = {}
+    critical_dependencies = {}
+    for wave in app_graph.get_waves():
+        for app in wave:
+            dependencies = app_graph.get_dependencies(app)
+            start_time = 0.0
+            if dependencies:
+                critical_dependency = max(dependencies, key=lambda dep: finish_times[id(dep)])
+                critical_dependencies[id(app)] = critical_dependency
+                start_time = finish_times[id(critical_dependency)]
+            finish_times[id(app)] = start_time + durations[app.name]
+
+    if not app_graph.apps:
+        return []
+    critical_path = [max(app_graph.apps, key=lambda app: finish_times[id(app)])]
+    while id(critical_path[-1]) in critical_dependencies:
+        critical_path.append(critical_dependencies[id(critical_path[-1])])
+    critical_path.reverse()
+    return critical_path
+
+
+def estimate_makespan(waves, durations, parallel):
+    """Simulates the deployment done by "apployer deploy --parallel". Waves are deployed one after
+    another and applications in each wave are started longest first, whenever one of the parallel
+    deployments finishes.
+
+    Args:
+        waves (list[list[`apployer.appstack.AppConfig`]]): Deployment waves.
+        durations (dict[str,float]): Application names mapped to their deployment durations.
+        parallel (int): Maximum number of applications deployed at the same time.
+
+    Returns:
+        float: Duration of the whole deployment of the applications.
+    """
+    makespan = 0.0
+    for wave in waves:
+        finish_times = [0.0] * min(parallel, len(wave))
+        for app in sorted(wave, key=lambda app: durations[app.name], reverse=True):
+            start_time = heapq.heappop(finish_times)
+            heapq.heappush(finish_times, start_time + durations[app.name])
+        makespan += max(finish_times)
+    return makespan
+
+
+def get_limiting_apps(app_graph, sorted_apps, durations, parallel):
+    """Finds applications whose dependencies limit the concurrency of the deployment - the ones
+    that would shorten it the most if their dependencies were broken up. For applications pinned
+    with "order" parameter, it's the pin that is dropped (their dependencies are kept).
+
+    Args:
+        app_graph (`apployer.app_graph.AppGraph`): Dependency graph of applications.
+        sorted_apps (list[`apployer.appstack.AppConfig`]): Applications in deployment order.
+        durations (dict[str,float]): Application names mapped to their deployment durations.
+        parallel (int): Maximum number of applications deployed at the same time.
+
+    Returns:
+        list[`LimitingApp`]: Applications which dependencies stretch the deployment,
+            the most limiting first.
+    """
+    # a copy, it's modified below
+    app_graph = app_graph.get_subgraph(sorted_apps)
+    makespan = estimate_makespan(get_deployment_waves(app_graph, sorted_apps), durations, parallel)
+    pinned_apps = [app for app in sorted_apps if app.is_ordered]
+    limiting_apps = []
+    for app in sorted_apps:
+        dependencies = app_graph.get_dependencies(app)
+        if app.is_ordered:
+            barrier_graph = add_order_barriers(
+                app_graph.get_subgraph(sorted_apps), sorted_apps,
+                [pinned_app for pinned_app in pinned_apps if pinned_app is not app])
+            independent_makespan = estimate_makespan(barrier_graph.get_waves(), durations, parallel)
+        elif dependencies:
+            for dependency in dependencies:
+                app_graph.remove_dependency(app, dependency)
+            independent_makespan = estimate_makespan(
+                get_deployment_waves(app_graph, sorted_apps), durations, parallel)
+            for dependency in dependencies:
+                app_graph.add_dependency(app, dependency)
+        else:
+            continue
+
+        if independent_makespan < makespan:
+            limiting_apps.append(LimitingApp(
+                app.name, makespan - independent_makespan,
+                [dependency.name for dependency in dependencies],
+                app.order if app.is_ordered else None))
+    return sorted(limiting_apps, key=lambda limiting_app: limiting_app.makespan_reduction,
+                  reverse=True)
+
+
+def analyze_appstack(appstack, durations, parallel):
+    """Estimates the deployment of the appstack.
+
+    Args:
+        appstack (`apployer.appstack.AppStack`): Expanded appstack.
+        durations (dict[str,float]): Application names mapped to their deployment durations.
+        parallel (int): Maximum number of applications deployed at the same time.
+
+    Returns:
+        `AppstackAnalysis`: The estimates.
+    """
+    apps = [app for app in appstack.apps if is_push_enabled(app.push_if)]
+    app_graph = get_deployment_graph(appstack).get_subgraph(apps)
+    waves = get_deployment_waves(app_graph, apps)
+    critical_path = get_critical_path(
+        add_order_barriers(app_graph.get_subgraph(apps), apps), durations)
+    total_duration = sum(durations[app.name] for app in apps)
+    critical_path_duration = sum(durations[app.name] for app in critical_path)
+    return AppstackAnalysis(
+        app_count=len(apps),
+        wave_count=len(waves),
+        parallel=parallel,
+        total_duration=total_duration,
+        critical_path=[app.name for app in critical_path],
+        critical_path_duration=critical_path_duration,
+        makespan=estimate_makespan(waves, durations, parallel),
+        makespan_lower_bound=max(critical_path_duration, total_duration / parallel),
+        limiting_apps=get_limiting_apps(app_graph, apps, durations, parallel))
+
+
+def format_analysis(analysis, durations, limiting_app_count=10):
+    """
+    Args:
+        analysis (`AppstackAnalysis`): The estimates.
+        durations (dict[str,float]): Application names mapped to their deployment durations.
+        limiting_app_count (int): How many of the most limiting applications to show.
+
+    Returns:
+        str: Human readable report.
+    """
+    lines = [
+        'Applications: {}, deployment waves: {}'.format(analysis.app_count, analysis.wave_count),
+        'Serial deployment: {:.0f} s'.format(analysis.total_duration),
+        'Critical path: {:.0f} s'.format(analysis.critical_path_duration),
+    ]
+    lines.extend('    {:<40} {:>8.0f} s'.format(name, durations[name])
+                 for name in analysis.critical_path)
+    lines.append('Estimated makespan with parallelism {}: {:.0f} s (lower bound: {:.0f} s)'.format(
+        analysis.parallel, analysis.makespan, analysis.makespan_lower_bound))
+    if analysis.limiting_apps:
+        lines.append('Apps whose dependencies most limit concurrency (makespan reduction without '
+                     'the dependencies, or without the "order" pin):')
+        lines.extend('    {:<40} {:>8.0f} s  {}'.format(
+            app.name, app.makespan_reduction, _format_limitation(app))
+                     for app in analysis.limiting_apps[:limiting_app_count])
+    return '\n'.join(lines)
+
+
+def _format_limitation(limiting_app):
+    if limiting_app.order is not None:
+        return 'pinned with order: {}'.format(limiting_app.order)
+    return 'depends on: {}'.format(', '.join(limiting_app.dependencies))
@@ -18,13 +18,20 @@
 Utilities for handling application artifacts.
 """
 
+import functools
+import glob
+import hashlib
 import os
 from os import path
 import re
+from zipfile import ZipFile, ZIP_DEFLATED
 
 
 # match all up to a dash followed by a "v" and a digit or by a digit only (e.g. -0, -v1)
 _ARTIFACT_NAME_EXTRACTOR = re.compile(r'(.*?)(?:\-v?\d)')
+_HASHING_CHUNK_SIZE = 1024 * 1024
+# mode of files which permissions weren't stored in the ZIP
+_DEFAULT_FILE_MODE = 0o644
 
 
 def get_artifact_name(artifact_zip_path):
@@ -65,3 +72,82 @@ def get_file_path(file_part_name, directory):
             return path.join(full_dir, file_name)
     raise IOError('File with partial name "{}" not found in directory "{}"'
                   .format(file_part_name, full_dir))
+
+
+def get_artifact_path(artifacts_location, artifact_name):
+    """Gets the path to the artifact of an application.
+
+    Args:
+        artifacts_location (str): Path to a directory containing artifacts in ZIP format.
+        artifact_name (str): Name of the artifact (see `get_artifact_name`).
+
+    Returns:
+        str: Path to the artifact.
+
+    Raises:
+        IOError: Artifact wasn't found.
+    """
+    artifact_partial_path = path.join(artifacts_location, artifact_name)
+    try:
+        return glob.glob('{}*'.format(artifact_partial_path))[0]
+    except IndexError:
+        raise IOError("Didn't find any artifact matching to path {}"
+                      .format(artifact_partial_path))
+
+
+def get_file_sha1(file_path):
+    """
+    Args:
+        file_path (str): Path to a file.
+
+    Returns:
+        str: SHA1 hex digest of file's contents.
+    """
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(_HASHING_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_zip_resources(zip_path):
+    """Describes the files in a ZIP archive the way Cloud Controller's resource matching
+    and application bits upload expect. Files are hashed straight from the archive,
+    without extracting it.
+
+    Args:
+        zip_path (str): Path to a ZIP archive.
+
+    Returns:
+        list[dict]: Descriptions of the files (directories are skipped). Each one has
+            "fn" (path in the archive), "size", "sha1" and "mode" (octal string) keys.
+    """
+    resources = []
+    with ZipFile(zip_path) as zip_file:
+        for info in zip_file.infolist():
+            if info.filename.endswith('/'):
+                continue
+            file_hash = hashlib.sha1()
+            with zip_file.open(info) as zipped_file:
+                for chunk in iter(functools.partial(zipped_file.read, _HASHING_CHUNK_SIZE), b''):
+                    file_hash.update(chunk)
+            mode = (info.external_attr >> 16) & 0o777 or _DEFAULT_FILE_MODE
+            resources.append({'fn': info.filename, 'size': info.file_size,
+                              'sha1': file_hash.hexdigest(), 'mode': '{:04o}'.format(mode)})
+    return resources
+
+
+def copy_zip_files(source_zip_path, file_names, target_file):
+    """Writes a ZIP archive containing only some of the files from another archive.
+    Files are copied one by one, without extracting the whole source archive.
+
+    Args:
+        source_zip_path (str): Path to the source ZIP archive.
+        file_names (list[str]): Paths (in the archive) of the files to copy.
+        target_file (file): File object to which the new archive will be written.
+    """
+    with ZipFile(source_zip_path) as source_zip, \
+            ZipFile(target_file, 'w', ZIP_DEFLATED) as target_zip:
+        for file_name in file_names:
+            info = source_zip.getinfo(file_name)
+            target_zip.writestr(info, source_zip.read(info))
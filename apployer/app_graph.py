@@ -0,0 +1,313 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Dependency graph of applications. It's pure Python, so it can be used without networkx.
+"""
+
+import itertools
+import logging
+
+from .appstack import MalformedAppStackError
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+
+class AppGraph(object):
+    """Directed graph in which an edge from app A to app B means that A requires B to be deployed
+    first. Applications are kept in the order in which they were given, and this order is used
+    whenever the graph doesn't determine one.
+
+    Attributes:
+        apps (list[`apployer.appstack.AppConfig`]): All applications (nodes of the graph).
+
+    Args:
+        apps (list[`apployer.appstack.AppConfig`]): See class attributes.
+    """
+
+    def __init__(self, apps):
+        self.apps = list(apps)
+        # Applications are compared by identity, not by value (like nodes in networkx graphs).
+        self._indices = {id(app): index for index, app in enumerate(self.apps)}
+        self._dependencies = [set() for _ in self.apps]
+
+    def add_dependency(self, app, required_app):
+        """Marks that an application requires another one to be deployed first.
+
+        Args:
+            app (`apployer.appstack.AppConfig`): The dependent application.
+            required_app (`apployer.appstack.AppConfig`): Application it depends on.
+        """
+        self._dependencies[self._indices[id(app)]].add(self._indices[id(required_app)])
+
+    def remove_dependency(self, app, required_app):
+        """Removes the dependency added with `add_dependency`.
+
+        Args:
+            app (`apployer.appstack.AppConfig`): The dependent application.
+            required_app (`apployer.appstack.AppConfig`): Application it depends on.
+        """
+        self._dependencies[self._indices[id(app)]].discard(self._indices[id(required_app)])
+
+    def get_dependencies(self, app):
+        """
+        Args:
+            app (`apployer.appstack.AppConfig`): An application.
+
+        Returns:
+            list[`apployer.appstack.AppConfig`]: Applications that the given one depends on.
+        """
+        return [self.apps[index] for index in sorted(self._dependencies[self._indices[id(app)]])]
+
+    def get_edges(self):
+        """
+        Returns:
+            list[tuple]: Pairs of (dependent app, required app).
+        """
+        return [(self.apps[index], self.apps[required_index])
+                for index, dependencies in enumerate(self._dependencies)
+                for required_index in sorted(dependencies)]
+
+    def get_subgraph(self, apps):
+        """
+        Args:
+            apps (list[`apployer.appstack.AppConfig`]): Some of the applications from the graph.
+
+        Returns:
+            `AppGraph`: Graph of the given applications and dependencies between them.
+        """
+        subgraph = AppGraph(apps)
+        app_ids = {id(app) for app in apps}
+        for app, required_app in self.get_edges():
+            if id(app) in app_ids and id(required_app) in app_ids:
+                subgraph.add_dependency(app, required_app)
+        return subgraph
+
+    def get_closure(self, apps, with_dependencies=True, with_dependents=False):
+        """
+        Args:
+            apps (list[`apployer.appstack.AppConfig`]): Some of the applications from the graph.
+            with_dependencies (bool): Should the applications that the given ones (transitively)
+                depend on be included.
+            with_dependents (bool): Should the applications (transitively) depending on the given
+                ones be included.
+
+        Returns:
+            list[`apployer.appstack.AppConfig`]: The given applications with the included ones,
+                in the order of the graph.
+        """
+        dependents = [[] for _ in self.apps]
+        for index, dependencies in enumerate(self._dependencies):
+            for required_index in dependencies:
+                dependents[required_index].append(index)
+
+        reached = set()
+        to_visit = [self._indices[id(app)] for app in apps]
+        while to_visit:
+            index = to_visit.pop()
+            if index in reached:
+                continue
+            reached.add(index)
+            if with_dependencies:
+                to_visit.extend(self._dependencies[index])
+            if with_dependents:
+                to_visit.extend(dependents[index])
+        return [self.apps[index] for index in sorted(reached)]
+
+    def get_waves(self):
+        """Assigns applications to deployment waves (Kahn's algorithm, linear in the size of the
+        graph). All dependencies of an application are in the waves preceding its own, so all
+        applications from a single wave can be deployed in parallel.
+
+        Returns:
+            list[list[`apployer.appstack.AppConfig`]]: The waves. Applications in each wave
+                are in their original order.
+
+        Raises:
+            ValueError: The graph has cycles.
+        """
+        dependents = [[] for _ in self.apps]
+        remaining_counts = []
+        for index, dependencies in enumerate(self._dependencies):
+            remaining_counts.append(len(dependencies))
+            for required_index in dependencies:
+                dependents[required_index].append(index)
+
+        wave = [index for index, count in enumerate(remaining_counts) if count == 0]
+        waves = []
+        while wave:
+            waves.append([self.apps[index] for index in wave])
+            next_wave = []
+            for index in wave:
+                for dependent_index in dependents[index]:
+                    remaining_counts[dependent_index] -= 1
+                    if remaining_counts[dependent_index] == 0:
+                        next_wave.append(dependent_index)
+            wave = sorted(next_wave)
+
+        if sum(len(wave) for wave in waves) != len(self.apps):
+            raise ValueError('There are cycles in the application graph.')
+        return waves
+
+
+def get_app_graph(appstack):
+    """Creates a graph in which applications are linked to the applications providing the services
+    they require and to the applications listed in their "after" parameter.
+
+    Args:
+        appstack (`apployer.appstack.AppStack`): The appstack.
+
+    Returns:
+        `AppGraph`: Dependency graph of appstack's applications.
+
+    Raises:
+        MalformedAppStackError: A service is provided twice or an application requires a service
+            or an application that isn't defined anywhere.
+    """
+    service_providers = {}
+    for app in appstack.apps:
+        # add exposed services to providers dictionary (service depends on app)
+        for service in app.user_provided_services:
+            _map_service_provider(service, app, service_providers)
+        if app.broker_config:
+            for service_instance in app.broker_config.service_instances:
+                _map_service_provider(service_instance, app, service_providers)
+
+    global_broker_instances = itertools.chain(
+        *[broker.service_instances for broker in appstack.brokers])
+    global_instance_names = set([instance.name for instance in global_broker_instances] +
+                                [service.name for service in appstack.user_provided_services])
+    app_graph = AppGraph(appstack.apps)
+    names_to_apps = {app.name: app for app in appstack.apps}
+
+    for app in appstack.apps:
+        _log.debug('Adding app to dependency graph: %s', app.name)
+        # app depends on apps explicitly listed in its "after" parameter
+        for required_app_name in app.after:
+            if required_app_name not in names_to_apps:
+                raise MalformedAppStackError("App " + required_app_name + " from \"after\" of " +
+                                             app.name + " isn't defined anywhere!")
+            app_graph.add_dependency(app, names_to_apps[required_app_name])
+            _log.debug('Marked dependency of %s on %s through "after" parameter.',
+                       app.name, required_app_name)
+        # app depends on the providers of services it requires
+        for service_name in app.app_properties.get('services', []):
+            if service_name in service_providers:
+                app_graph.add_dependency(app, service_providers[service_name])
+                _log.debug('Marked dependency of %s on %s through service %s.',
+                           app.name, service_providers[service_name].name, service_name)
+            elif service_name in global_instance_names:
+                # We don't care about this dependency since all global user provided services
+                # will be created before first application is deployed.
+                pass
+            elif not _to_bool(app.push_if):
+                # We don't care about applications that will not be pushed to CF
+                pass
+            else:
+                raise MalformedAppStackError("Service instance: " + service_name + " for: " +
+                                             app.artifact_name + " isn't defined anywhere!")
+    return app_graph
+
+
+def get_deployment_graph(appstack):
+    """Creates the dependency graph used when deploying. Apart from the dependencies from
+    `get_app_graph` it links the applications to the apps they need to be registered in.
+
+    Args:
+        appstack (`apployer.appstack.AppStack`): The appstack.
+
+    Returns:
+        `AppGraph`: Dependency graph of appstack's applications.
+    """
+    app_graph = get_app_graph(appstack)
+    names_to_apps = {app.name: app for app in appstack.apps}
+    for app in appstack.apps:
+        # app needs to be registered in an already running registrator app
+        if app.register_in:
+            app_graph.add_dependency(app, names_to_apps[app.register_in])
+    return app_graph
+
+
+def get_deployment_waves(app_graph, sorted_apps):
+    """Splits applications sorted in deployment order into waves that need to be deployed one
+    after another. Each application pinned to a fixed position with "order" parameter is a barrier
+    and gets a wave of its own. Applications between the barriers are assigned to waves according
+    to their dependencies.
+
+    Args:
+        app_graph (`AppGraph`): Dependency graph containing (at least) the sorted applications.
+        sorted_apps (list[`apployer.appstack.AppConfig`]): Applications in deployment order
+            (with "order" parameter applied).
+
+    Returns:
+        list[list[`apployer.appstack.AppConfig`]]: The waves.
+    """
+    waves = []
+    segment = []
+    for app in sorted_apps + [None]:
+        if app is None or app.is_ordered:
+            if segment:
+                waves.extend(app_graph.get_subgraph(segment).get_waves())
+            if app is not None:
+                waves.append([app])
+            segment = []
+        else:
+            segment.append(app)
+    return waves
+
+
+def add_order_barriers(app_graph, sorted_apps, pinned_apps=None):
+    """Makes each application pinned to a fixed position with "order" parameter depend on all
+    applications before it, and all applications after it depend on it.
+
+    Args:
+        app_graph (`AppGraph`): Dependency graph containing (at least) the sorted applications.
+        sorted_apps (list[`apployer.appstack.AppConfig`]): Applications in deployment order
+            (with "order" parameter applied).
+        pinned_apps (list[`apployer.appstack.AppConfig`]): Applications that should be barriers.
+            By default, all the sorted applications with "order" parameter.
+
+    Returns:
+        `AppGraph`: The given graph, changed.
+    """
+    if pinned_apps is None:
+        pinned_apps = [app for app in sorted_apps if app.is_ordered]
+    pinned_app_ids = {id(app) for app in pinned_apps}
+    for index, app in enumerate(sorted_apps):
+        if id(app) in pinned_app_ids:
+            for previous_app in sorted_apps[:index]:
+                app_graph.add_dependency(app, previous_app)
+            for next_app in sorted_apps[index + 1:]:
+                app_graph.add_dependency(next_app, app)
+    return app_graph
+
+
+def _to_bool(push_if):
+    if isinstance(push_if, bool):
+        return push_if
+    if isinstance(push_if, str):
+        return str.lower(push_if) != 'false'
+    return True
+
+
+def _map_service_provider(service_instance, app, service_providers):
+    """Marks that a service is provided by an application."""
+    service_name = service_instance.name
+    if service_name not in service_providers:
+        service_providers[service_name] = app
+        _log.debug('Marking app %s as provider for service %s', app.name, service_name)
+    else:
+        raise MalformedAppStackError('The same service defined twice: ' + service_name)
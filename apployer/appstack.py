@@ -23,37 +23,176 @@ import logging
 
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
+# Types accepted in fields holding strings that may come from YAML as numbers (e.g. passwords).
+_SCALAR_TYPES = (basestring, int, long, float)
+# Types accepted in "push_if" fields, see `apployer.app_graph._to_bool`.
+_PUSH_IF_TYPES = (bool, basestring, int)
+
+
+class Field(object):
+    """Schema of a single field of a data container.
+
+    Attributes:
+        name (str): Name of the field.
+        types (tuple[type]): Types that the field's value can have. If empty, it can have any type.
+        required (bool): Whether the field needs a non-empty value. Otherwise None is allowed, too.
+        container (str): Name of the `DataContainer` class of the value (or of the list elements
+            if `many` is set). Such values are (de)serialized with the class.
+        many (bool): Whether the field holds a list of `container` instances.
+        serialized (bool): Whether the field is included in the dictionary created by `to_dict`.
+    """
+
+    __slots__ = ('name', 'types', 'required', 'container', 'many', 'serialized')
+
+    def __init__(self, name, types=(), required=False, # pylint: disable=too-many-arguments
+                 container=None, many=False, serialized=True):
+        self.name = name
+        self.types = types
+        self.required = required
+        self.container = container
+        self.many = many
+        self.serialized = serialized
+
+
+class _CompiledSchema(object):
+    """Field lists of a data container class prepared for the (de)serialization and validation,
+    so that they don't need to be worked out on each call.
+
+    Args:
+        fields (tuple[`Field`]): All fields of the class.
+    """
+
+    def __init__(self, fields):
+        self.names = tuple(field.name for field in fields)
+        # (name, is container, is list of containers)
+        self.serialized = tuple((field.name, bool(field.container), field.many)
+                                for field in fields if field.serialized)
+        # (name, container class, is list)
+        self.nested = tuple((field.name, _get_container_class(field.container), field.many)
+                            for field in fields if field.container)
+        # (name, accepted types, required, is list of containers)
+        self.validated = tuple(
+            (field.name,
+             (list,) if field.many else
+             (_get_container_class(field.container),) if field.container else field.types,
+             field.required,
+             _get_container_class(field.container) if field.many else None)
+            for field in fields)
+
+
+def _get_container_class(name):
+    return globals()[name]
+
+
+class _DataContainerMeta(type):
+    """Gives data container classes slots for the fields from their schema (`_fields`),
+    so their instances don't carry dictionaries.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        namespace['__slots__'] = tuple(field.name for field in namespace.get('_fields', ()))
+        return super(_DataContainerMeta, mcs).__new__(mcs, name, bases, namespace)
+
 
 class DataContainer(object):
     """
-    Base class for data containers.
+    Base class for data containers. Subclasses describe their fields in `_fields`.
+    Containers derived from one another (e.g. a merged or sorted appstack) share all the values
+    they don't change, so values in containers should be treated as immutable - replace them
+    instead of modifying them in place.
     """
 
-    # Lambdas taking field/value pairs from __dict__ items.
-    # If any field returns True for one of the filters then it's not included in the dictionary
-    # being created in to_dict function.
-    _to_dict_filters = []
+    __metaclass__ = _DataContainerMeta
+
+    # Schema of the container (tuple[`Field`]), in the order of constructor's arguments.
+    _fields = ()
 
     @classmethod
-    def _obj_to_dict(cls, obj):
-        if hasattr(obj, 'to_dict'):
-            return obj.to_dict()
-        elif isinstance(obj, list):
-            return [cls._obj_to_dict(element) for element in obj]
-        else:
-            return obj
+    def _get_schema(cls):
+        """
+        Returns:
+            `_CompiledSchema`: Schema of the class. It's compiled on the first use, because
+                the classes of nested containers may be defined after this one.
+        """
+        schema = cls.__dict__.get('_compiled_schema')
+        if schema is None:
+            schema = _CompiledSchema(cls._fields)
+            setattr(cls, '_compiled_schema', schema)
+        return schema
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            return all(getattr(self, name) == getattr(other, name)
+                       for name in self._get_schema().names)
         else:
             return False
 
+    def __ne__(self, other):
+        return not self == other
+
     def __repr__(self):
         """
         Helps investigating failing tests.
         """
-        return '{}({})'.format(self.__class__.__name__, self.__dict__)
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self._get_schema().names))
+
+    def _validate(self):
+        """Checks the types of the fields' values.
+
+        Raises:
+            MalformedAppStackError: A field has a wrong type, or a required field is empty.
+        """
+        for name, types, required, element_class in self._get_schema().validated:
+            value = getattr(self, name)
+            if value is None or value == '':
+                if required:
+                    raise MalformedAppStackError('{} {}: "{}" field is required.'.format(
+                        self.__class__.__name__, getattr(self, 'name', ''), name))
+                continue
+            if types and not isinstance(value, types):
+                raise self._get_wrong_type_error(name, value)
+            if element_class and not all(isinstance(element, element_class) for element in value):
+                raise self._get_wrong_type_error(name, value)
+
+    def _get_wrong_type_error(self, name, value):
+        """
+        Returns:
+            MalformedAppStackError: Error saying that the field has a wrong type.
+        """
+        return MalformedAppStackError('{} {}: "{}" field has a wrong type: {!r}'.format(
+            self.__class__.__name__, getattr(self, 'name', ''), name, value))
+
+    @classmethod
+    def from_dict(cls, container_dict):
+        """
+        Args:
+            container_dict (dict): Instance of the class serialized to a dictionary.
+
+        Returns:
+            DataContainer: Deserialized instance.
+        """
+        return cls(**cls._deserialize_fields(container_dict))
+
+    @classmethod
+    def _deserialize_fields(cls, container_dict):
+        """
+        Args:
+            container_dict (dict): Instance of the class serialized to a dictionary.
+
+        Returns:
+            dict: Constructor's arguments, with the nested containers deserialized.
+        """
+        init_dict = dict(container_dict)
+        for name, container_class, many in cls._get_schema().nested:
+            value = init_dict.get(name)
+            if value is None:
+                continue
+            if many:
+                init_dict[name] = [container_class.from_dict(element) for element in value]
+            else:
+                init_dict[name] = container_class.from_dict(value)
+        return init_dict
 
     def copy(self):
         """
@@ -62,18 +201,37 @@ class DataContainer(object):
         """
         return copy.deepcopy(self)
 
+    def replace(self, **changes):
+        """
+        Args:
+            changes: New values of some of the fields.
+
+        Returns:
+            DataContainer: A shallow copy of self with the given fields replaced. Values of other
+                fields are shared with self.
+        """
+        new_container = self.__class__.__new__(self.__class__)
+        for name in self._get_schema().names:
+            setattr(new_container, name, getattr(self, name))
+        for name, value in changes.items():
+            setattr(new_container, name, value)
+        return new_container
+
     def to_dict(self):
         """Used when converting the object to dictionary before serialization to YAML.
+        Empty fields are left out.
 
         Returns:
             dict: This object presented as a dictionary.
         """
-        non_filtered = {field: self._obj_to_dict(value) for field, value in self.__dict__.items()}
-        return {field: value for field, value in non_filtered.items()
-                if value and
-                not field.startswith('_') and
-                value not in (None, [], {}) and
-                not any([dict_filter(field, value) for dict_filter in self._to_dict_filters])}
+        container_dict = {}
+        for name, is_container, many in self._get_schema().serialized:
+            value = getattr(self, name)
+            if value and is_container:
+                value = [element.to_dict() for element in value] if many else value.to_dict()
+            if value:
+                container_dict[name] = value
+        return container_dict
 
 
 class AppStack(DataContainer):
@@ -91,8 +249,20 @@ class AppStack(DataContainer):
         buildpacks (list[str]): List of buildpacks (only their names) that need to be set up in CF.
         domain (str): Environment's address domain
             (e.g. for app.example.com, the domain is example.com).
+        security_groups (list[`SecurityGroup`]): Security groups that need to be set up in CF.
+        post_actions (list[`PostAction`]): Commands run after the deployment.
     """
 
+    _fields = (
+        Field('apps', container='AppConfig', many=True),
+        Field('user_provided_services', container='UserProvidedService', many=True),
+        Field('brokers', container='BrokerConfig', many=True),
+        Field('buildpacks', (list,)),
+        Field('domain', (basestring,)),
+        Field('security_groups', container='SecurityGroup', many=True),
+        Field('post_actions', container='PostAction', many=True),
+    )
+
     def __init__(self, apps=None, user_provided_services=None, # pylint: disable=too-many-arguments
                  brokers=None, buildpacks=None, domain=None, security_groups=None,
                  post_actions=None):
@@ -104,6 +274,7 @@ class AppStack(DataContainer):
         self.security_groups = security_groups or []
         self.post_actions = post_actions or []
 
+        self._validate()
         self._validate_register_in()
 
     @staticmethod
@@ -115,19 +286,12 @@ class AppStack(DataContainer):
         Returns:
             `AppStack`: AppStack instance deserialized from a dictionary.
         """
-        apps = AppStack._get_apps(appstack)
-        user_provided_services = [UserProvidedService(**service_dict) for service_dict
-                                  in appstack.get('user_provided_services', [])]
-        brokers = [BrokerConfig.from_dict(broker_dict) for broker_dict
-                   in appstack.get('brokers', [])]
-        buildpacks = appstack.get('buildpacks', [])
-        domain = appstack.get('domain')
-        security_groups = [SecurityGroup.from_dict(sg_dict) for sg_dict
-                           in appstack.get('security_groups', [])]
-        post_actions = [PostAction.from_dict(pa_dict) for pa_dict
-                        in appstack.get('post_actions', [])]
-        return AppStack(apps, user_provided_services, brokers, buildpacks,
-                        domain, security_groups, post_actions)
+        # other top-level entries of appstack.yml (e.g. YAML anchors) are ignored
+        init_dict = AppStack._deserialize_fields(
+            {name: appstack[name] for name in AppStack._get_schema().names
+             if name in appstack and name != 'apps'})
+        init_dict['apps'] = AppStack._get_apps(appstack)
+        return AppStack(**init_dict)
 
     @staticmethod
     def _get_apps(appstack):
@@ -171,9 +335,7 @@ class AppStack(DataContainer):
             merged_app = app.merge_manifest(manifests[app.artifact_name])
             apps.append(merged_app)
 
-        new_appstack = self.copy()
-        new_appstack.apps = apps
-        return new_appstack
+        return self.replace(apps=apps)
 
     def _validate_register_in(self):
         """Checks if non-empty "register_in" fields in applications point to another application
@@ -217,20 +379,33 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
         push_options (`PushOptions`): Parameters for pushing the app to Cloud Foundry.
         order (int): Fixed position in application's deployment sequence.
             If not provided it will be set automatically during application sorting.
+            Deprecated, because it forces a total order on the deployment - use `after` instead.
         is_ordered (bool): Whether `order` is set to a meaningful value and should be taken into
             consideration.
         push_if: flag to determine if really create on environment
+        after (list[str]): Names of other appstack applications that need to be deployed before
+            this one, even though it doesn't use their services.
     """
 
-    _to_dict_filters = [lambda key, _: key in ['is_ordered']]
+    _fields = (
+        Field('name', (basestring,), required=True),
+        Field('app_properties', (dict,)),
+        Field('user_provided_services', container='UserProvidedService', many=True),
+        Field('broker_config', container='BrokerConfig'),
+        Field('artifact_name', (basestring,)),
+        Field('register_in', (basestring,)),
+        Field('push_options', container='PushOptions'),
+        Field('order', (int,)),
+        Field('push_if', _PUSH_IF_TYPES),
+        Field('register_config', (basestring,)),
+        Field('after', (list,)),
+        Field('is_ordered', (bool,), serialized=False),
+    )
 
     def __init__(self, name, app_properties=None,   # pylint: disable=too-many-arguments
                  user_provided_services=None, broker_config=None, artifact_name=None,
                  register_in=None, push_options=None, order=None, push_if=True,
-                 register_config=None):
-
-        if not name:
-            raise MalformedAppStackError("Application's name not specified.")
+                 register_config=None, after=None):
         self.name = name
         self.app_properties = app_properties or {}
         self.user_provided_services = user_provided_services or []
@@ -240,41 +415,15 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
         self.register_config = register_config
         self.push_options = push_options or PushOptions()
         self.push_if = push_if
-
+        self.after = after or []
         self.order = order
-        if isinstance(order, int):
-            self.is_ordered = True
-        elif order is None:
-            self.is_ordered = False
-        else:
-            raise MalformedAppStackError('App {}: order parameter is not int.'.format(name))
+        self.is_ordered = isinstance(order, int)
+
+        self._validate()
 
     def __hash__(self):
         return hash('app' + self.name)
 
-    @staticmethod
-    def from_dict(app_config_dict):
-        """
-        Args:
-            app_config_dict (dict): `AppConfig` instance serialized to a dictionary.
-
-        Returns:
-            `AppConfig`: Deserialized instance.
-        """
-        upsis = 'user_provided_services'
-        push_options = 'push_options'
-        broker_config = 'broker_config'
-        init_dict = app_config_dict.copy()
-
-        init_dict[upsis] = [UserProvidedService(**service_params)
-                            for service_params in app_config_dict.get(upsis, [])]
-        init_dict[push_options] = PushOptions(**app_config_dict.get(push_options, {}))
-        if broker_config in app_config_dict:
-            init_dict[broker_config] = BrokerConfig.from_dict(
-                app_config_dict[broker_config])
-
-        return AppConfig(**init_dict)
-
     def merge_manifest(self, app_manifest):
         """Merges the manifest of an application with it's properties defined in appstack.
         Values from appstack take precedence over the ones from manifest.
@@ -285,10 +434,10 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
                 "memory") taken from it's "manifest.yml".
 
         Returns:
-            `AppConfig`: Application's config expanded by its manifest.
+            `AppConfig`: Application's config expanded by its manifest. It shares everything apart
+                from "app_properties" with this config.
         """
-        merged_config = copy.deepcopy(self)
-        merged_app_properties = merged_config.app_properties
+        merged_app_properties = dict(self.app_properties)
 
         for key, value in app_manifest.items():
             # TODO if value in manifest has different type than in config raise an error
@@ -306,7 +455,7 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
         if 'name' not in merged_app_properties:
             merged_app_properties['name'] = self.name
 
-        return merged_config
+        return self.replace(app_properties=merged_app_properties)
 
     # TODO add a function that expands the config with default CF parameters
     # those will only affect app_properties
@@ -320,10 +469,17 @@ class PushOptions(DataContainer):
         post_command (str): Shell command that will be run after pushing the application.
     """
 
+    _fields = (
+        Field('params', (basestring,)),
+        Field('post_command', (basestring,)),
+    )
+
     def __init__(self, params='', post_command=None):
         self.params = params
         self.post_command = post_command
 
+        self._validate()
+
 
 class BrokerConfig(DataContainer):
     """Configuration of a Cloud Foundry service broker.
@@ -339,9 +495,18 @@ class BrokerConfig(DataContainer):
         push_if: flag to determine if really create on environment
     """
 
+    _fields = (
+        Field('name', (basestring,), required=True),
+        Field('url', (basestring,), required=True),
+        Field('auth_username', _SCALAR_TYPES),
+        Field('auth_password', _SCALAR_TYPES),
+        Field('services', (list,)),
+        Field('service_instances', container='ServiceInstance', many=True),
+        Field('push_if', _PUSH_IF_TYPES),
+    )
+
     def __init__(self, name, url, auth_username, auth_password, # pylint: disable=too-many-arguments
                  services=None, service_instances=None, push_if=True):
-        # TODO validate the fields
         self.name = name
         self.url = url
         self.auth_username = auth_username
@@ -350,22 +515,7 @@ class BrokerConfig(DataContainer):
         self.service_instances = service_instances or []
         self.push_if = push_if
 
-    @staticmethod
-    def from_dict(broker_config_dict):
-        """
-        Args:
-            broker_config_dict (dict): `BrokerConfig` instance serialized to a dictionary.
-
-        Returns:
-            `BrokerConfig`: Deserialized instance.
-        """
-        service_instances = 'service_instances'
-        init_dict = broker_config_dict.copy()
-
-        init_dict[service_instances] = [
-            ServiceInstance(**service_params)
-            for service_params in broker_config_dict.get(service_instances, [])]
-        return BrokerConfig(**init_dict)
+        self._validate()
 
 
 class ServiceInstance(DataContainer):
@@ -379,13 +529,21 @@ class ServiceInstance(DataContainer):
         push_if: flag to determine if really create on environment
     """
 
+    _fields = (
+        Field('name', (basestring,), required=True),
+        Field('plan', (basestring,), required=True),
+        Field('label', (basestring,)),
+        Field('push_if', _PUSH_IF_TYPES),
+    )
+
     def __init__(self, name, plan, label=None, push_if=True):
-        # TODO validate the fields
         self.name = name
         self.plan = plan
         self.label = label
         self.push_if = push_if
 
+        self._validate()
+
 
 class UserProvidedService(DataContainer):
     """Configuration of a Cloud Foundry user-provided service instance.
@@ -397,12 +555,19 @@ class UserProvidedService(DataContainer):
         push_if: flag to determine if really create on environment
     """
 
+    _fields = (
+        Field('name', (basestring,), required=True),
+        Field('credentials', (dict,)),
+        Field('push_if', _PUSH_IF_TYPES),
+    )
+
     def __init__(self, name, credentials, push_if=True):
-        # TODO validate the fields
         self.name = name
         self.credentials = credentials
         self.push_if = push_if
 
+        self._validate()
+
 
 class SecurityGroup(DataContainer):
     """Configuration of a Cloud Foundry security group.
@@ -415,6 +580,15 @@ class SecurityGroup(DataContainer):
         ports (str): Same as in CF (refer to cf help)
         push_if: flag to determine if really create on environment
     """
+
+    _fields = (
+        Field('name', (basestring,), required=True),
+        Field('protocol', (basestring,), required=True),
+        Field('destination', (basestring,), required=True),
+        Field('ports', (basestring, int), required=True),
+        Field('push_if', _PUSH_IF_TYPES),
+    )
+
     #pylint: disable=too-many-arguments
     def __init__(self, name, protocol, destination, ports, push_if=True):
         self.name = name
@@ -423,22 +597,7 @@ class SecurityGroup(DataContainer):
         self.ports = ports
         self.push_if = push_if
 
-    @classmethod
-    def from_dict(cls, security_group_dict):
-        """
-        Args:
-            security_group_dict (dict): `SecurityGroup` instance serialized to a dictionary.
-
-        Returns:
-        `SecurityGroup`: Deserialized instance.
-        """
-        name = security_group_dict['name']
-        protocol = security_group_dict['protocol']
-        destination = security_group_dict['destination']
-        ports = security_group_dict['ports']
-        push_if = security_group_dict['push_if']
-
-        return cls(name, protocol, destination, ports, push_if)
+        self._validate()
 
     def to_dict_for_cf_json(self):
         """Creates dict from instance of this class for CF create-security-group json (i.e.
@@ -455,14 +614,14 @@ class PostAction(DataContainer):
     """Set of custom commands (defined in appstack.yml) to be executed after
     appstack deployment
     """
+
+    _fields = (
+        Field('name', (basestring,), required=True),
+        Field('commands', (list,), required=True),
+    )
+
     def __init__(self, name, commands):
         self.name = name
         self.commands = commands
 
-    @classmethod
-    def from_dict(cls, post_action_dict):
-        """Creates PostAction from dictionary"""
-        name = post_action_dict['name']
-        commands = post_action_dict['commands']
-
-        return cls(name, commands)
+        self._validate()
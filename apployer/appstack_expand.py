@@ -18,16 +18,19 @@
 Appstack expansion - adding application manifests and sorting in deployment order.
 """
 
+import collections
 from contextlib import contextmanager
 import itertools
 import logging
 import os
 from os import path
+import time
 import zipfile
 
 import yaml
 
 from .app_file import get_artifact_name
+from .app_graph import get_app_graph, get_deployment_waves
 from .appstack import AppConfig, AppStack, MalformedAppStackError
 
 # Code doing the deployment from a release package (already containing an expanded appstack)
@@ -40,6 +43,9 @@ finally:
 
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
+# seconds
+WATCH_INTERVAL = 1.0
+
 
 def expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path):
     """Creates an expanded appstack, that is appstack with merged app manifests and also
@@ -50,60 +56,215 @@ def expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_pa
         artifacts_location (str): Location of deployable artifacts (zips) of platform applications.
         expanded_appstack_path (str): Where to store expanded appstack file.
     """
-    with open(appstack_file_path) as appstack_file:
-        appstack_dict = yaml.load(appstack_file)
-        appstack = AppStack.from_appstack_dict(appstack_dict)
-    manifests = _get_artifact_manifests(artifacts_location)
+    AppStackExpander(appstack_file_path, artifacts_location, expanded_appstack_path).expand()
+
+
+class _ExpansionCache(object):
+    """What `AppStackExpander` keeps from the previous expansion.
+
+    Attributes:
+        artifacts (dict[str,tuple]): Zip names mapped to their modification times, sizes,
+            artifact names and manifests.
+        manifests (dict[str,dict]): Artifact names mapped to their manifests.
+        merged_apps (dict[str,tuple]): Application names mapped to their configs from
+            the appstack, the manifests they were merged with and the merged configs.
+        dependency_signature (tuple): Dependencies of the applications (see
+            `_get_dependency_signature`) when they were last sorted.
+        sorted_app_names (list[str]): Names of the applications in deployment order.
+    """
 
-    _log.info('Expanding appstack with application manifests...')
-    merged_appstack = appstack.merge_manifests(manifests)
-    expanded_appstack = _sort_appstack(merged_appstack)
+    def __init__(self):
+        self.artifacts = {}
+        self.manifests = {}
+        self.merged_apps = {}
+        self.dependency_signature = None
+        self.sorted_app_names = None
 
-    with open(expanded_appstack_path, 'w') as expanded_appstack_file:
-        _log.info('Saving expanded appstack file to %s', path.abspath(expanded_appstack_path))
-        yaml.dump(
-            expanded_appstack.to_dict(),
-            expanded_appstack_file,
-            default_flow_style=False,
-            width=1000)
 
+class AppStackExpander(object):
+    """Expands an appstack (see `expand_appstack`) and keeps the artifacts' manifests, merged
+    applications and their deployment order in memory. Expanding it again after the appstack has
+    been edited only re-reads the changed artifacts, re-merges the changed applications and
+    sorts them again only if their dependencies have changed.
 
-def _get_artifact_manifests(artifacts_path):
-    """Gets application manifests from artifacts residing under the given path.
-    All zip files will be interpreted as artifacts.
+    Args:
+        appstack_file_path (str): Location of appstack configuration file.
+        artifacts_location (str): Location of deployable artifacts (zips) of platform applications.
+        expanded_appstack_path (str): Where to store expanded appstack file.
+    """
 
+    def __init__(self, appstack_file_path, artifacts_location, expanded_appstack_path):
+        self.appstack_file_path = appstack_file_path
+        self.artifacts_location = path.abspath(artifacts_location)
+        self.expanded_appstack_path = expanded_appstack_path
+        self._cache = _ExpansionCache()
+        self._expanded_appstack_yaml = None
+        self._input_mtimes = None
+
+    def expand(self):
+        """Expands the appstack and saves it, if it's different from the one saved before.
+
+        Returns:
+            bool: True if the expanded appstack has changed.
+
+        Raises:
+            MalformedAppStackError: Appstack is invalid, e.g. there are cycles in the dependencies
+                of applications.
+        """
+        with open(self.appstack_file_path) as appstack_file:
+            appstack = AppStack.from_appstack_dict(yaml.load(appstack_file))
+        self._refresh_manifests()
+
+        _log.info('Expanding appstack with application manifests...')
+        merged_apps = [self._merge_app(app) for app in appstack.apps]
+        merged_appstack = appstack.replace(apps=merged_apps)
+        dependency_signature = _get_dependency_signature(merged_appstack)
+        if dependency_signature == self._cache.dependency_signature:
+            _log.info("Dependencies of applications haven't changed, keeping their order.")
+            names_to_apps = {app.name: app for app in merged_apps}
+            expanded_appstack = merged_appstack.replace(
+                apps=[names_to_apps[name] for name in self._cache.sorted_app_names])
+        else:
+            expanded_appstack = _sort_appstack(merged_appstack)
+            self._cache.dependency_signature = dependency_signature
+            self._cache.sorted_app_names = [app.name for app in expanded_appstack.apps]
+
+        expanded_appstack_yaml = yaml.dump(expanded_appstack.to_dict(), default_flow_style=False,
+                                           width=1000)
+        if expanded_appstack_yaml == self._expanded_appstack_yaml:
+            _log.info("Expanded appstack hasn't changed.")
+            return False
+        with open(self.expanded_appstack_path, 'w') as expanded_appstack_file:
+            _log.info('Saving expanded appstack file to %s',
+                      path.abspath(self.expanded_appstack_path))
+            expanded_appstack_file.write(expanded_appstack_yaml)
+        self._expanded_appstack_yaml = expanded_appstack_yaml
+        return True
+
+    def expand_if_changed(self):
+        """Expands the appstack if the appstack file or any of the artifacts has changed since
+        the last call. Errors in the appstack are logged, so that they can be fixed while watching.
+
+        Returns:
+            bool: True if the expanded appstack has changed.
+        """
+        try:
+            input_mtimes = self._get_input_mtimes()
+            if input_mtimes == self._input_mtimes:
+                return False
+            self._input_mtimes = input_mtimes
+            return self.expand()
+        # files can be caught in the middle of being saved
+        except (EnvironmentError, MalformedAppStackError, TypeError, yaml.YAMLError,
+                zipfile.BadZipfile) as ex:
+            _log.error('Expanding appstack %s failed, waiting for the next change: %s',
+                       self.appstack_file_path, ex)
+            return False
+
+    def watch(self, interval=WATCH_INTERVAL):
+        """Expands the appstack every time it (or any of the artifacts) changes, until interrupted.
+
+        Args:
+            interval (float): How often (in seconds) the files are checked.
+        """
+        _log.info('Watching %s and artifacts in %s for changes...',
+                  self.appstack_file_path, self.artifacts_location)
+        while True:
+            self.expand_if_changed()
+            time.sleep(interval)
+
+    def _get_input_mtimes(self):
+        """
+        Returns:
+            dict[str,float]: Paths of the appstack file and artifacts mapped to their modification
+                times.
+        """
+        input_paths = [self.appstack_file_path] + [
+            path.join(self.artifacts_location, name) for name in os.listdir(self.artifacts_location)
+            if name.endswith('.zip')]
+        return {input_path: os.stat(input_path).st_mtime for input_path in input_paths}
+
+    def _refresh_manifests(self):
+        """Reads the manifests of the artifacts that are new or have changed since the last call."""
+        _log.info('Getting manifests from application zips in %s', self.artifacts_location)
+        artifacts = {}
+        for zip_name in os.listdir(self.artifacts_location):
+            if not zip_name.endswith('.zip'):
+                continue
+            zip_stat = os.stat(path.join(self.artifacts_location, zip_name))
+            artifact = self._cache.artifacts.get(zip_name)
+            if not artifact or artifact[:2] != (zip_stat.st_mtime, zip_stat.st_size):
+                artifact = (zip_stat.st_mtime, zip_stat.st_size, get_artifact_name(zip_name),
+                            _get_artifact_manifest(path.join(self.artifacts_location, zip_name)))
+            artifacts[zip_name] = artifact
+        self._cache.artifacts = artifacts
+        self._cache.manifests = {artifact_name: manifest for _, _, artifact_name, manifest
+                                 in artifacts.values() if manifest is not None}
+
+    def _merge_app(self, app):
+        """
+        Args:
+            app (`AppConfig`): Application from the appstack.
+
+        Returns:
+            `AppConfig`: Application merged with the manifest of its artifact. It's the one merged
+                before if neither of them has changed.
+        """
+        manifest = self._cache.manifests.get(app.artifact_name)
+        merged_app = self._cache.merged_apps.get(app.name)
+        if merged_app and merged_app[0] == app and merged_app[1] is manifest:
+            return merged_app[2]
+        _log.debug('Merging manifest from artifact %s to %s application',
+                   app.artifact_name, app.name)
+        if manifest is None:
+            _log.debug("Artifact %s doesn't have a manifest.", app.artifact_name)
+        self._cache.merged_apps[app.name] = (app, manifest, app.merge_manifest(manifest or {}))
+        return self._cache.merged_apps[app.name][2]
+
+
+def _get_dependency_signature(appstack):
+    """
     Args:
-        artifacts_path (str): Path to directory containing application artifacts.
+        appstack (`AppStack`): Appstack with merged manifests.
 
     Returns:
-        dict[str,dict]: Mapping of artifact name to manifest's fields,
-            e.g. 'app_A': {'memory': '64M', 'command': './app_A'}
+        tuple: Everything that affects the deployment order of appstack's applications
+            (see `_sort_appstack`). The order needs to be recomputed only if it changes.
+    """
+    return (
+        tuple((app.name, tuple(app.app_properties.get('services', [])),
+               tuple(service.name for service in app.user_provided_services),
+               tuple(instance.name for instance in app.broker_config.service_instances)
+               if app.broker_config else (),
+               tuple(app.after), app.order, app.push_if)
+              for app in appstack.apps),
+        tuple(instance.name for broker in appstack.brokers
+              for instance in broker.service_instances),
+        tuple(service.name for service in appstack.user_provided_services))
+
+
+def _get_artifact_manifest(zip_path):
+    """
+    Args:
+        zip_path (str): Path of application's artifact.
+
+    Returns:
+        dict: Manifest's fields of the application, e.g. {'memory': '64M', 'command': './app_A'}.
+            None if the artifact doesn't have a manifest.
     """
-    artifacts_path = path.abspath(artifacts_path)
-    _log.info('Getting manifests from application zips in %s', artifacts_path)
     manifest_file_name = 'manifest.yml'
-    manifests = {}
-    zip_names = [name for name in os.listdir(artifacts_path) if name.endswith('.zip')]
-    for zip_name in zip_names:
-        zip_file = zipfile.ZipFile(path.join(artifacts_path, zip_name))
-        if manifest_file_name not in zip_file.namelist():
-            _log.debug("%s doesn't contain %s", zip_name, manifest_file_name)
-            continue
-
-        manifest_path = zip_file.extract(manifest_file_name)
-        with open(manifest_path) as manifest_file:
-            manifest_file_dict = yaml.load(manifest_file)
-        os.remove(manifest_path)
-
-        artifact_name = get_artifact_name(zip_name)
-        _log.debug('Got manifest from artifact: %s', artifact_name)
-        # Manifest file can theoretically contain more than one app definition, but our apps
-        # have only themselves in their manifests.
-        manifests[artifact_name] = manifest_file_dict['applications'][0]
-    return manifests
-
-
-def _sort_appstack(appstack): #pylint: disable=too-many-locals
+    zip_file = zipfile.ZipFile(zip_path)
+    if manifest_file_name not in zip_file.namelist():
+        _log.debug("%s doesn't contain %s", zip_path, manifest_file_name)
+        return None
+    manifest_file_dict = yaml.load(zip_file.read(manifest_file_name))
+    _log.debug('Got manifest from artifact: %s', zip_path)
+    # Manifest file can theoretically contain more than one app definition, but our apps
+    # have only themselves in their manifests.
+    return manifest_file_dict['applications'][0]
+
+
+def _sort_appstack(appstack):
     """
     Sorts the appstack so that applications and services can be successfully deployed going from
     first to last in "apps" and "user_provided_services" lists.
@@ -111,135 +272,79 @@ def _sort_appstack(appstack): #pylint: disable=too-many-locals
     :return: A new appstack with applications sorted in order they should be deployed.
     :rtype: `AppStack`
     """
+    app_graph = get_app_graph(appstack)
+    networkx_graph = _to_networkx_graph(app_graph)
+    _dump_graph(networkx_graph)
+    _detect_cycles(networkx_graph)
 
-    app_graph = networkx.DiGraph()
-    service_providers = {}
-
-    for app in appstack.apps:
-        _log.debug('Adding app to dependency graph: %s', app.name)
-        app_graph.add_node(app)
-        # add exposed services to providers dictionary (service depends on app)
-        for service in app.user_provided_services:
-            _map_service_provider(service, app, service_providers)
-        if app.broker_config:
-            for service_instance in app.broker_config.service_instances:
-                _map_service_provider(service_instance, app, service_providers)
-        # add names of required services to graph (app depends on service)
-        for service_name in app.app_properties.get('services', []):
-            app_graph.add_edge(app, service_name)
-
-    final_graph = _substitute_services(
-        app_graph,
-        service_providers,
-        appstack.user_provided_services,
-        appstack.brokers)
-    _dump_graph(final_graph)
-    _detect_cycles(final_graph)
-
-    deployment_sequences = _get_app_deployment_sequences(final_graph)
+    deployment_sequences = app_graph.get_waves()
     sorted_apps = list(itertools.chain(*deployment_sequences))
     final_sorted_apps = _apply_app_order_parameter(sorted_apps)
+    _warn_about_order_parameter(app_graph, final_sorted_apps, len(deployment_sequences))
 
-    sorted_appstack = appstack.copy()
-    sorted_appstack.apps = final_sorted_apps
-    return sorted_appstack
+    return appstack.replace(apps=final_sorted_apps)
 
 
-def _substitute_services(
-        app_graph,
-        service_providers,
-        global_user_provided_services,
-        global_brokers):
+def _to_networkx_graph(app_graph):
     """
-    All edges in the graph are from an app to a service.
-    This function creates a new graph in which apps are linked to the provider of the service
-    they depend on (which is another application).
-    :param `networkx.DiGraph` app_graph:
-    :param dict[str,`AppConfig`] service_providers: Links service name and the application
-        that provides it.
-    :param list[dict] global_user_provided_services: List of standalone user provided services
-        defined in the appstack.
-    :param list[dict] global_brokers: List of brokers that aren't created from applications
-        defined in appstack.
-    :return: A new graph containing only links between applications.
+    :param `AppGraph` app_graph:
+    :return: The same graph in networkx format, used for dumping and cycle detection.
+    :rtype: `networkx.DiGraph`
     """
-    global_broker_instances = itertools.chain(
-        *[broker.service_instances for broker in global_brokers])
-    global_broker_instances_names = [instance.name for instance in global_broker_instances]
-    global_user_instances_names = [instance.name for instance in global_user_provided_services]
-    global_instance_names = set(global_broker_instances_names + global_user_instances_names)
-    final_graph = app_graph.copy()
-    service_nodes = []
-
-    for dependency in app_graph.edges():
-        service_name = dependency[1]
-        service_nodes.append(service_name)
-
-        if service_name in service_providers:
-            final_graph.add_edge(dependency[0], service_providers[service_name])
-            _log.debug('Marked dependency of %s on %s through service %s.',
-                       dependency[0].name, service_providers[service_name].name, service_name)
-        elif service_name in global_instance_names:
-            # We don't care about this edge since all global user provided services will
-            # be created before first application is deployed.
-            pass
-        elif not _to_bool(dependency[0].push_if):
-            # We don't care about applications that will not be pushed to CF
-            pass
-        else:
-            raise MalformedAppStackError("Service instance: " + service_name + " for: " +
-                                         dependency[0].artifact_name + " isn't defined anywhere!")
-
-    final_graph.remove_nodes_from(service_nodes)
-    return final_graph
-
-
-def _to_bool(push_if):
-    if isinstance(push_if, bool):
-        return push_if
-    if isinstance(push_if, str):
-        return str.lower(push_if) != 'false'
-    return True
-
-
-def _get_app_deployment_sequences(graph):
-    """
-    :param `networkx.DiGraph` graph:
-    :return: Lists of applications that may be deployed in parallel.
-    First list needs to be deployed first, the second one after that, etc.
-    :rtype: list[list[`AppConfig`]]
-    """
-    deployment_sequences = []
-    while graph:
-        leaves = [component for component, dep_num in graph.out_degree_iter() if dep_num == 0]
-        deployment_sequences.append(leaves)
-        graph.remove_nodes_from(leaves)
-    return deployment_sequences
-
-
-def _map_service_provider(service_instance, app, service_providers):
-    """
-    Marks that a service is provided by an application.
-    """
-    service_name = service_instance.name
-    if service_name not in service_providers:
-        service_providers[service_name] = app
-        _log.debug('Marking app %s as provider for service %s', app.name, service_name)
-    else:
-        raise MalformedAppStackError('The same service defined twice: ' + service_name)
+    graph = networkx.DiGraph()
+    graph.add_nodes_from(app_graph.apps)
+    graph.add_edges_from(app_graph.get_edges())
+    return graph
 
 
 def _detect_cycles(graph):
     """
     Detects cycles in graph and raises exception when it finds one.
+    Finding strongly connected components is linear, unlike enumerating all the cycles (their
+    number can grow exponentially). One shortest cycle is reported for each component.
     """
-    cycles = list(networkx.algorithms.simple_cycles(graph))
+    cycles = []
+    for component in networkx.strongly_connected_components(graph):
+        if len(component) > 1 or any(graph.has_edge(node, node) for node in component):
+            cycles.append(_find_shortest_cycle(graph, component))
     if cycles:
         with _simple_app_config_repr():
             raise MalformedAppStackError("Appstack can't be reliably deployed, because there "
                                          "are cycles in app dependencies: " + str(cycles))
 
 
+def _find_shortest_cycle(graph, component):
+    """
+    Finds the shortest cycle in a strongly connected component with breadth-first searches.
+    :param `networkx.DiGraph` graph:
+    :param set component: Nodes of a strongly connected component of the graph.
+    :return: Nodes of the cycle, in order.
+    :rtype: list
+    """
+    shortest_cycle = None
+    for start_node in component:
+        parents = {start_node: None}
+        queue = collections.deque([start_node])
+        cycle = None
+        while queue and cycle is None:
+            node = queue.popleft()
+            for successor in graph.successors_iter(node):
+                if successor is start_node:
+                    cycle = [node]
+                    while parents[cycle[-1]] is not None:
+                        cycle.append(parents[cycle[-1]])
+                    cycle.reverse()
+                    break
+                if successor in component and successor not in parents:
+                    parents[successor] = node
+                    queue.append(successor)
+        if cycle and (shortest_cycle is None or len(cycle) < len(shortest_cycle)):
+            shortest_cycle = cycle
+            if len(shortest_cycle) == 1:
+                break
+    return shortest_cycle
+
+
 def _dump_graph(graph):
     """
     Dumps the graph in GraphML format to a file.
@@ -260,6 +365,28 @@ def _simple_app_config_repr():
         AppConfig.__repr__ = app_config_repr
 
 
+def _warn_about_order_parameter(app_graph, final_sorted_apps, dependency_wave_count):
+    """
+    Warns about the cost of "order" parameter. Each app pinned to a fixed position is a barrier -
+    all apps before it need to be deployed before it, and all apps after it need to wait for it.
+    Apps between the barriers can only be deployed in waves computed from their dependencies.
+
+    Args:
+        app_graph (`AppGraph`): Dependency graph of applications.
+        final_sorted_apps (list[`AppConfig`]): Apps sorted with "order" parameter applied.
+        dependency_wave_count (int): Number of deployment waves without "order" parameter.
+    """
+    ordered_apps = [app for app in final_sorted_apps if app.is_ordered]
+    if not ordered_apps:
+        return
+    serial_step_count = len(get_deployment_waves(app_graph, final_sorted_apps))
+    _log.warning('Apps %s use deprecated "order" parameter. It turns %s deployment waves '
+                 'resulting from dependencies into %s serial steps (%s more) when deploying '
+                 'in parallel. Use "after" parameter instead.',
+                 ', '.join(app.name for app in ordered_apps), dependency_wave_count,
+                 serial_step_count, serial_step_count - dependency_wave_count)
+
+
 def _apply_app_order_parameter(sorted_apps):
     """
     Args:
@@ -281,18 +408,13 @@ def _apply_app_order_parameter(sorted_apps):
 
     # We need to recalculate (normalize) negative orders.
     # They're no longer valid after changing size of final_apps by removing some apps.
-    for app in ordered_apps:
-        app.normalized_order = app.order + len(sorted_apps) if app.order < 0 else app.order
+    normalized_orders = [app.order + len(sorted_apps) if app.order < 0 else app.order
+                         for app in ordered_apps]
 
-    # We need to have this sorted according to ascending "normalized_order" field.
+    # We need to have this sorted according to ascending normalized order.
     # Inserting application to in the list shifts all after it.
-    sorted_ordered_apps = sorted(ordered_apps, key=lambda app: app.normalized_order)
-
-    for app in sorted_ordered_apps:
-        final_apps.insert(app.normalized_order, app)
-
-    # Cleanup after order normalization
-    for app in ordered_apps:
-        del app.normalized_order
+    for normalized_order, app in sorted(zip(normalized_orders, ordered_apps),
+                                        key=lambda order_and_app: order_and_app[0]):
+        final_apps.insert(normalized_order, app)
 
     return final_apps
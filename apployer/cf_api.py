@@ -28,13 +28,24 @@ WARNING: Functions used here must be used AFTER logging in to cloud foundry with
 from `apployer.cf_cli`
 """
 
+import binascii
+from contextlib import contextmanager
 import json
+import os
+import shutil
+import tempfile
+import time
 
-from apployer import cf_cli
+from apployer import app_file, cf_cli, retry, trace
 
 CF_CURL = [cf_cli.CF, 'curl']
+RESULTS_PER_PAGE = 100
+# seconds
+STAGING_TIMEOUT = 15 * 60
+POLL_INTERVAL = 2
 
 
+@retry.non_idempotent
 def create_service_binding(service_guid, app_guid):
     """Creates a binding between a service and an application.
 
@@ -54,6 +65,7 @@ def create_service_binding(service_guid, app_guid):
             'Response body: {}'.format(service_guid, app_guid, response_json))
 
 
+@retry.non_idempotent
 def delete_service_binding(binding):
     """Deletes a service binding.
 
@@ -66,6 +78,160 @@ def delete_service_binding(binding):
         raise cf_cli.CommandFailedError('Failed to delete a service binding. CF response: {}'
                                         .format(cmd_output))
 
+
+@retry.idempotent_read
+def get_app_env(app_guid):
+    """
+    Args:
+        app_guid (str): Application's GUID.
+
+    Returns:
+        dict: Application's user-provided environment variables ("environment_json").
+    """
+    app_description = _cf_curl_get('/v2/apps/{}'.format(app_guid))
+    return app_description['entity']['environment_json'] or {}
+
+
+@retry.idempotent_write
+def update_app_env(app_guid, environment):
+    """Replaces application's user-provided environment variables. Application needs to be
+    restarted for them to take effect.
+
+    Args:
+        app_guid (str): Application's GUID.
+        environment (dict): All user-provided environment variables of the application.
+    """
+    # Variables can hold secrets, so they're passed in a file, not on the command line.
+    with _request_body_file() as (request_file, request_path):
+        json.dump({'environment_json': environment}, request_file)
+        request_file.close()
+        _cf_curl_send('/v2/apps/{}'.format(app_guid), 'PUT', request_path)
+
+
+@retry.idempotent_read
+def match_resources(resources):
+    """Asks Cloud Controller which files it already has in its resource cache, so that they don't
+    need to be uploaded.
+
+    Args:
+        resources (list[dict]): Descriptions of files, with at least "sha1" and "size" keys
+            (see `apployer.app_file.get_zip_resources`).
+
+    Returns:
+        list[dict]: Descriptions (with "sha1" and "size" keys) of the files that are cached.
+    """
+    with _request_body_file() as (request_file, request_path):
+        json.dump([{'sha1': resource['sha1'], 'size': resource['size']}
+                   for resource in resources], request_file)
+        request_file.close()
+        return _cf_curl_send('/v2/resource_match', 'PUT', request_path)
+
+
+@retry.idempotent_write
+def upload_app_bits(app_guid, cached_resources, zip_path, uploaded_file_names):
+    """Uploads application's files. Only the files that aren't in Cloud Controller's resource cache
+    are sent, the cached ones are only referenced.
+
+    Args:
+        app_guid (str): Application's GUID.
+        cached_resources (list[dict]): Descriptions of application's files that are cached
+            (see `match_resources`). They need "fn", "sha1", "size" and "mode" keys.
+        zip_path (str): Path to the ZIP archive with all application's files.
+        uploaded_file_names (list[str]): Paths (in the archive) of the files to upload.
+    """
+    boundary = 'apployer-{}'.format(binascii.hexlify(os.urandom(16)))
+    with _request_body_file() as (request_file, request_path):
+        request_file.write(
+            '--{0}\r\nContent-Disposition: form-data; name="resources"\r\n\r\n{1}\r\n'
+            '--{0}\r\nContent-Disposition: form-data; name="application"; '
+            'filename="application.zip"\r\nContent-Type: application/zip\r\n\r\n'
+            .format(boundary, json.dumps(cached_resources)))
+        # the ZIP is written to a separate file, because offsets in ZIP are relative to its start
+        with tempfile.TemporaryFile() as zip_file:
+            app_file.copy_zip_files(zip_path, uploaded_file_names, zip_file)
+            zip_file.seek(0)
+            shutil.copyfileobj(zip_file, request_file)
+        request_file.write('\r\n--{}--\r\n'.format(boundary))
+        request_file.close()
+        _cf_curl_send('/v2/apps/{}/bits'.format(app_guid), 'PUT', request_path,
+                      'Content-Type: multipart/form-data; boundary={}'.format(boundary))
+
+
+@retry.idempotent_write
+def start_app(app_guid):
+    """Requests the start of the application. Cloud Controller stages it first, if it's needed.
+    Doesn't wait for it (see `wait_for_app_start`).
+
+    Args:
+        app_guid (str): Application's GUID.
+    """
+    with _request_body_file() as (request_file, request_path):
+        json.dump({'state': 'STARTED'}, request_file)
+        request_file.close()
+        _cf_curl_send('/v2/apps/{}'.format(app_guid), 'PUT', request_path)
+
+
+@retry.idempotent_write
+def restage_app(app_guid):
+    """Stages the application again (with its latest bits) and restarts it. Doesn't wait for it
+    (see `wait_for_app_start`).
+
+    Args:
+        app_guid (str): Application's GUID.
+    """
+    with trace.span('cf_curl_post', path='/v2/apps/{}/restage'.format(app_guid)):
+        cmd_output = cf_cli.get_command_output(
+            CF_CURL + ['/v2/apps/{}/restage'.format(app_guid), '-X', 'POST'])
+    _parse_response(cmd_output, 'POST', '/v2/apps/{}/restage'.format(app_guid))
+
+
+@retry.idempotent_read
+def is_app_started(app_guid):
+    """Checks once whether the application is staged and one of its instances is running.
+
+    Args:
+        app_guid (str): Application's GUID.
+
+    Returns:
+        bool: Is the application started.
+
+    Raises:
+        CommandFailedError: Staging failed.
+    """
+    app_description = _cf_curl_get('/v2/apps/{}'.format(app_guid))['entity']
+    if app_description['package_state'] == 'FAILED':
+        raise cf_cli.CommandFailedError('Staging of app {} failed: {} {}'.format(
+            app_guid, app_description.get('staging_failed_reason'),
+            app_description.get('staging_failed_description')))
+    if app_description['package_state'] != 'STAGED':
+        return False
+    instances = _cf_curl_get('/v2/apps/{}/instances'.format(app_guid))
+    return any(instance['state'] == 'RUNNING' for instance in instances.values())
+
+
+def wait_for_app_start(app_guid, timeout=STAGING_TIMEOUT):
+    """Polls the application until it's staged and one of its instances is running.
+    Only the single polls are retried after transient errors, so the retries don't extend
+    the deadline.
+
+    Args:
+        app_guid (str): Application's GUID.
+        timeout (int): How long (in seconds) to wait.
+
+    Raises:
+        CommandFailedError: Staging failed or the application didn't start in time.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if is_app_started(app_guid):
+            return
+        if time.time() > deadline:
+            raise cf_cli.CommandFailedError("App {} didn't start in {} seconds".format(
+                app_guid, timeout))
+        time.sleep(POLL_INTERVAL)
+
+
+@retry.idempotent_read
 def get_app_name(app_guid):
     """
     Args:
@@ -78,6 +244,7 @@ def get_app_name(app_guid):
     return app_desctiption['entity']['name']
 
 
+@retry.idempotent_read
 def get_upsi_credentials(service_guid):
     """Gets the credentials (configuration) of a user-provided service instance.
 
@@ -92,6 +259,7 @@ def get_upsi_credentials(service_guid):
     return upsi_description['entity']['credentials']
 
 
+@retry.idempotent_read
 def get_upsi_bindings(service_guid):
     """Gets the bindings of a given user provided service instance.
 
@@ -107,6 +275,40 @@ def get_upsi_bindings(service_guid):
     return bindings_response['resources']
 
 
+@retry.idempotent_read
+def get_space_apps(space_guid):
+    """Gets the summaries of all applications in a space with a single request.
+
+    Args:
+        space_guid (str): Space's GUID.
+
+    Returns:
+        list[dict]: Summaries of the applications. Apart from application's fields (e.g. "guid",
+            "name", "state", "package_state") each one has "running_instances".
+    """
+    return _cf_curl_get('/v2/spaces/{}/summary'.format(space_guid))['apps']
+
+
+@retry.idempotent_read
+def get_all_resources(api_path):
+    """Gets all resources from a paginated list endpoint, following the "next_url" links.
+
+    Args:
+        api_path (str): CF API path of a list endpoint, e.g. /v2/service_brokers
+
+    Returns:
+        list[dict]: All the resources. Each one has "metadata" and "entity" fields.
+    """
+    separator = '&' if '?' in api_path else '?'
+    next_url = '{}{}results-per-page={}'.format(api_path, separator, RESULTS_PER_PAGE)
+    resources = []
+    while next_url:
+        page = _cf_curl_get(next_url)
+        resources.extend(page['resources'])
+        next_url = page.get('next_url')
+    return resources
+
+
 def _cf_curl_get(path):
     """Calls "cf curl" with a given path.
 
@@ -117,10 +319,62 @@ def _cf_curl_get(path):
     Returns:
         dict: JSON returned by the endpoint.
     """
-    cmd_output = cf_cli.get_command_output(CF_CURL + [path])
+    with trace.span('cf_curl_get', path=path):
+        cmd_output = cf_cli.get_command_output(CF_CURL + [path])
     response_json = json.loads(cmd_output)
     if 'error_code' not in response_json:
         return response_json
     else:
         raise cf_cli.CommandFailedError('Failed GET on CF API path {}\n'
                                         'Response body: {}'.format(path, response_json))
+
+
+def _cf_curl_send(path, method, body_path, content_type='Content-Type: application/json'):
+    """Calls "cf curl" sending the contents of a file as the request's body.
+
+    Args:
+        path (str): CF API path.
+        method (str): HTTP method, e.g. PUT.
+        body_path (str): Path to the file with request's body.
+        content_type (str): Content-Type header of the request.
+
+    Returns:
+        dict or list: JSON returned by the endpoint. Empty dictionary if it returned nothing.
+    """
+    with trace.span('cf_curl_' + method.lower(), path=path):
+        cmd_output = cf_cli.get_command_output(
+            CF_CURL + [path, '-X', method, '-H', content_type, '-d', '@' + body_path])
+    return _parse_response(cmd_output, method, path)
+
+
+def _parse_response(cmd_output, method, path):
+    """
+    Returns:
+        dict or list: JSON from the output of "cf curl". Empty dictionary if there's no output.
+
+    Raises:
+        CommandFailedError: The endpoint returned an error.
+    """
+    if not cmd_output.strip():
+        return {}
+    response_json = json.loads(cmd_output)
+    if isinstance(response_json, dict) and 'error_code' in response_json:
+        raise cf_cli.CommandFailedError('Failed {} on CF API path {}\n'
+                                        'Response body: {}'.format(method, path, response_json))
+    return response_json
+
+
+@contextmanager
+def _request_body_file():
+    """Temporary file for the body of a request. It's removed afterwards, because bodies can hold
+    secrets.
+
+    Yields:
+        tuple: Opened file and its path.
+    """
+    request_fd, request_path = tempfile.mkstemp(prefix='apployer_request_')
+    try:
+        with os.fdopen(request_fd, 'wb') as request_file:
+            yield request_file, request_path
+    finally:
+        os.remove(request_path)
@@ -16,6 +16,8 @@
 
 """
 Wrapper for command line tool "cf".
+Public functions are retried after transient errors according to their idempotency
+(see `apployer.retry`).
 """
 
 from collections import namedtuple
@@ -23,6 +25,8 @@ import logging
 from subprocess import Popen, PIPE, STDOUT, CalledProcessError
 import subprocess
 
+from apployer import retry, trace
+
 CF = 'cf'
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
@@ -34,8 +38,14 @@ BuildpackDescription = namedtuple('BuildpackDescription',
 class CommandFailedError(Exception):
     """
     Command carried out by CF CLI has failed.
+
+    Attributes:
+        output (str): Output of the failed command, if it was captured.
     """
-    pass
+
+    def __init__(self, message='', output=None):
+        super(CommandFailedError, self).__init__(message)
+        self.output = output
 
 
 class CfInfo(object):
@@ -76,6 +86,7 @@ def login(cf_info):
     target(cf_info.org, cf_info.space)
 
 
+@retry.idempotent_write
 def bind_service(app_name, instance_name):
     """Binds a service instance to an application.
     Args:
@@ -88,6 +99,7 @@ def bind_service(app_name, instance_name):
     run_command([CF, 'bind-service', app_name, instance_name])
 
 
+@retry.idempotent_read
 def buildpacks():
     """
     Returns:
@@ -98,6 +110,7 @@ def buildpacks():
     return [BuildpackDescription(*buildpack_line.split()) for buildpack_line in buildpack_lines]
 
 
+@retry.idempotent_write
 def unbind_service(app_name, instance_name):
     """Unbinds a service instance from an application.
     Args:
@@ -110,6 +123,7 @@ def unbind_service(app_name, instance_name):
     run_command([CF, 'unbind-service', app_name, instance_name])
 
 
+@retry.non_idempotent
 def create_buildpack(buildpack_name, buildpack_path, position=1):
     """Creates a buildpack. Always enables it afterwards (--enable flag).
 
@@ -125,6 +139,7 @@ def create_buildpack(buildpack_name, buildpack_path, position=1):
                  buildpack_name, buildpack_path, str(position), '--enable'])
 
 
+@retry.idempotent_write
 def create_org(org_name):
     """Creates a new organization. Will do nothing if it's already created.
 
@@ -137,6 +152,7 @@ def create_org(org_name):
     run_command([CF, 'create-org', org_name])
 
 
+@retry.non_idempotent
 def create_service(broker, plan, instance_name):
     """Creates a service instance.
 
@@ -151,6 +167,7 @@ def create_service(broker, plan, instance_name):
     run_command([CF, 'create-service', broker, plan, instance_name])
 
 
+@retry.non_idempotent
 def create_service_broker(name, user, password, url):
     """Creates a service broker.
 
@@ -166,6 +183,7 @@ def create_service_broker(name, user, password, url):
     run_command([CF, 'create-service-broker', name, user, password, url])
 
 
+@retry.idempotent_write
 def create_space(space_name, org_name):
     """Creates a new space within an organization. Will do nothing if it's already created.
 
@@ -179,6 +197,7 @@ def create_space(space_name, org_name):
     run_command([CF, 'create-space', space_name, '-o', org_name])
 
 
+@retry.non_idempotent
 def create_user_provided_service(service_name, credentials):
     """Creates a user provided service.
 
@@ -193,6 +212,7 @@ def create_user_provided_service(service_name, credentials):
     run_command([CF, 'create-user-provided-service', service_name, '-p', credentials])
 
 
+@retry.idempotent_write
 def enable_service_access(broker):
     """Enables access to every plan of a service broker for every organization.
 
@@ -205,6 +225,7 @@ def enable_service_access(broker):
     run_command([CF, 'enable-service-access', broker])
 
 
+@retry.idempotent_read
 def env(app_name):
     """
     Args:
@@ -216,6 +237,20 @@ def env(app_name):
     return get_command_output([CF, 'env', app_name])
 
 
+@retry.idempotent_read
+def get_app_guid(app_name):
+    """
+    Args:
+        app_name (str): Application's name.
+
+    Returns:
+        str: GUID of the application that can be used in API calls.
+    """
+    cmd_output = get_command_output([CF, 'app', '--guid', app_name])
+    return cmd_output.split()[0]
+
+
+@retry.idempotent_read
 def get_service_guid(service_name):
     """
     Args:
@@ -228,6 +263,20 @@ def get_service_guid(service_name):
     return cmd_output.split()[0]
 
 
+@retry.idempotent_read
+def get_space_guid(space_name):
+    """
+    Args:
+        space_name (str): Name of a space in the targeted organization.
+
+    Returns:
+        str: GUID of the space that can be used in API calls.
+    """
+    cmd_output = get_command_output([CF, 'space', '--guid', space_name])
+    return cmd_output.split()[0]
+
+
+@retry.idempotent_read
 def oauth_token():
     """
     Returns:
@@ -237,10 +286,11 @@ def oauth_token():
     return command_out.splitlines()[-1]
 
 
+@retry.idempotent_write
 def push(app_location, manifest_location, options='', timeout=180):
     """Push an application to Cloud Foundry.
     Args:
-        app_location (str): Path to directory containing application's files.
+        app_location (str): Path to directory or ZIP archive containing application's files.
         manifest_location (str): Path to a manifest the application should be pushed with.
         options (str): String with additional options for "cf push" command.
         timeout (int): Push timeout.
@@ -248,10 +298,12 @@ def push(app_location, manifest_location, options='', timeout=180):
     Raises:
         CommandFailedError: "cf push" failed.
     """
-    command = [CF, 'push', '-t', str(timeout), '-f', manifest_location] + options.split()
-    run_command(command, work_dir=app_location, skip_output=False)
+    command = [CF, 'push', '-t', str(timeout), '-f', manifest_location,
+               '-p', app_location] + options.split()
+    run_command(command, skip_output=False)
 
 
+@retry.idempotent_write
 def restage(app_name):
     """Restage an application.
 
@@ -264,6 +316,7 @@ def restage(app_name):
     run_command([CF, 'restage', app_name], skip_output=False)
 
 
+@retry.idempotent_write
 def restart(app_name):
     """Restart an application.
 
@@ -276,6 +329,7 @@ def restart(app_name):
     run_command([CF, 'restart', app_name], skip_output=False)
 
 
+@retry.idempotent_read
 def service(service_name):
     """
     Args:
@@ -287,6 +341,7 @@ def service(service_name):
     return get_command_output([CF, 'service', service_name])
 
 
+@retry.idempotent_read
 def service_brokers():
     """
     Returns:
@@ -298,6 +353,7 @@ def service_brokers():
     return set([line.split()[0] for line in broker_lines])
 
 
+@retry.idempotent_write
 def update_buildpack(buildpack_name, buildpack_path):
     """Updates a buildpack.
 
@@ -311,6 +367,7 @@ def update_buildpack(buildpack_name, buildpack_path):
     run_command([CF, 'update-buildpack', buildpack_name, '-p', buildpack_path])
 
 
+@retry.idempotent_write
 def update_service_broker(name, user, password, url):
     """Updates a service broker.
 
@@ -326,6 +383,7 @@ def update_service_broker(name, user, password, url):
     run_command([CF, 'update-service-broker', name, user, password, url])
 
 
+@retry.idempotent_write
 def update_user_provided_service(service_name, credentials):
     """Updates a user provided service.
 
@@ -340,6 +398,7 @@ def update_user_provided_service(service_name, credentials):
     run_command([CF, 'update-user-provided-service', service_name, '-p', credentials])
 
 
+@retry.non_idempotent
 def create_security_group(security_group, path_to_json):
     """Creates CF security group
 
@@ -354,6 +413,7 @@ def create_security_group(security_group, path_to_json):
     run_command([CF, 'create-security-group', security_group, path_to_json])
 
 
+@retry.idempotent_write
 def bind_security_group(security_group, org, space):
     """Binds CF security group to specific organization and space
 
@@ -368,6 +428,7 @@ def bind_security_group(security_group, org, space):
     run_command([CF, 'bind-security-group', security_group, org, space])
 
 
+@retry.idempotent_write
 def api(api_url, ssl_validation):
     """Set target Cloud Foundry API URL for the CF CLI commands.
 
@@ -385,6 +446,7 @@ def api(api_url, ssl_validation):
     run_command(command, skip_output=False)
 
 
+@retry.idempotent_write
 def auth(username, password):
     """Logs into CF CLI as a specific user.
 
@@ -400,6 +462,7 @@ def auth(username, password):
     run_command([CF, 'auth', username, password], skip_output=False)
 
 
+@retry.idempotent_write
 def target(org, space):
     """Set target organization and space for the CF CLI commands.
 
@@ -423,10 +486,12 @@ def get_command_output(command):
         CommandFailedError: When the command fails (returns non-zero code).
     """
     try:
-        output = subprocess.check_output(command)
+        with trace.span(trace.get_command_name(command)):
+            output = subprocess.check_output(command)
         return output.rstrip()
     except CalledProcessError as ex:
-        raise CommandFailedError('Command failed: {}\nOutput: {}'.format(' '.join(command), ex.output))
+        raise CommandFailedError('Command failed: {}\nOutput: {}'.format(' '.join(command), ex.output),
+                                 output=ex.output)
 
 
 def run_command(command, work_dir='.', skip_output=True, shell=False):
@@ -441,13 +506,16 @@ def run_command(command, work_dir='.', skip_output=True, shell=False):
     Raises:
         CommandFailedError: When the command fails (returns non-zero code).
     """
-    proc = Popen(command, stdout=PIPE, stderr=STDOUT, cwd=work_dir, shell=shell)
-    output = proc.stdout.read()
+    with trace.span(trace.get_command_name(command)):
+        proc = Popen(command, stdout=PIPE, stderr=STDOUT, cwd=work_dir, shell=shell)
+        output = proc.stdout.read()
+        return_code = proc.wait()
     if skip_output:
-        if proc.wait() != 0:
+        if return_code != 0:
             raise CommandFailedError('Command failed: {}\nOutput: {}'
-                                     .format(' '.join(command), output))
+                                     .format(' '.join(command), output), output=output)
     else:
         _log.debug(output)
-        if proc.wait() != 0:
-            raise CommandFailedError('Command failed: {}'.format(' '.join(command)))
+        if return_code != 0:
+            raise CommandFailedError('Command failed: {}'.format(' '.join(command)),
+                                     output=output)
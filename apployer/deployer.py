@@ -22,22 +22,31 @@ brokers.
 import glob
 import json
 import logging
+import os
 from os import path, remove
 import subprocess
+import threading
 from zipfile import ZipFile
 
-import datadiff
 from pkg_resources import parse_version
 import yaml
 
 import apployer.app_file as app_file
-from apployer import cf_cli, cf_api, dry_run
+from apployer import cf_cli, cf_api, dry_run, native_push, trace, upsi
+from .app_graph import get_deployment_graph
 from .cf_cli import CommandFailedError
+from .history import DeploymentHistory
+from .journal import DeploymentJournal
+from .native_push import NativePusher, FINGERPRINT_ENV_VAR
+from .scheduling import get_app_waves, map_in_parallel, AsyncStagingDeployment
+from .staging import StagingPoller
+from .upsi import UpsiDeployer
 
 _log = logging.getLogger(__name__) #pylint: disable=invalid-name
 
 UPGRADE_STRATEGY = 'UPGRADE'
 PUSH_ALL_STRATEGY = 'PUSH_ALL'
+FINGERPRINT_STRATEGY = 'FINGERPRINT'
 
 UNPACKED_ARTIFACTS_FOLDER = 'apps'
 FINAL_MANIFESTS_FOLDER = 'manifests'
@@ -46,7 +55,15 @@ DEPLOYER_OUTPUT = 'apployer_out'
 
 SG_RULES_FILENAME = 'set-access.json'
 
-def deploy_appstack(cf_login_data, filled_appstack, artifacts_path, is_dry_run, push_strategy):
+# registrator apps can be unpacked on demand by many apps being registered at the same time
+_registrator_unpacking_lock = threading.Lock() #pylint: disable=invalid-name
+# output directories are created on demand by apps deployed in parallel
+_output_dirs_lock = threading.Lock() #pylint: disable=invalid-name
+
+
+def deploy_appstack(cf_login_data, filled_appstack, artifacts_path, # pylint: disable=too-many-arguments
+                    is_dry_run, push_strategy, resume=False, parallel=1, async_staging=False,
+                    selected_steps=None):
     """Deploys the appstack to Cloud Foundry.
 
     Args:
@@ -58,23 +75,51 @@ def deploy_appstack(cf_login_data, filled_appstack, artifacts_path, is_dry_run,
         push_strategy (str): Strategy for pushing applications.
         is_dry_run (bool): Is this a dry run? If set to True, no changes (except for creating org
             and space) will be introduced to targeted Cloud Foundry.
+        resume (bool): Should the steps completed by the previous (interrupted) deployment be
+            skipped. Steps are skipped only if their configuration hasn't changed since then.
+        parallel (int): Maximum number of applications deployed at the same time. Applications
+            are deployed in waves resulting from their dependencies, the longest ones (according
+            to the history of previous deployments) first.
+        async_staging (bool): Should applications be staged without waiting for them.
+            See `apployer.scheduling.AsyncStagingDeployment`. Nothing is staged in a dry run, so it's
+            ignored then.
+        selected_steps (set[str]): Deployment steps of the entities that should be deployed,
+            e.g. "app:data-catalog" or "user_provided_service:sso". Other entities are skipped.
+            If None, everything is deployed.
     """
-    global cf_cli, register_in_application_broker #pylint: disable=C0103,W0603,W0601
+    global cf_cli, cf_api, register_in_application_broker #pylint: disable=C0103,W0603,W0601
 
     if is_dry_run:
         normal_cf_cli = cf_cli
-        cf_cli = dry_run.get_dry_run_cf_cli()
+        cf_cli = native_push.cf_cli = upsi.cf_cli = dry_run.get_dry_run_cf_cli()
+        normal_cf_api = cf_api
+        cf_api = native_push.cf_api = upsi.cf_api = dry_run.get_dry_run_cf_api()
         normal_register_in_app_broker = register_in_application_broker
         register_in_application_broker = dry_run.get_dry_function(register_in_application_broker)
+        deployment_journal = DeploymentJournal(None)
+        deployment_history = DeploymentHistory(None)
+    else:
+        deployment_journal = DeploymentJournal(
+            DEPLOYER_OUTPUT, resume,
+            [cf_login_data.api_url, cf_login_data.org, cf_login_data.space])
+        deployment_history = DeploymentHistory(DEPLOYER_OUTPUT)
+    trace.get_tracer().add_listener(deployment_history.record_span)
     try:
-        _do_deploy(cf_login_data, filled_appstack, artifacts_path, is_dry_run, push_strategy)
+        _do_deploy(cf_login_data, filled_appstack, artifacts_path, is_dry_run, push_strategy,
+                   deployment_journal, parallel, deployment_history,
+                   async_staging and not is_dry_run, selected_steps)
     finally:
+        trace.get_tracer().remove_listener(deployment_history.record_span)
+        deployment_history.save()
         if is_dry_run:
-            cf_cli = normal_cf_cli
+            cf_cli = native_push.cf_cli = upsi.cf_cli = normal_cf_cli
+            cf_api = native_push.cf_api = upsi.cf_api = normal_cf_api
             register_in_application_broker = normal_register_in_app_broker
 
 
-def _do_deploy(cf_login_data, filled_appstack, artifacts_path, is_dry_run, push_strategy):
+def _do_deploy(cf_login_data, filled_appstack, artifacts_path, # pylint: disable=too-many-arguments
+               is_dry_run, push_strategy, deployment_journal, parallel=1,
+               deployment_history=None, async_staging=False, selected_steps=None):
     """Iterates over each CF entity defined in filled_appstack
     and executes CF commands necessery for deployment.
 
@@ -86,51 +131,308 @@ def _do_deploy(cf_login_data, filled_appstack, artifacts_path, is_dry_run, push_
         artifacts_path (str): Path to a directory containing application artifacts (zips).
         is_dry_run (bool): When enabled then all write commands to CF will be only logged.
         push_strategy (str): Strategy for pushing applications.
+        deployment_journal (`apployer.journal.DeploymentJournal`): Journal recording completed
+            steps.
+        parallel (int): Maximum number of applications deployed at the same time.
+        deployment_history (`apployer.history.DeploymentHistory`): Durations of previous
+            deployments, used to start the longest applications first.
+        async_staging (bool): Should applications be staged without waiting for them.
+        selected_steps (set[str]): Deployment steps of the entities that should be deployed.
+            If None, everything is deployed.
     """
     _prepare_org_and_space(cf_login_data)
 
+    apps_to_restart = _deploy_global_entities(cf_login_data, filled_appstack, artifacts_path,
+                                              deployment_journal, selected_steps)
+
+    app_steps = _AppSteps(filled_appstack, artifacts_path, is_dry_run, push_strategy,
+                          deployment_journal)
+    apps_to_restart.extend(_deploy_apps(
+        app_steps,
+        [app for app in filled_appstack.apps
+         if is_push_enabled(app.push_if) and _is_selected(selected_steps, 'app', app.name)],
+        parallel, deployment_history or DeploymentHistory(None),
+        StagingPoller(cf_cli.get_space_guid(cf_login_data.space)) if async_staging else None))
+
+    with trace.context(phase='restart_apps'), trace.span('restart_apps'):
+        deployment_journal.run_step('restart_apps', sorted(apps_to_restart),
+                                    _restart_apps, filled_appstack, apps_to_restart)
+    _execute_post_actions([post_action for post_action in filled_appstack.post_actions
+                           if _is_selected(selected_steps, 'post_action', post_action.name)],
+                          artifacts_path, deployment_journal)
+
+    _log.info('DEPLOYMENT FINISHED')
+
+
+def _deploy_global_entities(cf_login_data, filled_appstack, # pylint: disable=too-many-arguments
+                            artifacts_path, deployment_journal, selected_steps):
+    """Deploys the entities that applications need: security groups, user-provided services,
+    brokers and buildpacks.
+
+    Returns:
+        list[str]: GUIDs of applications that need to be restarted because of updates of
+            user-provided services.
+    """
     apps_to_restart = []
 
     for security_group in filled_appstack.security_groups:
-        if is_push_enabled(security_group.push_if):
-            setup_security_group(cf_login_data, security_group)
+        if is_push_enabled(security_group.push_if) and \
+                _is_selected(selected_steps, 'security_group', security_group.name):
+            _run_step(deployment_journal, 'security_group', security_group.name,
+                      security_group.to_dict(), setup_security_group, cf_login_data, security_group)
 
     for service in filled_appstack.user_provided_services:
-        if is_push_enabled(service.push_if):
-            affected_apps = UpsiDeployer(service).deploy()
+        if is_push_enabled(service.push_if) and \
+                _is_selected(selected_steps, 'user_provided_service', service.name):
+            affected_apps = _run_step(deployment_journal, 'user_provided_service', service.name,
+                                      service.to_dict(), UpsiDeployer(service).deploy)
             apps_to_restart.extend(affected_apps)
 
     for broker in filled_appstack.brokers:
-        if is_push_enabled(broker.push_if):
-            setup_broker(broker)
+        if is_push_enabled(broker.push_if) and _is_selected(selected_steps, 'broker', broker.name):
+            _run_step(deployment_journal, 'broker', broker.name, broker.to_dict(),
+                      setup_broker, broker)
 
     for buildpack in filled_appstack.buildpacks:
-        setup_buildpack(buildpack, artifacts_path)
+        if _is_selected(selected_steps, 'buildpack', buildpack):
+            _run_step(deployment_journal, 'buildpack', buildpack,
+                      [buildpack, _get_artifact_names(artifacts_path, buildpack)],
+                      setup_buildpack, buildpack, artifacts_path)
+
+    return apps_to_restart
+
 
-    names_to_apps = {app.name: app for app in filled_appstack.apps}
+def _deploy_apps(app_steps, apps, parallel, deployment_history, staging_poller=None):
+    """Deploys the applications one after another, in parallel waves or with asynchronous
+    staging (see `apployer.scheduling`).
 
-    for app in filled_appstack.apps:
-        if is_push_enabled(app.push_if):
-            app_deployer = AppDeployer(app, DEPLOYER_OUTPUT)
-            affected_apps = app_deployer.deploy(artifacts_path, is_dry_run, push_strategy)
+    Args:
+        app_steps (`_AppSteps`): Deployment steps of the applications.
+        apps (list[`apployer.appstack.AppConfig`]): Applications to deploy, in deployment order.
+        parallel (int): Maximum number of applications deployed at the same time.
+        deployment_history (`apployer.history.DeploymentHistory`): Durations of previous
+            deployments, used to start the longest applications first.
+        staging_poller (`apployer.staging.StagingPoller`): Poller of staging applications.
+            If given, applications are staged without waiting for them.
+
+    Returns:
+        list[str]: GUIDs of applications that need to be restarted.
+    """
+    if staging_poller is not None:
+        return AsyncStagingDeployment(app_steps, parallel, staging_poller, deployment_history) \
+            .deploy(get_deployment_graph(app_steps.filled_appstack), apps)
+    apps_to_restart = []
+    for wave in get_app_waves(app_steps.filled_appstack, apps, parallel, deployment_history):
+        for affected_apps in map_in_parallel(app_steps.deploy, wave, parallel):
             apps_to_restart.extend(affected_apps)
-            if app.register_in:
-                # FIXME this universal mechanism is kind of pointless, because we can only do
-                # registering in application-broker. Even we made "register.sh" in the registrator
-                # app to be universal, we still need to pass a specific set of arguments to the
-                # script.
-                # And those are arguments wanted by the application-broker.
-                registrator_name = app.register_in
-                register_in_application_broker(
-                    app,
-                    names_to_apps[registrator_name],
-                    filled_appstack.domain,
-                    DEPLOYER_OUTPUT,
-                    artifacts_path)
-    _restart_apps(filled_appstack, apps_to_restart)
-    _execute_post_actions(filled_appstack.post_actions, artifacts_path)
+    return apps_to_restart
+
+
+def _is_selected(selected_steps, kind, name):
+    """
+    Args:
+        selected_steps (set[str]): Deployment steps that should be run. None if all of them.
+        kind (str): Kind of the deployed entity, e.g. "app".
+        name (str): Name of the deployed entity.
+
+    Returns:
+        bool: True if the entity should be deployed.
+    """
+    return selected_steps is None or '{}:{}'.format(kind, name) in selected_steps
 
-    _log.info('DEPLOYMENT FINISHED')
+
+class _AppSteps(object):
+    """Deployment steps of applications, run through the deployment journal.
+
+    Attributes:
+        filled_appstack (`apployer.appstack.AppStack`): Expanded appstack filled with configuration
+            extracted from a live TAP environment.
+        artifacts_path (str): Path to a directory containing application artifacts (zips).
+        is_dry_run (bool): When enabled then all write commands to CF will be only logged.
+        push_strategy (str): Strategy for pushing applications.
+        deployment_journal (`apployer.journal.DeploymentJournal`): Journal recording completed
+            steps.
+    """
+
+    def __init__(self, filled_appstack, artifacts_path, # pylint: disable=too-many-arguments
+                 is_dry_run, push_strategy, deployment_journal):
+        self.filled_appstack = filled_appstack
+        self.artifacts_path = artifacts_path
+        self.is_dry_run = is_dry_run
+        self.push_strategy = push_strategy
+        self.deployment_journal = deployment_journal
+        self._names_to_apps = {app.name: app for app in filled_appstack.apps}
+        # application deployers and whether the applications have been pushed, see `push`
+        self._pushes = {}
+
+    def get_inputs(self, app):
+        """
+        Returns:
+            list: Everything that affects the deployment step of the application (see
+                `apployer.journal.DeploymentJournal.run_step`).
+        """
+        app_inputs = [app.to_dict(), self.push_strategy,
+                      _get_artifact_names(self.artifacts_path, app.artifact_name)]
+        if app.register_in:
+            app_inputs.append(self._names_to_apps[app.register_in].to_dict())
+        return app_inputs
+
+    def deploy(self, app):
+        """Deploys the application (see `_deploy_app`), unless the journal has it completed.
+
+        Returns:
+            list[str]: GUIDs of applications that need to be restarted.
+        """
+        return _run_step(
+            self.deployment_journal, 'app', app.name, self.get_inputs(app),
+            _deploy_app, app, self._names_to_apps, self.filled_appstack.domain,
+            self.artifacts_path, self.is_dry_run, self.push_strategy)
+
+    def push(self, app):
+        """Pushes the application without waiting for it to start (see `AppDeployer.push`),
+        unless the journal has its deployment completed.
+
+        Returns:
+            str: GUID of the application if it's staging, None if there's no need to wait for it.
+        """
+        if self.deployment_journal.is_completed('app:' + app.name, self.get_inputs(app)):
+            return None
+        app_deployer = AppDeployer(app, DEPLOYER_OUTPUT)
+        with trace.context(phase='app', app=app.name):
+            is_pushed = app_deployer.push(self.artifacts_path, self.push_strategy,
+                                          wait_for_start=False)
+        self._pushes[app.name] = (app_deployer, is_pushed)
+        return app_deployer.staging_app_guid
+
+    def finish(self, app):
+        """Finishes the deployment of the application (see `_finish_app_deployment`) once
+        it's running, unless the journal has it completed.
+
+        Returns:
+            list[str]: GUIDs of applications that need to be restarted.
+        """
+        app_deployer, is_pushed = self._pushes.get(
+            app.name, (AppDeployer(app, DEPLOYER_OUTPUT), False))
+        return _run_step(
+            self.deployment_journal, 'app', app.name, self.get_inputs(app),
+            _finish_app_deployment, app_deployer, is_pushed, self._names_to_apps,
+            self.filled_appstack.domain, self.artifacts_path, self.is_dry_run)
+
+
+def get_app_selection_steps(filled_appstack, app_names, with_dependencies=False,
+                            with_dependents=False):
+    """Selects the deployment steps needed to deploy just some of the applications. Apart from
+    the applications, the global user-provided services and brokers providing the services they
+    bind and the buildpacks they use are selected.
+
+    Args:
+        filled_appstack (`apployer.appstack.AppStack`): Expanded appstack filled with configuration
+            extracted from a live TAP environment.
+        app_names (list[str]): Names of the applications.
+        with_dependencies (bool): Should the applications that the given ones depend on (through
+            services, "after" and "register_in" parameters) be deployed as well.
+        with_dependents (bool): Should the applications depending on the given ones be deployed
+            as well.
+
+    Returns:
+        set[str]: Deployment steps (see `deploy_appstack`).
+    """
+    app_graph = get_deployment_graph(filled_appstack)
+    apps = app_graph.get_closure([app for app in filled_appstack.apps if app.name in app_names],
+                                 with_dependencies, with_dependents)
+    _log.info('Selected applications: %s', ', '.join(app.name for app in apps))
+
+    bound_services = set()
+    used_buildpacks = set()
+    for app in apps:
+        bound_services.update(app.app_properties.get('services', []))
+        used_buildpacks.add(app.app_properties.get('buildpack'))
+
+    selected_steps = {'app:' + app.name for app in apps}
+    selected_steps.update('user_provided_service:' + service.name
+                          for service in filled_appstack.user_provided_services
+                          if service.name in bound_services)
+    selected_steps.update('broker:' + broker.name for broker in filled_appstack.brokers
+                          if bound_services.intersection(
+                              instance.name for instance in broker.service_instances))
+    selected_steps.update('buildpack:' + buildpack for buildpack in filled_appstack.buildpacks
+                          if buildpack in used_buildpacks)
+    return selected_steps
+
+
+def _run_step(deployment_journal, kind, name, inputs, function, *args):
+    """Runs a deployment step through the journal, tracing it.
+
+    Args:
+        deployment_journal (`apployer.journal.DeploymentJournal`): Journal recording completed
+            steps.
+        kind (str): Kind of the deployed entity, e.g. "app". It's also the deployment phase.
+        name (str): Name of the deployed entity.
+        inputs: JSON-serializable description of everything that affects the step.
+        function (types.FunctionType): Function carrying out the step.
+        args: Positional arguments for the function.
+
+    Returns:
+        Result of the function or the result recorded when the step was completed before.
+    """
+    step = '{}:{}'.format(kind, name)
+    with trace.context(phase=kind, **{kind: name}), trace.span(step):
+        return deployment_journal.run_step(step, inputs, function, *args)
+
+
+def _deploy_app(app, names_to_apps, domain, # pylint: disable=too-many-arguments
+                artifacts_path, is_dry_run, push_strategy):
+    """Deploys a single application and registers it in its registrator app if it's needed.
+
+    Returns:
+        list[str]: List of applications (their guids) that need to be restarted because of
+            updates of user-provided services provided by this applications.
+    """
+    app_deployer = AppDeployer(app, DEPLOYER_OUTPUT)
+    affected_apps = app_deployer.deploy(artifacts_path, is_dry_run, push_strategy)
+    _register_app(app, names_to_apps, domain, artifacts_path)
+    return affected_apps
+
+
+def _finish_app_deployment(app_deployer, is_push_needed, # pylint: disable=too-many-arguments
+                           names_to_apps, domain, artifacts_path, is_dry_run):
+    """Finishes the deployment of an application pushed with `AppDeployer.push`, once it's running.
+
+    Returns:
+        list[str]: List of applications (their guids) that need to be restarted because of
+            updates of user-provided services provided by this applications.
+    """
+    affected_apps = app_deployer.set_up_services(is_dry_run, is_push_needed)
+    _register_app(app_deployer.app, names_to_apps, domain, artifacts_path)
+    return affected_apps
+
+
+def _register_app(app, names_to_apps, domain, artifacts_path):
+    """Registers the application in its registrator app if it's needed."""
+    if app.register_in:
+        # FIXME this universal mechanism is kind of pointless, because we can only do
+        # registering in application-broker. Even we made "register.sh" in the registrator
+        # app to be universal, we still need to pass a specific set of arguments to the
+        # script.
+        # And those are arguments wanted by the application-broker.
+        registrator_name = app.register_in
+        with trace.context(phase='registration'), trace.span('registration'):
+            register_in_application_broker(
+                app,
+                names_to_apps[registrator_name],
+                domain,
+                DEPLOYER_OUTPUT,
+                artifacts_path)
+
+
+def _get_artifact_names(artifacts_path, artifact_name):
+    """
+    Returns:
+        list[str]: Names of the files in artifacts directory that can be the given artifact.
+            Their change (e.g. a version bump) means that the artifact has changed.
+    """
+    return sorted(path.basename(artifact_path) for artifact_path
+                  in glob.glob(path.join(artifacts_path, '{}*'.format(artifact_name))))
 
 
 def is_push_enabled(value):
@@ -173,10 +475,11 @@ def register_in_application_broker(registered_app, # pylint: disable=function-re
     application_broker_url = 'http://{}.{}'.format(application_broker.name, app_domain)
 
     register_script_path = path.join(unpacked_apps_dir, application_broker.name, 'register.sh')
-    if not path.exists(register_script_path):
-        _log.debug("Registration script %s doesn't exist. Most probably, the artifact it's in "
-                   "didn't need to be unpacked yet. Gonna do that now...")
-        AppDeployer(application_broker, unpacked_apps_dir).prepare(artifacts_location)
+    with _registrator_unpacking_lock:
+        if not path.exists(register_script_path):
+            _log.debug("Registration script %s doesn't exist. Most probably, the artifact it's in "
+                       "didn't need to be unpacked yet. Gonna do that now...", register_script_path)
+            AppDeployer(application_broker, unpacked_apps_dir).extract(artifacts_location)
 
     command = ['/bin/bash', register_script_path, '-b', application_broker_url,
                '-a', registered_app.name, '-n', registered_app.name,
@@ -280,10 +583,7 @@ def setup_buildpack(buildpack_name, buildpacks_directory):
 def _check_buildpack_needed(buildpack_name, buildpack_path):
     buildpack_description = next(buildpack_descr for buildpack_descr in cf_cli.buildpacks()
                                  if buildpack_descr.buildpack == buildpack_name)
-    buildpack_filename = path.basename(buildpack_path)
-    _log.debug('Buildpack in deployment package: %s; in environment: %s',
-               buildpack_filename, buildpack_description.filename)
-    return buildpack_filename != buildpack_description.filename
+    return is_buildpack_update_needed(buildpack_path, buildpack_description.filename)
 
 
 def setup_service_instance(broker, service_instance):
@@ -308,105 +608,18 @@ def setup_service_instance(broker, service_instance):
         _log.debug('Created instance %s of service %s.', service_instance.name, broker_name)
 
 
-def _execute_post_actions(post_actions, artifacts_path):
+def _execute_post_actions(post_actions, artifacts_path, deployment_journal):
     for post_action in post_actions:
-        _log.info(str.format('Executing post action: {}', post_action.name))
-        for command in post_action.commands:
-            _log.info(str.format('Executing command: {}', command))
-            cf_cli.run_command(command, work_dir=artifacts_path,
-                               skip_output=False, shell=True)
-
-
-class UpsiDeployer(object):
-    """Does the setup of a single user-provided service instance.
-
-    Attributes:
-        service (`apployer.appstack.UserProvidedService`): Service's configuration from the filled
-            expanded appstack.
-
-    Args:
-        service (`apployer.appstack.UserProvidedService`): See class attributes.
-    """
-
-    def __init__(self, service):
-        self.service = service
+        _run_step(deployment_journal, 'post_action', post_action.name, post_action.to_dict(),
+                  _execute_post_action, post_action, artifacts_path)
 
-    @staticmethod
-    def _recreate_bindings(bindings):
-        """Recreates the given service bindings..
 
-        Args:
-            bindings (list[dict]): List of dictionaries representing a binding.
-                Binding has "metadata" and "entity" fields.
-        """
-        for binding in bindings:
-            service_guid = binding['entity']['service_instance_guid']
-            app_guid = binding['entity']['app_guid']
-            _log.debug('Rebinding %s to %s...', service_guid, app_guid)
-
-            cf_api.delete_service_binding(binding)
-            cf_api.create_service_binding(service_guid, app_guid)
-
-    def deploy(self):
-        """Sets up a user provided service. It will be created if it doesn't exist.
-        It will be updated if it exists and its credentials in the live environment are different
-        than in appstack.
-
-        Returns:
-            list[str]: List of applications (their guids) that need to be restarted because of the
-                update of this service. This list will be empty when there's nothing to restart.
-
-        Raises:
-            CommandFailedError: Failed to set up the service.
-        """
-        service_name = self.service.name
-        _log.info('Setting up user provided service %s...', service_name)
-        try:
-            service_guid = cf_cli.get_service_guid(service_name)
-            _log.info('User provided service %s has GUID %s.', service_name, service_guid)
-        except CommandFailedError as ex:
-            _log.debug(str(ex))
-            _log.info("Failed to get GUID of user provided service %s, assuming it doesn't exist "
-                      "yet. Gonna create it now...", service_name)
-            cf_cli.create_user_provided_service(service_name,
-                                                json.dumps(self. service.credentials))
-            _log.debug('Created user provided service %s.', service_name)
-            return []
-
-        return self._update(service_guid)
-
-    def _update(self, service_guid):
-        """Updates the service if it's different in the appstack and in the live environment.
-
-        Args:
-            service_guid (str): GUID of a service.
-
-        Returns:
-            list[str]: List of applications (their guids) that need to be restarted because of the
-                update of this service. This list will be empty when there's nothing to restart
-        """
-        service_name = self.service.name
-        appstack_credentials = self.service.credentials
-        live_credentials = cf_api.get_upsi_credentials(service_guid)
-
-        if live_credentials != appstack_credentials:
-            _log.info('User provided service %s is different in the live environment and appstack. '
-                      'Will update it...', service_name)
-            _log.debug('Service credentials differences:\n%s',
-                       datadiff.diff(live_credentials, appstack_credentials,
-                                     fromfile='live env', tofile='appstack'))
-            cf_cli.update_user_provided_service(service_name, json.dumps(appstack_credentials))
-
-            service_bindings = cf_api.get_upsi_bindings(service_guid)
-            _log.info('Rebinding apps to service instance %s...', service_name)
-            self._recreate_bindings(service_bindings)
-
-            app_guids = [binding['entity']['app_guid'] for binding in service_bindings]
-            return app_guids
-        else:
-            _log.info('Service %s already exists and is up-to-date. No need to do anything...',
-                      service_name)
-            return []
+def _execute_post_action(post_action, artifacts_path):
+    _log.info(str.format('Executing post action: {}', post_action.name))
+    for command in post_action.commands:
+        _log.info(str.format('Executing command: {}', command))
+        cf_cli.run_command(command, work_dir=artifacts_path,
+                           skip_output=False, shell=True)
 
 
 class AppDeployer(object):
@@ -415,19 +628,25 @@ class AppDeployer(object):
     Attributes:
         app (`apployer.appstack.AppConfig`): Application's configuration from the filled
             expanded appstack.
-        output_path (str): Output path for Apployer. Application artifacts will be unpacked there.
+        output_path (str): Output path for Apployer. Filled manifests will be saved there and
+            application artifacts will be unpacked there (when needed).
+        staging_app_guid (str): GUID of the application if `push` has left it staging.
+        native_pusher (`apployer.native_push.NativePusher`): Pushes the application through
+            Cloud Controller API when it's enough.
 
     Args:
         app (`apployer.appstack.AppConfig`): See class attributes.
         output_path (str): See class attributes.
     """
 
-    FILLED_MANIFEST = 'filled_manifest.yml'
-
     # TODO it should throw some error on push that can be handled by the overall procedure.
     def __init__(self, app, output_path):
         self.app = app
         self.output_path = output_path
+        self.staging_app_guid = None
+        self.native_pusher = NativePusher(app, self._get_live_env_value)
+        self._live_env = None
+        self._live_env_error = None
 
     def deploy(self, artifacts_location, is_dry_run, push_strategy=UPGRADE_STRATEGY):
         """Sets up the application in Cloud Foundry. This also sets up the broker (if one is
@@ -445,101 +664,202 @@ class AppDeployer(object):
                 updates of user-provided services provided by this applications.
                 This list will be empty when there's nothing to restart.
         """
-        is_push_needed = self._check_push_needed(push_strategy)
+        is_push_needed = self.push(artifacts_location, push_strategy)
+        return self.set_up_services(is_dry_run, is_push_needed)
+
+    def push(self, artifacts_location, push_strategy=UPGRADE_STRATEGY, wait_for_start=True):
+        """Pushes the application (or only updates its environment) when it's needed.
+
+        Args:
+            artifacts_location (str): Path to a directory containing artifacts in ZIP format.
+            push_strategy (str): Strategy for pushing the application.
+            wait_for_start (bool): If False, the application will be left staging and
+                `staging_app_guid` will be set. It needs to be started before
+                `set_up_services` is called.
+
+        Returns:
+            bool: True if the application has been pushed.
+        """
+        is_push_needed = self._check_push_needed(push_strategy, artifacts_location)
+        include_fingerprints = push_strategy == FINGERPRINT_STRATEGY
 
         _log.info('Setting up application %s...', self.app.name)
-        self._push_app(artifacts_location, is_push_needed)
+        # PUSH_ALL always pushes, even if only environment variables have changed
+        if is_push_needed and push_strategy != PUSH_ALL_STRATEGY \
+                and self.native_pusher.is_env_update_enough(artifacts_location):
+            with trace.context(phase='env_update'), trace.span('env_update'):
+                self.native_pusher.update_env(artifacts_location, include_fingerprints)
+            is_push_needed = False
+        elif is_push_needed and include_fingerprints \
+                and self.native_pusher.is_bits_upload_enough(artifacts_location):
+            with trace.context(phase='push'), trace.span('push', native=True):
+                self.staging_app_guid = self.native_pusher.upload_bits(artifacts_location,
+                                                                       wait_for_start)
+        else:
+            self._push_app(artifacts_location, is_push_needed, wait_for_start,
+                           include_fingerprints)
+        return is_push_needed
+
+    def set_up_services(self, is_dry_run, is_push_needed):
+        """Sets up what the (running) application provides: user-provided services and a broker.
+        Runs application's post-push command if it has been pushed.
 
+        Args:
+            is_dry_run (bool): When enabled then all write commands to CF will be only logged.
+            is_push_needed (bool): Has the application been pushed (see `push`).
+
+        Returns:
+            list[str]: List of applications (their guids) that need to be restarted because of
+                updates of user-provided services provided by this applications.
+        """
         apps_to_restart = []
         for service in self.app.user_provided_services:
-            affected_apps = UpsiDeployer(service).deploy()
+            with trace.context(phase='user_provided_service', user_provided_service=service.name):
+                affected_apps = UpsiDeployer(service).deploy()
             apps_to_restart.extend(affected_apps)
 
         if is_push_needed and self.app.push_options.post_command:
-            self._execute_post_command(is_dry_run)
+            with trace.context(phase='post_command'), trace.span('post_command'):
+                self._execute_post_command(is_dry_run)
 
         if self.app.broker_config:
-            setup_broker(self.app.broker_config)
+            with trace.context(phase='broker', broker=self.app.broker_config.name):
+                setup_broker(self.app.broker_config)
 
         return apps_to_restart
 
-    def prepare(self, artifacts_location):
-        """Prepares the application for deployment. It extracts the artifact and saves a full
-        app manifest to the artifact directory for CF CLI to use.
-
-        Returns:
-            str: Path to the directory from which the application can be pushed to CF.
-        """
-        _log.debug('Preparing app artifact of app %s...', self.app.name)
-        artifact_partial_path = path.join(artifacts_location, self.app.artifact_name)
-        try:
-            artifact_path = glob.glob('{}*'.format(artifact_partial_path))[0]
-        except IndexError:
-            raise IOError("Didn't find any artifact matching to path {}"
-                          .format(artifact_partial_path))
+    def prepare(self, artifacts_location, include_fingerprints=False):
+        """Prepares the application for deployment. It saves a full app manifest for CF CLI to use.
+        The manifest is kept outside of the artifact, so that the artifact can be pushed as it is,
+        without unpacking it.
 
-        unpacked_path = path.realpath(path.join(self.output_path, self.app.name))
+        Args:
+            artifacts_location (str): Path to a directory containing artifacts in ZIP format.
+            include_fingerprints (bool): Should application's fingerprints needed by FINGERPRINT
+                push strategy be added to the environment variables in the manifest. The base
+                fingerprint is always added, see `NativePusher.is_env_update_enough`.
 
-        _log.debug('Unpacking app artifact from %s to %s...', artifact_path, unpacked_path)
-        ZipFile(artifact_path).extractall(unpacked_path)
+        Returns:
+            str: Path to the filled manifest.
 
-        filled_manifest_path = path.join(unpacked_path, self.FILLED_MANIFEST)
+        Raises:
+            IOError: Application's artifact wasn't found.
+        """
+        _log.debug('Preparing app %s...', self.app.name)
+        app_file.get_artifact_path(artifacts_location, self.app.artifact_name)
+
+        app_properties = dict(self.app.app_properties)
+        app_properties['env'] = self.native_pusher.get_manifest_env(artifacts_location,
+                                                                    include_fingerprints)
+
+        manifests_path = path.realpath(path.join(self.output_path, FINAL_MANIFESTS_FOLDER))
+        with _output_dirs_lock:
+            if not path.exists(manifests_path):
+                os.makedirs(manifests_path)
+        filled_manifest_path = path.join(manifests_path, self.app.name + '.yml')
         _log.debug('Dumping filled application manifest: %s', filled_manifest_path)
         with open(filled_manifest_path, 'w') as manifest_file:
             yaml.dump(
-                {'applications': [self.app.app_properties]},
+                {'applications': [app_properties]},
                 manifest_file,
                 default_flow_style=False,
                 width=1000)
 
+        return filled_manifest_path
+
+    def extract(self, artifacts_location):
+        """Unpacks application's artifact. It's only needed when Apployer itself needs files from
+        inside of it (e.g. the registration script).
+
+        Returns:
+            str: Path to the directory with application's files.
+
+        Raises:
+            IOError: Application's artifact wasn't found.
+        """
+        artifact_path = app_file.get_artifact_path(artifacts_location, self.app.artifact_name)
+        unpacked_path = path.realpath(path.join(self.output_path, self.app.name))
+        _log.debug('Unpacking app artifact from %s to %s...', artifact_path, unpacked_path)
+        with trace.span('unpack', artifact=path.basename(artifact_path)):
+            ZipFile(artifact_path).extractall(unpacked_path)
         return unpacked_path
 
-    def _push_app(self, artifacts_location, is_push_needed):
+    def _push_app(self, artifacts_location, is_push_needed, wait_for_start=True,
+                  include_fingerprints=False):
         """Pushes an application to Cloud Foundry. Or not, if the conditions aren't right.
         Can also restart it.
         """
         if is_push_needed:
             _log.info('Pushing app %s...', self.app.name)
-            prepared_app_path = self.prepare(artifacts_location)
-            app_manifest_location = path.join(prepared_app_path, self.FILLED_MANIFEST)
-            cf_cli.push(prepared_app_path, app_manifest_location, self.app.push_options.params)
+            with trace.context(phase='prepare'), trace.span('prepare'):
+                app_manifest_location = self.prepare(artifacts_location, include_fingerprints)
+            artifact_path = app_file.get_artifact_path(artifacts_location, self.app.artifact_name)
+            push_options = self.app.push_options.params
+            # Without waiting for the start, CF CLI only uploads the application. It's started
+            # (and staged) through the API, which doesn't wait for it either.
+            start_through_api = not wait_for_start and '--no-start' not in push_options
+            if start_through_api:
+                push_options += ' --no-start'
+            with trace.context(phase='push'), trace.span('push'):
+                cf_cli.push(path.realpath(artifact_path), app_manifest_location, push_options)
+                if start_through_api:
+                    self.staging_app_guid = cf_cli.get_app_guid(self.app.name)
+                    cf_api.start_app(self.staging_app_guid)
         else:
             _log.info("No need to push app %s, it's already up-to-date...", self.app.name)
 
-    def _check_push_needed(self, push_strategy):
+    def _check_push_needed(self, push_strategy, artifacts_location):
         _log.debug('Checking whether to push app %s...', self.app.name)
+        if push_strategy == PUSH_ALL_STRATEGY:
+            return is_app_push_needed(push_strategy, None, self.app)
+        if push_strategy == FINGERPRINT_STRATEGY:
+            try:
+                live_fingerprint = self._get_live_env_value(FINGERPRINT_ENV_VAR)
+            except CommandFailedError as ex:
+                _log.debug(str(ex))
+                live_fingerprint = None
+            return is_app_push_needed(push_strategy, None, self.app, live_fingerprint,
+                                      self.native_pusher.get_fingerprint(artifacts_location))
         try:
-            if push_strategy == PUSH_ALL_STRATEGY:
-                _log.debug('Will push app %s because strategy is PUSH_ALL.', self.app.name)
-            else:
-                live_app_version = self._get_app_version()
-                # empty version string will be parsed to the lowest possible version
-                appstack_app_version = self.app.app_properties.get('env', {}).get('VERSION', '')
-                if parse_version(live_app_version) >= parse_version(appstack_app_version):
-                    _log.debug("App's version (%s) in the live environment isn't lower than the "
-                               "one in filled appstack (%s).\nWon't push app %s",
-                               live_app_version, appstack_app_version, self.app.name)
-                    return False
-                else:
-                    _log.debug("App's version (%s) in the in filled appstack is higher than in "
-                               "live environment (%s).\nWill push app %s",
-                               appstack_app_version, live_app_version, self.app.name)
+            live_app_version = self._get_app_version()
         except (CommandFailedError, AppVersionNotFoundError) as ex:
             _log.debug(str(ex))
             _log.debug("Getting app (%s) version failed. Will push the app because of that.",
                        self.app.name)
-        return True
+            return True
+        return is_app_push_needed(push_strategy, live_app_version, self.app)
 
     def _get_app_version(self):
-        app_env = cf_cli.env(self.app.name)
-        try:
-            app_version_line = next(line for line in app_env.splitlines()
-                                    if line.startswith('VERSION:'))
-        except StopIteration:
+        app_version = self._get_live_env_value('VERSION')
+        if app_version is None:
             raise AppVersionNotFoundError(
                 "Can't determine the version of app {}. VERSION environment variable not found."
                 .format(self.app.name))
-        return app_version_line.split()[1]
+        return app_version
+
+    def _get_live_env_value(self, variable_name):
+        """
+        Returns:
+            str: Value of the user-provided environment variable of the application in the live
+                environment. None if the variable isn't set.
+
+        Raises:
+            CommandFailedError: Application doesn't exist or its environment can't be read.
+        """
+        if self._live_env_error is not None:
+            raise CommandFailedError(str(self._live_env_error), self._live_env_error.output)
+        if self._live_env is None:
+            try:
+                self._live_env = cf_cli.env(self.app.name)
+            except CommandFailedError as ex:
+                # most probably the application doesn't exist, there's no point in asking again
+                self._live_env_error = ex
+                raise
+        prefix = variable_name + ':'
+        for line in self._live_env.splitlines():
+            if line.startswith(prefix):
+                return line[len(prefix):].strip()
+        return None
 
     def _execute_post_command(self, is_dry_run):
         if is_dry_run:
@@ -550,6 +870,68 @@ class AppDeployer(object):
             subprocess.check_call(self.app.push_options.post_command, shell=True)
 
 
+def is_app_push_needed(push_strategy, live_app_version, app, # pylint: disable=too-many-arguments
+                       live_fingerprint=None, fingerprint=None):
+    """Decides whether an application needs to be pushed.
+
+    Args:
+        push_strategy (str): Strategy for pushing the application.
+        live_app_version (str): Version of the application in the live environment.
+            None if the application or its version wasn't found there.
+        app (`apployer.appstack.AppConfig`): Application's configuration from the filled
+            expanded appstack.
+        live_fingerprint (str): Fingerprint of the application in the live environment (only
+            needed for FINGERPRINT strategy). None if the application or its fingerprint wasn't
+            found there.
+        fingerprint (str): Fingerprint of the application that would be pushed (only needed for
+            FINGERPRINT strategy).
+
+    Returns:
+        bool: True if the application should be pushed.
+    """
+    if push_strategy == PUSH_ALL_STRATEGY:
+        _log.debug('Will push app %s because strategy is PUSH_ALL.', app.name)
+        return True
+    if push_strategy == FINGERPRINT_STRATEGY:
+        if live_fingerprint == fingerprint:
+            _log.debug("App %s hasn't changed since it was pushed. Won't push it.", app.name)
+            return False
+        _log.debug('Fingerprint of app %s (%s) differs from the live one (%s). Will push it.',
+                   app.name, fingerprint, live_fingerprint)
+        return True
+    if live_app_version is None:
+        _log.debug("App %s or its version wasn't found in the live environment. Will push it.",
+                   app.name)
+        return True
+
+    # empty version string will be parsed to the lowest possible version
+    appstack_app_version = app.app_properties.get('env', {}).get('VERSION', '')
+    if parse_version(live_app_version) >= parse_version(appstack_app_version):
+        _log.debug("App's version (%s) in the live environment isn't lower than the "
+                   "one in filled appstack (%s).\nWon't push app %s",
+                   live_app_version, appstack_app_version, app.name)
+        return False
+    _log.debug("App's version (%s) in the in filled appstack is higher than in "
+               "live environment (%s).\nWill push app %s",
+               appstack_app_version, live_app_version, app.name)
+    return True
+
+
+def is_buildpack_update_needed(buildpack_path, live_buildpack_filename):
+    """
+    Args:
+        buildpack_path (str): Path to the buildpack's artifact in the deployment package.
+        live_buildpack_filename (str): File name of the buildpack in the live environment.
+
+    Returns:
+        bool: True if the buildpack in the live environment is different (in other version).
+    """
+    buildpack_filename = path.basename(buildpack_path)
+    _log.debug('Buildpack in deployment package: %s; in environment: %s',
+               buildpack_filename, live_buildpack_filename)
+    return buildpack_filename != live_buildpack_filename
+
+
 class AppVersionNotFoundError(Exception):
     """
     'VERSION' environment variable wasn't present for an application.
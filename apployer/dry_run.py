@@ -18,11 +18,14 @@
 Providing an elegant option of a dry run for the Apployer.
 """
 
+from contextlib import contextmanager
 import inspect
+import json
 import logging
+import os
 import types
 
-from apployer import cf_cli
+from apployer import cf_api, cf_cli
 
 _log = logging.getLogger(__name__) #pylint: disable=invalid-name
 
@@ -32,11 +35,21 @@ def get_dry_run_cf_cli():
     Functions that don't introduce any changes to Cloud Foundry (with the exception of those that
     create the org and space) will remain, others will just log their names and parameters."""
     function_exceptions = ['login', 'buildpacks', 'create_org', 'create_space', 'env',
-                           'get_app_guid', 'get_service_guid', 'oauth_token', 'service', 'service_brokers',
+                           'get_app_guid', 'get_service_guid', 'get_space_guid', 'oauth_token',
+                           'service', 'service_brokers',
                            'api', 'auth', 'target', 'get_command_output']
     return provide_dry_run_module(cf_cli, function_exceptions)
 
 
+def get_dry_run_cf_api():
+    """Providing a module with functions having identical signatures as functions in cf_api.
+    Functions that only read from Cloud Foundry will remain, others will just log their names and
+    parameters."""
+    function_exceptions = ['get_all_resources', 'get_app_env', 'get_app_name', 'get_space_apps',
+                           'get_upsi_bindings', 'get_upsi_credentials', 'match_resources']
+    return provide_dry_run_module(cf_api, function_exceptions)
+
+
 def provide_dry_run_module(module, exceptions):
     """Provides a new module with functions having identical signatures as functions in the
     provided module. Public functions (the ones not starting with "_") in the new module do nothing
@@ -75,3 +88,142 @@ def get_dry_function(function):
         _log.info('DRY RUN: calling %s with arguments %s',
                   function.__name__, inspect.getcallargs(function, *args, **kwargs))
     return _wrapper
+
+
+class CommandSnapshot(object):
+    """Outputs of the read-only CF CLI commands (`cf_cli.get_command_output`, which is also used by
+    `cf_api`) recorded from a live environment. Failed commands are recorded as well, since
+    the deployment makes decisions based on the failures (e.g. "cf env" fails for an application
+    that doesn't exist).
+
+    Only the oauth token is left out. The outputs of "cf env" and "cf curl" (application
+    environments, user-provided service credentials) are recorded as they are, because the dry run
+    compares them with the appstack, so the snapshot file contains credentials. It's created
+    readable only by its owner.
+
+    Attributes:
+        commands (dict[str,dict]): Commands (joined with spaces) mapped to the records of their
+            results. Record has "output" and "failed" fields.
+
+    Args:
+        commands (dict[str,dict]): See class attributes.
+    """
+
+    # outputs of those commands are secrets that shouldn't be written to a file
+    SECRET_COMMANDS = {'cf oauth-token'}
+
+    def __init__(self, commands=None):
+        self.commands = commands or {}
+
+    @classmethod
+    def load(cls, snapshot_path):
+        """
+        Args:
+            snapshot_path (str): Path to a snapshot file created by `CommandSnapshot.save`.
+
+        Returns:
+            `CommandSnapshot`: The snapshot.
+        """
+        with open(snapshot_path) as snapshot_file:
+            return cls(json.load(snapshot_file))
+
+    def save(self, snapshot_path):
+        """
+        Args:
+            snapshot_path (str): Path of the snapshot file.
+        """
+        _log.info('Saving snapshot of %s CF commands to %s...', len(self.commands), snapshot_path)
+        _log.warning('Snapshot %s contains credentials from the environment, keep it private.',
+                     snapshot_path)
+        snapshot_fd = os.open(snapshot_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(snapshot_fd, 'w') as snapshot_file:
+            json.dump(self.commands, snapshot_file, indent=2, sort_keys=True)
+
+    def get_recording_function(self, get_command_output):
+        """
+        Args:
+            get_command_output (types.FunctionType): Function getting outputs of commands from
+                the live environment, like `cf_cli.get_command_output`.
+
+        Returns:
+            types.FunctionType: Substitute for the function that records the results of the
+                commands it runs.
+        """
+        def _recording_get_command_output(command):
+            command_string = ' '.join(command)
+            try:
+                output = get_command_output(command)
+            except cf_cli.CommandFailedError as ex:
+                self._record(command_string, ex.output, True)
+                raise
+            self._record(command_string, output, False)
+            return output
+        return _recording_get_command_output
+
+    def replay(self, command):
+        """Substitute for `cf_cli.get_command_output` that takes the results from the snapshot.
+
+        Args:
+            command (list[str]): List of command parts.
+
+        Returns:
+            str: Recorded output of the command.
+
+        Raises:
+            CommandFailedError: When the command has failed during recording or it wasn't
+                recorded at all.
+        """
+        command_string = ' '.join(command)
+        record = self.commands.get(command_string)
+        if record is None:
+            _log.warning("Command %s isn't in the snapshot. Treating it as a failed one.",
+                         command_string)
+            raise cf_cli.CommandFailedError('Command not in snapshot: {}'.format(command_string))
+        if record['failed']:
+            raise cf_cli.CommandFailedError(
+                'Command failed: {}\nOutput: {}'.format(command_string, record['output']),
+                output=record['output'])
+        return record['output']
+
+    def _record(self, command_string, output, failed):
+        if command_string not in self.SECRET_COMMANDS:
+            self.commands[command_string] = {'output': output, 'failed': failed}
+
+
+@contextmanager
+def recording_snapshot(snapshot_path):
+    """Context in which outputs of all CF commands reading from the environment are recorded.
+    They are saved to a file when the context exits.
+
+    Args:
+        snapshot_path (str): Path of the snapshot file.
+    """
+    snapshot = CommandSnapshot()
+    live_get_command_output = cf_cli.get_command_output
+    cf_cli.get_command_output = snapshot.get_recording_function(live_get_command_output)
+    try:
+        yield snapshot
+    finally:
+        cf_cli.get_command_output = live_get_command_output
+        snapshot.save(snapshot_path)
+
+
+@contextmanager
+def replaying_snapshot(snapshot_path):
+    """Context in which CF commands reading from the environment return results recorded in
+    a snapshot and all the other commands (logging in, targeting, creating the org and space)
+    are only logged. Combined with the dry run, this makes the deployment work entirely offline.
+
+    Args:
+        snapshot_path (str): Path to a snapshot file recorded with `recording_snapshot`.
+    """
+    snapshot = CommandSnapshot.load(snapshot_path)
+    live_get_command_output = cf_cli.get_command_output
+    live_run_command = cf_cli.run_command
+    cf_cli.get_command_output = snapshot.replay
+    cf_cli.run_command = get_dry_function(live_run_command)
+    try:
+        yield snapshot
+    finally:
+        cf_cli.get_command_output = live_get_command_output
+        cf_cli.run_command = live_run_command
@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Client of Cloudera Manager's REST API used to extract the configuration of the Hadoop cluster.
+"""
+
+import json
+import logging
+import threading
+import urllib
+
+from .memoization import memoized
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+API_VERSION = 'v10'
+
+
+class ClouderaManagerClient(object):
+    """Reads only the resources (services' roles, configurations, hosts) needed to get a value,
+    instead of the whole deployment description. Each resource is read once and its items are
+    indexed by their names, even if many threads need it at the same time.
+
+    Args:
+        execute_command (callable): Function running a shell command (on the jumpbox) and returning
+            its output.
+        hostname (str): Host of Cloudera Manager.
+        port (int): Port of Cloudera Manager.
+        user (str): Cloudera Manager's user.
+        password (str): Password of the user.
+    """
+
+    def __init__(self, execute_command, hostname, port, user, password): # pylint: disable=too-many-arguments
+        self._execute_command = execute_command
+        self._api_url = 'http://{}:{}/api/{}'.format(hostname, port, API_VERSION)
+        self._user = user
+        self._password = password
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def get_cluster_name(self):
+        """
+        Returns:
+            str: Name of the (first) cluster managed by Cloudera Manager.
+        """
+        return self._get_items('/clusters')[0]['name']
+
+    def get_role_hostname(self, service_name, role_name):
+        """
+        Args:
+            service_name (str): Name of a service, e.g. "HDFS".
+            role_name (str): Name of the service's role, e.g. "HDFS-NAMENODE".
+
+        Returns:
+            str: Hostname of the host on which the role runs.
+
+        Raises:
+            KeyError: There's no such role.
+        """
+        host_id = self._get_roles(service_name)[role_name]['hostRef']['hostId']
+        return self._get_hostname(host_id)
+
+    def get_service_config(self, service_name):
+        """
+        Args:
+            service_name (str): Name of a service, e.g. "SENTRY".
+
+        Returns:
+            dict[str,str]: Service's configuration items (names mapped to values).
+        """
+        return self._get_config(self._get_service_path(service_name) + '/config')
+
+    def get_role_config_group_config(self, service_name, group_name):
+        """
+        Args:
+            service_name (str): Name of a service, e.g. "SQOOP_CLIENT".
+            group_name (str): Name of the service's role config group, e.g.
+                "SQOOP_CLIENT-GATEWAY-BASE".
+
+        Returns:
+            dict[str,str]: Group's configuration items (names mapped to values).
+        """
+        return self._get_config('{}/roleConfigGroups/{}/config'.format(
+            self._get_service_path(service_name), urllib.quote(group_name)))
+
+    def _get_service_path(self, service_name):
+        return '/clusters/{}/services/{}'.format(urllib.quote(self.get_cluster_name()),
+                                                 urllib.quote(service_name))
+
+    @memoized
+    def _get_roles(self, service_name):
+        roles = self._get_items(self._get_service_path(service_name) + '/roles')
+        return {role['name']: role for role in roles}
+
+    @memoized
+    def _get_hostname(self, host_id):
+        return self._get('/hosts/' + urllib.quote(host_id))['hostname']
+
+    @memoized
+    def _get_config(self, resource_path):
+        return {item['name']: item.get('value') for item in self._get_items(resource_path)}
+
+    @memoized
+    def _get_items(self, resource_path):
+        return self._get(resource_path).get('items', [])
+
+    def _get(self, resource_path):
+        """
+        Args:
+            resource_path (str): Path of a resource, relative to API's URL.
+
+        Returns:
+            dict: Resource's JSON.
+        """
+        url = self._api_url + resource_path
+        _log.info('Send request to %s', url)
+        response = self._execute_command('curl -X GET {} -u {}:{}'.format(url, self._user, self._password))
+        return json.loads(response)
@@ -20,6 +20,9 @@ Deduction of some configuration variables based on those already fetched.
 
 THRIFT_SERVER_URL = 'thrift_server_url'
 HIVE_SERVER_URL = 'hive_server_url'
+# variables from which the final configuration is deduced
+REQUIRED_VARIABLES = ('kerberos_host', 'kerberos_realm', 'namenode_internal_host', 'arcadia_node',
+                      'external_tool_arcadia')
 
 
 def deduce_final_configuration(fetched_config):
@@ -23,10 +23,12 @@ import logging
 import os
 import pprint
 import jinja2
+from jinja2 import meta
 import yaml
 
 from .jumpbox_utilities import ConfigurationExtractor
-from .conf_finalizer import deduce_final_configuration
+from .conf_finalizer import deduce_final_configuration, REQUIRED_VARIABLES
+from ..template_variables import record_fill
 
 DEPLOY_CONF_FILE = 'templates/template_variables.yml'
 DEFAULT_FILLED_APPSTACK_PATH = 'filled_expanded_appstack.yml'
@@ -47,8 +49,9 @@ def fill_appstack(expanded_appstack_file, fetcher_config_path):
     if not fetcher_config_path:
         fetcher_config_path = DEFAULT_FETCHER_CONF
     fetcher_config = _get_fetcher_config(fetcher_config_path)
-    env_conf_values = _get_environment_config(fetcher_config)
     deployment_variables = _evaluate_deployment_variables(fetcher_config)
+    needed_variables = _get_needed_variables(expanded_appstack_file, deployment_variables)
+    env_conf_values = _get_environment_config(fetcher_config, needed_variables)
     filled_config = _get_full_deployment_config(deployment_variables, env_conf_values)
     _fill_appstack(expanded_appstack_file, filled_config, DEFAULT_FILLED_APPSTACK_PATH)
     return DEFAULT_FILLED_APPSTACK_PATH
@@ -61,10 +64,27 @@ def _get_fetcher_config(fetcher_config_path):
     return fetcher_config
 
 
-def _get_environment_config(fetcher_config):
+def _get_needed_variables(expanded_appstack_file, deployment_variables):
+    """
+    Args:
+        expanded_appstack_file (str): Path to the expanded appstack.
+        deployment_variables (dict): Variables set in the deployment configuration file.
+
+    Returns:
+        set[str]: Names of the variables that need to be extracted from the environment - the ones
+            used by the expanded appstack (or needed to deduce the final configuration) and not set
+            in the deployment configuration file.
+    """
+    with open(expanded_appstack_file) as appstack_file:
+        appstack_ast = jinja2.Environment().parse(appstack_file.read())
+    used_variables = meta.find_undeclared_variables(appstack_ast).union(REQUIRED_VARIABLES)
+    return {name for name in used_variables if not deployment_variables.get(name)}
+
+
+def _get_environment_config(fetcher_config, needed_variables=None):
     _log.info("Extracting configuration values from environment...")
     with ConfigurationExtractor(fetcher_config) as cf_extractor:
-        env_conf = cf_extractor.get_deployment_configuration()
+        env_conf = cf_extractor.get_deployment_configuration(needed_variables)
 
     _log.debug('Config values fetched from environment:\n%s', pprint.pformat(env_conf))
     return env_conf
@@ -108,3 +128,4 @@ def _fill_appstack(expanded_appstack_file, filled_config, filled_appstack_path):
     with open(filled_appstack_path, 'w') as appstack_file:
         appstack_file.write(full_appstack_str)
     _log.info('Filled expanded appstack file: %s', os.path.realpath(filled_appstack_path))
+    record_fill(expanded_appstack_file, filled_config)
@@ -21,14 +21,19 @@ import re
 import json
 import yaml
 import logging
+import functools
 import tempfile
 import subprocess
 import shutil
+import threading
 import urlparse
 import xml.etree.ElementTree as ET
 import ConfigParser
+from multiprocessing.pool import ThreadPool
 
+from .cm_client import ClouderaManagerClient
 from .expressions import ExpressionsEngine, FsKeyValueStore, return_fixed_output
+from .memoization import memoized
 
 GENERATE_KEYTAB_SCRIPT = """#!/bin/sh
 
@@ -49,12 +54,56 @@ sudo rm $TMP
 """
 
 PORT_CHECKER_SCRIPT = """
-import socket;
-import sys;
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-result = sock.connect_ex(("{hostname}", {port}))
-print(result);
+import json
+import socket
+import threading
+
+ADDRESSES = {addresses}
+TIMEOUT = {timeout}
+results = [None] * len(ADDRESSES)
+
+def check_port(index, hostname, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        results[index] = sock.connect_ex((hostname, port))
+    except socket.error:
+        results[index] = -1
+    finally:
+        sock.close()
+
+threads = [threading.Thread(target=check_port, args=(index, hostname, port))
+           for index, (hostname, port) in enumerate(ADDRESSES)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(json.dumps(results))
 """
+PORT_CHECKER_SCRIPT_PATH = '/tmp/check_ports.py'
+# seconds, for each port
+PORT_CHECK_TIMEOUT = 5
+
+# Output of commands run through the payload channel (see `ConfigurationExtractor.execute_payload_command`)
+# is preceded by this marker and its length in bytes.
+PAYLOAD_MARKER = 'APPLOYER_PAYLOAD'
+FRAMED_COMMAND_TEMPLATE = 'payload=$(mktemp) && {{ {command} ; }} > "$payload"; status=$?; ' \
+                          'echo "{marker} $(wc -c < "$payload")"; cat "$payload"; rm -f "$payload"; exit $status'
+PAYLOAD_HEADER_PATTERN = re.compile(r'(?:^|\n){}\s+(\d+)\n'.format(PAYLOAD_MARKER))
+# messages of sudo configured with "requiretty"
+TTY_REQUIRED_MESSAGES = ('must have a tty', 'no tty present')
+
+
+class TtyRequiredError(Exception):
+    """Command can't be run without a pseudo-terminal (e.g. because of sudo's "requiretty")."""
+
+
+# Variables telling whether services are reachable, mapped to the variables holding the services'
+# hosts and ports. All the ports are checked at once, by a single script run on the jumpbox.
+PROBED_SERVICES = {
+    'external_tool_hue': ('hue_node', 'hue_port'),
+    'external_tool_arcadia': ('arcadia_node', 'arcadia_port'),
+}
 
 hgm_service_name = 'HADOOPGROUPSMAPPING'
 hgm_role_name = 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER'
@@ -66,6 +115,22 @@ DEFAULT_H2O_PROVISIONER_PORT = '9876'
 DEFAULT_OOZIE_PORT = '11000'
 DEFAULT_YARN_PORT = '8032'
 
+AUTH_GATEWAY_PROFILE = 'cloud,warehouse-auth-gateway,zookeeper-auth-gateway,hdfs-auth-gateway,' \
+                       'https-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'
+KERBEROS_AUTH_GATEWAY_PROFILE = 'cloud,kerberos-warehouse-auth-gateway,zookeeper-auth-gateway,' \
+                                'hdfs-auth-gateway,kerberos-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'
+# services which client configurations are provided as "import_hadoop_conf_<service name>" variables
+CLIENT_CONFIG_SERVICES = ('HDFS', 'HBASE', 'YARN', 'HIVE')
+
+# Maximum number of variables' providers (each running a few commands) evaluated at the same time.
+PROVIDER_THREADS = 8
+# Waiting for results of a thread pool without a timeout can't be interrupted with Ctrl+C.
+_POOL_RESULTS_TIMEOUT = 24 * 3600
+
+
+def _constant(value):
+    return lambda: value
+
 
 class ConfigurationExtractor(object):
     def __init__(self, config):
@@ -85,6 +150,15 @@ class ConfigurationExtractor(object):
         self._cdh_manager_ssh_user = config['cdh-manager']['ssh_user']
         self._inventory = self._generate_inventory(config['workers_count'], config['masters_count'], config['envname'])
         self._envname = config['envname']
+        self._cdh_manager_hostname = self._inventory['cdh-manager'][0]
+        self._jumpboxes_vars = None
+        self._tty_required = False
+        self._jumpboxes_vars_lock = threading.Lock()
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+        self._cm_client = ClouderaManagerClient(lambda command: self.execute_command(command),
+                                                self._cdh_manager_hostname, self._cdh_manager_port,
+                                                self._cdh_manager_user, self._cdh_manager_password)
 
     def __enter__(self):
         return self
@@ -111,15 +185,70 @@ class ConfigurationExtractor(object):
         self._logger.info('Expressions evaluated')
         return deployment_variables
 
-    def get_deployment_configuration(self):
+    def get_deployment_configuration(self, variables=None):
+        """Gets the values of configuration variables from the environment.
+
+        Args:
+            variables (set[str]): Names of the needed variables (e.g. the ones used in the expanded
+                appstack). Only their providers are evaluated. If None, all variables are provided.
+
+        Returns:
+            dict: Variables' values.
+        """
         self._logger.info('Getting deployment configuration')
-        self._jumpboxes_vars = self._get_ansible_hosts()
-        cf_tiny_yml_data = self._get_data_from_cf_tiny_yaml()
-        docker_broker_yml = self._get_data_from_docker_broker_yaml()
-        defaults_cdh_yml = self._get_data_from_defaults_cdh_yaml()
-        cdh_manager_data = self._get_data_from_cdh_manager()
+        if variables is None:
+            self._jumpboxes_vars = self._get_ansible_hosts()
+            data_getters = [self._get_data_from_cf_tiny_yaml, self._get_data_from_docker_broker_yaml,
+                            self._get_data_from_defaults_cdh_yaml, self._get_data_from_cdh_manager]
+            result = {}
+            for data in self._map_concurrently(lambda data_getter: data_getter(), data_getters):
+                result.update(data)
+        else:
+            result = self._get_variables(variables)
         self._logger.info('Deployment configuration downloaded')
-        return dict(cf_tiny_yml_data.items() + cdh_manager_data.items() + docker_broker_yml.items() + defaults_cdh_yml.items())
+        return result
+
+    def _get_variables(self, names):
+        """Evaluates the providers of variables concurrently. Variables without providers (e.g.
+        "kerberos_host" when Kerberos isn't used) are skipped.
+
+        Args:
+            names (iterable[str]): Names of the variables.
+
+        Returns:
+            dict: Variables' values.
+        """
+        providers = self._get_providers()
+        names = sorted(name for name in set(names) if name in providers)
+        return dict(zip(names, self._map_concurrently(self._get_variable, names)))
+
+    @memoized
+    def _get_variable(self, name):
+        self._logger.debug('Providing variable %s', name)
+        return self._get_providers()[name]()
+
+    def _map_concurrently(self, function, items):
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        pool = ThreadPool(min(len(items), PROVIDER_THREADS))
+        try:
+            return pool.map_async(function, items).get(_POOL_RESULTS_TIMEOUT)
+        finally:
+            pool.close()
+
+    def _get_providers(self):
+        """
+        Returns:
+            dict[str,callable]: Names of variables mapped to the functions providing their values.
+                Providers share the data they read (files, Cloudera Manager's settings), so
+                evaluating a few of them is cheap.
+        """
+        providers = dict(self._get_cf_tiny_yaml_providers())
+        providers['h2o_provisioner_host'] = \
+            lambda: self._get_docker_broker_yaml()['jobs'][0]['networks'][0]['static_ips'][0]
+        providers['kerberos_password'] = lambda: self._get_defaults_cdh_yaml()['cf_kerberos_password']
+        providers.update(self._get_cdh_manager_providers())
+        return providers
 
     def _get_ansible_hosts(self):
         inventory_file_content = return_fixed_output(
@@ -132,183 +261,169 @@ class ConfigurationExtractor(object):
             return config
 
     def _get_ansible_var(self, option, section='jump-boxes:vars', default_value=''):
+        with self._jumpboxes_vars_lock:
+            if self._jumpboxes_vars is None:
+                self._jumpboxes_vars = self._get_ansible_hosts()
         if self._jumpboxes_vars.has_option(section, option):
             return self._jumpboxes_vars.get(section, option)
         else:
             return default_value
 
-    def _get_data_from_cf_tiny_yaml(self):
-        cf_tiny_yaml_file_content = self.execute_command('sudo -i cat ' + self._paths['cf_tiny_yml'])
-        cf_tiny_yaml_file_content = return_fixed_output(cf_tiny_yaml_file_content, rstrip=False)
-        cf_tiny_yaml = yaml.load(cf_tiny_yaml_file_content)
-        result = {
-            "nats_ip": cf_tiny_yaml['properties']['nats']['machines'][0],
-            "h2o_provisioner_port": DEFAULT_H2O_PROVISIONER_PORT,
-            "cf_admin_password": cf_tiny_yaml['properties']['loggregator_endpoint']['shared_secret'],
-            "cf_admin_client_password": cf_tiny_yaml['properties']['loggregator_endpoint']['shared_secret'],
-            "apps_domain": cf_tiny_yaml['properties']['domain'],
-            "tap_console_password": cf_tiny_yaml['properties']['loggregator_endpoint']['shared_secret'],
-            "atk_client_pass": cf_tiny_yaml['properties']['loggregator_endpoint']['shared_secret'],
-            "email_address": cf_tiny_yaml['properties']['login']['smtp']['senderEmail'],
-            "run_domain": cf_tiny_yaml['properties']['domain'],
-            "smtp_pass": '"{}"'.format(cf_tiny_yaml['properties']['login']['smtp']['password']),
-            "smtp_user": '"{}"'.format(cf_tiny_yaml['properties']['login']['smtp']['user']),
-            "smtp_port": cf_tiny_yaml['properties']['login']['smtp']['port'],
-            "smtp_host": cf_tiny_yaml['properties']['login']['smtp']['host'],
-            "smtp_protocol": self._determine_smtp_protocol(cf_tiny_yaml['properties']['login']['smtp']['port']),
-            "cloudera_manager_internal_host": self._inventory['cdh-manager'][0]
+    @memoized
+    def _get_remote_yaml(self, file_path):
+        file_content = self.execute_command('sudo -i cat ' + file_path)
+        return yaml.load(return_fixed_output(file_content, rstrip=False))
+
+    def _get_cf_tiny_yaml(self):
+        return self._get_remote_yaml(self._paths['cf_tiny_yml'])
+
+    def _get_docker_broker_yaml(self):
+        return self._get_remote_yaml(self._paths['docker_broker_yml'])
+
+    def _get_defaults_cdh_yaml(self):
+        return self._get_remote_yaml(self._paths['defaults_cdh_yml'])
+
+    def _get_cf_tiny_yaml_providers(self):
+        properties = lambda: self._get_cf_tiny_yaml()['properties']
+        shared_secret = lambda: properties()['loggregator_endpoint']['shared_secret']
+        smtp = lambda: properties()['login']['smtp']
+        providers = {
+            "nats_ip": lambda: properties()['nats']['machines'][0],
+            "h2o_provisioner_port": lambda: DEFAULT_H2O_PROVISIONER_PORT,
+            "cf_admin_password": shared_secret,
+            "cf_admin_client_password": shared_secret,
+            "apps_domain": lambda: properties()['domain'],
+            "tap_console_password": shared_secret,
+            "atk_client_pass": shared_secret,
+            "email_address": lambda: smtp()['senderEmail'],
+            "run_domain": lambda: properties()['domain'],
+            "smtp_pass": lambda: '"{}"'.format(smtp()['password']),
+            "smtp_user": lambda: '"{}"'.format(smtp()['user']),
+            "smtp_port": lambda: smtp()['port'],
+            "smtp_host": lambda: smtp()['host'],
+            "smtp_protocol": lambda: self._determine_smtp_protocol(smtp()['port']),
+            "cloudera_manager_internal_host": lambda: self._inventory['cdh-manager'][0]
         }
         for i, node in enumerate(self._inventory['cdh-master']):
-            result['master_node_host_{}'.format(i + 1)] = node
+            providers['master_node_host_{}'.format(i + 1)] = _constant(node)
+        return providers
 
-        return result
+    def _get_data_from_cf_tiny_yaml(self):
+        return self._get_variables(self._get_cf_tiny_yaml_providers())
 
     def _get_data_from_docker_broker_yaml(self):
-        docker_broker_yaml_file_content = self.execute_command('sudo -i cat ' + self._paths['docker_broker_yml'])
-        docker_broker_yaml_file_content = return_fixed_output(docker_broker_yaml_file_content, rstrip=False)
-        docker_broker_yaml = yaml.load(docker_broker_yaml_file_content)
-        return {
-            "h2o_provisioner_host": docker_broker_yaml['jobs'][0]['networks'][0]['static_ips'][0]
-        }
+        return self._get_variables(['h2o_provisioner_host'])
 
     def _get_data_from_defaults_cdh_yaml(self):
-        defaults_cdh_yaml_file_content = self.execute_command('sudo -i cat ' + self._paths['defaults_cdh_yml'])
-        defaults_cdh_yaml_file_content = return_fixed_output(defaults_cdh_yaml_file_content, rstrip=False)
-        defaults_cdh_yaml = yaml.load(defaults_cdh_yaml_file_content)
-        return {
-            "kerberos_password": defaults_cdh_yaml['cf_kerberos_password']
+        return self._get_variables(['kerberos_password'])
+
+    def _get_cdh_manager_providers(self):
+        def if_kerberos(provider):
+            return lambda: provider() if self._kerberos_used else ''
+
+        def if_aws_kubernetes(provider):
+            return lambda: provider() if self._get_ansible_var('provider') == 'aws' and self._kubernetes_used \
+                else ''
+
+        def host(service_name, role_name):
+            return lambda: self._cm_client.get_role_hostname(service_name, role_name)
+
+        def keytab(principal_name):
+            return if_kerberos(lambda: self._generate_keytab(principal_name))
+
+        def base64_file(file_path):
+            return if_kerberos(lambda: self._generate_base64_for_file(file_path))
+
+        def ansible_var(option):
+            return if_aws_kubernetes(lambda: self._get_ansible_var(option))
+
+        providers = {
+            'sentry_port': if_kerberos(self._get_sentry_port),
+            'sentry_address': if_kerberos(host('SENTRY', 'SENTRY-SENTRY_SERVER')),
+            'sentry_keytab_value': keytab('hive/sys'),
+            'hdfs_keytab_value': keytab('hdfs'),
+            'auth_gateway_keytab_value': keytab('authgateway/sys'),
+            'vcap_keytab_value': keytab('vcap'),
+            'hgm_keytab_value': keytab('hgm/sys'),
+            'krb5_base64': base64_file('/etc/krb5.conf'),
+            'kerberos_cacert': base64_file('/var/krb5kdc/cacert.pem'),
+            'auth_gateway_profile': lambda: KERBEROS_AUTH_GATEWAY_PROFILE if self._kerberos_used
+            else AUTH_GATEWAY_PROFILE,
+
+            'vpc': if_aws_kubernetes(self._get_vpc_id),
+            'region': ansible_var('region'),
+            'kubernetes_aws_access_key_id': ansible_var('kubernetes_aws_access_key_id'),
+            'kubernetes_aws_secret_access_key': ansible_var('kubernetes_aws_secret_access_key'),
+            'key_name': ansible_var('key_name'),
+            'consul_dc': if_aws_kubernetes(lambda: self._envname),
+            'consul_join': if_aws_kubernetes(
+                lambda: return_fixed_output(self.execute_command('host cdh-master-0')).split()[3]),
+            'kubernetes_subnet': ansible_var('kubernetes_subnet_id'),
+            'kubernetes_subnet_cidr': if_aws_kubernetes(self._get_kubernetes_subnet_cidr),
+            'quay_io_username': ansible_var('quay_io_username'),
+            'quay_io_password': ansible_var('quay_io_password'),
+
+            'java_http_proxy': lambda: self._get_java_http_proxy()
+            if self._get_ansible_var('provider') == 'openstack' else '',
+            'kubernetes_used': _constant(self._kubernetes_used),
+
+            'hgm_adress': self._get_hgm_address,
+            'hgm_password': lambda: self._get_hgm_config_value('basic_auth_pass'),
+            'hgm_username': lambda: self._get_hgm_config_value('basic_auth_user'),
+            'oozie_server': lambda: 'http://' + host('OOZIE', 'OOZIE-OOZIE_SERVER')() + ':' + DEFAULT_OOZIE_PORT,
+            'job_tracker': lambda: host('YARN', 'YARN-GATEWAY')() + ':' + DEFAULT_YARN_PORT,
+            'metastore': self._get_metastore,
+
+            'cloudera_address': _constant(self._cdh_manager_hostname),
+            'cloudera_port': _constant(self._cdh_manager_port),
+            'cloudera_user': _constant(self._cdh_manager_user),
+            'cloudera_password': _constant(self._cdh_manager_password),
+
+            'namenode_internal_host': host('HDFS', 'HDFS-NAMENODE'),
+            'hue_node': host('HUE', 'HUE-HUE_SERVER'),
+            'hue_port': _constant(DEFAULT_HUE_PORT),
+            'h2o_node': lambda: self._inventory['cdh-worker'][0],
+            'arcadia_node': lambda: self._inventory['cdh-worker'][0],
+            'arcadia_port': _constant(DEFAULT_ARCADIA_PORT),
         }
+        if self._kerberos_used:
+            providers['kerberos_host'] = _constant(self._cdh_manager_hostname)
+        for service_name in CLIENT_CONFIG_SERVICES:
+            providers['import_hadoop_conf_' + service_name.lower()] = \
+                functools.partial(self._get_client_config, service_name)
+        for name in PROBED_SERVICES:
+            providers[name] = functools.partial(lambda name: self._get_probed_services_status()[name], name)
+        return providers
 
     def _get_data_from_cdh_manager(self):
-        self._cdh_manager_hostname = self._inventory['cdh-manager'][0]
-        deployments_settings_endpoint = 'http://{}:{}/api/v10/cm/deployment'.format(self._cdh_manager_hostname,
-                                                                                    self._cdh_manager_port)
-        self._logger.info('Send request to %s', deployments_settings_endpoint)
-        response = self.execute_command('curl -X GET {} -u {}:{}'
-                                        .format(deployments_settings_endpoint, self._cdh_manager_user,
-                                                self._cdh_manager_password))
-        deployment_settings = json.loads(response)
-        result = dict()
-
-        result['sentry_port'] = ''
-        result['sentry_address'] = ''
-        result['sentry_keytab_value'] = ''
-        result['hdfs_keytab_value'] = ''
-        result['auth_gateway_keytab_value'] = ''
-        result['vcap_keytab_value'] = ''
-        result['hgm_keytab_value'] = ''
-        result['krb5_base64'] = ''
-        result['kerberos_cacert'] = ''
-        result['auth_gateway_profile'] = 'cloud,warehouse-auth-gateway,zookeeper-auth-gateway,hdfs-auth-gateway,' \
-                                         'https-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'
-        if self._kerberos_used:
-            result['kerberos_host'] = self._cdh_manager_hostname
-            result['hdfs_keytab_value'] = self._generate_keytab('hdfs')
-            result['auth_gateway_keytab_value'] = self._generate_keytab('authgateway/sys')
-            result['hgm_keytab_value'] = self._generate_keytab('hgm/sys')
-            result['vcap_keytab_value'] = self._generate_keytab('vcap')
-            result['krb5_base64'] = self._generate_base64_for_file('/etc/krb5.conf')
-            result['kerberos_cacert'] = self._generate_base64_for_file('/var/krb5kdc/cacert.pem')
-            sentry_service = self._find_item_by_attr_value('SENTRY', 'name',
-                                                           deployment_settings['clusters'][0]['services'])
-            result['sentry_port'] = self._find_item_by_attr_value('sentry_service_server_rpc_port', 'name',
-                                                                  sentry_service['config']['items']).get('value') \
-                                    or DEFAULT_SENTRY_PORT
-            result['sentry_address'] = self._get_host('SENTRY', 'SENTRY-SENTRY_SERVER', deployment_settings).get(
-                'hostname')
-            result['sentry_keytab_value'] = self._generate_keytab('hive/sys')
-            result[
-                'auth_gateway_profile'] = 'cloud,kerberos-warehouse-auth-gateway,zookeeper-auth-gateway,hdfs-auth-gateway,' \
-                                          'kerberos-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'
-
-        result['vpc'] = ''
-        result['region'] = ''
-        result['kubernetes_aws_access_key_id'] = ''
-        result['kubernetes_aws_secret_access_key'] = ''
-        result['key_name'] = ''
-        result['consul_dc'] = ''
-        result['consul_join'] = ''
-        result['kubernetes_subnet_cidr'] = ''
-        result['kubernetes_subnet'] = ''
-        result['quay_io_username'] = ''
-        result['quay_io_password'] = ''
-        if self._get_ansible_var('provider') == 'aws' and self._kubernetes_used:
-            result['vpc'] = self._get_vpc_id()
-            result['region'] = self._get_ansible_var('region')
-            result['kubernetes_aws_access_key_id'] = self._get_ansible_var('kubernetes_aws_access_key_id')
-            result['kubernetes_aws_secret_access_key'] = self._get_ansible_var('kubernetes_aws_secret_access_key')
-            result['key_name'] = self._get_ansible_var('key_name')
-            result['consul_dc'] = self._envname
-            result['consul_join'] = return_fixed_output(self.execute_command('host cdh-master-0')).split()[3]
-            result['kubernetes_subnet'] = self._get_ansible_var('kubernetes_subnet_id')
-
-            command_output = self.execute_command(
-                'aws --region {} ec2 describe-subnets --filters Name=subnet-id,Values={}'
-                    .format(result['region'], result['kubernetes_subnet']))
-            subnet_json = json.loads(return_fixed_output(command_output, rstrip=False))
-            result['kubernetes_subnet_cidr'] = subnet_json['Subnets'][0]['CidrBlock']
-            result['quay_io_username'] = self._get_ansible_var('quay_io_username')
-            result['quay_io_password'] = self._get_ansible_var('quay_io_password')
-
-        result['java_http_proxy'] = ''
-        if self._get_ansible_var('provider') == 'openstack':
-            result['java_http_proxy'] = self._get_java_http_proxy()
-
-        result['kubernetes_used'] = self._kubernetes_used
-
-        hgm_service = self._find_item_by_attr_value(hgm_service_name, 'name',
-                                                    deployment_settings['clusters'][0]['services'])
+        return self._get_variables(self._get_cdh_manager_providers())
+
+    def _get_sentry_port(self):
+        return self._cm_client.get_service_config('SENTRY').get('sentry_service_server_rpc_port') \
+            or DEFAULT_SENTRY_PORT
+
+    def _get_kubernetes_subnet_cidr(self):
+        command_output = self.execute_command(
+            'aws --region {} ec2 describe-subnets --filters Name=subnet-id,Values={}'
+                .format(self._get_ansible_var('region'), self._get_ansible_var('kubernetes_subnet_id')))
+        subnet_json = json.loads(return_fixed_output(command_output, rstrip=False))
+        return subnet_json['Subnets'][0]['CidrBlock']
+
+    def _get_hgm_config_value(self, name):
+        return self._cm_client.get_role_config_group_config(hgm_service_name, hgm_role_name + '-BASE')[name]
+
+    def _get_hgm_address(self):
         hgm_protocol = 'http://' if self._kerberos_used else 'https://'
-        result['hgm_adress'] = hgm_protocol + self._get_host(hgm_service_name, hgm_role_name, deployment_settings)[
-            'hostname'] + ':' + self._find_item_by_attr_value('rest_port', 'name',
-                                                              self._find_item_by_attr_value(hgm_role_name + '-BASE',
-                                                                                            'name', hgm_service[
-                                                                                                'roleConfigGroups'])[
-                                                                  'config']['items'])['value']
-        result['hgm_password'] = self._find_item_by_attr_value('basic_auth_pass', 'name',
-                                                               self._find_item_by_attr_value(hgm_role_name + '-BASE',
-                                                                                             'name', hgm_service[
-                                                                                                 'roleConfigGroups'])[
-                                                                   'config']['items'])['value']
-        result['hgm_username'] = self._find_item_by_attr_value('basic_auth_user', 'name',
-                                                               self._find_item_by_attr_value(hgm_role_name + '-BASE',
-                                                                                             'name', hgm_service[
-                                                                                                 'roleConfigGroups'])[
-                                                                   'config']['items'])['value']
-
-        result['oozie_server'] = 'http://' + self._get_host('OOZIE', 'OOZIE-OOZIE_SERVER', deployment_settings)[
-            'hostname'] + ':' + DEFAULT_OOZIE_PORT
-
-        result['job_tracker'] = self._get_host('YARN', 'YARN-GATEWAY', deployment_settings)[
-                                    'hostname'] + ':' + DEFAULT_YARN_PORT
-
-        sqoop_client = self._find_item_by_attr_value('SQOOP_CLIENT', 'name',
-                                                     deployment_settings['clusters'][0]['services'])
-        sqoop_entry = self._find_item_by_attr_value('sqoop-conf/sqoop-site.xml_client_config_safety_valve', 'name',
-                                                    self._find_item_by_attr_value('SQOOP_CLIENT-GATEWAY-BASE', 'name',
-                                                                                  sqoop_client['roleConfigGroups'])[
-                                                        'config']['items'])['value']
-        result['metastore'] = self._get_property_value(sqoop_entry, 'sqoop.metastore.client.autoconnect.url')
-
-        result['cloudera_address'] = self._inventory['cdh-manager'][0]
-        result['cloudera_port'] = self._cdh_manager_port
-        result['cloudera_user'] = self._cdh_manager_user
-        result['cloudera_password'] = self._cdh_manager_password
-
-        result['namenode_internal_host'] = self._get_host('HDFS', 'HDFS-NAMENODE', deployment_settings)['hostname']
-        result['hue_node'] = self._get_host('HUE', 'HUE-HUE_SERVER', deployment_settings)['hostname']
-        result['hue_port'] = DEFAULT_HUE_PORT
-        result['external_tool_hue'] = self._check_port(result['hue_node'], result['hue_port'])
-        result['h2o_node'] = self._inventory['cdh-worker'][0]
-        result['arcadia_node'] = self._inventory['cdh-worker'][0]
-        result['arcadia_port'] = DEFAULT_ARCADIA_PORT
-        result['external_tool_arcadia'] = self._check_port(result['arcadia_node'], result['arcadia_port'])
-        cluster_name = deployment_settings['clusters'][0]['name']
-        result['import_hadoop_conf_hdfs'] = self._get_client_config_for_service('HDFS', cluster_name)
-        result['import_hadoop_conf_hbase'] = self._get_client_config_for_service('HBASE', cluster_name)
-        result['import_hadoop_conf_yarn'] = self._get_client_config_for_service('YARN', cluster_name)
-        result['import_hadoop_conf_hive'] = self._get_client_config_for_service('HIVE', cluster_name)
-        return result
+        hgm_host = self._cm_client.get_role_hostname(hgm_service_name, hgm_role_name)
+        return hgm_protocol + hgm_host + ':' + self._get_hgm_config_value('rest_port')
+
+    def _get_metastore(self):
+        sqoop_entry = self._cm_client.get_role_config_group_config(
+            'SQOOP_CLIENT', 'SQOOP_CLIENT-GATEWAY-BASE')['sqoop-conf/sqoop-site.xml_client_config_safety_valve']
+        return self._get_property_value(sqoop_entry, 'sqoop.metastore.client.autoconnect.url')
+
+    def _get_client_config(self, service_name):
+        return self._get_client_config_for_service(service_name, self._cm_client.get_cluster_name())
 
     def _get_java_http_proxy(self):
         http_proxy = self._get_ansible_var('http_proxy')
@@ -379,6 +494,52 @@ class ConfigurationExtractor(object):
             self._logger.info('Calling local command: %s', command)
             return subprocess.check_output(command, shell=True)
 
+    def execute_payload_command(self, command):
+        """Runs a command producing a large output (e.g. a base64 encoded file). Unlike
+        `execute_command`, the command is run without a pseudo-terminal and its output is framed
+        with its length, so it's transferred intact and doesn't need to be filtered line by line.
+        If sudo requires a terminal, this and all the following payload commands are run through
+        `execute_command`.
+
+        Args:
+            command (str): Shell command.
+
+        Returns:
+            str: Output of the command. In the terminal fallback, lines are separated with "\\r\\n".
+        """
+        if not self._tty_required:
+            try:
+                return self._execute_framed_command(command)
+            except TtyRequiredError:
+                self._logger.info('A terminal is required to run commands with sudo, falling back to it.')
+                self._tty_required = True
+        return self.execute_command(command)
+
+    def _execute_framed_command(self, command):
+        framed_command = FRAMED_COMMAND_TEMPLATE.format(command=command, marker=PAYLOAD_MARKER)
+        if self._ssh_required:
+            self._logger.info('Execute remote payload command {} on {} machine.'.format(command, self._hostname))
+            process = subprocess.Popen(
+                ['ssh', '-i', self._ssh_key_filename, '-T', '{}@{}'.format(self._username, self._hostname),
+                 '-o', 'UserKnownHostsFile=/dev/null', '-o', 'StrictHostKeyChecking=no', framed_command],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            self._logger.info('Calling local payload command: %s', command)
+            process = subprocess.Popen(framed_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error_output = process.communicate()
+
+        if process.returncode:
+            if any(message in error_output for message in TTY_REQUIRED_MESSAGES):
+                raise TtyRequiredError(error_output)
+            raise subprocess.CalledProcessError(process.returncode, command, error_output)
+        header = PAYLOAD_HEADER_PATTERN.search(output)
+        if not header:
+            raise subprocess.CalledProcessError(process.returncode, command, 'No payload in output: ' + output)
+        payload = output[header.end():header.end() + int(header.group(1))]
+        if len(payload) != int(header.group(1)):
+            raise subprocess.CalledProcessError(process.returncode, command, 'Payload has been truncated.')
+        return payload
+
     def _generate_script(self, script, target):
         with tempfile.NamedTemporaryFile('w') as f:
             f.file.write(script)
@@ -392,64 +553,103 @@ class ConfigurationExtractor(object):
             else:
                 shutil.copyfile(f.name, target)
 
-    def _generate_keytab(self, principal_name):
-        self._logger.info('Generating keytab for {} principal.'.format(principal_name))
-
+    @memoized
+    def _upload_keytab_script(self):
+        """Puts the keytab generating script on CDH manager's machine. It's done once, so keytabs can
+        be generated concurrently.
+        """
         self._generate_script(GENERATE_KEYTAB_SCRIPT, '/tmp/generate_keytab_script.sh')
 
         COPY_KEYTAB_SCRIPT = 'sudo -i scp -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ' \
                              '/tmp/generate_keytab_script.sh {}@{}:/tmp/'.format(self._cdh_manager_ssh_user,
                                                                                  self._cdh_manager_hostname)
-
         if self._ssh_required:
             CHMOD_KEYTAB_SCRIPT = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ' \
                                   '"chmod 700 /tmp/generate_keytab_script.sh"'.format(self._cdh_manager_ssh_user,
                                                                                       self._cdh_manager_hostname)
+        else:
+            CHMOD_KEYTAB_SCRIPT = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ' \
+                                  'chmod 700 /tmp/generate_keytab_script.sh'.format(self._cdh_manager_ssh_user,
+                                                                                    self._cdh_manager_hostname)
+        try:
+            self.execute_command(COPY_KEYTAB_SCRIPT)
+            self.execute_command(CHMOD_KEYTAB_SCRIPT)
+        except subprocess.CalledProcessError as e:
+            self._logger.error('Process failed with exit code %s and output %s', e.returncode, e.output)
+            raise e
+
+    def _generate_keytab(self, principal_name):
+        self._logger.info('Generating keytab for {} principal.'.format(principal_name))
+
+        self._upload_keytab_script()
+
+        if self._ssh_required:
             EXECUTE_KEYTAB_SCRIPT = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ' \
                                     '"/tmp/generate_keytab_script.sh {}"'.format(self._cdh_manager_ssh_user,
                                                                                  self._cdh_manager_hostname,
                                                                                  principal_name)
         else:
-            CHMOD_KEYTAB_SCRIPT = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ' \
-                                  'chmod 700 /tmp/generate_keytab_script.sh'.format(self._cdh_manager_ssh_user,
-                                                                                    self._cdh_manager_hostname)
             EXECUTE_KEYTAB_SCRIPT = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ' \
                                     '/tmp/generate_keytab_script.sh {}'.format(self._cdh_manager_ssh_user,
                                                                                self._cdh_manager_hostname,
                                                                                principal_name)
 
         try:
-            self.execute_command(COPY_KEYTAB_SCRIPT)
-            self.execute_command(CHMOD_KEYTAB_SCRIPT)
-            keytab_hash = self.execute_command(EXECUTE_KEYTAB_SCRIPT)
+            keytab_hash = self.execute_payload_command(EXECUTE_KEYTAB_SCRIPT)
         except subprocess.CalledProcessError as e:
             self._logger.error('Process failed with exit code %s and output %s', e.returncode, e.output)
             raise e
 
-        keytab_hash = return_fixed_output(keytab_hash)
+        keytab_hash = ''.join(return_fixed_output(keytab_hash, rstrip=False).split())
         self._logger.info('Keytab for %s principal has been generated.', principal_name)
         return keytab_hash
 
-    def _check_port(self, hostname, port):
-        self._logger.info('Check is port %d open on %s machine.', port, hostname)
-        port_checker_script = PORT_CHECKER_SCRIPT.format(hostname=hostname, port=port)
-        self._generate_script(port_checker_script, '/tmp/check_port.py')
-        status = int(return_fixed_output(self.execute_command('sudo -i python /tmp/check_port.py')))
-        return False if status else True
+    @memoized
+    def _get_probed_services_status(self):
+        """
+        Returns:
+            dict[str,bool]: Names of the variables from `PROBED_SERVICES` mapped to the statuses of
+                their services (True if service's port is open).
+        """
+        names = sorted(PROBED_SERVICES)
+        addresses = [(self._get_variable(PROBED_SERVICES[name][0]), self._get_variable(PROBED_SERVICES[name][1]))
+                     for name in names]
+        return dict(zip(names, self._check_ports(addresses)))
+
+    def _check_ports(self, addresses):
+        """Checks on the jumpbox whether ports are open. All of them are checked at the same time,
+        each with a short timeout, in a single run of a script.
+
+        Args:
+            addresses (list[tuple]): Pairs of (hostname, port).
+
+        Returns:
+            list[bool]: Is each port open.
+        """
+        self._logger.info('Check are ports open: %s', ', '.join('{}:{}'.format(*address) for address in addresses))
+        port_checker_script = PORT_CHECKER_SCRIPT.format(
+            addresses=json.dumps([[hostname, int(port)] for hostname, port in addresses]),
+            timeout=PORT_CHECK_TIMEOUT)
+        self._generate_script(port_checker_script, PORT_CHECKER_SCRIPT_PATH)
+        output = self.execute_command('sudo -i python ' + PORT_CHECKER_SCRIPT_PATH)
+        statuses = json.loads(return_fixed_output(output))
+        return [status == 0 for status in statuses]
 
     def _generate_base64_for_file(self, file_path):
         self._logger.info('Generating base64 for %s file.', file_path)
+        # base64 doesn't need a terminal on CDH manager's machine
+        ssh_tty_option = '-tt' if self._tty_required else '-T'
         if self._ssh_required:
-            GENERATE_BASE_64 = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null ' \
+            GENERATE_BASE_64 = 'sudo -i ssh {} {}@{} -o UserKnownHostsFile=/dev/null ' \
                                '-o StrictHostKeyChecking=no "base64 {}"' \
-                .format(self._cdh_manager_ssh_user, self._cdh_manager_hostname, file_path)
+                .format(ssh_tty_option, self._cdh_manager_ssh_user, self._cdh_manager_hostname, file_path)
         else:
-            GENERATE_BASE_64 = 'sudo -i ssh -tt {}@{} -o UserKnownHostsFile=/dev/null ' \
+            GENERATE_BASE_64 = 'sudo -i ssh {} {}@{} -o UserKnownHostsFile=/dev/null ' \
                                '-o StrictHostKeyChecking=no base64 {}' \
-                .format(self._cdh_manager_ssh_user, self._cdh_manager_hostname, file_path)
+                .format(ssh_tty_option, self._cdh_manager_ssh_user, self._cdh_manager_hostname, file_path)
 
-        base64_file_hash = self.execute_command(GENERATE_BASE_64)
-        base64_file_hash = return_fixed_output(base64_file_hash)
+        base64_file_hash = self.execute_payload_command(GENERATE_BASE_64)
+        base64_file_hash = ''.join(return_fixed_output(base64_file_hash, rstrip=False).split())
         self._logger.info('Base64 hash for %s file on %s machine has been generated.', file_path,
                           self._cdh_manager_hostname)
         return base64_file_hash
@@ -459,10 +659,9 @@ class ConfigurationExtractor(object):
                              '--password {} --user {} -P {}'
                              .format(self._cdh_manager_hostname, self._cdh_manager_port, cluster_name, service_name,
                                      self._cdh_manager_password, self._cdh_manager_user, service_name))
-        base64_file_hash = self.execute_command('base64 {}/clientConfig'.format(service_name))
+        base64_file_hash = self.execute_payload_command('base64 {}/clientConfig'.format(service_name))
         self.execute_command('rm -r {}'.format(service_name))
-        result = base64_file_hash.splitlines()
-        return ''.join(result)
+        return ''.join(base64_file_hash.split())
 
     def _determine_smtp_protocol(self, port):
         self._logger.info('Determining mail protocol')
@@ -481,12 +680,6 @@ class ConfigurationExtractor(object):
         except StopIteration:
             return dict()
 
-    def _get_host(self, service_name, role_name, settings):
-        hdfs_service = self._find_item_by_attr_value(service_name, 'name', settings['clusters'][0]['services'])
-        hdfs_namenode = self._find_item_by_attr_value(role_name, 'name', hdfs_service['roles'])
-        host_id = hdfs_namenode['hostRef']['hostId']
-        return self._find_item_by_attr_value(host_id, 'hostId', settings['hosts'])
-
     def _get_property_value(self, config, key):
         properties = ET.fromstring('<properties>' + config + '</properties>')
         for property in properties:
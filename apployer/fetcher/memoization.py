@@ -0,0 +1,41 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Caching the results of methods of objects fetching configuration from a live environment.
+"""
+
+import functools
+import threading
+
+
+def memoized(method):
+    """Caches method's results for each object and arguments. Concurrent calls with the same
+    arguments wait for the first one instead of repeating it. The object needs to have
+    a `_memo` dictionary and a `_memo_lock` lock.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        """Returns the cached result of the method, calling it if there's none yet."""
+        with self._memo_lock: # pylint: disable=protected-access
+            entry = self._memo.setdefault( # pylint: disable=protected-access
+                (method.__name__,) + args, {'lock': threading.Lock()})
+        with entry['lock']:
+            if 'result' not in entry:
+                entry['result'] = method(self, *args)
+            return entry['result']
+    return wrapper
@@ -0,0 +1,148 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+History of applications' deployment durations. It's used to predict how long an application will
+take to deploy, so that the longest ones can be started first.
+"""
+
+import json
+import logging
+import os
+import threading
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+HISTORY_FILE_NAME = 'deployment_history.json'
+# Deployment phases (names of trace spans) of an application which durations are recorded.
+# Staging happens during "push" (CF CLI starts the app right after uploading it).
+RECORDED_PHASES = ('prepare', 'push', 'env_update', 'registration', 'post_command')
+# How many most recent durations of each phase are kept.
+KEPT_DURATIONS = 5
+
+
+class DeploymentHistory(object):
+    """Durations of applications' deployment phases from the recent deployments.
+    Phases' durations are collected from the deployment's trace spans (see `record_span`).
+
+    Attributes:
+        history_path (str): Path of the history file. None if the history isn't persisted
+            (e.g. during a dry run).
+
+    Args:
+        output_path (str): Directory in which the history file is kept. If None, nothing will be
+            loaded or saved.
+    """
+
+    def __init__(self, output_path):
+        self.history_path = os.path.join(output_path, HISTORY_FILE_NAME) if output_path else None
+        self._durations = {}
+        self._lock = threading.Lock()
+        if self.history_path and os.path.exists(self.history_path):
+            self._durations = self._load()
+
+    def record(self, app_name, phase, duration):
+        """Records the duration of application's deployment phase.
+
+        Args:
+            app_name (str): Name of the application.
+            phase (str): Deployment phase, e.g. "push".
+            duration (float): Duration in seconds.
+        """
+        with self._lock:
+            durations = self._durations.setdefault(app_name, {}).setdefault(phase, [])
+            durations.append(round(duration, 3))
+            del durations[:-KEPT_DURATIONS]
+
+    def record_span(self, name, duration, span_args):
+        """Listener of trace spans (see `apployer.trace.Tracer.add_listener`) recording
+        the durations of applications' deployment phases.
+        """
+        if name in RECORDED_PHASES and 'app' in span_args:
+            self.record(span_args['app'], name, duration)
+
+    def get_phase_durations(self, app_name):
+        """
+        Args:
+            app_name (str): Name of the application.
+
+        Returns:
+            dict[str,float]: Average recent duration (in seconds) of each recorded phase of
+                application's deployment.
+        """
+        with self._lock:
+            return {phase: sum(durations) / len(durations)
+                    for phase, durations in self._durations.get(app_name, {}).items()}
+
+    def get_expected_duration(self, app_name):
+        """
+        Args:
+            app_name (str): Name of the application.
+
+        Returns:
+            float: Expected duration (in seconds) of application's deployment. None if it has
+                never been recorded.
+        """
+        phase_durations = self.get_phase_durations(app_name)
+        if not phase_durations:
+            return None
+        return sum(phase_durations.values())
+
+    def sort_longest_first(self, apps):
+        """Sorts applications by their expected deployment duration, the longest first.
+        Applications without history are expected to take as long as an average application.
+        Applications with the same expected duration stay in their original order.
+
+        Args:
+            apps (list[`apployer.appstack.AppConfig`]): Applications.
+
+        Returns:
+            list[`apployer.appstack.AppConfig`]: Sorted applications.
+        """
+        expected_durations = {app.name: self.get_expected_duration(app.name) for app in apps}
+        known_durations = [duration for duration in expected_durations.values()
+                           if duration is not None]
+        average_duration = sum(known_durations) / len(known_durations) if known_durations else 0
+        return sorted(
+            apps,
+            key=lambda app: expected_durations[app.name]
+            if expected_durations[app.name] is not None else average_duration,
+            reverse=True)
+
+    def save(self):
+        """Saves the history to its file (if it's persisted)."""
+        if not self.history_path:
+            return
+        _log.debug('Saving deployment history to %s...', self.history_path)
+        if not os.path.exists(os.path.dirname(self.history_path)):
+            os.makedirs(os.path.dirname(self.history_path))
+        temp_path = self.history_path + '.tmp'
+        with self._lock:
+            with open(temp_path, 'w') as history_file:
+                json.dump(self._durations, history_file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.history_path)
+
+    def _load(self):
+        """
+        Returns:
+            dict[str,dict]: Application names mapped to their phases' recent durations.
+        """
+        try:
+            with open(self.history_path) as history_file:
+                return json.load(history_file)
+        except ValueError:
+            _log.warning('Deployment history %s is malformed, ignoring it.', self.history_path)
+            return {}
@@ -0,0 +1,155 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Journal of completed deployment steps that allows resuming an interrupted deployment.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from os import path
+import threading
+import time
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+JOURNAL_FILE_NAME = 'deployment_journal.log'
+
+
+def get_fingerprint(inputs):
+    """
+    Args:
+        inputs: JSON-serializable description of everything that affects a deployment step.
+
+    Returns:
+        str: Fingerprint (SHA1 hex digest) of the inputs.
+    """
+    serialized = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+class DeploymentJournal(object):
+    """Append-only journal of completed deployment steps. Each line of the journal file is a JSON
+    record with the step's name, fingerprint of its inputs and its result.
+    When resuming, steps that have been completed with the same inputs are skipped and their
+    recorded results are returned instead.
+
+    Attributes:
+        journal_path (str): Path of the journal file. None if the journal isn't persisted
+            (e.g. during a dry run).
+        target (list[str]): Cloud Foundry target (API URL, org and space) that the steps are run
+            against. It's a part of the inputs of every step, so steps completed against another
+            target aren't skipped.
+
+    Args:
+        output_path (str): Directory in which the journal file will be kept. If None, nothing
+            will be written or skipped.
+        resume (bool): Should steps completed in the previous run be skipped. If False, the journal
+            from the previous run is discarded.
+        target (list[str]): See class attributes.
+    """
+
+    def __init__(self, output_path, resume=False, target=None):
+        self.journal_path = path.join(output_path, JOURNAL_FILE_NAME) if output_path else None
+        self.target = target
+        self._completed_steps = {}
+        self._lock = threading.Lock()
+
+        if not self.journal_path:
+            return
+        if not path.exists(output_path):
+            os.makedirs(output_path)
+        if resume:
+            self._completed_steps = self._load()
+            _log.info('Resuming deployment. %s steps were completed in the previous run.',
+                      len(self._completed_steps))
+        else:
+            open(self.journal_path, 'w').close()
+
+    def run_step(self, step, inputs, function, *args, **kwargs):
+        """Runs the deployment step, unless it has already been completed with the same inputs.
+
+        Args:
+            step (str): Unique name of the step, e.g. "app:data-catalog".
+            inputs: JSON-serializable description of everything that affects the step.
+            function (types.FunctionType): Function carrying out the step.
+            args: Positional arguments for the function.
+            kwargs: Keyword arguments for the function.
+
+        Returns:
+            Result of the function or the result recorded when the step was completed before.
+            The result needs to be JSON-serializable.
+        """
+        if self.is_completed(step, inputs):
+            _log.info('Step %s has already been completed, skipping it...', step)
+            return self._completed_steps[step]['result']
+
+        result = function(*args, **kwargs)
+        self._record(step, self._get_fingerprint(inputs), result)
+        return result
+
+    def is_completed(self, step, inputs):
+        """
+        Args:
+            step (str): Unique name of the step, e.g. "app:data-catalog".
+            inputs: JSON-serializable description of everything that affects the step.
+
+        Returns:
+            bool: True if the step was completed in the previous run with the same inputs.
+        """
+        completed_step = self._completed_steps.get(step)
+        return bool(completed_step) and \
+            completed_step['fingerprint'] == self._get_fingerprint(inputs)
+
+    def _get_fingerprint(self, inputs):
+        """
+        Returns:
+            str: Fingerprint of step's inputs and the target.
+        """
+        return get_fingerprint([self.target, inputs])
+
+    def _record(self, step, fingerprint, result):
+        if not self.journal_path:
+            return
+        record = {'step': step, 'fingerprint': fingerprint, 'result': result,
+                  'time': time.time()}
+        with self._lock:
+            with open(self.journal_path, 'a') as journal_file:
+                journal_file.write(json.dumps(record, default=str) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def _load(self):
+        """
+        Returns:
+            dict[str,dict]: Completed step names mapped to their records.
+        """
+        completed_steps = {}
+        if not path.exists(self.journal_path):
+            _log.warning("Journal %s doesn't exist, nothing to resume.", self.journal_path)
+            return completed_steps
+        with open(self.journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line can be incomplete if Apployer was killed while writing it
+                    _log.debug('Skipping a malformed journal line: %s', line)
+                    continue
+                completed_steps[record['step']] = record
+        return completed_steps
@@ -18,6 +18,9 @@
 CLI for apployer.
 """
 
+from collections import namedtuple
+from contextlib import contextmanager
+import functools
 import logging
 import os
 import sys
@@ -29,11 +32,18 @@ import yaml
 import validators
 
 import apployer
+from apployer import cf_cli, dry_run as dry_run_module, retry, trace
+from .analysis import (analyze_appstack, format_analysis, get_app_durations,
+                       DEFAULT_APP_DURATION)
 from .appstack import AppStack
-from .appstack_expand import expand_appstack
-from .deployer import deploy_appstack, UPGRADE_STRATEGY
+from .appstack_expand import expand_appstack, AppStackExpander, WATCH_INTERVAL
+from .deployer import (deploy_appstack, get_app_selection_steps, UPGRADE_STRATEGY,
+                       PUSH_ALL_STRATEGY, DEPLOYER_OUTPUT)
 from apployer.cf_cli import CfInfo
 from .fetcher import fill_appstack, DEFAULT_FETCHER_CONF, DEFAULT_FILLED_APPSTACK_PATH
+from .history import DeploymentHistory
+from .plan import LiveState, make_plan, format_plan
+from . import template_variables
 
 DEFAULT_EXPANDED_APPSTACK_FILE = 'expanded_appstack.yml'
 DEFAULT_APPSTACK_FILE = 'appstack.yml'
@@ -41,6 +51,34 @@ DEFAULT_ARTIFACTS_PATH = 'artifacts'
 
 _log = logging.getLogger(__name__) #pylint: disable=invalid-name
 
+# options of "deploy" controlling how the deployment is carried out
+DeploymentOptions = namedtuple('DeploymentOptions', [
+    'retry_budget', 'resume', 'record_snapshot_path', 'snapshot_path', 'trace_path', 'parallel',
+    'async_staging'])
+# options of "deploy" selecting what gets deployed
+SelectionOptions = namedtuple('SelectionOptions', [
+    'changed_vars', 'only', 'with_deps', 'with_dependents'])
+
+
+def _grouped_options(group_name, group_class):
+    """Makes a command get its options named like the fields of a named tuple as one argument.
+    It needs to be applied before the options.
+
+    Args:
+        group_name (str): Name of the argument the options will be passed in.
+        group_class (type): Named tuple that will hold the options.
+    """
+    def decorator(command):
+        """Decorates the command's function."""
+        @functools.wraps(command)
+        def wrapper(*args, **kwargs):
+            """Calls the command's function with the options grouped."""
+            kwargs[group_name] = group_class(*[kwargs.pop(field)
+                                               for field in group_class._fields])
+            return command(*args, **kwargs)
+        return wrapper
+    return decorator
+
 
 @click.group()
 @click.option('-v', '--verbose', is_flag=True,
@@ -60,7 +98,12 @@ def cli(verbose):
 @click.argument('APPSTACK_FILE', required=False, default=DEFAULT_APPSTACK_FILE)
 @click.argument('EXPANDED_APPSTACK_LOCATION',
                 default=DEFAULT_EXPANDED_APPSTACK_FILE, required=False)
-def expand(appstack_file, artifacts_location, expanded_appstack_location):
+@click.option('--watch', is_flag=True,
+              help='Keep running and expand the appstack again every time it (or any artifact) '
+                   'changes. Only the changed applications are merged again.')
+@click.option('--interval', type=float, default=WATCH_INTERVAL, show_default=True,
+              help='How often (in seconds) the files are checked for changes with --watch.')
+def expand(appstack_file, artifacts_location, expanded_appstack_location, watch, interval):
     """
     Merges the manifests from app artifacts in appstack creating an expanded appstack that can be
     added to TAP release package. Applications in expanded appstack are sorted according to
@@ -74,7 +117,14 @@ def expand(appstack_file, artifacts_location, expanded_appstack_location):
 
     EXPANDED_APPSTACK_LOCATION defaults to "expanded_appstack.yml".
     """
-    expand_appstack(appstack_file, artifacts_location, expanded_appstack_location)
+    if not watch:
+        expand_appstack(appstack_file, artifacts_location, expanded_appstack_location)
+        return
+    expander = AppStackExpander(appstack_file, artifacts_location, expanded_appstack_location)
+    try:
+        expander.watch(interval)
+    except KeyboardInterrupt:
+        _log.info('Stopped watching.')
 
 
 @cli.command()
@@ -116,13 +166,63 @@ def expand(appstack_file, artifacts_location, expanded_appstack_location):
               help="Strategy for pushing the applications.\n"
                    "'UPGRADE': deploy everything that doesn't exist in the environment or is in "
                    "lower version on the environment than in the filled appstack.\n"
-                   "'PUSH_ALL': deploy everything from filled appstack.'")
+                   "'PUSH_ALL': deploy everything from filled appstack.\n"
+                   "'FINGERPRINT': deploy everything that doesn't exist in the environment or "
+                   "whose artifact, filled manifest or push options have changed since it was "
+                   "pushed.")
 @click.option('--dry-run', is_flag=True,
               help="Does a dry run of the deployment. No changes will be introduced to the "
                    "Cloud Foundry environment, except for creating org and space if those don't "
                    "already exist. "
                    "Each action that the deployment would perform is logged.")
-
+@click.option('--retry-budget', type=int,
+              default=retry.get_policy().budget, show_default=True,
+              help="How many times in total Cloud Foundry operations that failed because of "
+                   "transient errors can be retried during the deployment.")
+@click.option('--resume', is_flag=True,
+              help="Resumes an interrupted deployment. Steps (security groups, services, brokers, "
+                   "buildpacks, applications, etc.) completed by the previous deployment are "
+                   "skipped, unless their configuration has changed since then.")
+@click.option('--record-snapshot', 'record_snapshot_path',
+              help="Records the outputs of all commands reading from Cloud Foundry during "
+                   "the deployment (or its dry run) to the given file. This file can be later used "
+                   "with --snapshot. The file contains credentials from the environment "
+                   "(application environments, user-provided service credentials), so keep "
+                   "it private.")
+@click.option('--snapshot', 'snapshot_path',
+              help="Does the dry run entirely offline. State of Cloud Foundry is taken from "
+                   "the given file recorded with --record-snapshot. Requires --dry-run.")
+@click.option('--trace', 'trace_path',
+              help="Saves the timeline of all the deployment's operations (CF commands, "
+                   "unpacking, pushing, registration, etc.) to the given file in Chrome trace "
+                   "format. It can be viewed in chrome://tracing.")
+@click.option('--parallel', type=int,
+              default=1, show_default=True,
+              help="Maximum number of applications deployed at the same time. Applications are "
+                   "deployed in waves resulting from their dependencies. In each wave, "
+                   "applications that took the longest to deploy in the previous deployments "
+                   "are started first.")
+@click.option('--async-staging', is_flag=True,
+              help="Don't wait for each application to stage and start. Applications are staged "
+                   "concurrently and their states are polled together. Each application is "
+                   "pushed as soon as the applications it depends on are running.")
+@click.option('--changed-vars', is_flag=True,
+              help="Deploy only the applications, services, brokers, etc. that reference "
+                   "template variables whose values have changed between the last two runs "
+                   "filling the expanded appstack. With 'UPGRADE' push strategy, the affected "
+                   "applications are pushed as with 'PUSH_ALL'.")
+@click.option('--only',
+              help="Comma-separated names of applications. Only they (along with the global "
+                   "user-provided services and brokers providing the services they bind and "
+                   "the buildpacks they use) will be deployed.")
+@click.option('--with-deps', is_flag=True,
+              help="With --only, also deploy the applications that the given ones depend on "
+                   "(through services, 'after' and 'register_in'), transitively.")
+@click.option('--with-dependents', is_flag=True,
+              help="With --only, also deploy the applications that depend on the given ones, "
+                   "transitively.")
+@_grouped_options('selection_options', SelectionOptions)
+@_grouped_options('deployment_options', DeploymentOptions)
 def deploy( #pylint: disable=too-many-arguments
         artifacts_location,
         cf_api_endpoint,
@@ -135,7 +235,9 @@ def deploy( #pylint: disable=too-many-arguments
         expanded_appstack,
         appstack,
         push_strategy,
-        dry_run):
+        dry_run,
+        deployment_options,
+        selection_options):
     """
     Deploy the whole appstack.
     This should be run from environment's bastion to reduce chance of errors.
@@ -152,18 +254,124 @@ def deploy( #pylint: disable=too-many-arguments
     -e ../tools/expanded_appstack.yml
     """
     start_time = time.time()
+    _check_deploy_options(dry_run, deployment_options, selection_options)
 
     if validators.url(artifacts_location):
         _download_artifacts_from_url(artifacts_location, appstack)
         artifacts_location = DEFAULT_ARTIFACTS_PATH
 
+    filled_appstack = _get_filled_appstack(appstack, expanded_appstack, filled_appstack,
+                                           fetcher_config, artifacts_location)
+    _deploy_selected(CfInfo(api_url=cf_api_endpoint, password=cf_password, user=cf_user,
+                            org=cf_org, space=cf_space),
+                     filled_appstack, artifacts_location, dry_run, push_strategy,
+                     deployment_options, selection_options)
+
+    _log.info('Deployment time: %s', _seconds_to_time(time.time() - start_time))
+
+
+@cli.command()
+@click.argument('ARTIFACTS_LOCATION')
+@click.argument('CF_API_ENDPOINT')
+@click.option('-u', '--cf-user',
+              default='admin', show_default=True,
+              help="Cloud Foundry user on who's behalf we'll deploy appstack.")
+@click.option('-p', '--cf-password', prompt=True, hide_input=True,
+              help="User's password for Cloud Foundry instance.")
+@click.option('-o', '--cf-org',
+              default='seedorg', show_default=True,
+              help="Cloud Foundry organization to deploy apps to.")
+@click.option('-s', '--cf-space',
+              default='seedspace', show_default=True,
+              help="Cloud Foundry space to deploy apps to.")
+@click.option('-f', '--fetch-conf', 'fetcher_config',
+              default=DEFAULT_FETCHER_CONF, show_default=True,
+              help='Path to the configuration file for environment configuration fetcher.')
+@click.option('-l', '--filled-appstack',
+              default=DEFAULT_FILLED_APPSTACK_PATH,
+              help="Path to the file containing expanded appstack filled with configuration taken "
+                   "from live TAP environment. See the same option of \"deploy\".")
+@click.option('-e', '--expanded-appstack',
+              default=DEFAULT_EXPANDED_APPSTACK_FILE,
+              help="Path to the file containing the expanded appstack definition. "
+                   "See the same option of \"deploy\".")
+@click.option('-a', '--appstack',
+              default=DEFAULT_APPSTACK_FILE, show_default=True,
+              help='Path to the file containing non-expanded appstack. Only used if expanded'
+                   'appstack has not been specified.')
+@click.option('--push-strategy',
+              default=UPGRADE_STRATEGY, show_default=True,
+              help="Strategy for pushing the applications. See the same option of \"deploy\".")
+def plan( #pylint: disable=too-many-arguments
+        artifacts_location,
+        cf_api_endpoint,
+        cf_user,
+        cf_password,
+        cf_org,
+        cf_space,
+        fetcher_config,
+        filled_appstack,
+        expanded_appstack,
+        appstack,
+        push_strategy):
+    """
+    Show what the deployment of the appstack would do, without changing anything.
+    State of the environment is read once, in bulk, so this is much faster than "deploy --dry-run".
+
+    ARTIFACTS_LOCATION: Path to a directory with applications' artifacts (zips).
+    It should be the "apps/" subdirectory of an unpacked TAP release package.
+
+    CF_API_ENDPOINT: Endpoint of CF API, the same as for "deploy".
+    """
     cf_info = CfInfo(api_url=cf_api_endpoint, password=cf_password, user=cf_user,
                      org=cf_org, space=cf_space)
     filled_appstack = _get_filled_appstack(appstack, expanded_appstack, filled_appstack,
                                            fetcher_config, artifacts_location)
-    deploy_appstack(cf_info, filled_appstack, artifacts_location, dry_run, push_strategy)
+    cf_cli.api(cf_info.api_url, cf_info.ssl_validation)
+    cf_cli.auth(cf_info.user, cf_info.password)
 
-    _log.info('Deployment time: %s', _seconds_to_time(time.time() - start_time))
+    live_state = LiveState.fetch(cf_info.org, cf_info.space)
+    deployment_plan = make_plan(filled_appstack, live_state, artifacts_location, push_strategy)
+    _log.info('Deployment plan:\n%s', format_plan(deployment_plan))
+
+
+@cli.command()
+@click.argument('EXPANDED_APPSTACK_FILE', required=False, default=DEFAULT_EXPANDED_APPSTACK_FILE)
+@click.option('--parallel', type=int,
+              default=4, show_default=True,
+              help='Maximum number of applications deployed at the same time.')
+@click.option('--durations', 'durations_path',
+              help="YAML file mapping application names to their expected deployment durations "
+                   "(in seconds). They take precedence over the durations recorded by previous "
+                   "deployments (in {}).".format(DEPLOYER_OUTPUT))
+@click.option('--default-duration', type=float,
+              default=DEFAULT_APP_DURATION, show_default=True,
+              help='Deployment duration (in seconds) of applications with unknown durations.')
+@click.option('--top', 'limiting_app_count', type=int,
+              default=10, show_default=True,
+              help='How many applications limiting the concurrency the most to show.')
+def analyze(expanded_appstack_file, parallel, durations_path, default_duration, limiting_app_count):
+    """
+    Estimate how long the deployment of the appstack takes. Shows the critical path through
+    applications' dependency graph, the estimated makespan of "deploy --parallel" and
+    the applications whose dependencies limit the concurrency of the deployment the most
+    (breaking them up would shorten the deployment).
+
+    EXPANDED_APPSTACK_FILE defaults to "expanded_appstack.yml".
+    """
+    if parallel < 1:
+        raise ApployerArgumentError('--parallel needs to be at least 1.')
+    with open(expanded_appstack_file) as appstack_file:
+        appstack = AppStack.from_appstack_dict(yaml.load(appstack_file))
+    declared_durations = {}
+    if durations_path:
+        with open(durations_path) as durations_file:
+            declared_durations = yaml.load(durations_file) or {}
+
+    durations = get_app_durations(appstack.apps, DeploymentHistory(DEPLOYER_OUTPUT),
+                                  declared_durations, default_duration)
+    analysis = analyze_appstack(appstack, durations, parallel)
+    _log.info('Deployment analysis:\n%s', format_analysis(analysis, durations, limiting_app_count))
 
 
 @cli.command()
@@ -288,6 +496,136 @@ def _get_filled_appstack( #pylint: disable=too-many-arguments
     return AppStack.from_appstack_dict(filled_appstack_dict)
 
 
+def _check_deploy_options(dry_run, deployment_options, selection_options):
+    """
+    Args:
+        dry_run (bool): Is "deploy" doing a dry run.
+        deployment_options (`DeploymentOptions`): Options of "deploy".
+        selection_options (`SelectionOptions`): Options of "deploy".
+
+    Raises:
+        ApployerArgumentError: The options can't be used together.
+    """
+    if deployment_options.snapshot_path and not dry_run:
+        raise ApployerArgumentError('--snapshot can only be used with --dry-run.')
+    if deployment_options.snapshot_path and deployment_options.record_snapshot_path:
+        raise ApployerArgumentError("--snapshot and --record-snapshot can't be used together.")
+    if deployment_options.parallel < 1:
+        raise ApployerArgumentError('--parallel needs to be at least 1.')
+    if (selection_options.with_deps or selection_options.with_dependents) \
+            and not selection_options.only:
+        raise ApployerArgumentError('--with-deps and --with-dependents can only be used with --only.')
+
+
+def _deploy_selected(cf_info, filled_appstack, # pylint: disable=too-many-arguments
+                     artifacts_location, dry_run, push_strategy, deployment_options,
+                     selection_options):
+    """Deploys the entities of the filled appstack selected with the options of "deploy".
+
+    Args:
+        cf_info (`apployer.cf_cli.CfInfo`): Credentials and addresses needed to log into
+            Cloud Foundry.
+        filled_appstack (`apployer.appstack.AppStack`): Filled appstack.
+        artifacts_location (str): Path to a directory with applications' artifacts (zips).
+        dry_run (bool): Should it be a dry run.
+        push_strategy (str): Strategy for pushing the applications.
+        deployment_options (`DeploymentOptions`): Options of "deploy".
+        selection_options (`SelectionOptions`): Options of "deploy".
+    """
+    selected_steps = _get_selected_steps(filled_appstack, *selection_options)
+    if selected_steps is not None and not selected_steps:
+        _log.info('Nothing has been selected, there is nothing to deploy.')
+        return
+    if selection_options.changed_vars and push_strategy == UPGRADE_STRATEGY:
+        push_strategy = PUSH_ALL_STRATEGY
+    retry.get_policy().reset(budget=deployment_options.retry_budget)
+    if deployment_options.trace_path:
+        trace.get_tracer().start()
+    try:
+        with _get_snapshot_context(deployment_options.record_snapshot_path,
+                                   deployment_options.snapshot_path):
+            deploy_appstack(cf_info, filled_appstack, artifacts_location, dry_run, push_strategy,
+                            deployment_options.resume, deployment_options.parallel,
+                            deployment_options.async_staging, selected_steps)
+    finally:
+        _log.info(retry.get_policy().summary())
+        if deployment_options.trace_path:
+            trace.get_tracer().save(deployment_options.trace_path)
+
+
+def _get_selected_steps(filled_appstack, changed_vars, only, # pylint: disable=too-many-arguments
+                        with_deps, with_dependents):
+    """
+    Args:
+        filled_appstack (`apployer.appstack.AppStack`): Filled appstack.
+        changed_vars (bool): Should only the entities using changed template variables be selected.
+        only (str): Comma-separated names of the selected applications. None if not given.
+        with_deps (bool): Should the dependencies of the selected applications be selected, too.
+        with_dependents (bool): Should the applications depending on the selected ones be
+            selected, too.
+
+    Returns:
+        set[str]: Deployment steps of the selected entities. When both selections are given, only
+            the steps in both of them. None if everything needs to be deployed.
+
+    Raises:
+        ApployerArgumentError: Unknown applications were given or there weren't two fill runs yet.
+    """
+    selected_steps = _get_changed_steps() if changed_vars else None
+    if only:
+        app_names = [name.strip() for name in only.split(',') if name.strip()]
+        unknown_app_names = set(app_names).difference(app.name for app in filled_appstack.apps)
+        if unknown_app_names:
+            raise ApployerArgumentError('Applications given with --only are not in the appstack: '
+                                        + ', '.join(sorted(unknown_app_names)))
+        app_steps = get_app_selection_steps(filled_appstack, app_names, with_deps, with_dependents)
+        selected_steps = app_steps if selected_steps is None else selected_steps & app_steps
+    return selected_steps
+
+
+def _get_changed_steps():
+    """
+    Returns:
+        set[str]: Deployment steps of the entities using template variables that have changed
+            between the last two fill runs. None if everything needs to be deployed.
+
+    Raises:
+        ApployerArgumentError: There weren't two fill runs yet.
+    """
+    try:
+        changed_steps = template_variables.get_changed_steps()
+    except IOError as ex:
+        raise ApployerArgumentError(
+            "--changed-vars needs records of two runs filling the expanded appstack ({} and {}): "
+            "{}".format(template_variables.PREVIOUS_FILL_RECORD_PATH,
+                        template_variables.FILL_RECORD_PATH, ex))
+    if changed_steps:
+        _log.info('Entities using the changed variables: %s', ', '.join(sorted(changed_steps)))
+    return changed_steps
+
+
+def _get_snapshot_context(record_snapshot_path, snapshot_path):
+    """
+    Args:
+        record_snapshot_path (str): Path of the snapshot file to record. Can be None.
+        snapshot_path (str): Path of the snapshot file to replay. Can be None.
+
+    Returns:
+        Context manager in which the deployment should be run.
+    """
+    if record_snapshot_path:
+        return dry_run_module.recording_snapshot(record_snapshot_path)
+    if snapshot_path:
+        _log.info('Using the state of Cloud Foundry recorded in %s.', snapshot_path)
+        return dry_run_module.replaying_snapshot(snapshot_path)
+    return _null_context()
+
+
+@contextmanager
+def _null_context():
+    yield
+
+
 def _setup_logging(level):
     log_formatter = logging.Formatter(
         '%(asctime)s-%(levelname)s-%(name)s: %(message)s', '%H:%M:%S')
@@ -331,15 +669,11 @@ def _seconds_to_time(seconds):
 
 
 # TODO secondary
-# add retrying of CF CLI methods
 # automatically download CF CLI
-# Change "order" parameter in app configuration to "after" (a list). This way we can explicitly
-#   define that some application needs to be created before the given one so it can work.
-#   E.g. in hdfs-broker config: after: [auth-gateway]
-#   Those dependencies can be resolved on the graph.
+# Replace "order" parameters in appstack.yml with "after" lists.
 # Add a meaningful integration test and get rid of some unit tests with a lot of mocks.
 # make creation of upsis and service instances parallel
-#   (just use a ThreadPool for running them)
+#   (just use a ThreadPool for running them, like for applications with --parallel)
 # document how to add a new application, broker, upsi, etc.
 # switch all addresses to HTTPS
 # add options for bastion addressess, users and key-files
@@ -0,0 +1,228 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Pushing applications through Cloud Controller API instead of CF CLI, and the fingerprints telling
+when that's possible.
+"""
+
+import logging
+
+from apployer import app_file, cf_api, cf_cli
+from .cf_cli import CommandFailedError
+from .journal import get_fingerprint
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+# environment variables of pushed applications holding the fingerprints of what was pushed
+FINGERPRINT_ENV_VAR = 'APPLOYER_FINGERPRINT'
+BASE_FINGERPRINT_ENV_VAR = 'APPLOYER_BASE_FINGERPRINT'
+CONFIG_FINGERPRINT_ENV_VAR = 'APPLOYER_CONFIG_FINGERPRINT'
+FINGERPRINT_ENV_VARS = (FINGERPRINT_ENV_VAR, BASE_FINGERPRINT_ENV_VAR, CONFIG_FINGERPRINT_ENV_VAR)
+
+
+class NativePusher(object):
+    """Pushes an application through Cloud Controller API instead of CF CLI. It's much faster,
+    but it's only possible when nothing except application's environment variables (and maybe
+    its artifact) has changed since it was pushed. Fingerprints kept in the environment variables
+    of the application tell that.
+
+    Attributes:
+        app (`apployer.appstack.AppConfig`): Application's configuration from the filled
+            expanded appstack.
+        get_live_env_value (types.FunctionType): Returns the value of the given user-provided
+            environment variable of the application in the live environment (None if it isn't
+            set). Raises `apployer.cf_cli.CommandFailedError` if the environment can't be read.
+
+    Args:
+        app (`apployer.appstack.AppConfig`): See class attributes.
+        get_live_env_value (types.FunctionType): See class attributes.
+    """
+
+    def __init__(self, app, get_live_env_value):
+        self.app = app
+        self.get_live_env_value = get_live_env_value
+        self._artifact_sha1 = None
+
+    def get_fingerprint(self, artifacts_location, include_env=True, include_artifact=True):
+        """
+        Args:
+            artifacts_location (str): Path to a directory containing artifacts in ZIP format.
+            include_env (bool): If False, the base fingerprint (ignoring environment variables)
+                will be returned.
+            include_artifact (bool): If False (and `include_env` too), the configuration
+                fingerprint (ignoring the artifact) will be returned.
+
+        Returns:
+            str: Fingerprint of the application (see `get_app_fingerprint`).
+        """
+        if not include_artifact:
+            return get_app_fingerprint(self.app, None, include_env)
+        if self._artifact_sha1 is None:
+            artifact_path = app_file.get_artifact_path(artifacts_location, self.app.artifact_name)
+            self._artifact_sha1 = app_file.get_file_sha1(artifact_path)
+        return get_app_fingerprint(self.app, self._artifact_sha1, include_env)
+
+    def get_manifest_env(self, artifacts_location, include_fingerprints):
+        """
+        Args:
+            artifacts_location (str): Path to a directory containing artifacts in ZIP format.
+            include_fingerprints (bool): Should the fingerprints needed by FINGERPRINT push
+                strategy be included. The base fingerprint is always included, see
+                `is_env_update_enough`.
+
+        Returns:
+            dict: Environment variables from the filled manifest with application's fingerprints.
+        """
+        env = dict(self.app.app_properties.get('env') or {})
+        env[BASE_FINGERPRINT_ENV_VAR] = self.get_fingerprint(artifacts_location, include_env=False)
+        if not include_fingerprints:
+            return env
+        env[FINGERPRINT_ENV_VAR] = self.get_fingerprint(artifacts_location)
+        env[CONFIG_FINGERPRINT_ENV_VAR] = self.get_fingerprint(
+            artifacts_location, include_env=False, include_artifact=False)
+        return env
+
+    def is_env_update_enough(self, artifacts_location):
+        """Checks whether the live application differs from the one from the appstack only in
+        environment variables. Application's base fingerprint, which ignores them, guards that
+        nothing else has changed. It's set by every push, whatever the push strategy. Then
+        the live environment variables ("environment_json") are compared with the ones from
+        the filled manifest.
+
+        Returns:
+            bool: True if the live application differs from the one from the appstack only in
+                environment variables.
+        """
+        try:
+            live_base_fingerprint = self.get_live_env_value(BASE_FINGERPRINT_ENV_VAR)
+            if live_base_fingerprint != self.get_fingerprint(artifacts_location, include_env=False):
+                return False
+            live_env = cf_api.get_app_env(cf_cli.get_app_guid(self.app.name))
+        except CommandFailedError as ex:
+            _log.debug(str(ex))
+            return False
+        return bool(get_changed_env_names(live_env, self.app.app_properties.get('env') or {}))
+
+    def is_bits_upload_enough(self, artifacts_location):
+        """
+        Returns:
+            bool: True if the live application differs from the one from the appstack only in
+                its artifact and environment variables.
+        """
+        try:
+            live_config_fingerprint = self.get_live_env_value(CONFIG_FINGERPRINT_ENV_VAR)
+        except CommandFailedError:
+            return False
+        return live_config_fingerprint == self.get_fingerprint(
+            artifacts_location, include_env=False, include_artifact=False)
+
+    def update_env(self, artifacts_location, include_fingerprints):
+        """Applies the environment variables from the filled manifest to the live application and
+        restarts it. It's much faster than a push, because the application isn't restaged.
+        """
+        app_guid = cf_cli.get_app_guid(self.app.name)
+        _log.info('Only environment variables of app %s have changed. Updating them '
+                  'without pushing the app...', self.app.name)
+        self._apply_env(app_guid, artifacts_location, include_fingerprints)
+        if '--no-start' not in self.app.push_options.params:
+            cf_cli.restart(self.app.name)
+
+    def upload_bits(self, artifacts_location, wait_for_start=True):
+        """Pushes the application through Cloud Controller API instead of CF CLI. Only the files
+        that Cloud Controller doesn't have in its resource cache are uploaded, straight from
+        the artifact, without extracting it. Then the application is restaged.
+        Manifest's settings other than the environment variables aren't applied, so it can only
+        be used when they didn't change.
+
+        Returns:
+            str: GUID of the application if it has been left staging (because of
+                `wait_for_start` set to False), None otherwise.
+        """
+        app_guid = cf_cli.get_app_guid(self.app.name)
+        artifact_path = app_file.get_artifact_path(artifacts_location, self.app.artifact_name)
+        resources = app_file.get_zip_resources(artifact_path)
+        cached_keys = {(resource['sha1'], resource['size'])
+                       for resource in cf_api.match_resources(resources) or []}
+        cached_resources = [resource for resource in resources
+                            if (resource['sha1'], resource['size']) in cached_keys]
+        uploaded_file_names = [resource['fn'] for resource in resources
+                               if (resource['sha1'], resource['size']) not in cached_keys]
+        _log.info('Only the artifact (and environment variables) of app %s have changed. '
+                  'Uploading %s of its %s files (the rest is cached in Cloud Foundry)...',
+                  self.app.name, len(uploaded_file_names), len(resources))
+        cf_api.upload_app_bits(app_guid, cached_resources, artifact_path, uploaded_file_names)
+        self._apply_env(app_guid, artifacts_location, include_fingerprints=True)
+        if '--no-start' in self.app.push_options.params:
+            return None
+        cf_api.restage_app(app_guid)
+        if not wait_for_start:
+            return app_guid
+        cf_api.wait_for_app_start(app_guid)
+        return None
+
+    def _apply_env(self, app_guid, artifacts_location, include_fingerprints):
+        """Sets the environment variables from the filled manifest (and application's fingerprints)
+        on the live application. Variables that aren't in the manifest are left untouched, like
+        "cf push" does.
+        """
+        live_env = cf_api.get_app_env(app_guid)
+        env = dict(live_env)
+        env.update(self.get_manifest_env(artifacts_location, include_fingerprints))
+        _log.info('Changed environment variables of app %s: %s', self.app.name,
+                  ', '.join(get_changed_env_names(live_env, env)) or 'none')
+        cf_api.update_app_env(app_guid, env)
+
+
+def get_app_fingerprint(app, artifact_sha1, include_env=True):
+    """Computes the fingerprint of everything that's pushed for an application: its artifact,
+    filled manifest and push options. Any change to them changes the fingerprint.
+
+    Args:
+        app (`apployer.appstack.AppConfig`): Application's configuration from the filled
+            expanded appstack.
+        artifact_sha1 (str): SHA1 of application's artifact (see `app_file.get_file_sha1`).
+            If None, the artifact is ignored.
+        include_env (bool): If False, environment variables from the manifest are ignored and
+            the result is the base fingerprint. Applications with the same base fingerprint
+            differ only in environment variables. If the artifact is ignored too, the result is
+            the configuration fingerprint.
+
+    Returns:
+        str: The fingerprint (SHA1 hex digest).
+    """
+    app_properties = dict(app.app_properties)
+    if include_env:
+        app_properties['env'] = {name: value for name, value
+                                 in (app_properties.get('env') or {}).items()
+                                 if name not in FINGERPRINT_ENV_VARS}
+    else:
+        app_properties.pop('env', None)
+    return get_fingerprint([artifact_sha1, app_properties, app.push_options.to_dict()])
+
+
+def get_changed_env_names(live_env, env):
+    """
+    Args:
+        live_env (dict): Environment variables of an application in the live environment.
+        env (dict): Environment variables from application's filled manifest.
+
+    Returns:
+        list[str]: Sorted names of the variables from the manifest that the live application
+            doesn't have or has with other values. Fingerprints aren't taken into account.
+    """
+    return sorted(name for name, value in env.items()
+                  if live_env.get(name) != value and name not in FINGERPRINT_ENV_VARS)
@@ -0,0 +1,346 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Computing the deployment plan - a list of actions that a deployment of a filled appstack would
+perform. The state of the live environment is read once, with a few bulk (paginated) CF API
+queries for the space and one query for the bindings of each of its user-provided services, and
+the plan is computed from it in memory, using the same decisions as the deployer.
+"""
+
+from collections import namedtuple
+import logging
+from os import path
+
+import apployer.app_file as app_file
+from apployer import cf_api
+from .deployer import (is_app_push_needed, is_buildpack_update_needed, is_push_enabled,
+                       FINGERPRINT_STRATEGY, PUSH_ALL_STRATEGY)
+from .native_push import (get_app_fingerprint, get_changed_env_names, BASE_FINGERPRINT_ENV_VAR,
+                          CONFIG_FINGERPRINT_ENV_VAR, FINGERPRINT_ENV_VAR)
+from .upsi import is_upsi_update_needed
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+CREATE = 'create'
+UPDATE = 'update'
+PUSH = 'push'
+RUN = 'run'
+RESTART = 'restart'
+SKIP = 'skip'
+
+PlannedAction = namedtuple('PlannedAction', ['kind', 'name', 'action', 'reason'])
+
+# GUID of a live application and its user-provided environment variables ("environment_json").
+# Apart from the version (VERSION), they hold the fingerprints of what was pushed.
+LiveApp = namedtuple('LiveApp', ['guid', 'env'])
+
+
+class LiveState(object):
+    """Snapshot of the Cloud Foundry entities that the deployment of an appstack depends on.
+
+    Attributes:
+        apps (dict[str,`LiveApp`]): Names of applications in the space mapped to their GUIDs and
+            environment variables.
+        upsi_credentials (dict[str,dict]): Names of user-provided services in the space mapped
+            to their credentials.
+        upsi_bound_apps (dict[str,list[str]]): Names of user-provided services mapped to GUIDs of
+            applications bound to them.
+        service_instances (set[str]): Names of all service instances in the space.
+        brokers (set[str]): Names of service brokers.
+        buildpacks (dict[str,str]): Names of buildpacks mapped to their file names.
+        security_groups (set[str]): Names of security groups.
+    """
+
+    def __init__(self):
+        self.apps = {}
+        self.upsi_credentials = {}
+        self.upsi_bound_apps = {}
+        self.service_instances = set()
+        self.brokers = set()
+        self.buildpacks = {}
+        self.security_groups = set()
+
+    @classmethod
+    def fetch(cls, org, space):
+        """Reads the state of the live environment. It needs to be called after logging in to
+        Cloud Foundry. Org and space don't need to be targeted and don't need to exist.
+
+        Args:
+            org (str): Name of the organization that the appstack would be deployed to.
+            space (str): Name of the space that the appstack would be deployed to.
+
+        Returns:
+            `LiveState`: The snapshot.
+        """
+        live_state = cls()
+        _log.info('Reading the state of the live environment...')
+        space_guid = _get_space_guid(org, space)
+        if space_guid:
+            live_state._fetch_space_entities(space_guid) # pylint: disable=protected-access
+        else:
+            _log.info("Space %s in org %s doesn't exist yet.", space, org)
+
+        live_state.brokers = {broker['entity']['name'] for broker
+                              in cf_api.get_all_resources('/v2/service_brokers')}
+        live_state.buildpacks = {buildpack['entity']['name']: buildpack['entity']['filename']
+                                 for buildpack in cf_api.get_all_resources('/v2/buildpacks')}
+        live_state.security_groups = {group['entity']['name'] for group
+                                      in cf_api.get_all_resources('/v2/security_groups')}
+        return live_state
+
+    def _fetch_space_entities(self, space_guid):
+        for app in cf_api.get_all_resources('/v2/spaces/{}/apps'.format(space_guid)):
+            self.apps[app['entity']['name']] = LiveApp(
+                app['metadata']['guid'], app['entity'].get('environment_json') or {})
+
+        upsis = cf_api.get_all_resources(
+            '/v2/user_provided_service_instances?q=space_guid:{}'.format(space_guid))
+        for upsi in upsis:
+            upsi_name = upsi['entity']['name']
+            self.upsi_credentials[upsi_name] = upsi['entity']['credentials']
+            # listing all service bindings would go through the whole foundation
+            bindings = cf_api.get_all_resources(
+                '/v2/user_provided_service_instances/{}/service_bindings'
+                .format(upsi['metadata']['guid']))
+            self.upsi_bound_apps[upsi_name] = [binding['entity']['app_guid']
+                                               for binding in bindings]
+
+        instances = cf_api.get_all_resources(
+            '/v2/spaces/{}/service_instances?return_user_provided_service_instances=true'
+            .format(space_guid))
+        self.service_instances = {instance['entity']['name'] for instance in instances}
+        self.service_instances.update(self.upsi_credentials)
+
+
+def _get_space_guid(org, space):
+    """
+    Returns:
+        str: GUID of the space or None if either the space or the org doesn't exist.
+    """
+    orgs = cf_api.get_all_resources('/v2/organizations?q=name:{}'.format(org))
+    if not orgs:
+        return None
+    spaces = cf_api.get_all_resources('/v2/spaces?q=name:{}&q=organization_guid:{}'
+                                      .format(space, orgs[0]['metadata']['guid']))
+    if not spaces:
+        return None
+    return spaces[0]['metadata']['guid']
+
+
+def make_plan(filled_appstack, live_state, artifacts_path, push_strategy):
+    """Computes the actions that the deployment of the appstack would perform. The order of
+    actions is the same as the order of deployment.
+
+    Args:
+        filled_appstack (`apployer.appstack.AppStack`): Expanded appstack filled with configuration
+            extracted from a live TAP environment.
+        live_state (`LiveState`): State of the live environment.
+        artifacts_path (str): Path to a directory containing application artifacts (zips).
+        push_strategy (str): Strategy for pushing applications.
+
+    Returns:
+        list[`PlannedAction`]: The plan.
+    """
+    plan = []
+    apps_to_restart = []
+
+    for security_group in filled_appstack.security_groups:
+        if is_push_enabled(security_group.push_if):
+            _plan_security_group(security_group, live_state, plan)
+
+    for service in filled_appstack.user_provided_services:
+        if is_push_enabled(service.push_if):
+            apps_to_restart.extend(_plan_upsi(service, live_state, plan))
+
+    for broker in filled_appstack.brokers:
+        if is_push_enabled(broker.push_if):
+            _plan_broker(broker, live_state, plan)
+
+    for buildpack in filled_appstack.buildpacks:
+        _plan_buildpack(buildpack, artifacts_path, live_state, plan)
+
+    for app in filled_appstack.apps:
+        if is_push_enabled(app.push_if):
+            apps_to_restart.extend(_plan_app(app, live_state, artifacts_path, push_strategy,
+                                             plan))
+
+    _plan_restarts(filled_appstack, apps_to_restart, live_state, plan)
+
+    for post_action in filled_appstack.post_actions:
+        plan.append(PlannedAction('post_action', post_action.name, RUN,
+                                  '{} command(s)'.format(len(post_action.commands))))
+    return plan
+
+
+def _plan_security_group(security_group, live_state, plan):
+    """Plans the same decisions as `apployer.deployer.setup_security_group`."""
+    if security_group.name in live_state.security_groups:
+        reason = 'exists, will be bound to the space (rules are not updated)'
+    else:
+        reason = "doesn't exist"
+    plan.append(PlannedAction('security_group', security_group.name, CREATE, reason))
+
+
+def _plan_restarts(filled_appstack, app_guids, live_state, plan):
+    """Plans the same decisions as `apployer.deployer._restart_apps`."""
+    app_names = {live_app.guid: app_name for app_name, live_app in live_state.apps.items()}
+    for app_guid in app_guids:
+        app_name = app_names.get(app_guid, app_guid)
+        app = next((app for app in filled_appstack.apps if app.name == app_name), None)
+        if app and '--no-start' not in app.push_options.params:
+            plan.append(PlannedAction('app', app_name, RESTART,
+                                      'bound user-provided service has changed'))
+
+
+def _plan_upsi(service, live_state, plan):
+    """Plans the same decisions as `apployer.upsi.UpsiDeployer.deploy`.
+
+    Returns:
+        list[str]: GUIDs of applications that would be restarted because of the service update.
+    """
+    if service.name not in live_state.upsi_credentials:
+        plan.append(PlannedAction('user_provided_service', service.name, CREATE, "doesn't exist"))
+        return []
+    if is_upsi_update_needed(live_state.upsi_credentials[service.name], service.credentials):
+        bound_apps = live_state.upsi_bound_apps.get(service.name, [])
+        plan.append(PlannedAction('user_provided_service', service.name, UPDATE,
+                                  'credentials differ, {} app(s) will be rebound'
+                                  .format(len(bound_apps))))
+        return bound_apps
+    plan.append(PlannedAction('user_provided_service', service.name, SKIP, 'up-to-date'))
+    return []
+
+
+def _plan_broker(broker, live_state, plan):
+    """Plans the same decisions as `apployer.deployer.setup_broker`."""
+    if broker.name in live_state.brokers:
+        plan.append(PlannedAction('broker', broker.name, UPDATE, 'exists'))
+    else:
+        plan.append(PlannedAction('broker', broker.name, CREATE, "doesn't exist"))
+    for service_instance in broker.service_instances:
+        if service_instance.name in live_state.service_instances:
+            plan.append(PlannedAction('service_instance', service_instance.name, SKIP, 'exists'))
+        else:
+            plan.append(PlannedAction('service_instance', service_instance.name, CREATE,
+                                      "doesn't exist"))
+
+
+def _plan_buildpack(buildpack_name, artifacts_path, live_state, plan):
+    """Plans the same decisions as `apployer.deployer.setup_buildpack`."""
+    buildpack_path = app_file.get_file_path(buildpack_name, artifacts_path)
+    if buildpack_name not in live_state.buildpacks:
+        plan.append(PlannedAction('buildpack', buildpack_name, CREATE, "doesn't exist"))
+    elif is_buildpack_update_needed(buildpack_path, live_state.buildpacks[buildpack_name]):
+        plan.append(PlannedAction('buildpack', buildpack_name, UPDATE,
+                                  '{} -> {}'.format(live_state.buildpacks[buildpack_name],
+                                                    path.basename(buildpack_path))))
+    else:
+        plan.append(PlannedAction('buildpack', buildpack_name, SKIP, 'up-to-date'))
+
+
+def _plan_app(app, live_state, artifacts_path, push_strategy, plan):
+    """Plans the same decisions as `apployer.deployer.AppDeployer.deploy`.
+
+    Returns:
+        list[str]: GUIDs of applications that would be restarted because of updates of
+            user-provided services provided by this application.
+    """
+    _plan_push(app, live_state.apps.get(app.name), artifacts_path, push_strategy, plan)
+
+    apps_to_restart = []
+    for service in app.user_provided_services:
+        apps_to_restart.extend(_plan_upsi(service, live_state, plan))
+    if app.broker_config:
+        _plan_broker(app.broker_config, live_state, plan)
+    if app.register_in:
+        plan.append(PlannedAction('registration', app.name, RUN, 'in ' + app.register_in))
+    return apps_to_restart
+
+
+def _plan_push(app, live_app, artifacts_path, push_strategy, plan):
+    """Plans the same decisions as `apployer.deployer.AppDeployer.push`."""
+    live_env = live_app.env if live_app else {}
+    fingerprint = None
+    if push_strategy == FINGERPRINT_STRATEGY:
+        fingerprint = get_app_fingerprint(app, _get_artifact_sha1(app, artifacts_path))
+    if not is_app_push_needed(push_strategy, live_env.get('VERSION'), app,
+                              live_env.get(FINGERPRINT_ENV_VAR), fingerprint):
+        if push_strategy == FINGERPRINT_STRATEGY:
+            reason = 'fingerprint unchanged'
+        else:
+            reason = 'live version {} is up-to-date'.format(live_env.get('VERSION'))
+        plan.append(PlannedAction('app', app.name, SKIP, reason))
+    elif push_strategy != PUSH_ALL_STRATEGY and _is_env_update_enough(app, live_env,
+                                                                      artifacts_path):
+        plan.append(PlannedAction('app', app.name, UPDATE,
+                                  'only environment variables changed, will restart'))
+    else:
+        plan.append(PlannedAction('app', app.name, PUSH,
+                                  _get_push_reason(app, live_app, push_strategy, fingerprint)))
+        if app.push_options.post_command:
+            plan.append(PlannedAction('post_command', app.name, RUN,
+                                      app.push_options.post_command))
+
+
+def _get_push_reason(app, live_app, push_strategy, fingerprint):
+    """
+    Returns:
+        str: Why the application would be pushed and how.
+    """
+    if live_app is None:
+        return "doesn't exist"
+    if push_strategy == FINGERPRINT_STRATEGY and live_app.env.get(CONFIG_FINGERPRINT_ENV_VAR) \
+            == get_app_fingerprint(app, None, include_env=False):
+        return 'only artifact changed, will upload changed files'
+    if push_strategy == FINGERPRINT_STRATEGY:
+        return 'fingerprint {} -> {}'.format(live_app.env.get(FINGERPRINT_ENV_VAR), fingerprint)
+    if live_app.env.get('VERSION') is None:
+        return 'live version unknown'
+    return '{} -> {}'.format(live_app.env['VERSION'],
+                             app.app_properties.get('env', {}).get('VERSION', ''))
+
+
+def _is_env_update_enough(app, live_env, artifacts_path):
+    """Plans the same decision as `apployer.native_push.NativePusher.is_env_update_enough`."""
+    live_base_fingerprint = live_env.get(BASE_FINGERPRINT_ENV_VAR)
+    if live_base_fingerprint is None or live_base_fingerprint != get_app_fingerprint(
+            app, _get_artifact_sha1(app, artifacts_path), include_env=False):
+        return False
+    return bool(get_changed_env_names(live_env, app.app_properties.get('env') or {}))
+
+
+def _get_artifact_sha1(app, artifacts_path):
+    """
+    Returns:
+        str: SHA1 of application's artifact.
+    """
+    return app_file.get_file_sha1(app_file.get_artifact_path(artifacts_path, app.artifact_name))
+
+
+def format_plan(plan):
+    """
+    Args:
+        plan (list[`PlannedAction`]): The plan.
+
+    Returns:
+        str: Human readable table of the plan followed by a summary.
+    """
+    lines = ['{:<22} {:<40} {:<8} {}'.format(*action) for action in plan]
+    changes = [action for action in plan if action.action != SKIP]
+    lines.append('Plan: {} action(s), {} entities up-to-date.'.format(
+        len(changes), len(plan) - len(changes)))
+    return '\n'.join(lines)
@@ -0,0 +1,239 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Retrying of Cloud Foundry operations that failed because of transient errors.
+
+Every public function of `apployer.cf_cli` and `apployer.cf_api` is marked with one of the
+operation classes below. The class decides when a failed call can be safely repeated:
+
+* idempotent-read - doesn't change anything, can always be repeated after a transient error,
+* idempotent-write - repeating it leaves Cloud Foundry in the same state as calling it once,
+    so it can also be repeated after a transient error,
+* non-idempotent - can be repeated only if the error shows that the request didn't even reach
+    Cloud Controller (e.g. the connection was refused).
+"""
+
+import logging
+import random
+import threading
+import time
+
+from decorator import decorator
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+IDEMPOTENT_READ = 'idempotent-read'
+IDEMPOTENT_WRITE = 'idempotent-write'
+NON_IDEMPOTENT = 'non-idempotent'
+
+# Errors showing that the request couldn't have had any effect in Cloud Foundry.
+CONNECTION_ERROR_MARKERS = (
+    'connection refused',
+    'no such host',
+    'network is unreachable',
+    'TLS handshake timeout',
+)
+
+# Errors that will probably go away when the operation is repeated after a while.
+TRANSIENT_ERROR_MARKERS = CONNECTION_ERROR_MARKERS + (
+    'Server error, status code: 5',
+    'Service Unavailable',
+    'Bad Gateway',
+    'Gateway Timeout',
+    'i/o timeout',
+    'connection reset by peer',
+    'unexpected EOF',
+    'StagingTimeExpired',
+    'StagerUnavailable',
+    'Start app timeout',
+    'CF-ServiceUnavailable',
+)
+
+
+class RetryPolicy(object):
+    """Decides whether and when a failed Cloud Foundry operation should be repeated.
+    It also keeps count of all the retries done during a run.
+
+    Attributes:
+        max_attempts (int): Maximum number of calls of a single operation (first one included).
+        base_delay (float): Upper limit (in seconds) of the delay before the first retry.
+            The limit doubles with each subsequent retry.
+        max_delay (float): Delay (in seconds) will never be longer than this.
+        budget (int): Number of retries that can be done during the whole run, summed over
+            all operations. It stops a broken environment from multiplying the deployment time.
+        retry_counts (dict[str,int]): Number of retries done for each operation (function name).
+
+    Args:
+        max_attempts (int): See class attributes.
+        base_delay (float): See class attributes.
+        max_delay (float): See class attributes.
+        budget (int): See class attributes.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=60.0, budget=30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retry_counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def total_retries(self):
+        """
+        Returns:
+            int: Number of retries done so far.
+        """
+        return sum(self.retry_counts.values())
+
+    @property
+    def retries_left(self):
+        """
+        Returns:
+            int: Number of retries that can still be done in this run.
+        """
+        return max(self.budget - self.total_retries, 0)
+
+    def get_delay(self, retry_number):
+        """Exponential backoff with "full jitter" - the delay is drawn uniformly from the range
+        limited by the exponentially growing ceiling. Jitter prevents parallel operations failing
+        at the same time from hitting Cloud Controller at the same time again.
+
+        Args:
+            retry_number (int): Number of the retry, starting from 1.
+
+        Returns:
+            float: Delay (in seconds) before the retry.
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (retry_number - 1))
+        return random.uniform(0, ceiling)
+
+    def call(self, operation_class, function, *args, **kwargs):
+        """Calls the function, repeating it after errors if the operation class allows it.
+
+        Args:
+            operation_class (str): One of `IDEMPOTENT_READ`, `IDEMPOTENT_WRITE`, `NON_IDEMPOTENT`.
+            function (types.FunctionType): Cloud Foundry operation.
+            args: Positional arguments for the function.
+            kwargs: Keyword arguments for the function.
+
+        Returns:
+            Whatever the function returns.
+
+        Raises:
+            Whatever the function raises, when it can't be retried anymore.
+        """
+        attempt = 1
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as ex: # pylint: disable=broad-except
+                if attempt >= self.max_attempts or \
+                        not is_retryable(operation_class, ex) or \
+                        not self._take_retry(function.__name__):
+                    raise
+                delay = self.get_delay(attempt)
+                _log.warning('Operation %s failed with a transient error (attempt %s of %s). '
+                             'Will retry in %.1f seconds...\nError: %s',
+                             function.__name__, attempt, self.max_attempts, delay, ex)
+                time.sleep(delay)
+                attempt += 1
+
+    def reset(self, budget=None):
+        """Forgets the retries done so far. Should be called at the beginning of each run.
+
+        Args:
+            budget (int): New retry budget. The old one will be kept if it's not given.
+        """
+        with self._lock:
+            if budget is not None:
+                self.budget = budget
+            self.retry_counts = {}
+
+    def summary(self):
+        """
+        Returns:
+            str: Human readable summary of the retries done.
+        """
+        if not self.retry_counts:
+            return 'No operations needed to be retried.'
+        counts = ', '.join('{}: {}'.format(name, count)
+                           for name, count in sorted(self.retry_counts.items()))
+        return 'Retried operations: {}. Retry budget left: {}/{}.'.format(
+            counts, self.retries_left, self.budget)
+
+    def _take_retry(self, operation_name):
+        with self._lock:
+            if self.retries_left <= 0:
+                _log.warning('Retry budget (%s) exhausted, %s will not be retried.',
+                             self.budget, operation_name)
+                return False
+            self.retry_counts[operation_name] = self.retry_counts.get(operation_name, 0) + 1
+            return True
+
+
+_policy = RetryPolicy() # pylint: disable=invalid-name
+
+
+def get_policy():
+    """
+    Returns:
+        `RetryPolicy`: Policy used by all the Cloud Foundry operations.
+    """
+    return _policy
+
+
+def is_retryable(operation_class, error):
+    """
+    Args:
+        operation_class (str): One of `IDEMPOTENT_READ`, `IDEMPOTENT_WRITE`, `NON_IDEMPOTENT`.
+        error (Exception): Error raised by the operation.
+
+    Returns:
+        bool: Can the operation be safely repeated after such an error.
+    """
+    error_text = '{}\n{}'.format(error, getattr(error, 'output', None) or '')
+    if operation_class == NON_IDEMPOTENT:
+        markers = CONNECTION_ERROR_MARKERS
+    else:
+        markers = TRANSIENT_ERROR_MARKERS
+    return any(marker in error_text for marker in markers)
+
+
+def retried(operation_class):
+    """Creates a decorator that makes the decorated function retry according to the policy.
+    Signature of the function is preserved, so the dry run can still inspect it.
+
+    Args:
+        operation_class (str): One of `IDEMPOTENT_READ`, `IDEMPOTENT_WRITE`, `NON_IDEMPOTENT`.
+
+    Returns:
+        types.FunctionType: The decorator.
+    """
+    def _caller(function, *args, **kwargs):
+        return _policy.call(operation_class, function, *args, **kwargs)
+
+    def _decorate(function):
+        decorated = decorator(_caller, function)
+        decorated.operation_class = operation_class
+        return decorated
+    return _decorate
+
+
+idempotent_read = retried(IDEMPOTENT_READ) # pylint: disable=invalid-name
+idempotent_write = retried(IDEMPOTENT_WRITE) # pylint: disable=invalid-name
+non_idempotent = retried(NON_IDEMPOTENT) # pylint: disable=invalid-name
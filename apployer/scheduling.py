@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Scheduling of application deployments: one after another, in parallel waves or with asynchronous
+staging.
+"""
+
+import logging
+from multiprocessing.pool import ThreadPool
+import Queue
+import time
+
+from apployer import cf_api
+from .app_graph import add_order_barriers, get_deployment_graph, get_deployment_waves
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+# Waiting for results of a thread pool without a timeout can't be interrupted with Ctrl+C.
+_POOL_RESULTS_TIMEOUT = 7 * 24 * 3600
+
+
+def get_app_waves(filled_appstack, apps, parallel, deployment_history):
+    """Splits the applications into waves that need to be deployed one after another.
+
+    Args:
+        filled_appstack (`apployer.appstack.AppStack`): Expanded appstack filled with configuration
+            extracted from a live TAP environment.
+        apps (list[`apployer.appstack.AppConfig`]): Applications to deploy, in deployment order.
+        parallel (int): Maximum number of applications deployed at the same time.
+        deployment_history (`apployer.history.DeploymentHistory`): Durations of previous
+            deployments.
+
+    Returns:
+        list[list[`apployer.appstack.AppConfig`]]: The waves. Applications in each wave are in
+            the order in which they should be started. When deploying serially, there's one wave
+            with all the applications in deployment order.
+    """
+    if parallel <= 1:
+        return [apps]
+    waves = get_deployment_waves(get_deployment_graph(filled_appstack), apps)
+    _log.info('Deploying %s applications in %s waves, up to %s at the same time...',
+              len(apps), len(waves), parallel)
+    # Starting the longest applications last would stretch their waves.
+    return [deployment_history.sort_longest_first(wave) for wave in waves]
+
+
+def map_in_parallel(function, items, parallel):
+    """Calls the function for each of the items, in their order, in up to "parallel" threads.
+
+    Returns:
+        list: Results of the function, in order of the items.
+
+    Raises:
+        Exception: The first exception raised by the function. Calls that have already started
+            are allowed to finish.
+    """
+    if parallel <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(parallel, len(items)))
+    try:
+        # chunksize of 1 makes the items be picked up by the threads in order
+        return pool.map_async(function, items, chunksize=1).get(_POOL_RESULTS_TIMEOUT)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class AsyncStagingDeployment(object):
+    """Deploys applications without waiting for them to stage. Pushes run in up to "parallel"
+    threads, but staging applications don't occupy any thread. All of them are polled together
+    from the deploying thread. Each application is pushed as soon as all applications it depends
+    on are running and finished, instead of waiting for their whole deployment wave.
+    The deployment can only be done once, the threads are stopped at its end.
+
+    Attributes:
+        app_steps: Deployment steps of the applications. Its `push(app)` pushes an application
+            and returns its GUID if the application is staging, None if there's no need to wait
+            for it. Its `finish(app)` finishes the deployment of a running application and returns
+            the list of GUIDs of applications that need to be restarted.
+        staging_poller (`apployer.staging.StagingPoller`): Poller of staging applications.
+        deployment_history (`apployer.history.DeploymentHistory`): Durations of previous
+            deployments, used to push the longest applications first.
+
+    Args:
+        app_steps: See class attributes.
+        parallel (int): Maximum number of applications pushed (or finished) at the same time.
+        staging_poller (`apployer.staging.StagingPoller`): See class attributes.
+        deployment_history (`apployer.history.DeploymentHistory`): See class attributes.
+    """
+
+    def __init__(self, app_steps, parallel, staging_poller, deployment_history):
+        self.app_steps = app_steps
+        self.staging_poller = staging_poller
+        self.deployment_history = deployment_history
+        self._pool = ThreadPool(parallel)
+        self._results = Queue.Queue()
+        # times when the pushed applications have been left staging
+        self._staging_start_times = {}
+        self._next_poll_time = 0
+
+    def deploy(self, app_graph, apps):
+        """
+        Args:
+            app_graph (`apployer.app_graph.AppGraph`): Dependency graph of (at least)
+                the applications.
+            apps (list[`apployer.appstack.AppConfig`]): Applications to deploy, in deployment
+                order.
+
+        Returns:
+            list[str]: GUIDs of applications that need to be restarted.
+
+        Raises:
+            Exception: The first exception raised by a deployment step. Steps that have already
+                started are allowed to finish.
+        """
+        app_graph = add_order_barriers(app_graph.get_subgraph(apps), apps)
+        waiting_counts = {id(app): len(app_graph.get_dependencies(app)) for app in apps}
+        dependents = {id(app): [] for app in apps}
+        for app, required_app in app_graph.get_edges():
+            dependents[id(required_app)].append(app)
+
+        apps_to_restart = []
+        finished_count = 0
+        try:
+            self._push([app for app in apps if not waiting_counts[id(app)]])
+            while finished_count < len(apps):
+                step_result = self._get_step_result()
+                if step_result is None:
+                    continue
+                step, app, result = step_result
+                if step == 'push' and result:
+                    _log.info('App %s is staging...', app.name)
+                    # the push itself (and waiting for a thread) is recorded by its trace span
+                    self._staging_start_times[app.name] = time.time()
+                    self.staging_poller.watch(result, app)
+                elif step == 'push':
+                    self._pool.apply_async(self._run, ('finish', app))
+                else:
+                    apps_to_restart.extend(result)
+                    finished_count += 1
+                    for dependent in dependents[id(app)]:
+                        waiting_counts[id(dependent)] -= 1
+                    self._push([dependent for dependent in dependents[id(app)]
+                                if not waiting_counts[id(dependent)]])
+        finally:
+            self._pool.close()
+            self._pool.join()
+        return apps_to_restart
+
+    def _push(self, ready_apps):
+        """Starts pushing the applications, the longest ones first."""
+        for app in self.deployment_history.sort_longest_first(ready_apps):
+            self._pool.apply_async(self._run, ('push', app))
+
+    def _run(self, step, app):
+        """Runs a deployment step ("push" or "finish") of the application in a pool's thread and
+        puts its result (or error) into the results queue.
+        """
+        try:
+            self._results.put((step, app, getattr(self.app_steps, step)(app), None))
+        except Exception as ex: # pylint: disable=broad-except
+            self._results.put((step, app, None, ex))
+
+    def _get_step_result(self):
+        """Polls the staging applications if it's time for that and starts finishing the ones
+        that are running. Then waits (until the next poll) for the result of a deployment step.
+
+        Returns:
+            tuple: The step, the application and step's result. None if no step has finished.
+
+        Raises:
+            Exception: Error raised by the step.
+        """
+        if self.staging_poller.watched_count and time.time() >= self._next_poll_time:
+            for app in self.staging_poller.poll():
+                self.deployment_history.record(app.name, 'staging',
+                                               time.time() - self._staging_start_times[app.name])
+                self._pool.apply_async(self._run, ('finish', app))
+            self._next_poll_time = time.time() + cf_api.POLL_INTERVAL
+        timeout = max(self._next_poll_time - time.time(), 0) \
+            if self.staging_poller.watched_count else _POOL_RESULTS_TIMEOUT
+        try:
+            step, app, result, error = self._results.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        if error is not None:
+            raise error
+        return step, app, result
+
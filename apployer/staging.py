@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Watching many applications staging at the same time.
+"""
+
+from collections import OrderedDict
+import logging
+import time
+
+from apployer import cf_api
+from .cf_cli import CommandFailedError
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+
+class StagingPoller(object):
+    """Polls the states of staging applications. All of them are checked with a single request for
+    the summary of their space, so there's no need for a request (and a waiting thread) per
+    application.
+
+    Attributes:
+        space_guid (str): GUID of the space with the applications.
+        timeout (float): How long (in seconds) an application can take to stage and start.
+
+    Args:
+        space_guid (str): See class attributes.
+        timeout (float): See class attributes.
+    """
+
+    def __init__(self, space_guid, timeout=cf_api.STAGING_TIMEOUT):
+        self.space_guid = space_guid
+        self.timeout = timeout
+        # application GUIDs mapped to (item, deadline), in the order in which they were added
+        self._watched_apps = OrderedDict()
+
+    def watch(self, app_guid, item):
+        """Starts watching a staging application.
+
+        Args:
+            app_guid (str): Application's GUID.
+            item: Anything identifying the application for the caller. It will be returned by
+                `poll` when the application starts.
+        """
+        self._watched_apps[app_guid] = (item, time.time() + self.timeout)
+
+    @property
+    def watched_count(self):
+        """
+        Returns:
+            int: Number of applications that are still watched.
+        """
+        return len(self._watched_apps)
+
+    def poll(self):
+        """Checks the states of all watched applications.
+
+        Returns:
+            list: Items of the applications that have started (have a running instance).
+                They're no longer watched.
+
+        Raises:
+            CommandFailedError: Staging of an application has failed or it didn't start in time.
+        """
+        if not self._watched_apps:
+            return []
+        app_summaries = {app_summary['guid']: app_summary
+                         for app_summary in cf_api.get_space_apps(self.space_guid)}
+        started_items = []
+        for app_guid, (item, deadline) in list(self._watched_apps.items()):
+            app_summary = app_summaries.get(app_guid, {})
+            if app_summary.get('package_state') == 'FAILED':
+                raise CommandFailedError('Staging of app {} failed: {} {}'.format(
+                    app_summary.get('name', app_guid), app_summary.get('staging_failed_reason'),
+                    app_summary.get('staging_failed_description')))
+            if app_summary.get('package_state') == 'STAGED' \
+                    and app_summary.get('running_instances', 0) > 0:
+                _log.info('App %s has started.', app_summary['name'])
+                del self._watched_apps[app_guid]
+                started_items.append(item)
+            elif time.time() > deadline:
+                raise CommandFailedError("App {} didn't start in {} seconds".format(
+                    app_summary.get('name', app_guid), self.timeout))
+        return started_items
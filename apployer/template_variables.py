@@ -0,0 +1,205 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Index of the template variables used in the expanded appstack (which is a Jinja template filled
+with the configuration of an environment) and of the appstack entities referencing them.
+It allows redeploying only the entities whose variables have changed between two fill runs.
+"""
+
+import bisect
+import json
+import logging
+import os
+from os import path
+
+import jinja2
+from jinja2 import meta, nodes
+import yaml
+
+from .journal import get_fingerprint
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+# Records of the variables' values from the last and the previous fill runs.
+FILL_RECORD_PATH = 'filled_variables.json'
+PREVIOUS_FILL_RECORD_PATH = 'filled_variables.previous.json'
+
+# Top-level lists of the appstack mapped to the kinds of their entities' deployment steps
+# (see `apployer.deployer._run_step`).
+ENTITY_KINDS = {
+    'apps': 'app',
+    'user_provided_services': 'user_provided_service',
+    'brokers': 'broker',
+    'security_groups': 'security_group',
+    'post_actions': 'post_action',
+}
+
+
+class VariableIndex(object):
+    """Template variables of the expanded appstack mapped to the deployment steps of the entities
+    (e.g. "app:data-catalog") referencing them.
+
+    Attributes:
+        steps (dict[str,set[str]]): Variable names mapped to the deployment steps.
+        global_variables (set[str]): Variables referenced outside of any entity (e.g. in "domain"),
+            which can affect all of them.
+
+    Args:
+        template_str (str): Content of the expanded appstack file.
+    """
+
+    def __init__(self, template_str):
+        self.steps = {}
+        self.global_variables = set()
+
+        template_ast = jinja2.Environment().parse(template_str)
+        variables = meta.find_undeclared_variables(template_ast)
+        entity_lines = _get_entity_lines(template_str)
+        start_lines = [start_line for start_line, _, _ in entity_lines]
+        for name_node in template_ast.find_all(nodes.Name):
+            if name_node.ctx != 'load' or name_node.name not in variables:
+                continue
+            index = bisect.bisect_right(start_lines, name_node.lineno) - 1
+            if index >= 0 and name_node.lineno <= entity_lines[index][1]:
+                self.steps.setdefault(name_node.name, set()).add(entity_lines[index][2])
+            else:
+                self.global_variables.add(name_node.name)
+
+    @staticmethod
+    def from_file(template_path):
+        """
+        Args:
+            template_path (str): Path of the expanded appstack file.
+
+        Returns:
+            `VariableIndex`: Index of the file.
+        """
+        with open(template_path) as template_file:
+            return VariableIndex(template_file.read())
+
+    def get_affected_steps(self, variables):
+        """
+        Args:
+            variables (list[str]): Names of the variables.
+
+        Returns:
+            set[str]: Deployment steps of the entities referencing any of the variables.
+                None if a global variable is among them, so all entities can be affected.
+        """
+        if self.global_variables.intersection(variables):
+            return None
+        affected_steps = set()
+        for variable in variables:
+            affected_steps.update(self.steps.get(variable, ()))
+        return affected_steps
+
+
+def _get_entity_lines(template_str):
+    """
+    Args:
+        template_str (str): Content of the expanded appstack file.
+
+    Returns:
+        list[tuple]: (first line, last line, deployment step) of each entity in the file,
+            ordered by lines. Lines are numbered from 1, like in Jinja.
+    """
+    entity_lines = []
+    root_node = yaml.compose(template_str)
+    for key_node, value_node in root_node.value if root_node else []:
+        kind = ENTITY_KINDS.get(key_node.value)
+        if not kind or not isinstance(value_node, yaml.SequenceNode):
+            continue
+        for entity_node in value_node.value:
+            names = [entity_value.value for entity_key, entity_value in entity_node.value
+                     if entity_key.value == 'name']
+            # the end mark points right after the entity, which usually is the next line's start
+            end_mark = entity_node.end_mark
+            last_line = end_mark.line + 1 if end_mark.column else end_mark.line
+            entity_lines.append((entity_node.start_mark.line + 1, last_line,
+                                 '{}:{}'.format(kind, names[0] if names else '')))
+    return sorted(entity_lines)
+
+
+def record_fill(expanded_appstack_path, filled_config):
+    """Records the fingerprints of variables' values used to fill the expanded appstack.
+    The record of the previous fill run is kept, so that they can be compared.
+
+    Args:
+        expanded_appstack_path (str): Path of the expanded appstack that has been filled.
+        filled_config (dict): Variables used to fill it.
+    """
+    if path.exists(FILL_RECORD_PATH):
+        os.rename(FILL_RECORD_PATH, PREVIOUS_FILL_RECORD_PATH)
+    with open(expanded_appstack_path) as expanded_appstack_file:
+        expanded_appstack_fingerprint = get_fingerprint(expanded_appstack_file.read())
+    fill_record = {
+        'expanded_appstack': path.abspath(expanded_appstack_path),
+        'expanded_appstack_fingerprint': expanded_appstack_fingerprint,
+        # only the fingerprints, so that no credentials are written out
+        'variables': {name: get_fingerprint(value) for name, value in filled_config.items()},
+    }
+    with open(FILL_RECORD_PATH, 'w') as fill_record_file:
+        json.dump(fill_record, fill_record_file, indent=2, sort_keys=True)
+
+
+def get_changed_variables(previous_fill_record, fill_record):
+    """
+    Args:
+        previous_fill_record (dict): Record of a fill run (see `record_fill`).
+        fill_record (dict): Record of a later fill run.
+
+    Returns:
+        list[str]: Names of the variables whose values differ between the fill runs,
+            sorted.
+    """
+    previous_variables = previous_fill_record['variables']
+    variables = fill_record['variables']
+    return sorted(name for name in set(previous_variables).union(variables)
+                  if previous_variables.get(name) != variables.get(name))
+
+
+def get_changed_steps():
+    """Finds the deployment steps that need to be run again because the variables they use
+    have changed between the last two fill runs.
+
+    Returns:
+        set[str]: The deployment steps (e.g. "app:data-catalog"). None if all entities can be
+            affected.
+
+    Raises:
+        IOError: There were no two fill runs.
+    """
+    with open(PREVIOUS_FILL_RECORD_PATH) as previous_fill_record_file:
+        previous_fill_record = json.load(previous_fill_record_file)
+    with open(FILL_RECORD_PATH) as fill_record_file:
+        fill_record = json.load(fill_record_file)
+
+    if previous_fill_record.get('expanded_appstack_fingerprint') != \
+            fill_record['expanded_appstack_fingerprint']:
+        _log.info('Expanded appstack has changed since the previous fill run, '
+                  'everything will be deployed.')
+        return None
+    changed_variables = get_changed_variables(previous_fill_record, fill_record)
+    _log.info('Variables changed since the previous fill run: %s',
+              ', '.join(changed_variables) or 'none')
+    index = VariableIndex.from_file(fill_record['expanded_appstack'])
+    changed_steps = index.get_affected_steps(changed_variables)
+    if changed_steps is None:
+        _log.info('Changed variables %s are used outside of appstack entities, '
+                  'everything will be deployed.',
+                  ', '.join(index.global_variables.intersection(changed_variables)))
+    return changed_steps
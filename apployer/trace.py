@@ -0,0 +1,182 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Timing trace of the deployment. Operations are recorded as spans (with their start time and
+duration) and can be saved as a Chrome trace (JSON) file that can be viewed in chrome://tracing
+or https://ui.perfetto.dev.
+
+Each span is tagged with the deployment context (e.g. the application being deployed and the
+phase of the deployment) of the thread it was recorded in.
+Tracing is disabled by default and then, unless something listens to the spans (see
+`Tracer.add_listener`), they cost next to nothing.
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+
+class Tracer(object):
+    """Collects spans as Chrome trace "complete" events.
+
+    Attributes:
+        enabled (bool): Are the spans recorded.
+        events (list[dict]): Recorded trace events.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._lock = threading.Lock()
+        self._context = threading.local()
+        self._listeners = []
+
+    def get_context(self):
+        """
+        Returns:
+            dict: Deployment context of the current thread.
+        """
+        return getattr(self._context, 'values', {})
+
+    @contextmanager
+    def context(self, **values):
+        """Sets the deployment context (e.g. app='data-catalog', phase='push') for all spans
+        recorded by the current thread inside of it. Contexts can be nested.
+
+        Args:
+            values: Context's values.
+        """
+        previous_values = self.get_context()
+        new_values = dict(previous_values)
+        new_values.update(values)
+        self._context.values = new_values
+        try:
+            yield
+        finally:
+            self._context.values = previous_values
+
+    @contextmanager
+    def span(self, name, **args):
+        """Records the time spent inside of it as a span.
+
+        Args:
+            name (str): Name of the span, e.g. name of the operation.
+            args: Additional information about the span, e.g. a command.
+        """
+        if not self.enabled and not self._listeners:
+            yield
+            return
+        span_args = dict(self.get_context())
+        span_args.update(args)
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start_time
+            if self.enabled:
+                self._record_event(name, start_time, duration, span_args)
+            for listener in list(self._listeners):
+                listener(name, duration, span_args)
+
+    def _record_event(self, name, start_time, duration, span_args):
+        event = {
+            'name': name,
+            'cat': span_args.get('phase', 'deployment'),
+            'ph': 'X',
+            'ts': int(start_time * 1000000),
+            'dur': int(duration * 1000000),
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': span_args,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def add_listener(self, listener):
+        """Makes the listener be called after each span, even if tracing is disabled.
+
+        Args:
+            listener (types.FunctionType): Function taking span's name, its duration
+                (in seconds) and its arguments (dict with the deployment context).
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Args:
+            listener (types.FunctionType): Listener added with `add_listener`.
+        """
+        self._listeners.remove(listener)
+
+    def start(self):
+        """Starts recording the spans. Spans recorded before are discarded."""
+        with self._lock:
+            self.events = []
+        self.enabled = True
+
+    def save(self, trace_path):
+        """Saves the recorded spans as a Chrome trace file.
+
+        Args:
+            trace_path (str): Path of the trace file.
+        """
+        _log.info('Saving deployment trace (%s spans) to %s...', len(self.events), trace_path)
+        with self._lock:
+            trace = {'traceEvents': sorted(self.events, key=lambda event: event['ts']),
+                     'displayTimeUnit': 'ms'}
+        with open(trace_path, 'w') as trace_file:
+            json.dump(trace, trace_file, default=str)
+
+
+_tracer = Tracer() # pylint: disable=invalid-name
+
+
+def get_tracer():
+    """
+    Returns:
+        `Tracer`: Tracer used by the whole Apployer.
+    """
+    return _tracer
+
+
+def span(name, **args):
+    """Records a span with the global tracer. See `Tracer.span`."""
+    return _tracer.span(name, **args)
+
+
+def context(**values):
+    """Sets the deployment context for the global tracer. See `Tracer.context`."""
+    return _tracer.context(**values)
+
+
+def get_command_name(command):
+    """
+    Args:
+        command (list[str] or str): Command (list of parts or a shell command).
+
+    Returns:
+        str: Name of the command without its arguments (they can contain credentials),
+            e.g. "cf push".
+    """
+    if isinstance(command, basestring):
+        command = command.split()
+    return ' '.join(command[:2])
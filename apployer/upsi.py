@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Deployment of user-provided service instances.
+"""
+
+import json
+import logging
+
+import datadiff
+
+from apployer import cf_api, cf_cli
+from .cf_cli import CommandFailedError
+
+_log = logging.getLogger(__name__) #pylint: disable=invalid-name
+
+
+class UpsiDeployer(object):
+    """Does the setup of a single user-provided service instance.
+
+    Attributes:
+        service (`apployer.appstack.UserProvidedService`): Service's configuration from the filled
+            expanded appstack.
+
+    Args:
+        service (`apployer.appstack.UserProvidedService`): See class attributes.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    @staticmethod
+    def _recreate_bindings(bindings):
+        """Recreates the given service bindings..
+
+        Args:
+            bindings (list[dict]): List of dictionaries representing a binding.
+                Binding has "metadata" and "entity" fields.
+        """
+        for binding in bindings:
+            service_guid = binding['entity']['service_instance_guid']
+            app_guid = binding['entity']['app_guid']
+            _log.debug('Rebinding %s to %s...', service_guid, app_guid)
+
+            cf_api.delete_service_binding(binding)
+            cf_api.create_service_binding(service_guid, app_guid)
+
+    def deploy(self):
+        """Sets up a user provided service. It will be created if it doesn't exist.
+        It will be updated if it exists and its credentials in the live environment are different
+        than in appstack.
+
+        Returns:
+            list[str]: List of applications (their guids) that need to be restarted because of the
+                update of this service. This list will be empty when there's nothing to restart.
+
+        Raises:
+            CommandFailedError: Failed to set up the service.
+        """
+        service_name = self.service.name
+        _log.info('Setting up user provided service %s...', service_name)
+        try:
+            service_guid = cf_cli.get_service_guid(service_name)
+            _log.info('User provided service %s has GUID %s.', service_name, service_guid)
+        except CommandFailedError as ex:
+            _log.debug(str(ex))
+            _log.info("Failed to get GUID of user provided service %s, assuming it doesn't exist "
+                      "yet. Gonna create it now...", service_name)
+            cf_cli.create_user_provided_service(service_name,
+                                                json.dumps(self. service.credentials))
+            _log.debug('Created user provided service %s.', service_name)
+            return []
+
+        return self._update(service_guid)
+
+    def _update(self, service_guid):
+        """Updates the service if it's different in the appstack and in the live environment.
+
+        Args:
+            service_guid (str): GUID of a service.
+
+        Returns:
+            list[str]: List of applications (their guids) that need to be restarted because of the
+                update of this service. This list will be empty when there's nothing to restart
+        """
+        service_name = self.service.name
+        appstack_credentials = self.service.credentials
+        live_credentials = cf_api.get_upsi_credentials(service_guid)
+
+        if is_upsi_update_needed(live_credentials, appstack_credentials):
+            _log.info('User provided service %s is different in the live environment and appstack. '
+                      'Will update it...', service_name)
+            _log.debug('Service credentials differences:\n%s',
+                       datadiff.diff(live_credentials, appstack_credentials,
+                                     fromfile='live env', tofile='appstack'))
+            cf_cli.update_user_provided_service(service_name, json.dumps(appstack_credentials))
+
+            service_bindings = cf_api.get_upsi_bindings(service_guid)
+            _log.info('Rebinding apps to service instance %s...', service_name)
+            self._recreate_bindings(service_bindings)
+
+            app_guids = [binding['entity']['app_guid'] for binding in service_bindings]
+            return app_guids
+        else:
+            _log.info('Service %s already exists and is up-to-date. No need to do anything...',
+                      service_name)
+            return []
+
+
+def is_upsi_update_needed(live_credentials, appstack_credentials):
+    """
+    Args:
+        live_credentials (dict): Credentials of a user-provided service in the live environment.
+        appstack_credentials (dict): Credentials of the service in the filled appstack.
+
+    Returns:
+        bool: True if the service needs to be updated.
+    """
+    return live_credentials != appstack_credentials
@@ -0,0 +1,204 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+End-to-end deployment benchmark. Deploys synthetic appstacks of different sizes to the fake CF
+(see fake_cf.py) and reports wall time, number of forked CF commands and the growth of peak RSS
+during the deployment. Each size is measured in a separate process, so peak RSS of one doesn't
+hide the other.
+
+Run from the repository's root directory:
+    python -m tests.benchmarks.bench_deploy
+    python -m tests.benchmarks.bench_deploy --sizes 50 --latency 0.01
+    python -m tests.benchmarks.bench_deploy --save-baselines
+
+Results are compared to the baselines stored in baselines.json. The benchmark fails if
+the number of CF commands grows or the time or memory grows above the tolerance. Baselines hold
+time relative to a reference measured on the same machine, so that they can be compared across
+machines: time relative to the reference run (forking trivial fake CF commands one after another).
+Memory is kept as the growth of peak RSS (in KB) during the deployment, which doesn't include
+the memory taken by the interpreter and the imported modules.
+"""
+
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from apployer.cf_cli import CfInfo
+from apployer.deployer import deploy_appstack, UPGRADE_STRATEGY
+from .harness import FakeCfEnvironment, make_synthetic_appstack
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_SIZES = '50,200,1000'
+# relative growth of time and memory that isn't considered a regression
+TOLERANCE = 0.25
+# growth of memory (in KB) that isn't considered a regression, even above the relative tolerance
+RSS_TOLERANCE_KB = 512
+# number of trivial fake CF commands forked in the reference run
+REFERENCE_COMMAND_COUNT = 50
+# measurements stored in the baselines, the others depend on the machine
+BASELINE_METRICS = ('forks', 'wall_time_ratio', 'deploy_rss_kb')
+
+
+def run_reference(latency):
+    """Times the reference run: trivial fake CF commands forked one after another. Deployment
+    spends most of its time running CF commands, so its time relative to the reference run
+    doesn't depend much on the speed of the machine.
+
+    Args:
+        latency (float): Latency of each fake CF command (in seconds).
+
+    Returns:
+        float: Time of the reference run (in seconds).
+    """
+    work_dir = tempfile.mkdtemp(prefix='apployer_bench_')
+    try:
+        with FakeCfEnvironment(work_dir).activated(latency), open(os.devnull, 'w') as devnull:
+            start_time = time.time()
+            for _ in range(REFERENCE_COMMAND_COUNT):
+                subprocess.check_call(['cf', 'target'], stdout=devnull)
+            return time.time() - start_time
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _get_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_single(app_count, latency):
+    """Runs the deployment of a synthetic appstack in a temporary directory.
+
+    Args:
+        app_count (int): Number of applications in the appstack.
+        latency (float): Latency of each fake CF command (in seconds).
+
+    Returns:
+        dict: Measurements.
+    """
+    reference_time = run_reference(latency)
+    work_dir = tempfile.mkdtemp(prefix='apployer_bench_')
+    old_cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        artifacts_path = os.path.join(work_dir, 'artifacts')
+        appstack = make_synthetic_appstack(app_count, artifacts_path)
+        fake_cf = FakeCfEnvironment(work_dir)
+        start_rss_kb = _get_rss_kb()
+        with fake_cf.activated(latency):
+            start_time = time.time()
+            deploy_appstack(CfInfo('https://api.example.com', 'password'), appstack,
+                            artifacts_path, False, UPGRADE_STRATEGY)
+            wall_time = time.time() - start_time
+        peak_rss_kb = _get_rss_kb()
+        return {
+            'wall_time': round(wall_time, 3),
+            'wall_time_ratio': round(wall_time / reference_time, 2),
+            'forks': fake_cf.get_command_count(),
+            'peak_rss_kb': peak_rss_kb,
+            'deploy_rss_kb': peak_rss_kb - start_rss_kb,
+        }
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(results, baselines):
+    """
+    Args:
+        results (dict[str,dict]): Measurements for each appstack size.
+        baselines (dict[str,dict]): Baseline measurements (see `BASELINE_METRICS`) for each
+            appstack size.
+
+    Returns:
+        list[str]: Descriptions of the regressions.
+    """
+    regressions = []
+    for size, result in sorted(results.items()):
+        baseline = baselines.get(size)
+        if not baseline:
+            continue
+        if result['forks'] > baseline['forks']:
+            regressions.append('{} apps: forks {} > {}'.format(
+                size, result['forks'], baseline['forks']))
+        if result['wall_time_ratio'] > baseline['wall_time_ratio'] * (1 + TOLERANCE):
+            regressions.append('{} apps: wall_time_ratio {} > {} (+{:.0%} tolerance)'.format(
+                size, result['wall_time_ratio'], baseline['wall_time_ratio'], TOLERANCE))
+        if result['deploy_rss_kb'] > \
+                baseline['deploy_rss_kb'] * (1 + TOLERANCE) + RSS_TOLERANCE_KB:
+            regressions.append('{} apps: deploy_rss_kb {} > {} (+{:.0%} +{} KB tolerance)'.format(
+                size, result['deploy_rss_kb'], baseline['deploy_rss_kb'], TOLERANCE,
+                RSS_TOLERANCE_KB))
+    return regressions
+
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True,
+              help='Comma-separated numbers of applications in the synthetic appstacks.')
+@click.option('--latency', default=0.0, show_default=True,
+              help='Latency (in seconds) of each fake CF command.')
+@click.option('--save-baselines', is_flag=True,
+              help='Save the results as new baselines.')
+@click.option('--single', type=int,
+              help='Run a single measurement in this process and print it as JSON.')
+def main(sizes, latency, save_baselines, single):
+    """Runs the deployment benchmark."""
+    if single:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_single(single, latency)))
+        return
+
+    results = {}
+    for size in sizes.split(','):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'tests.benchmarks.bench_deploy',
+             '--single', size, '--latency', str(latency)])
+        results[size] = json.loads(output.splitlines()[-1])
+        print('{:>6} apps: {wall_time:>9.2f} s (x{wall_time_ratio} reference) {forks:>7} forks '
+              '{peak_rss_kb:>9} KB peak RSS (+{deploy_rss_kb} KB during the deployment)'.format(
+                  size, **results[size]))
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as baselines_file:
+            baselines = json.load(baselines_file)
+
+    if save_baselines:
+        baselines.update((size, {metric: result[metric] for metric in BASELINE_METRICS})
+                         for size, result in results.items())
+        with open(BASELINES_PATH, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=2, sort_keys=True, separators=(',', ': '))
+            baselines_file.write('\n')
+        print('Baselines saved to {}'.format(BASELINES_PATH))
+        return
+
+    regressions = compare(results, baselines)
+    for regression in regressions:
+        print('REGRESSION: ' + regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
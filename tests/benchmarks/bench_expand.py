@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Scaling benchmark of sorting the appstack (dependency graph and deployment waves) done by
+"apployer expand". Run from the repository's root directory:
+    python -m tests.benchmarks.bench_expand
+    python -m tests.benchmarks.bench_expand --sizes 100,1000
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import click
+
+from apployer.app_graph import get_app_graph
+from apployer.appstack import AppConfig, AppStack, UserProvidedService
+from apployer.appstack_expand import _sort_appstack
+
+DEFAULT_SIZES = '100,1000,3000,10000'
+
+
+def make_synthetic_appstack(app_count, seed=0):
+    """Creates an appstack in which each application provides a service and requires up to three
+    services of the applications defined before it.
+
+    Args:
+        app_count (int): Number of applications.
+        seed (int): Seed for the random generator.
+
+    Returns:
+        `apployer.appstack.AppStack`: The appstack.
+    """
+    generator = random.Random(seed)
+    apps = []
+    for index in range(app_count):
+        required = generator.sample(range(index), generator.randint(0, min(index, 3)))
+        apps.append(AppConfig(
+            'app-{}'.format(index),
+            app_properties={'services': ['app-{}-service'.format(req) for req in required]},
+            user_provided_services=[UserProvidedService('app-{}-service'.format(index), {})]))
+    generator.shuffle(apps)
+    return AppStack(apps=apps)
+
+
+def _measure(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return time.time() - start_time, result
+
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True,
+              help='Comma-separated numbers of applications in the synthetic appstacks.')
+def main(sizes):
+    """Runs the appstack sorting benchmark."""
+    work_dir = tempfile.mkdtemp(prefix='apployer_bench_')
+    old_cwd = os.getcwd()
+    try:
+        # sorting dumps the graph to the working directory
+        os.chdir(work_dir)
+        for size in [int(size) for size in sizes.split(',')]:
+            appstack = make_synthetic_appstack(size)
+            waves_time, waves = _measure(lambda: get_app_graph(appstack).get_waves())
+            sort_time, _ = _measure(_sort_appstack, appstack)
+            print('{:>6} apps: {:>4} waves in {:>8.3f} s, whole sorting {:>8.3f} s'.format(
+                size, len(waves), waves_time, sort_time))
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
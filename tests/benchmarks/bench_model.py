@@ -0,0 +1,156 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Benchmark of the appstack model on a filled appstack carrying realistic blobs (base64 encoded
+keytabs and Hadoop configuration zips). Measures loading the appstack from a dictionary and
+dumping it back, and the time and the memory taken by merging manifests and sorting the appstack
+(done by "apployer expand"), compared with a single deep copy of the appstack. Each size is
+measured in a separate process, so peak RSS of one doesn't hide the other.
+
+Run from the repository's root directory:
+    python -m tests.benchmarks.bench_model
+    python -m tests.benchmarks.bench_model --sizes 100 --config-zip-kb 512
+"""
+
+import base64
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from apployer.appstack import AppConfig, AppStack, UserProvidedService
+from apployer.appstack_expand import _sort_appstack
+
+DEFAULT_SIZES = '50,200,1000'
+KEYTAB_KB = 2
+CONFIG_ZIP_KB = 128
+
+
+def _make_blob(size_kb, seed):
+    return base64.b64encode((str(seed) * size_kb * 1024)[:size_kb * 1024])
+
+
+def make_filled_appstack(app_count, keytab_kb=KEYTAB_KB, config_zip_kb=CONFIG_ZIP_KB):
+    """Creates an appstack filled like the one of a kerberized platform. Each application has its
+    own keytab and Hadoop configuration zip in the environment and provides a service carrying
+    them, too.
+
+    Args:
+        app_count (int): Number of applications.
+        keytab_kb (int): Size of each keytab (before base64 encoding) in kilobytes.
+        config_zip_kb (int): Size of each Hadoop configuration zip (before base64 encoding)
+            in kilobytes.
+
+    Returns:
+        tuple: The `apployer.appstack.AppStack` and the manifests of its artifacts
+            (dict[str,dict]).
+    """
+    apps = []
+    manifests = {}
+    for index in range(app_count):
+        name = 'app-{}'.format(index)
+        blobs = {'KRB5_KEYTAB': _make_blob(keytab_kb, index),
+                 'HADOOP_CONFIG_ZIP': _make_blob(config_zip_kb, index)}
+        apps.append(AppConfig(
+            name,
+            app_properties={'env': dict(blobs, VERSION='0.1.{}'.format(index)),
+                            'services': ['app-{}-service'.format(index - 1)] if index else []},
+            user_provided_services=[UserProvidedService('app-{}-service'.format(index), blobs)]))
+        manifests[name] = {'memory': '256M', 'env': {'SPRING_PROFILES_ACTIVE': 'cloud'}}
+    return AppStack(apps=apps), manifests
+
+
+def _measure(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return round(time.time() - start_time, 3), result
+
+
+def _get_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_single(app_count, config_zip_kb):
+    """Expands a filled appstack in a temporary directory (sorting dumps the graph there).
+
+    Args:
+        app_count (int): Number of applications in the appstack.
+        config_zip_kb (int): Size of each Hadoop configuration zip in kilobytes.
+
+    Returns:
+        dict: Measurements.
+    """
+    work_dir = tempfile.mkdtemp(prefix='apployer_bench_')
+    old_cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        appstack, manifests = make_filled_appstack(app_count, config_zip_kb=config_zip_kb)
+        dump_time, appstack_dict = _measure(appstack.to_dict)
+        load_time, appstack = _measure(AppStack.from_appstack_dict, appstack_dict)
+        start_rss_kb = _get_rss_kb()
+        merge_time, merged_appstack = _measure(appstack.merge_manifests, manifests)
+        sort_time, _ = _measure(_sort_appstack, merged_appstack)
+        expand_rss_kb = _get_rss_kb() - start_rss_kb
+        deep_copy_time, _ = _measure(appstack.copy)
+        return {
+            'load_time': load_time,
+            'dump_time': dump_time,
+            'merge_time': merge_time,
+            'sort_time': sort_time,
+            'expand_rss_kb': expand_rss_kb,
+            'deep_copy_time': deep_copy_time,
+            'deep_copy_rss_kb': _get_rss_kb() - start_rss_kb - expand_rss_kb,
+        }
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True,
+              help='Comma-separated numbers of applications in the filled appstacks.')
+@click.option('--config-zip-kb', default=CONFIG_ZIP_KB, show_default=True,
+              help='Size of Hadoop configuration zip of each application in kilobytes.')
+@click.option('--single', type=int,
+              help='Run a single measurement in this process and print it as JSON.')
+def main(sizes, config_zip_kb, single):
+    """Runs the appstack model benchmark."""
+    if single:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_single(single, config_zip_kb)))
+        return
+
+    for size in sizes.split(','):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'tests.benchmarks.bench_model',
+             '--single', size, '--config-zip-kb', str(config_zip_kb)])
+        result = json.loads(output.splitlines()[-1])
+        print('{:>6} apps: load {load_time:>7.3f} s, dump {dump_time:>7.3f} s; '
+              'merge {merge_time:>7.3f} s, sort {sort_time:>7.3f} s, +{expand_rss_kb:>8} KB RSS; '
+              'one deep copy {deep_copy_time:>7.3f} s, +{deep_copy_rss_kb:>8} KB RSS'
+              .format(size, **result))
+
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,348 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Fake, stateful CF CLI. It keeps a model of apps, user-provided services, service instances,
+brokers, buildpacks and security groups in a JSON file and answers the commands used by
+Apployer the way the real CLI would.
+
+Environment variables:
+    FAKE_CF_STATE - path of the state file (required).
+    FAKE_CF_LATENCY - latency (in seconds) added to each command. Either a number or a JSON
+        dictionary of command names to latencies, with an optional "default" key,
+        e.g. {"push": 0.5, "default": 0.01}.
+"""
+
+from cStringIO import StringIO
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import time
+import zipfile
+
+FAILED_EXIT_CODE = 1
+
+
+class CommandFailed(Exception):
+    pass
+
+
+def main(args):
+    command = args[0] if args else ''
+    _sleep(command)
+
+    state_path = os.environ['FAKE_CF_STATE']
+    with open(state_path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        state = _load_state(state_path)
+        state['calls'][command] = state['calls'].get(command, 0) + 1
+        try:
+            output = COMMANDS.get(command, _ok)(state, *args[1:])
+            exit_code = 0
+        except CommandFailed as ex:
+            output = 'FAILED\n{}'.format(ex)
+            exit_code = FAILED_EXIT_CODE
+        with open(state_path, 'w') as state_file:
+            json.dump(state, state_file)
+
+    if output:
+        sys.stdout.write(output + '\n')
+    return exit_code
+
+
+def _sleep(command):
+    latency = os.environ.get('FAKE_CF_LATENCY')
+    if not latency:
+        return
+    latency = json.loads(latency)
+    if isinstance(latency, dict):
+        latency = latency.get(command, latency.get('default', 0))
+    time.sleep(latency)
+
+
+def _load_state(state_path):
+    state = {'calls': {}, 'apps': {}, 'upsis': {}, 'instances': {}, 'brokers': {},
+             'buildpacks': [], 'security_groups': [], 'bindings': {}, 'resource_cache': []}
+    if os.path.exists(state_path) and os.path.getsize(state_path):
+        with open(state_path) as state_file:
+            state.update(json.load(state_file))
+    return state
+
+
+def _new_guid():
+    return os.urandom(16).encode('hex')
+
+
+def _ok(state, *args): # pylint: disable=unused-argument
+    return 'OK'
+
+
+def _push(state, *args):
+    # imported here, because importing it takes longer than all the other commands
+    import yaml
+
+    manifest_path = args[list(args).index('-f') + 1]
+    with open(manifest_path) as manifest_file:
+        manifest = yaml.safe_load(manifest_file)
+    for app in manifest['applications']:
+        live_app = state['apps'].setdefault(app['name'], {'guid': _new_guid()})
+        live_app['env'] = app.get('env', {})
+        live_app['state'] = 'STOPPED' if '--no-start' in args else 'STARTED'
+        live_app['package_state'] = 'STAGED'
+        # Cloud Controller caches the pushed files
+        app_path = args[list(args).index('-p') + 1]
+        with zipfile.ZipFile(app_path) as app_zip:
+            for file_name in app_zip.namelist():
+                _cache_resource(state, app_zip.read(file_name))
+        for service_name in app.get('services', []):
+            service = state['upsis'].get(service_name) or state['instances'].get(service_name)
+            if service is None:
+                raise CommandFailed('Could not find service {} to bind to {}'
+                                    .format(service_name, app['name']))
+            state['bindings'].setdefault(service['guid'], [])
+            if live_app['guid'] not in state['bindings'][service['guid']]:
+                state['bindings'][service['guid']].append(live_app['guid'])
+    return 'OK'
+
+
+def _cache_resource(state, content):
+    resource_key = '{}:{}'.format(hashlib.sha1(content).hexdigest(), len(content))
+    if resource_key not in state['resource_cache']:
+        state['resource_cache'].append(resource_key)
+
+
+def _get_app(state, app_name):
+    try:
+        return state['apps'][app_name]
+    except KeyError:
+        raise CommandFailed("App {} not found".format(app_name))
+
+
+def _env(state, app_name):
+    app = _get_app(state, app_name)
+    lines = ['Getting env variables for app {}...'.format(app_name), 'OK', '',
+             'User-Provided:']
+    lines.extend('{}: {}'.format(key, value) for key, value in sorted(app['env'].items()))
+    return '\n'.join(lines)
+
+
+def _app(state, *args):
+    app_name = args[-1]
+    app = _get_app(state, app_name)
+    if '--guid' in args:
+        return app['guid']
+    return 'Showing health and status for app {}...'.format(app_name)
+
+
+def _space(state, *args): # pylint: disable=unused-argument
+    if '--guid' in args:
+        return 'fake-space-guid'
+    return 'Getting info of space {}...'.format(args[-1])
+
+
+def _restart(state, app_name):
+    _get_app(state, app_name)['state'] = 'STARTED'
+    return 'OK'
+
+
+def _service(state, *args):
+    service_name = args[-1]
+    service = state['upsis'].get(service_name) or state['instances'].get(service_name)
+    if service is None:
+        raise CommandFailed('Service instance {} not found'.format(service_name))
+    if '--guid' in args:
+        return service['guid']
+    return 'Service instance: {}'.format(service_name)
+
+
+def _create_upsi(state, service_name, _, credentials):
+    if service_name in state['upsis']:
+        raise CommandFailed('Service instance {} already exists'.format(service_name))
+    state['upsis'][service_name] = {'guid': _new_guid(), 'credentials': json.loads(credentials)}
+    return 'OK'
+
+
+def _update_upsi(state, service_name, _, credentials):
+    if service_name not in state['upsis']:
+        raise CommandFailed('Service instance {} not found'.format(service_name))
+    state['upsis'][service_name]['credentials'] = json.loads(credentials)
+    return 'OK'
+
+
+def _create_service(state, broker, plan, instance_name):
+    if instance_name not in state['instances']:
+        state['instances'][instance_name] = {'guid': _new_guid(), 'broker': broker, 'plan': plan}
+    return 'OK'
+
+
+def _service_brokers(state):
+    lines = ['Getting service brokers as admin...', '', 'name   url']
+    lines.extend('{} {}'.format(name, url) for name, url in sorted(state['brokers'].items()))
+    return '\n'.join(lines)
+
+
+def _create_service_broker(state, name, _, __, url):
+    if name in state['brokers']:
+        raise CommandFailed('Service broker {} already exists'.format(name))
+    state['brokers'][name] = url
+    return 'OK'
+
+
+def _update_service_broker(state, name, _, __, url):
+    if name not in state['brokers']:
+        raise CommandFailed('Service broker {} not found'.format(name))
+    state['brokers'][name] = url
+    return 'OK'
+
+
+def _buildpacks(state):
+    lines = ['Getting buildpacks...', '', 'buildpack position enabled locked filename']
+    lines.extend('{name} {position} true false {filename}'.format(**buildpack)
+                 for buildpack in state['buildpacks'])
+    return '\n'.join(lines)
+
+
+def _create_buildpack(state, name, buildpack_path, position, *_):
+    state['buildpacks'].insert(int(position) - 1, {
+        'name': name, 'filename': os.path.basename(buildpack_path)})
+    for index, buildpack in enumerate(state['buildpacks']):
+        buildpack['position'] = index + 1
+    return 'OK'
+
+
+def _update_buildpack(state, name, _, buildpack_path):
+    buildpack = next(bp for bp in state['buildpacks'] if bp['name'] == name)
+    buildpack['filename'] = os.path.basename(buildpack_path)
+    return 'OK'
+
+
+def _create_security_group(state, name, _):
+    if name not in state['security_groups']:
+        state['security_groups'].append(name)
+    return 'OK'
+
+
+def _get_request_body(options):
+    if '-d' not in options:
+        return None
+    data = options[list(options).index('-d') + 1]
+    if data.startswith('@'):
+        with open(data[1:], 'rb') as data_file:
+            return data_file.read()
+    return data
+
+
+def _upload_bits(state, app, options):
+    """Handles multipart upload of application's bits, caching the uploaded files."""
+    content_type = options[list(options).index('-H') + 1]
+    boundary = content_type.split('boundary=')[1]
+    for part in _get_request_body(options).split('--' + boundary):
+        headers, _, content = part.partition('\r\n\r\n')
+        if 'name="resources"' in headers:
+            cached_resources = json.loads(content[:-2])
+        elif 'name="application"' in headers:
+            uploaded_zip = zipfile.ZipFile(StringIO(content[:-2]))
+    for resource in cached_resources:
+        if '{sha1}:{size}'.format(**resource) not in state['resource_cache']:
+            raise CommandFailed('Resource {} is not cached'.format(resource['fn']))
+    app['uploaded_files'] = uploaded_zip.namelist()
+    for file_name in uploaded_zip.namelist():
+        _cache_resource(state, uploaded_zip.read(file_name))
+    app['package_state'] = 'PENDING'
+
+
+def _curl(state, api_path, *options):
+    parts = api_path.strip('/').split('/')
+    if parts[1] == 'resource_match':
+        return json.dumps([resource for resource in json.loads(_get_request_body(options))
+                           if '{sha1}:{size}'.format(**resource) in state['resource_cache']])
+    if parts[1] == 'user_provided_service_instances':
+        upsi = next((upsi for upsi in state['upsis'].values() if upsi['guid'] == parts[2]), None)
+        if upsi is not None and len(parts) == 3:
+            return json.dumps({'metadata': {'guid': upsi['guid']},
+                               'entity': {'credentials': upsi['credentials']}})
+        if upsi is not None and parts[3] == 'service_bindings':
+            return json.dumps({'resources': [
+                {'metadata': {'url': '/v2/service_bindings/{}'.format(_new_guid())},
+                 'entity': {'service_instance_guid': upsi['guid'], 'app_guid': app_guid}}
+                for app_guid in state['bindings'].get(upsi['guid'], [])]})
+    elif parts[1] == 'apps':
+        for app_name, app in state['apps'].items():
+            if app['guid'] != parts[2]:
+                continue
+            if len(parts) == 3 and 'PUT' in options:
+                update = json.loads(_get_request_body(options))
+                app['env'] = update.get('environment_json', app['env'])
+                if update.get('state') == 'STARTED' and app['state'] != 'STARTED':
+                    # staging takes a while, the app will be running on the next poll
+                    app['state'] = 'STARTED'
+                    app['package_state'] = 'PENDING'
+            elif len(parts) == 4 and parts[3] == 'bits':
+                _upload_bits(state, app, options)
+            elif len(parts) == 4 and parts[3] == 'restage':
+                app['state'] = 'STARTED'
+                app['package_state'] = 'STAGED'
+                app['restages'] = app.get('restages', 0) + 1
+            elif len(parts) == 4 and parts[3] == 'instances':
+                return json.dumps({'0': {'state': 'RUNNING' if app['state'] == 'STARTED'
+                                                  else 'DOWN'}})
+            return json.dumps({'metadata': {'guid': app['guid']},
+                               'entity': {'name': app_name, 'environment_json': app['env'],
+                                          'state': app['state'],
+                                          'package_state': app.get('package_state', 'STAGED')}})
+    elif parts[1] == 'spaces' and parts[3] == 'summary':
+        apps = []
+        for app_name, app in sorted(state['apps'].items()):
+            is_running = app['state'] == 'STARTED' and app.get('package_state') == 'STAGED'
+            apps.append({'guid': app['guid'], 'name': app_name, 'state': app['state'],
+                         'package_state': app.get('package_state', 'STAGED'),
+                         'running_instances': 1 if is_running else 0})
+            if app.get('package_state') == 'PENDING':
+                app['package_state'] = 'STAGED'
+        return json.dumps({'guid': parts[2], 'apps': apps})
+    elif parts[1] == 'service_bindings':
+        # bindings are tracked per service and app, creating and deleting them changes nothing
+        return '' if 'DELETE' in options else json.dumps({'metadata': {}})
+    return json.dumps({'error_code': 'CF-NotFound', 'description': 'Unknown path ' + api_path})
+
+
+COMMANDS = {
+    'push': _push,
+    'env': _env,
+    'app': _app,
+    'space': _space,
+    'restart': _restart,
+    'restage': _restart,
+    'service': _service,
+    'create-user-provided-service': _create_upsi,
+    'update-user-provided-service': _update_upsi,
+    'create-service': _create_service,
+    'service-brokers': _service_brokers,
+    'create-service-broker': _create_service_broker,
+    'update-service-broker': _update_service_broker,
+    'buildpacks': _buildpacks,
+    'create-buildpack': _create_buildpack,
+    'update-buildpack': _update_buildpack,
+    'create-security-group': _create_security_group,
+    'oauth-token': lambda state: 'bearer fake-token',
+    'curl': _curl,
+}
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,141 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Running Apployer's deployment against a fake, stateful "cf" executable (see fake_cf.py).
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import stat
+import sys
+import zipfile
+
+from apployer.appstack import (AppConfig, AppStack, BrokerConfig, SecurityGroup,
+                               ServiceInstance, UserProvidedService)
+
+FAKE_CF_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_cf.py')
+FAKE_BUILDPACK = 'fake-buildpack'
+
+
+class FakeCfEnvironment(object):
+    """Environment in which "cf" is the fake CF CLI.
+
+    Attributes:
+        work_dir (str): Directory with the fake "cf" executable and its state file.
+        state_path (str): Path to the state file of the fake CF.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.state_path = os.path.join(work_dir, 'fake_cf_state.json')
+
+    @contextmanager
+    def activated(self, latency=None):
+        """Context in which the fake "cf" is first on PATH.
+
+        Args:
+            latency (float or dict): Latency of the fake CF commands. See fake_cf.py.
+        """
+        bin_dir = os.path.join(self.work_dir, 'bin')
+        if not os.path.exists(bin_dir):
+            os.makedirs(bin_dir)
+        cf_path = os.path.join(bin_dir, 'cf')
+        with open(cf_path, 'w') as cf_file:
+            cf_file.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, FAKE_CF_SCRIPT))
+        os.chmod(cf_path, os.stat(cf_path).st_mode | stat.S_IEXEC)
+
+        old_environ = dict(os.environ)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        os.environ['FAKE_CF_STATE'] = self.state_path
+        if latency is not None:
+            os.environ['FAKE_CF_LATENCY'] = json.dumps(latency)
+        try:
+            yield self
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+
+    def get_state(self):
+        """
+        Returns:
+            dict: State of the fake CF.
+        """
+        if not os.path.exists(self.state_path):
+            return {'calls': {}}
+        with open(self.state_path) as state_file:
+            return json.load(state_file)
+
+    def get_command_count(self):
+        """
+        Returns:
+            int: Number of CF commands (i.e. process forks) done so far.
+        """
+        return sum(self.get_state()['calls'].values())
+
+
+def make_synthetic_appstack(app_count, artifacts_path):
+    """Creates an appstack resembling TAP's one and artifacts for its applications.
+    Every fifth application provides a user-provided service (bound to the next applications)
+    and every tenth one has a broker with a service instance.
+
+    Args:
+        app_count (int): Number of applications.
+        artifacts_path (str): Directory in which the artifacts will be created.
+
+    Returns:
+        `apployer.appstack.AppStack`: The appstack.
+    """
+    if not os.path.exists(artifacts_path):
+        os.makedirs(artifacts_path)
+    _make_zip(os.path.join(artifacts_path, FAKE_BUILDPACK + '-v1.zip'))
+
+    apps = []
+    last_upsi_name = 'global-upsi-0'
+    for index in range(app_count):
+        name = 'app-{:05d}'.format(index)
+        _make_zip(os.path.join(artifacts_path, name + '.zip'))
+        app_properties = {
+            'name': name,
+            'memory': '256M',
+            'env': {'VERSION': '1.0.{}'.format(index), 'SOME_SETTING': 'value-{}'.format(index)},
+            'services': [last_upsi_name],
+        }
+        app = AppConfig(name, app_properties=app_properties)
+        if index % 5 == 0:
+            last_upsi_name = name + '-upsi'
+            app.user_provided_services = [
+                UserProvidedService(last_upsi_name, {'url': 'http://{}.example.com'.format(name)})]
+        if index % 10 == 0:
+            app.broker_config = BrokerConfig(
+                name + '-broker', 'http://{}.example.com'.format(name), 'user', 'pass',
+                service_instances=[ServiceInstance(name + '-instance', 'free')])
+        apps.append(app)
+
+    return AppStack(
+        apps=apps,
+        user_provided_services=[UserProvidedService('global-upsi-{}'.format(index),
+                                                    {'key': 'value-{}'.format(index)})
+                                for index in range(2)],
+        buildpacks=[FAKE_BUILDPACK],
+        domain='example.com',
+        security_groups=[SecurityGroup('fake-security-group', 'tcp', '10.0.0.0/8', '1-65535')])
+
+
+def _make_zip(zip_path):
+    with zipfile.ZipFile(zip_path, mode='w') as zip_file:
+        zip_file.writestr('app.jar', 'x' * 1024)
@@ -0,0 +1,74 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from multiprocessing.pool import ThreadPool
+
+from mock import MagicMock
+import pytest
+
+from apployer.fetcher.cm_client import ClouderaManagerClient
+
+CM_API_URL = 'http://cm.example.com:7180/api/v10'
+CLUSTER_PATH = '/clusters/Cluster%201/services'
+
+RESPONSES = {
+    '/clusters': '{"items": [{"name": "Cluster 1"}]}',
+    CLUSTER_PATH + '/HDFS/roles': '{"items": [{"name": "HDFS-NAMENODE", "hostRef": {"hostId": "host-1"}},'
+                                  '{"name": "HDFS-DATANODE", "hostRef": {"hostId": "host-2"}}]}',
+    CLUSTER_PATH + '/SENTRY/config': '{"items": [{"name": "sentry_service_server_rpc_port", "value": "8038"},'
+                                     '{"name": "sentry_server_config_safety_valve"}]}',
+    CLUSTER_PATH + '/SQOOP_CLIENT/roleConfigGroups/SQOOP_CLIENT-GATEWAY-BASE/config':
+        '{"items": [{"name": "sqoop_client_java_heapsize", "value": "1024"}]}',
+    '/hosts/host-1': '{"hostId": "host-1", "hostname": "namenode.example.com"}',
+}
+
+
+@pytest.fixture
+def execute_command():
+    def get_response(command):
+        assert command.startswith('curl -X GET ' + CM_API_URL)
+        assert command.endswith(' -u admin:pass')
+        return RESPONSES[command.split()[3][len(CM_API_URL):]]
+    return MagicMock(side_effect=get_response)
+
+
+@pytest.fixture
+def cm_client(execute_command):
+    return ClouderaManagerClient(execute_command, 'cm.example.com', 7180, 'admin', 'pass')
+
+
+def test_get_role_hostname(cm_client, execute_command):
+    pool = ThreadPool(4)
+    try:
+        hostnames = pool.map(lambda _: cm_client.get_role_hostname('HDFS', 'HDFS-NAMENODE'), range(8))
+    finally:
+        pool.close()
+
+    assert hostnames == ['namenode.example.com'] * 8
+    # each resource is read once
+    assert execute_command.call_count == 3
+    with pytest.raises(KeyError):
+        cm_client.get_role_hostname('HDFS', 'HDFS-BALANCER')
+
+
+def test_get_config(cm_client, execute_command):
+    assert cm_client.get_service_config('SENTRY') == {'sentry_service_server_rpc_port': '8038',
+                                                      'sentry_server_config_safety_valve': None}
+    assert cm_client.get_role_config_group_config('SQOOP_CLIENT', 'SQOOP_CLIENT-GATEWAY-BASE') == \
+        {'sqoop_client_java_heapsize': '1024'}
+    assert cm_client.get_cluster_name() == 'Cluster 1'
+    assert execute_command.call_count == 3
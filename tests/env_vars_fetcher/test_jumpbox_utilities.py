@@ -14,9 +14,15 @@
 # limitations under the License.
 #
 
+import json
+import socket
+import subprocess
+import sys
+
 import pytest
 import ConfigParser
-from apployer.fetcher.jumpbox_utilities import ConfigurationExtractor
+from apployer.fetcher.jumpbox_utilities import ConfigurationExtractor, PORT_CHECKER_SCRIPT_PATH
+import mock
 from mock import MagicMock
 
 
@@ -101,6 +107,119 @@ def test_get_deployment_configuration(fetcher_config, monkeypatch):
         assert get_data_from_defaults_cdh_mock.called
 
 
+def test_get_deployment_configuration_only_needed_variables(fetcher_config, monkeypatch):
+    cm_api_url = 'http://cdh-master-2.node.trustedanalytics.consul:7180/api/v10'
+    command_outputs = {
+        'sudo -i cat /root/cf.yml': 'properties: {domain: example.com, login: {smtp: {port: 25}}}',
+        'curl -X GET {}/clusters -u admin:admin'.format(cm_api_url): '{"items": [{"name": "CDH-cluster"}]}',
+        'curl -X GET {}/clusters/CDH-cluster/services/HDFS/roles -u admin:admin'.format(cm_api_url):
+            '{"items": [{"name": "HDFS-NAMENODE", "hostRef": {"hostId": "host-1"}}]}',
+        'curl -X GET {}/clusters/CDH-cluster/services/HUE/roles -u admin:admin'.format(cm_api_url):
+            '{"items": [{"name": "HUE-HUE_SERVER", "hostRef": {"hostId": "host-2"}}]}',
+        'curl -X GET {}/hosts/host-1 -u admin:admin'.format(cm_api_url): '{"hostname": "namenode.example.com"}',
+        'curl -X GET {}/hosts/host-2 -u admin:admin'.format(cm_api_url): '{"hostname": "hue.example.com"}',
+    }
+    execute_command_mock = MagicMock(side_effect=lambda command: command_outputs[command])
+    monkeypatch.setattr('apployer.fetcher.jumpbox_utilities.ConfigurationExtractor.execute_command',
+                        execute_command_mock)
+    fetcher_config['kerberos_used'] = False
+
+    with ConfigurationExtractor(fetcher_config) as ce:
+        result = ce.get_deployment_configuration(
+            {'apps_domain', 'smtp_protocol', 'namenode_internal_host', 'hue_node', 'cloudera_port',
+             'kerberos_host', 'unknown_variable'})
+
+    assert result == {
+        'apps_domain': 'example.com',
+        'smtp_protocol': 'smtp',
+        'namenode_internal_host': 'namenode.example.com',
+        'hue_node': 'hue.example.com',
+        'cloudera_port': 7180,
+    }
+    # each file and Cloudera Manager's resource is read once, nothing else is run
+    assert sorted(call[0][0] for call in execute_command_mock.call_args_list) == sorted(command_outputs)
+
+
+def test_check_ports(fetcher_config, monkeypatch, tmpdir):
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.bind(('127.0.0.1', 0))
+    listening_socket.listen(1)
+    open_port = listening_socket.getsockname()[1]
+    closed_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    closed_socket.bind(('127.0.0.1', 0))
+    closed_port = closed_socket.getsockname()[1]
+    script_path = tmpdir.join('check_ports.py').strpath
+
+    def generate_script(self, script, target):
+        assert target == PORT_CHECKER_SCRIPT_PATH
+        with open(script_path, 'w') as script_file:
+            script_file.write(script)
+
+    execute_command_mock = MagicMock(side_effect=lambda command: subprocess.check_output(
+        [sys.executable, script_path]))
+    monkeypatch.setattr('apployer.fetcher.jumpbox_utilities.ConfigurationExtractor._generate_script',
+                        generate_script)
+    monkeypatch.setattr('apployer.fetcher.jumpbox_utilities.ConfigurationExtractor.execute_command',
+                        execute_command_mock)
+    try:
+        with ConfigurationExtractor(fetcher_config) as ce:
+            statuses = ce._check_ports([('127.0.0.1', open_port), ('127.0.0.1', str(closed_port)),
+                                        ('nonexistent.invalid', 80)])
+    finally:
+        listening_socket.close()
+        closed_socket.close()
+
+    assert statuses == [True, False, False]
+    execute_command_mock.assert_called_once_with('sudo -i python ' + PORT_CHECKER_SCRIPT_PATH)
+
+
+def test_probed_services_checked_at_once(fetcher_config, monkeypatch):
+    check_ports_mock = MagicMock(return_value=[False, True])
+    monkeypatch.setattr('apployer.fetcher.jumpbox_utilities.ConfigurationExtractor._check_ports',
+                        check_ports_mock)
+    monkeypatch.setattr('apployer.fetcher.cm_client.ClouderaManagerClient.get_role_hostname',
+                        MagicMock(return_value='hue.example.com'))
+
+    with ConfigurationExtractor(fetcher_config) as ce:
+        result = ce.get_deployment_configuration({'external_tool_hue', 'external_tool_arcadia'})
+
+    assert result == {'external_tool_arcadia': False, 'external_tool_hue': True}
+    check_ports_mock.assert_called_once_with([('cdh-worker-0.node.trustedanalytics.consul', 80),
+                                              ('hue.example.com', 8888)])
+
+
+@pytest.fixture
+def local_extractor(fetcher_config):
+    fetcher_config['jumpbox']['hostname'] = 'localhost'
+    return ConfigurationExtractor(fetcher_config)
+
+
+def test_execute_payload_command(local_extractor):
+    # warnings aren't filtered out and even a marker in the output doesn't confuse framing
+    payload = local_extractor.execute_payload_command(
+        "echo 'Warning: not a warning'; printf 'first\\r\\nAPPLOYER_PAYLOAD 3\\n\\000second'")
+
+    assert payload == 'Warning: not a warning\nfirst\r\nAPPLOYER_PAYLOAD 3\n\x00second'
+
+
+def test_execute_payload_command_failed(local_extractor):
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        local_extractor.execute_payload_command('echo some output; echo some error >&2; exit 3')
+
+    assert exc_info.value.returncode == 3
+    assert exc_info.value.output == 'some error\n'
+
+
+def test_execute_payload_command_tty_required(local_extractor, monkeypatch):
+    execute_command_mock = MagicMock(return_value='payload\r\n')
+    monkeypatch.setattr(local_extractor, 'execute_command', execute_command_mock)
+    command = 'echo "sudo: sorry, you must have a tty to run sudo" >&2; exit 1'
+
+    assert local_extractor.execute_payload_command(command) == 'payload\r\n'
+    assert local_extractor.execute_payload_command('echo other') == 'payload\r\n'
+    assert execute_command_mock.call_args_list == [mock.call(command), mock.call('echo other')]
+
+
 def test_get_data_from_inventory(fetcher_config, monkeypatch):
     _execute_command_mock = MagicMock()
     yaml_mock = MagicMock()
@@ -22,7 +22,7 @@ from apployer.appstack import (AppConfig, AppStack, BrokerConfig,
 
 
 def _services_to_dicts(service_list):
-    return [service.__dict__ for service in service_list]
+    return [service.to_dict() for service in service_list]
 
 
 TEST_APP_X_APP_PROPERTIES = {
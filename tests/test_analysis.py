@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+
+from apployer.analysis import (analyze_appstack, estimate_makespan, format_analysis,
+                               get_app_durations, get_critical_path)
+from apployer.app_graph import AppGraph
+from apployer.appstack import AppConfig, AppStack
+from apployer.history import DeploymentHistory
+
+
+@pytest.fixture
+def appstack():
+    """Two chains: a <- b <- c and d <- e, with f independent."""
+    return AppStack(apps=[
+        AppConfig('a'),
+        AppConfig('d'),
+        AppConfig('f'),
+        AppConfig('b', after=['a']),
+        AppConfig('e', after=['d']),
+        AppConfig('c', after=['b']),
+    ])
+
+
+DURATIONS = {'a': 10.0, 'b': 10.0, 'c': 30.0, 'd': 5.0, 'e': 40.0, 'f': 20.0}
+
+
+def test_get_app_durations():
+    history = DeploymentHistory(None)
+    history.record('a', 'push', 30.0)
+    history.record('b', 'push', 30.0)
+    apps = [AppConfig(name) for name in 'abc']
+
+    durations = get_app_durations(apps, history, {'b': 5}, default_duration=60)
+
+    assert durations == {'a': 30.0, 'b': 5.0, 'c': 60.0}
+
+
+def test_get_critical_path(appstack):
+    app_graph = AppGraph(appstack.apps)
+    apps = {app.name: app for app in appstack.apps}
+    app_graph.add_dependency(apps['b'], apps['a'])
+    app_graph.add_dependency(apps['c'], apps['b'])
+    app_graph.add_dependency(apps['e'], apps['d'])
+
+    critical_path = get_critical_path(app_graph, DURATIONS)
+
+    assert [app.name for app in critical_path] == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('parallel, makespan', [
+    (1, 50.0),
+    # "a" is started first, otherwise the first wave would take 30 s
+    (2, 30.0),
+    (3, 30.0),
+])
+def test_estimate_makespan(parallel, makespan):
+    durations = {'a': 20.0, 'b': 10.0, 'c': 10.0, 'd': 10.0}
+    waves = [[AppConfig('b'), AppConfig('c'), AppConfig('a')], [AppConfig('d')]]
+
+    assert estimate_makespan(waves, durations, parallel) == makespan
+
+
+def test_analyze_appstack(appstack):
+    analysis = analyze_appstack(appstack, DURATIONS, parallel=3)
+
+    assert analysis.app_count == 6
+    assert analysis.wave_count == 3
+    assert analysis.total_duration == 115.0
+    assert analysis.critical_path == ['a', 'b', 'c']
+    assert analysis.critical_path_duration == 50.0
+    # waves: [a, d, f] - 20 s, [b, e] - 40 s, [c] - 30 s
+    assert analysis.makespan == 90.0
+    assert analysis.makespan_lower_bound == 50.0
+    # without its dependency, "b" would be deployed in the first wave and "c" together with "e"
+    assert analysis.limiting_apps == [('b', 30.0, ['a'], None), ('c', 20.0, ['b'], None),
+                                      ('e', 10.0, ['d'], None)]
+    assert 'depends on: a' in format_analysis(analysis, DURATIONS)
+
+
+def test_analyze_appstack_serial(appstack):
+    analysis = analyze_appstack(appstack, DURATIONS, parallel=1)
+
+    assert analysis.makespan == analysis.total_duration
+    assert analysis.limiting_apps == []
+
+
+def test_analyze_appstack_with_order():
+    appstack = AppStack(apps=[AppConfig('a'), AppConfig('b'), AppConfig('p', order=0),
+                              AppConfig('c')])
+    durations = {'a': 10.0, 'b': 10.0, 'p': 5.0, 'c': 30.0}
+
+    analysis = analyze_appstack(appstack, durations, parallel=3)
+
+    # "c" can't start before "p", and "p" before "a" and "b"
+    assert analysis.critical_path == ['a', 'p', 'c']
+    assert analysis.critical_path_duration == 45.0
+    assert analysis.makespan == 45.0
+    # without the pin, all apps would be deployed in a single wave
+    assert analysis.limiting_apps == [('p', 15.0, [], 0)]
+    assert 'pinned with order: 0' in format_analysis(analysis, durations)
@@ -14,9 +14,12 @@
 # limitations under the License.
 #
 
+import hashlib
+from zipfile import ZipFile, ZipInfo
+
 import pytest
 
-from apployer.app_file import get_artifact_name, get_file_path
+from apployer.app_file import copy_zip_files, get_artifact_name, get_file_path, get_zip_resources
 
 
 @pytest.mark.parametrize('zip_name, artifact_name', [
@@ -45,3 +48,35 @@ def test_get_file_path_not_found(tmpdir):
 
     with pytest.raises(IOError):
         get_file_path('some-nonexistint-file', test_dir.strpath)
+
+
+@pytest.fixture
+def app_zip(tmpdir):
+    zip_path = tmpdir.join('app.zip').strpath
+    with ZipFile(zip_path, 'w') as zip_file:
+        zip_file.writestr('lib/', '')
+        zip_file.writestr('lib/app.jar', 'some jar')
+        script_info = ZipInfo('run.sh')
+        script_info.external_attr = 0o755 << 16
+        zip_file.writestr(script_info, 'echo hello')
+    return zip_path
+
+
+def test_get_zip_resources(app_zip):
+    assert get_zip_resources(app_zip) == [
+        {'fn': 'lib/app.jar', 'size': 8, 'sha1': hashlib.sha1('some jar').hexdigest(),
+         'mode': '0600'},
+        {'fn': 'run.sh', 'size': 10, 'sha1': hashlib.sha1('echo hello').hexdigest(),
+         'mode': '0755'},
+    ]
+
+
+def test_copy_zip_files(app_zip, tmpdir):
+    target_path = tmpdir.join('subset.zip').strpath
+    with open(target_path, 'wb') as target_file:
+        copy_zip_files(app_zip, ['run.sh'], target_file)
+
+    with ZipFile(target_path) as subset_zip:
+        assert subset_zip.namelist() == ['run.sh']
+        assert subset_zip.read('run.sh') == 'echo hello'
+        assert subset_zip.getinfo('run.sh').external_attr == 0o755 << 16
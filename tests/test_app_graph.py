@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import random
+
+import networkx
+import pytest
+
+from apployer.app_graph import AppGraph, get_app_graph, get_deployment_waves
+from apployer.appstack import (AppConfig, AppStack, BrokerConfig, MalformedAppStackError,
+                               ServiceInstance, UserProvidedService)
+
+
+def _get_random_graph(app_count, seed):
+    generator = random.Random(seed)
+    apps = [AppConfig('app_{}'.format(index)) for index in range(app_count)]
+    app_graph = AppGraph(apps)
+    for index, app in enumerate(apps[1:], 1):
+        for required_index in generator.sample(range(index), generator.randint(0, min(index, 3))):
+            app_graph.add_dependency(app, apps[required_index])
+    return app_graph
+
+
+def _get_waves_by_removing_leaves(app_graph):
+    """Reference implementation - repeatedly removing the leaves of the graph."""
+    graph = networkx.DiGraph()
+    graph.add_nodes_from(app_graph.apps)
+    graph.add_edges_from(app_graph.get_edges())
+    waves = []
+    while graph:
+        leaves = [node for node, out_degree in graph.out_degree_iter() if out_degree == 0]
+        waves.append(leaves)
+        graph.remove_nodes_from(leaves)
+    return waves
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_get_waves_same_as_removing_leaves(seed):
+    app_graph = _get_random_graph(200, seed)
+
+    waves = app_graph.get_waves()
+
+    expected_waves = _get_waves_by_removing_leaves(app_graph)
+    assert [{app.name for app in wave} for wave in waves] == \
+        [{app.name for app in wave} for wave in expected_waves]
+    for wave in waves:
+        assert wave == sorted(wave, key=app_graph.apps.index)
+
+
+def test_get_waves():
+    app_a, app_b, app_c, app_d = [AppConfig(name) for name in 'abcd']
+    app_graph = AppGraph([app_a, app_b, app_c, app_d])
+    app_graph.add_dependency(app_a, app_b)
+    app_graph.add_dependency(app_a, app_c)
+    app_graph.add_dependency(app_c, app_d)
+    app_graph.add_dependency(app_a, app_b)
+
+    assert app_graph.get_waves() == [[app_b, app_d], [app_c], [app_a]]
+    assert app_graph.get_dependencies(app_a) == [app_b, app_c]
+
+
+def test_get_waves_cycle():
+    app_a, app_b = AppConfig('a'), AppConfig('b')
+    app_graph = AppGraph([app_a, app_b])
+    app_graph.add_dependency(app_a, app_b)
+    app_graph.add_dependency(app_b, app_a)
+
+    with pytest.raises(ValueError):
+        app_graph.get_waves()
+
+
+def test_get_closure():
+    app_a, app_b, app_c, app_d, app_e = [AppConfig(name) for name in 'abcde']
+    app_graph = AppGraph([app_a, app_b, app_c, app_d, app_e])
+    app_graph.add_dependency(app_a, app_b)
+    app_graph.add_dependency(app_b, app_c)
+    app_graph.add_dependency(app_d, app_b)
+
+    assert app_graph.get_closure([app_b]) == [app_b, app_c]
+    assert app_graph.get_closure([app_b], False, True) == [app_a, app_b, app_d]
+    assert app_graph.get_closure([app_b], True, True) == [app_a, app_b, app_c, app_d]
+    assert app_graph.get_closure([app_e, app_b], False, False) == [app_b, app_e]
+
+
+def test_get_app_graph():
+    app_a = AppConfig('a', app_properties={'services': ['b-upsi', 'global-upsi']})
+    app_b = AppConfig('b', app_properties={'services': ['c-instance']},
+                      user_provided_services=[UserProvidedService('b-upsi', {})])
+    app_c = AppConfig('c', broker_config=BrokerConfig(
+        'c-broker', 'http://c', 'user', 'pass', service_instances=[ServiceInstance('c-instance', 'free')]))
+    app_d = AppConfig('d', after=['a'])
+    appstack = AppStack(apps=[app_a, app_b, app_c, app_d],
+                        user_provided_services=[UserProvidedService('global-upsi', {})])
+
+    app_graph = get_app_graph(appstack)
+
+    assert app_graph.get_edges() == [(app_a, app_b), (app_b, app_c), (app_d, app_a)]
+
+
+def test_get_app_graph_undefined_service():
+    appstack = AppStack(apps=[AppConfig('a', app_properties={'services': ['nonexistent']})])
+
+    with pytest.raises(MalformedAppStackError):
+        get_app_graph(appstack)
+
+
+def test_get_deployment_waves():
+    app_a, app_b, app_c, app_d, app_e = [AppConfig(name) for name in 'abcde']
+    app_c.order = 2
+    app_c.is_ordered = True
+    app_graph = AppGraph([app_a, app_b, app_c, app_d, app_e])
+    app_graph.add_dependency(app_b, app_a)
+    app_graph.add_dependency(app_e, app_a)
+
+    waves = get_deployment_waves(app_graph, [app_a, app_b, app_c, app_d, app_e])
+
+    # "c" is a barrier, so the dependency of "e" on "a" is already satisfied
+    assert waves == [[app_a], [app_b], [app_c], [app_d, app_e]]
@@ -18,7 +18,9 @@ import copy
 
 import pytest
 
-from apployer.appstack import AppConfig, AppStack, DataContainer, MalformedAppStackError
+from apployer.appstack import (AppConfig, AppStack, BrokerConfig, DataContainer,
+                               MalformedAppStackError, PostAction, PushOptions, SecurityGroup,
+                               ServiceInstance, UserProvidedService)
 from .fake_appstack import (TEST_APP_X, TEST_APP_Y, TEST_APPSTACK_DICT,
                             TEST_APPSTACK_USER_PROVIDED_SERVICES, TEST_APPSTACK, TEST_APP_MANIFESTS,
                             TEST_APPSTACK_WITH_MANIFESTS, BUILDPACK_NAME, TEST_SECURITY_GROUP,
@@ -26,11 +28,62 @@ from .fake_appstack import (TEST_APP_X, TEST_APP_Y, TEST_APPSTACK_DICT,
 
 
 def test_data_container_eq():
-    a, b = DataContainer(), DataContainer()
+    a, b = PushOptions(), PushOptions()
     assert a == b
-    a.something = 'qwerty'
+    a.params = 'qwerty'
     assert a != b
     assert not a.__eq__('something-else')
+    assert DataContainer() == DataContainer()
+
+
+def test_data_container_slots():
+    app = AppConfig('app')
+    assert not hasattr(app, '__dict__')
+    with pytest.raises(AttributeError):
+        app.something = 'qwerty'
+
+
+@pytest.mark.parametrize('container_class, kwargs', [
+    (AppConfig, {'name': 'app', 'after': 'not-a-list'}),
+    (AppConfig, {'name': 'app', 'app_properties': ['not', 'a', 'dict']}),
+    (AppConfig, {'name': 'app', 'user_provided_services': [{'name': 'not-deserialized'}]}),
+    (BrokerConfig, {'name': 'broker', 'url': None, 'auth_username': 'user',
+                    'auth_password': 'pass'}),
+    (ServiceInstance, {'name': 'instance', 'plan': ['free']}),
+    (UserProvidedService, {'name': '', 'credentials': {}}),
+    (SecurityGroup, {'name': 'group', 'protocol': 'tcp', 'destination': None, 'ports': '80'}),
+    (PostAction, {'name': 'action', 'commands': 'echo not-a-list'}),
+])
+def test_data_container_validation(container_class, kwargs):
+    with pytest.raises(MalformedAppStackError):
+        container_class(**kwargs)
+
+
+def test_data_container_dict_round_trip():
+    app = AppConfig('app', app_properties={'env': {'A': 'a'}}, order=-1, push_if=False,
+                    push_options=PushOptions(post_command='echo done'),
+                    user_provided_services=[UserProvidedService('app-service', {'url': 'u'})],
+                    broker_config=BrokerConfig('broker', 'http://broker', 'user', 12345,
+                                               service_instances=[ServiceInstance('i', 'free')]))
+
+    app_dict = app.to_dict()
+
+    # empty fields are left out
+    assert 'push_if' not in app_dict and 'after' not in app_dict
+    assert 'is_ordered' not in app_dict
+    assert app_dict['push_options'] == {'post_command': 'echo done'}
+    assert AppConfig.from_dict(dict(app_dict, push_if=False)) == app
+
+
+def test_data_container_replace():
+    services = ['service-a']
+    app = AppConfig('app', app_properties={'services': services}, order=1)
+
+    new_app = app.replace(name='other-app')
+
+    assert new_app.name == 'other-app' and app.name == 'app'
+    assert new_app.is_ordered
+    assert new_app.app_properties is app.app_properties
 
 
 @pytest.mark.parametrize('appstack_properties, manifest, merged_app_properties', [
@@ -98,6 +151,20 @@ def test_merge_app_config_and_manifest(appstack_properties, manifest, merged_app
     assert merged_app_cfg == proper_merged_app_cfg
 
 
+def test_merge_manifest_doesnt_change_config():
+    env = {'KEYTAB': 'a-big-blob'}
+    upsis = [UserProvidedService('some-service', {'KEYTAB': 'a-big-blob'})]
+    app_config = AppConfig('app', app_properties={'env': env}, user_provided_services=upsis)
+
+    merged_app_cfg = app_config.merge_manifest({'env': {'OTHER': 'value'}, 'memory': '64M'})
+
+    assert app_config.app_properties == {'env': {'KEYTAB': 'a-big-blob'}}
+    assert merged_app_cfg.app_properties == {
+        'name': 'app', 'memory': '64M', 'env': {'KEYTAB': 'a-big-blob', 'OTHER': 'value'}}
+    # not changed, so shared instead of copied
+    assert merged_app_cfg.user_provided_services is upsis
+
+
 @pytest.mark.parametrize('config_kwargs', [
     {'name': ''},
     {'name': 'bla', 'order': 'not-a-number'}
@@ -131,3 +198,12 @@ def test_parse_appstack_nonexistent_registrator():
 def test_merge_manifests():
     expanded_appstack = TEST_APPSTACK.merge_manifests(TEST_APP_MANIFESTS)
     assert TEST_APPSTACK_WITH_MANIFESTS == expanded_appstack
+
+
+def test_merge_manifests_doesnt_change_appstack():
+    original_appstack = copy.deepcopy(TEST_APPSTACK)
+
+    expanded_appstack = TEST_APPSTACK.merge_manifests(TEST_APP_MANIFESTS)
+
+    assert TEST_APPSTACK == original_appstack
+    assert expanded_appstack.user_provided_services is TEST_APPSTACK.user_provided_services
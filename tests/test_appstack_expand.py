@@ -16,12 +16,19 @@
 
 import itertools
 import os
+import shutil
+import zipfile
 
+from mock import MagicMock
+import networkx
 import pytest
 import yaml
 
-from apployer.appstack import AppConfig, AppStack, UserProvidedService, BrokerConfig
-from apployer.appstack_expand import expand_appstack, _sort_appstack
+from apployer.appstack import (AppConfig, AppStack, UserProvidedService, BrokerConfig,
+                               MalformedAppStackError, ServiceInstance)
+from apployer import appstack_expand
+from apployer.appstack_expand import (expand_appstack, AppStackExpander, _sort_appstack,
+                                      _detect_cycles)
 from tests.utils import get_appstack_resource_dir
 
 app_a_upsi_name = 'app_a_upsi'
@@ -39,7 +46,7 @@ app_c = AppConfig(
 
 app_d_instance_name = 'app_d_broker_instance'
 broker_d = BrokerConfig('name', 'url', 'username', 'password',
-                        service_instances=[UserProvidedService(app_d_instance_name, {})])
+                        service_instances=[ServiceInstance(app_d_instance_name, 'free')])
 app_d = AppConfig(
         name='app_d',
         app_properties={'services': [app_a_upsi_name]},
@@ -86,6 +93,35 @@ def test_sort_unlinked_apps():
     assert apps == set(sorted_appstack.apps)
 
 
+def test_sort_appstack_with_cycle():
+    apps = [AppConfig('app_x', app_properties={'services': ['y_upsi']},
+                      user_provided_services=[UserProvidedService('x_upsi', {})]),
+            AppConfig('app_y', app_properties={'services': ['x_upsi']},
+                      user_provided_services=[UserProvidedService('y_upsi', {})]),
+            AppConfig('app_z', app_properties={'services': ['z_upsi']},
+                      user_provided_services=[UserProvidedService('z_upsi', {})])]
+
+    with pytest.raises(MalformedAppStackError) as ex:
+        _sort_appstack(AppStack(apps, [], []))
+
+    message = str(ex.value)
+    assert '[app_z]' in message
+    assert '[app_x, app_y]' in message or '[app_y, app_x]' in message
+
+
+def test_detect_cycles_dense_graph():
+    # complete graph has more simple cycles than could ever be enumerated
+    apps = [AppConfig('app_{}'.format(index)) for index in range(30)]
+    graph = networkx.DiGraph()
+    graph.add_edges_from((app_a, app_b) for app_a in apps for app_b in apps if app_a is not app_b)
+
+    with pytest.raises(MalformedAppStackError) as ex:
+        _detect_cycles(graph)
+
+    cycle_description = str(ex.value).split(': ', 1)[1]
+    assert cycle_description.count('app_') == 2
+
+
 def test_appstack_expander(tmpdir, artifacts_location):
     appstack_file_path = os.path.join(get_appstack_resource_dir(), 'appstack.yml')
     expanded_appstack_path = tmpdir.join('expanded_appstack.yml').strpath
@@ -114,3 +150,140 @@ def test_appstack_expander(tmpdir, artifacts_location):
 
 # TODO test for exceptions
 # TODO create broker object. some fields will be required
+
+
+def test_sort_appstack_with_after():
+    app_x = AppConfig('app_x', after=['app_y'])
+    app_y = AppConfig('app_y', after=['app_z'])
+    app_z = AppConfig('app_z')
+    app_w = AppConfig('app_w')
+
+    sorted_appstack = _sort_appstack(AppStack([app_x, app_y, app_z, app_w], [], []))
+
+    assert [app.name for app in sorted_appstack.apps] == ['app_z', 'app_w', 'app_y', 'app_x']
+
+
+def test_sort_appstack_with_after_undefined_app():
+    with pytest.raises(MalformedAppStackError):
+        _sort_appstack(AppStack([AppConfig('app_x', after=['app_y'])], [], []))
+
+
+def test_order_parameter_warning(monkeypatch):
+    mock_log = MagicMock()
+    monkeypatch.setattr('apployer.appstack_expand._log', mock_log)
+    apps = [AppConfig('app_{}'.format(index)) for index in range(4)]
+    apps.append(AppConfig('pinned', order=2))
+
+    _sort_appstack(AppStack(apps, [], []))
+
+    warning_args = mock_log.warning.call_args[0]
+    assert warning_args[1:] == ('pinned', 1, 3, 2)
+
+
+@pytest.fixture
+def appstack_expander(tmpdir, artifacts_location, monkeypatch):
+    monkeypatch.chdir(tmpdir.strpath)
+    appstack_file_path = tmpdir.join('appstack.yml').strpath
+    shutil.copy(os.path.join(get_appstack_resource_dir(), 'appstack.yml'), appstack_file_path)
+    expander = AppStackExpander(appstack_file_path, artifacts_location,
+                                tmpdir.join('expanded_appstack.yml').strpath)
+    assert expander.expand()
+    return expander
+
+
+def _edit_appstack(expander, edit_function):
+    with open(expander.appstack_file_path) as appstack_file:
+        appstack_dict = yaml.load(appstack_file)
+    edit_function({app['name']: app for app in appstack_dict['apps']})
+    with open(expander.appstack_file_path, 'w') as appstack_file:
+        yaml.dump(appstack_dict, appstack_file)
+
+
+def _load_expanded_apps(expander):
+    with open(expander.expanded_appstack_path) as expanded_appstack_file:
+        return AppStack.from_appstack_dict(yaml.load(expanded_appstack_file)).apps
+
+
+def test_expander_same_as_expand_appstack(appstack_expander, tmpdir, artifacts_location):
+    expanded_appstack_path = tmpdir.join('other_expanded_appstack.yml').strpath
+
+    expand_appstack(appstack_expander.appstack_file_path, artifacts_location,
+                    expanded_appstack_path)
+
+    with open(expanded_appstack_path) as expanded_appstack_file:
+        with open(appstack_expander.expanded_appstack_path) as expander_output_file:
+            assert expanded_appstack_file.read() == expander_output_file.read()
+
+
+def test_expander_nothing_changed(appstack_expander, monkeypatch):
+    mock_sort = MagicMock()
+    mock_get_manifest = MagicMock()
+    monkeypatch.setattr('apployer.appstack_expand._sort_appstack', mock_sort)
+    monkeypatch.setattr('apployer.appstack_expand._get_artifact_manifest', mock_get_manifest)
+
+    assert not appstack_expander.expand()
+    assert not mock_sort.called
+    assert not mock_get_manifest.called
+
+
+def test_expander_app_changed(appstack_expander, monkeypatch):
+    old_merged_apps = {name: merged_app[2]
+                       for name, merged_app in appstack_expander._cache.merged_apps.items()}
+    monkeypatch.setattr('apployer.appstack_expand._sort_appstack', MagicMock())
+    def edit_appstack(apps):
+        apps['B']['push_options']['post_command'] = 'echo changed'
+    _edit_appstack(appstack_expander, edit_appstack)
+
+    assert appstack_expander.expand()
+
+    new_merged_apps = {name: merged_app[2]
+                       for name, merged_app in appstack_expander._cache.merged_apps.items()}
+    assert [name for name in sorted(new_merged_apps)
+            if new_merged_apps[name] is not old_merged_apps[name]] == ['B']
+    assert not appstack_expand._sort_appstack.called
+    expanded_apps = _load_expanded_apps(appstack_expander)
+    assert [app.name for app in expanded_apps] == appstack_expander._cache.sorted_app_names
+    assert [app.push_options.post_command for app in expanded_apps if app.name == 'B'] == \
+        ['echo changed']
+
+
+def test_expander_dependencies_changed(appstack_expander):
+    def edit_appstack(apps):
+        apps['H']['after'] = ['I']
+    _edit_appstack(appstack_expander, edit_appstack)
+
+    assert appstack_expander.expand()
+
+    app_names = [app.name for app in _load_expanded_apps(appstack_expander)]
+    assert app_names.index('I') < app_names.index('H')
+
+
+def test_expander_artifact_changed(appstack_expander, artifacts_location):
+    zip_path = os.path.join(artifacts_location, 'A.zip')
+    with zipfile.ZipFile(zip_path, mode='w') as zip_file:
+        zip_file.writestr('manifest.yml', yaml.dump(
+            {'applications': [{'name': 'A', 'memory': '1G'}]}))
+
+    assert appstack_expander.expand()
+
+    assert [app.app_properties['memory'] for app in _load_expanded_apps(appstack_expander)
+            if app.name == 'A'] == ['1G']
+
+
+def test_expand_if_changed(appstack_expander, monkeypatch):
+    # the output is the same as from the first expansion
+    assert not appstack_expander.expand_if_changed()
+    monkeypatch.setattr(appstack_expander, 'expand', MagicMock())
+
+    assert not appstack_expander.expand_if_changed()
+    assert not appstack_expander.expand.called
+    os.utime(appstack_expander.appstack_file_path, (0, 0))
+    appstack_expander.expand_if_changed()
+    assert appstack_expander.expand.called
+
+
+def test_expand_if_changed_invalid_appstack(appstack_expander):
+    with open(appstack_expander.appstack_file_path, 'a') as appstack_file:
+        appstack_file.write('\n- name: [broken\n')
+
+    assert not appstack_expander.expand_if_changed()
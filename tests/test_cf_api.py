@@ -14,13 +14,17 @@
 # limitations under the License.
 #
 
+from cStringIO import StringIO
 import json
+import os
+from subprocess import CalledProcessError
+import zipfile
 
 from mock import MagicMock
 import mock
 import pytest
 
-from apployer import cf_api, cf_cli
+from apployer import cf_api, cf_cli, retry
 
 
 @mock.patch('subprocess.check_output')
@@ -220,3 +224,198 @@ def test_get_app_name(check_output_mock):
 
     assert cf_api.get_app_name(app_guid) == app_name
     check_output_mock.assert_called_with('cf curl /v2/apps/{}'.format(app_guid).split(' '))
+
+
+@mock.patch('subprocess.check_output')
+def test_get_app_env(check_output_mock):
+    check_output_mock.return_value = json.dumps({
+        'metadata': {'guid': 'some-fake-guid'},
+        'entity': {'name': 'some-fake-name', 'environment_json': {'VERSION': '1.0'}}})
+
+    assert cf_api.get_app_env('some-fake-guid') == {'VERSION': '1.0'}
+    check_output_mock.assert_called_with('cf curl /v2/apps/some-fake-guid'.split(' '))
+
+
+@mock.patch('subprocess.check_output')
+def test_update_app_env(check_output_mock):
+    sent_requests = []
+    def check_output(command):
+        with open(command[-1].lstrip('@')) as request_file:
+            sent_requests.append(json.load(request_file))
+        return '{"metadata": {}, "entity": {}}'
+    check_output_mock.side_effect = check_output
+
+    cf_api.update_app_env('some-fake-guid', {'SECRET': 'value'})
+
+    command = check_output_mock.call_args[0][0]
+    assert command[:-1] == ['cf', 'curl', '/v2/apps/some-fake-guid', '-X', 'PUT',
+                            '-H', 'Content-Type: application/json', '-d']
+    assert sent_requests == [{'environment_json': {'SECRET': 'value'}}]
+    # secrets don't stay on the disk
+    assert not os.path.exists(command[-1].lstrip('@'))
+
+
+@mock.patch('subprocess.check_output')
+def test_update_app_env_error(check_output_mock):
+    check_output_mock.return_value = '{"error_code": "CF-something", "description": "bad"}'
+
+    with pytest.raises(cf_cli.CommandFailedError):
+        cf_api.update_app_env('some-fake-guid', {})
+
+
+@mock.patch('subprocess.check_output')
+def test_match_resources(check_output_mock):
+    resources = [{'fn': 'a.jar', 'sha1': 'sha-a', 'size': 1, 'mode': '0644'},
+                 {'fn': 'b.jar', 'sha1': 'sha-b', 'size': 2, 'mode': '0644'}]
+    sent_requests = []
+    def check_output(command):
+        with open(command[-1].lstrip('@')) as request_file:
+            sent_requests.append(json.load(request_file))
+        return '[{"sha1": "sha-b", "size": 2}]'
+    check_output_mock.side_effect = check_output
+
+    assert cf_api.match_resources(resources) == [{'sha1': 'sha-b', 'size': 2}]
+    assert sent_requests == [[{'sha1': 'sha-a', 'size': 1}, {'sha1': 'sha-b', 'size': 2}]]
+    assert check_output_mock.call_args[0][0][2:4] == ['/v2/resource_match', '-X']
+
+
+@mock.patch('subprocess.check_output')
+def test_upload_app_bits(check_output_mock, tmpdir):
+    zip_path = tmpdir.join('app.zip').strpath
+    with zipfile.ZipFile(zip_path, 'w') as zip_file:
+        zip_file.writestr('cached.jar', 'cached')
+        zip_file.writestr('new.jar', 'new')
+    cached_resources = [{'fn': 'cached.jar', 'sha1': 'sha', 'size': 6, 'mode': '0644'}]
+    sent_requests = []
+    def check_output(command):
+        with open(command[-1].lstrip('@'), 'rb') as request_file:
+            sent_requests.append((command, request_file.read()))
+        return ''
+    check_output_mock.side_effect = check_output
+
+    cf_api.upload_app_bits('some-fake-guid', cached_resources, zip_path, ['new.jar'])
+
+    command, body = sent_requests[0]
+    assert command[2:6] == ['/v2/apps/some-fake-guid/bits', '-X', 'PUT', '-H']
+    boundary = command[6].split('boundary=')[1]
+    parts = body.split('--' + boundary)
+    assert parts[-1] == '--\r\n'
+    assert json.loads(parts[1].split('\r\n\r\n', 1)[1]) == cached_resources
+    uploaded_zip = parts[2].split('\r\n\r\n', 1)[1][:-2]
+    with zipfile.ZipFile(StringIO(uploaded_zip)) as zip_file:
+        assert zip_file.namelist() == ['new.jar']
+
+
+@mock.patch('subprocess.check_output')
+def test_upload_app_bits_error(check_output_mock, tmpdir):
+    zip_path = tmpdir.join('app.zip').strpath
+    zipfile.ZipFile(zip_path, 'w').close()
+    check_output_mock.return_value = '{"error_code": "CF-AppBitsUploadInvalid"}'
+
+    with pytest.raises(cf_cli.CommandFailedError):
+        cf_api.upload_app_bits('some-fake-guid', [], zip_path, [])
+
+
+@mock.patch('subprocess.check_output')
+def test_start_app(check_output_mock):
+    sent_requests = []
+    def check_output(command):
+        with open(command[-1].lstrip('@')) as request_file:
+            sent_requests.append(json.load(request_file))
+        return '{"metadata": {}, "entity": {}}'
+    check_output_mock.side_effect = check_output
+
+    cf_api.start_app('some-fake-guid')
+
+    assert check_output_mock.call_args[0][0][2:5] == ['/v2/apps/some-fake-guid', '-X', 'PUT']
+    assert sent_requests == [{'state': 'STARTED'}]
+
+
+@mock.patch('subprocess.check_output')
+def test_get_space_apps(check_output_mock):
+    apps = [{'guid': 'app-guid', 'name': 'app', 'running_instances': 1}]
+    check_output_mock.return_value = json.dumps({'guid': 'space-guid', 'apps': apps})
+
+    assert cf_api.get_space_apps('space-guid') == apps
+    check_output_mock.assert_called_with('cf curl /v2/spaces/space-guid/summary'.split(' '))
+
+
+@mock.patch('subprocess.check_output')
+def test_restage_app(check_output_mock):
+    check_output_mock.return_value = '{"metadata": {}, "entity": {}}'
+
+    cf_api.restage_app('some-fake-guid')
+
+    check_output_mock.assert_called_with(
+        'cf curl /v2/apps/some-fake-guid/restage -X POST'.split(' '))
+
+
+def _app_with_package_state(package_state):
+    return json.dumps({'entity': {'package_state': package_state}})
+
+
+@mock.patch('time.sleep')
+@mock.patch('subprocess.check_output')
+def test_wait_for_app_start(check_output_mock, sleep_mock):
+    check_output_mock.side_effect = [
+        _app_with_package_state('PENDING'),
+        _app_with_package_state('STAGED'),
+        '{"0": {"state": "STARTING"}}',
+        _app_with_package_state('STAGED'),
+        '{"0": {"state": "RUNNING"}}',
+    ]
+
+    cf_api.wait_for_app_start('some-fake-guid')
+
+    assert sleep_mock.call_count == 2
+
+
+@mock.patch('time.sleep')
+@mock.patch('subprocess.check_output')
+def test_wait_for_app_start_staging_failed(check_output_mock, _):
+    check_output_mock.return_value = _app_with_package_state('FAILED')
+
+    with pytest.raises(cf_cli.CommandFailedError):
+        cf_api.wait_for_app_start('some-fake-guid')
+
+
+@mock.patch('time.sleep')
+@mock.patch('subprocess.check_output')
+def test_wait_for_app_start_timeout(check_output_mock, _):
+    check_output_mock.return_value = _app_with_package_state('PENDING')
+
+    with pytest.raises(cf_cli.CommandFailedError):
+        cf_api.wait_for_app_start('some-fake-guid', timeout=-1)
+
+
+@mock.patch('time.sleep')
+@mock.patch('subprocess.check_output')
+def test_wait_for_app_start_retries_within_deadline(check_output_mock, _, monkeypatch):
+    monkeypatch.setattr('apployer.retry._policy', retry.RetryPolicy())
+    check_output_mock.side_effect = [
+        CalledProcessError(1, 'cf curl', output='FAILED\nServer error, status code: 502'),
+        _app_with_package_state('PENDING'),
+    ]
+
+    with pytest.raises(cf_cli.CommandFailedError) as ex:
+        cf_api.wait_for_app_start('some-fake-guid', timeout=-1)
+
+    assert "didn't start" in str(ex.value)
+    assert check_output_mock.call_count == 2
+    assert retry.get_policy().retry_counts == {'is_app_started': 1}
+
+
+def test_get_all_resources(monkeypatch):
+    pages = {
+        '/v2/buildpacks?results-per-page=100': {
+            'next_url': '/v2/buildpacks?page=2&results-per-page=100',
+            'resources': [{'entity': {'name': 'a'}}]},
+        '/v2/buildpacks?page=2&results-per-page=100': {
+            'next_url': None,
+            'resources': [{'entity': {'name': 'b'}}]},
+    }
+    monkeypatch.setattr('apployer.cf_api._cf_curl_get', lambda path: pages[path])
+
+    resources = cf_api.get_all_resources('/v2/buildpacks')
+
+    assert [resource['entity']['name'] for resource in resources] == ['a', 'b']
@@ -150,16 +150,17 @@ def test_login(mock_popen):
 
 
 def test_push_app(mock_popen):
-    app_location = '/some/app/path'
-    manifest_location = '/some/app/app_manifest.yml'
+    app_location = '/some/app/artifact.zip'
+    manifest_location = '/some/manifests/app.yml'
     timeout = 100
-    command = ['cf', 'push', '-t', str(timeout),
-               '-f', manifest_location, '--no-start', '--no-hostname']
+    command = ['cf', 'push', '-t', str(timeout), '-f', manifest_location, '-p', app_location,
+               '--no-start', '--no-hostname']
     mock_popen.set_command(' '.join(command))
 
     cf_cli.push(app_location, manifest_location, ' '.join(command[-2:]), timeout)
 
-    assert call.Popen(command, stdout=PIPE, stderr=STDOUT, cwd=app_location, shell=False) in mock_popen.mock.method_calls
+    assert call.Popen(command, stdout=PIPE, stderr=STDOUT, cwd='.', shell=False) \
+        in mock_popen.mock.method_calls
 
 
 def test_restage_app(mock_popen):
@@ -268,6 +269,23 @@ def test_get_service_guid(check_output_mock):
     check_output_mock.assert_called_with('cf service --guid {}'.format(service_name).split(' '))
 
 
+@mock.patch('subprocess.check_output')
+def test_get_app_guid(check_output_mock):
+    app_guid = '02a7f900-e8b8-4a8f-93b8-ecfd9f2a194a'
+    check_output_mock.return_value = app_guid + '\n'
+
+    assert cf_cli.get_app_guid('some-app') == app_guid
+    check_output_mock.assert_called_with('cf app --guid some-app'.split(' '))
+
+
+@mock.patch('subprocess.check_output')
+def test_get_space_guid(check_output_mock):
+    check_output_mock.return_value = 'some-space-guid\n'
+
+    assert cf_cli.get_space_guid('some-space') == 'some-space-guid'
+    check_output_mock.assert_called_with('cf space --guid some-space'.split(' '))
+
+
 def test_create_security_group(mock_popen):
     security_group_name = 'test_security_group'
     security_group_config_json_path = 'fake/json/path.json'
@@ -14,7 +14,6 @@
 # limitations under the License.
 #
 
-import json
 import os
 
 import mock
@@ -22,14 +21,13 @@ from mock import MagicMock
 import pytest
 import yaml
 
-from apployer import deployer
+from apployer import deployer, native_push, upsi
 from apployer.appstack import (AppStack, AppConfig, UserProvidedService, BrokerConfig, PushOptions,
-                               SecurityGroup, ServiceInstance)
+                               PostAction, SecurityGroup, ServiceInstance)
 from apployer.cf_cli import CommandFailedError, CfInfo, BuildpackDescription
 
 from .fake_cli_outputs import GET_ENV_SUCCESS
 from .utils import get_appstack_resource
-from .test_cf_api import SERVICE_BINDING
 
 
 @pytest.fixture
@@ -83,6 +81,8 @@ def test_app_deploy(app_deployer, mock_upsi_deployer, mock_setup_broker):
     artifacts_location = 'some/fake/location'
     is_dry_run = True
     is_push_needed = True
+    app_deployer._check_push_needed = MagicMock(return_value=is_push_needed)
+    app_deployer.native_pusher.is_env_update_enough = MagicMock(return_value=False)
     broker = BrokerConfig('name', 'url', 'user', 'pass')
     app_deployer.app.broker_config = broker
     apps_to_restart = ['some-fake-guid-1', 'some-fake-guid-2']
@@ -95,12 +95,26 @@ def test_app_deploy(app_deployer, mock_upsi_deployer, mock_setup_broker):
 
     assert app_deployer.deploy(artifacts_location, is_dry_run) == apps_to_restart
 
-    mock_push_app.assert_called_with(artifacts_location, is_push_needed)
+    app_deployer._check_push_needed.assert_called_with(deployer.UPGRADE_STRATEGY,
+                                                       artifacts_location)
+    mock_push_app.assert_called_with(artifacts_location, is_push_needed, True, False)
     mock_upsi_deployer.assert_called_with(app_deployer.app.user_provided_services[0])
     mock_setup_broker.assert_called_with(broker)
     mock_execute_post_command.assert_called_with(is_dry_run)
 
 
+def test_push_all_with_env_drift(app_deployer):
+    app_deployer._check_push_needed = MagicMock(return_value=True)
+    app_deployer.native_pusher.is_env_update_enough = MagicMock(return_value=True)
+    app_deployer.native_pusher.update_env = MagicMock()
+    app_deployer._push_app = MagicMock()
+
+    assert app_deployer.push('some/fake/location', deployer.PUSH_ALL_STRATEGY)
+
+    assert not app_deployer.native_pusher.update_env.called
+    app_deployer._push_app.assert_called_with('some/fake/location', True, True, False)
+
+
 def test_execute_post_command(app_deployer, mock_check_call):
     is_dry_run = False
     app_deployer._execute_post_command(is_dry_run)
@@ -123,15 +137,41 @@ def test_get_app_version_fail(app_deployer, mock_cf_cli):
 
 
 def test_prepare_app(artifacts_location, app_deployer):
-    prepared_app_path = app_deployer.prepare(artifacts_location)
+    filled_app_manifest_path = app_deployer.prepare(artifacts_location)
+
+    assert filled_app_manifest_path == os.path.join(
+        app_deployer.output_path, deployer.FINAL_MANIFESTS_FOLDER, app_deployer.app.name + '.yml')
+    with open(filled_app_manifest_path) as filled_manifest_file:
+        manifest_dict = yaml.load(filled_manifest_file)
+    expected_app_properties = dict(app_deployer.app.app_properties)
+    expected_app_properties['env'] = {
+        native_push.BASE_FINGERPRINT_ENV_VAR: app_deployer.native_pusher.get_fingerprint(
+            artifacts_location, include_env=False)}
+    assert manifest_dict == {'applications': [expected_app_properties]}
+    assert 'env' not in app_deployer.app.app_properties
+    # the artifact doesn't need to be unpacked
+    assert not os.path.exists(os.path.join(app_deployer.output_path, app_deployer.app.name))
+
+
+def test_prepare_app_with_fingerprints(artifacts_location, app_deployer):
+    filled_app_manifest_path = app_deployer.prepare(artifacts_location, include_fingerprints=True)
+    native_pusher = app_deployer.native_pusher
 
-    app_manifest_path = os.path.join(prepared_app_path, 'manifest.yml')
-    filled_app_manifest_path = os.path.join(prepared_app_path,
-                                            deployer.AppDeployer.FILLED_MANIFEST)
-    assert os.path.exists(app_manifest_path)
     with open(filled_app_manifest_path) as filled_manifest_file:
         manifest_dict = yaml.load(filled_manifest_file)
-    assert manifest_dict == {'applications': [app_deployer.app.app_properties]}
+    assert manifest_dict['applications'][0]['env'] == {
+        native_push.FINGERPRINT_ENV_VAR: native_pusher.get_fingerprint(artifacts_location),
+        native_push.BASE_FINGERPRINT_ENV_VAR: native_pusher.get_fingerprint(artifacts_location,
+                                                                            include_env=False),
+        native_push.CONFIG_FINGERPRINT_ENV_VAR: native_pusher.get_fingerprint(
+            artifacts_location, include_env=False, include_artifact=False)}
+
+
+def test_extract_app(artifacts_location, app_deployer):
+    unpacked_app_path = app_deployer.extract(artifacts_location)
+
+    assert unpacked_app_path == os.path.join(app_deployer.output_path, app_deployer.app.name)
+    assert os.path.exists(os.path.join(unpacked_app_path, 'manifest.yml'))
 
 
 def test_prepare_app_no_artifact(app_deployer):
@@ -150,14 +190,43 @@ def test_check_app_push_needed(live_version, appstack_version, strategy, push_ne
     app_deployer = deployer.AppDeployer(app, 'some-fake-path')
     app_deployer._get_app_version = lambda: live_version
 
-    assert app_deployer._check_push_needed(strategy) == push_needed
+    assert app_deployer._check_push_needed(strategy, 'some/fake/location') == push_needed
+
+
+@pytest.mark.parametrize('live_fingerprint, push_needed', [
+    ('current-fingerprint', False),
+    ('old-fingerprint', True),
+    (None, True),
+])
+def test_check_app_push_needed_fingerprint(mock_cf_cli, live_fingerprint, push_needed):
+    app_deployer = deployer.AppDeployer(AppConfig('bla'), 'some-fake-path')
+    app_deployer.native_pusher.get_fingerprint = MagicMock(return_value='current-fingerprint')
+    mock_cf_cli.env.return_value = GET_ENV_SUCCESS
+    if live_fingerprint:
+        mock_cf_cli.env.return_value += '{}: {}\n'.format(native_push.FINGERPRINT_ENV_VAR,
+                                                         live_fingerprint)
+
+    assert app_deployer._check_push_needed(deployer.FINGERPRINT_STRATEGY,
+                                           'some/fake/location') == push_needed
+    app_deployer.native_pusher.get_fingerprint.assert_called_once_with('some/fake/location')
+
+
+def test_get_live_env_value_no_app(mock_cf_cli):
+    app_deployer = deployer.AppDeployer(AppConfig('bla'), 'some-fake-path')
+    mock_cf_cli.env.side_effect = CommandFailedError
+
+    for _ in range(2):
+        with pytest.raises(CommandFailedError):
+            app_deployer._get_live_env_value('VERSION')
+    # the failure is remembered
+    mock_cf_cli.env.assert_called_once_with('bla')
 
 
 def test_check_app_push_needed_get_version_fail():
     app_deployer = deployer.AppDeployer(AppConfig('bla'), 'some-fake-path')
     app_deployer._get_app_version = MagicMock(side_effect=CommandFailedError)
 
-    assert app_deployer._check_push_needed(deployer.UPGRADE_STRATEGY)
+    assert app_deployer._check_push_needed(deployer.UPGRADE_STRATEGY, 'some/fake/location')
 
 
 @pytest.fixture
@@ -167,29 +236,45 @@ def mock_check_call(monkeypatch):
     return mock_check
 
 
-def test_push_app(app_deployer, mock_check_call, mock_cf_cli):
+def test_push_app(app_deployer, mock_check_call, mock_cf_cli, monkeypatch):
     # arrange
     artifacts_location = '/bla/release/apps'
     push_strategy = 'some-fake-strategy'
     post_commands = 'blabla bla'
-    prepared_app_path = '/bla/release/apps/tested_app'
-    app_manifest_location = os.path.join(prepared_app_path, deployer.AppDeployer.FILLED_MANIFEST)
+    artifact_path = '/bla/release/apps/tested_app-1.0.zip'
+    app_manifest_location = '/bla/apployer_out/manifests/tested_app.yml'
 
     mock_prepare = MagicMock()
     app_deployer._check_push_needed = lambda _: True
     app_deployer.prepare = mock_prepare
-    mock_prepare.return_value = prepared_app_path
+    mock_prepare.return_value = app_manifest_location
+    monkeypatch.setattr('apployer.app_file.get_artifact_path', lambda *_: artifact_path)
 
     # act
     app_deployer._push_app(artifacts_location, push_strategy)
 
     # assert
-    mock_prepare.assert_called_with(artifacts_location)
-    mock_cf_cli.push.assert_called_with(prepared_app_path, app_manifest_location,
-                                 app_deployer.app.push_options.params)
+    mock_prepare.assert_called_with(artifacts_location, False)
+    mock_cf_cli.push.assert_called_with(artifact_path, app_manifest_location,
+                                        app_deployer.app.push_options.params)
     mock_check_call.called_with(post_commands.split())
 
 
+def test_push_app_without_waiting(app_deployer, mock_cf_cli, monkeypatch):
+    mock_cf_api = MagicMock()
+    monkeypatch.setattr('apployer.deployer.cf_api', mock_cf_api)
+    monkeypatch.setattr('apployer.app_file.get_artifact_path', lambda *_: '/apps/B.zip')
+    app_deployer.prepare = MagicMock(return_value='/apployer_out/manifests/B.yml')
+    mock_cf_cli.get_app_guid.return_value = 'app-guid'
+
+    app_deployer._push_app('/apps', True, wait_for_start=False)
+
+    mock_cf_cli.push.assert_called_with('/apps/B.zip', '/apployer_out/manifests/B.yml',
+                                        '--some --options --no-start')
+    mock_cf_api.start_app.assert_called_with('app-guid')
+    assert app_deployer.staging_app_guid == 'app-guid'
+
+
 def test_push_app_not_needed(app_deployer, mock_cf_cli, monkeypatch):
     is_push_needed = False
     app_deployer._push_app('/bla/release/apps', is_push_needed)
@@ -264,34 +349,6 @@ def test_enable_broker_access_no_broker_service(broker, mock_cf_cli):
     mock_cf_cli.enable_service_access.assert_called_once_with(broker.name)
 
 
-@pytest.fixture
-def upsi_deployer():
-    upsi = UserProvidedService('some-name', {'a': 'b'})
-    return deployer.UpsiDeployer(upsi)
-
-
-def test_create_user_provided_service(mock_cf_cli, upsi_deployer):
-    mock_cf_cli.get_service_guid.side_effect = CommandFailedError
-
-    upsi_deployer.deploy()
-
-    mock_cf_cli.get_service_guid.assert_called_with(upsi_deployer.service.name)
-    mock_cf_cli.create_user_provided_service.assert_called_with(
-        upsi_deployer.service.name, json.dumps(upsi_deployer.service.credentials))
-
-
-def test_update_user_provided_service_needed(mock_cf_cli, upsi_deployer):
-    service_guid = 'some-fake-guid'
-    app_guids = ['some', 'fake', 'guids']
-    mock_cf_cli.get_service_guid.return_value = service_guid
-    mock_update = MagicMock(return_value=app_guids)
-    upsi_deployer._update = mock_update
-
-    assert upsi_deployer.deploy() == app_guids
-
-    mock_update.assert_called_with(service_guid)
-
-
 @pytest.fixture
 def mock_cf_api(monkeypatch):
     cf_api = MagicMock()
@@ -299,42 +356,6 @@ def mock_cf_api(monkeypatch):
     return cf_api
 
 
-def test_update_upsi(mock_cf_api, mock_cf_cli, upsi_deployer):
-    service_guid = 'some-fake-guid'
-    service_bindings = [SERVICE_BINDING]
-    mock_cf_api.get_upsi_bindings.return_value = service_bindings
-    mock_cf_api.get_upsi_credentials.return_value = {'something': 123}
-    upsi_deployer._recreate_bindings = MagicMock()
-
-    assert upsi_deployer._update(service_guid) == [SERVICE_BINDING['entity']['app_guid']]
-
-    mock_cf_api.get_upsi_credentials.assert_called_with(service_guid)
-    mock_cf_api.get_upsi_bindings.assert_called_with(service_guid)
-    mock_cf_cli.update_user_provided_service(
-        upsi_deployer.service.name, json.dumps(upsi_deployer.service.credentials))
-    upsi_deployer._recreate_bindings.assert_called_with(service_bindings)
-
-
-def test_update_upsi_not_needed(mock_cf_api, mock_cf_cli, upsi_deployer):
-    service_guid = 'some-fake-guid'
-    mock_cf_api.get_upsi_credentials.return_value = upsi_deployer.service.credentials
-
-    assert upsi_deployer._update(service_guid) == []
-
-    mock_cf_api.get_upsi_credentials.assert_called_with(service_guid)
-    assert not mock_cf_api.get_upsi_bindings.call_args_list
-    assert not mock_cf_cli.update_user_provided_service.call_args_list
-
-
-def test_rebind_services(mock_cf_api, upsi_deployer):
-    upsi_deployer._recreate_bindings([SERVICE_BINDING])
-
-    mock_cf_api.delete_service_binding.assert_called_with(SERVICE_BINDING)
-    mock_cf_api.create_service_binding.assert_called_with(
-        SERVICE_BINDING['entity']['service_instance_guid'],
-        SERVICE_BINDING['entity']['app_guid'])
-
-
 def test_setup_service_instance(broker, mock_cf_cli):
     mock_cf_cli.service.side_effect = CommandFailedError
     service = broker.service_instances[0]
@@ -409,7 +430,7 @@ def test_setup_existing_buildpack(monkeypatch, mock_get_file_path):
     deployer.setup_buildpack('some-buildpack-name', 'release/tools')
 
 
-def test_deploy_appstack(monkeypatch, mock_upsi_deployer, mock_setup_broker):
+def test_deploy_appstack(monkeypatch, tmpdir, mock_upsi_deployer, mock_setup_broker):
     # arrange - data
     apps = [AppConfig('app1', register_in='application-broker'),
             AppConfig('application-broker')]
@@ -427,6 +448,7 @@ def test_deploy_appstack(monkeypatch, mock_upsi_deployer, mock_setup_broker):
     is_dry_run = False
 
     # arrange - mocks
+    monkeypatch.setattr('apployer.deployer.DEPLOYER_OUTPUT', tmpdir.strpath)
     mock_prep_org_and_space = MagicMock()
     monkeypatch.setattr('apployer.deployer._prepare_org_and_space', mock_prep_org_and_space)
     mock_upsi_deployer.return_value.deploy.return_value = [app_guids[0]]
@@ -470,6 +492,63 @@ def test_deploy_appstack(monkeypatch, mock_upsi_deployer, mock_setup_broker):
                                                    deployer.DEPLOYER_OUTPUT, artifacts_path)
 
 
+def test_deploy_appstack_selected_steps(monkeypatch, tmpdir, mock_upsi_deployer,
+                                        mock_setup_broker):
+    apps = [AppConfig('app1'), AppConfig('app2')]
+    user_provided_services = [UserProvidedService('upsi-1', {}), UserProvidedService('upsi-2', {})]
+    brokers = [BrokerConfig('broker-name', 'http://broker-url', 'username', 'password')]
+    security_groups = [SecurityGroup('sg-name', 'udp', '12.13.14.15/8', '56-139')]
+    post_actions = [PostAction('post-action', ['echo done'])]
+    appstack = AppStack(apps, user_provided_services, brokers, ['fake-buildpack'], 'fake-domain',
+                        security_groups, post_actions)
+    monkeypatch.setattr('apployer.deployer.DEPLOYER_OUTPUT', tmpdir.strpath)
+    monkeypatch.setattr('apployer.deployer._prepare_org_and_space', MagicMock())
+    mock_upsi_deployer.return_value.deploy.return_value = []
+    mock_setup_security_group, mock_setup_buildpack, mock_execute_post_action, \
+        mock_deploy_app = [MagicMock() for _ in range(4)]
+    monkeypatch.setattr('apployer.deployer.setup_security_group', mock_setup_security_group)
+    monkeypatch.setattr('apployer.deployer.setup_buildpack', mock_setup_buildpack)
+    monkeypatch.setattr('apployer.deployer._execute_post_action', mock_execute_post_action)
+    monkeypatch.setattr('apployer.deployer._deploy_app', mock_deploy_app)
+    mock_deploy_app.return_value = []
+    monkeypatch.setattr('apployer.deployer._restart_apps', MagicMock())
+
+    deployer.deploy_appstack(CfInfo('https://api.example.com', 'password'), appstack,
+                             'some-fake-path', False, deployer.PUSH_ALL_STRATEGY,
+                             selected_steps={'app:app2', 'user_provided_service:upsi-1'})
+
+    mock_upsi_deployer.assert_called_once_with(user_provided_services[0])
+    assert [call[0][0] for call in mock_deploy_app.call_args_list] == [apps[1]]
+    for mock_function in (mock_setup_broker, mock_setup_security_group, mock_setup_buildpack,
+                          mock_execute_post_action):
+        assert not mock_function.called
+
+
+def test_get_app_selection_steps():
+    apps = [
+        AppConfig('app1', app_properties={'services': ['upsi-1', 'broker-instance']}),
+        AppConfig('app2', app_properties={'services': ['app1-upsi'], 'buildpack': 'fake-buildpack'},
+                  register_in='app3'),
+        AppConfig('app3', user_provided_services=[UserProvidedService('app3-upsi', {})]),
+        AppConfig('app4', app_properties={'services': ['upsi-2']}),
+    ]
+    apps[0].user_provided_services = [UserProvidedService('app1-upsi', {})]
+    appstack = AppStack(
+        apps, [UserProvidedService('upsi-1', {}), UserProvidedService('upsi-2', {})],
+        [BrokerConfig('broker-name', 'http://broker-url', 'username', 'password',
+                      service_instances=[ServiceInstance('broker-instance', 'free')])],
+        ['fake-buildpack', 'other-buildpack'], 'fake-domain')
+
+    assert deployer.get_app_selection_steps(appstack, ['app2']) == \
+        {'app:app2', 'buildpack:fake-buildpack'}
+    assert deployer.get_app_selection_steps(appstack, ['app2'], with_dependencies=True) == \
+        {'app:app1', 'app:app2', 'app:app3', 'buildpack:fake-buildpack',
+         'user_provided_service:upsi-1', 'broker:broker-name'}
+    assert deployer.get_app_selection_steps(appstack, ['app1'], with_dependents=True) == \
+        {'app:app1', 'app:app2', 'buildpack:fake-buildpack', 'user_provided_service:upsi-1',
+         'broker:broker-name'}
+
+
 def test_deploy_appstack_dry_run(monkeypatch):
     fake_cf_login, fake_appstack, fake_artifacts_path, fake_is_dry_run, fake_strategy = 1, 2, 3, True, 4
     mock_do_deploy = MagicMock()
@@ -481,8 +560,12 @@ def test_deploy_appstack_dry_run(monkeypatch):
                              fake_is_dry_run, fake_strategy)
 
     mock_do_deploy.assert_called_with(fake_cf_login, fake_appstack,
-                                      fake_artifacts_path, fake_is_dry_run, fake_strategy)
+                                      fake_artifacts_path, fake_is_dry_run, fake_strategy,
+                                      mock.ANY, 1, mock.ANY, False, None)
     assert deployer.cf_cli is real_cf_cli
+    # modules deploying through the API are switched to the dry run along with the deployer
+    assert native_push.cf_cli is upsi.cf_cli is real_cf_cli
+    assert native_push.cf_api is upsi.cf_api is deployer.cf_api
     assert deployer.register_in_application_broker is real_register_in_app_broker
 
 
@@ -512,7 +595,7 @@ def test_register_in_app_broker(monkeypatch, mock_check_call):
 
     # assert
     mock_app_deployer_init.assert_called_with(app_broker, unpacked_apps_dir)
-    mock_app_deployer.prepare.assert_called_with(artifacts_path)
+    mock_app_deployer.extract.assert_called_with(artifacts_path)
     # This doesn't check much - oh well. A thorough integration test would be useful.
     assert mock_check_call.call_args_list
 
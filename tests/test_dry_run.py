@@ -16,7 +16,9 @@
 
 import mock
 from mock import MagicMock
-from apployer import dry_run
+import pytest
+
+from apployer import cf_cli, dry_run
 from . import fake_module
 
 
@@ -45,4 +47,49 @@ def test_get_dry_run_cf_cli_app_restart(info_mock):
     dry_run_cf_cli = dry_run.get_dry_run_cf_cli()
     fake_app_name = 'some-fake-app'
     dry_run_cf_cli.restart(fake_app_name)
-    info_mock.assert_called_with('DRY RUN: calling %s with arguments %s', 'restart', {'app_name': fake_app_name})
\ No newline at end of file
+    info_mock.assert_called_with('DRY RUN: calling %s with arguments %s', 'restart', {'app_name': fake_app_name})
+
+@mock.patch('apployer.dry_run._log.info')
+def test_get_dry_run_cf_api_delete_binding(info_mock):
+    dry_run_cf_api = dry_run.get_dry_run_cf_api()
+    binding = {'metadata': {'url': '/v2/service_bindings/some-guid'}}
+    dry_run_cf_api.delete_service_binding(binding)
+    info_mock.assert_called_with('DRY RUN: calling %s with arguments %s',
+                                 'delete_service_binding', {'binding': binding})
+
+
+def test_record_and_replay_snapshot(monkeypatch, tmpdir):
+    snapshot_path = tmpdir.join('snapshot.json').strpath
+    live_outputs = {'cf env some-app': 'VERSION: 1.0', 'cf oauth-token': 'bearer secret'}
+
+    def _fake_get_command_output(command):
+        command_string = ' '.join(command)
+        if command_string not in live_outputs:
+            raise cf_cli.CommandFailedError('Command failed', output='not found')
+        return live_outputs[command_string]
+    monkeypatch.setattr('apployer.cf_cli.get_command_output', _fake_get_command_output)
+
+    with dry_run.recording_snapshot(snapshot_path):
+        assert cf_cli.env('some-app') == 'VERSION: 1.0'
+        assert cf_cli.oauth_token() == 'bearer secret'
+        with pytest.raises(cf_cli.CommandFailedError):
+            cf_cli.service('some-service')
+    assert cf_cli.get_command_output is _fake_get_command_output
+    assert 'secret' not in tmpdir.join('snapshot.json').read()
+    assert tmpdir.join('snapshot.json').stat().mode & 0o777 == 0o600
+
+    live_run_command = cf_cli.run_command
+    mock_popen = MagicMock()
+    monkeypatch.setattr('apployer.cf_cli.get_command_output', MagicMock())
+    monkeypatch.setattr('apployer.cf_cli.Popen', mock_popen)
+    with dry_run.replaying_snapshot(snapshot_path):
+        assert cf_cli.env('some-app') == 'VERSION: 1.0'
+        with pytest.raises(cf_cli.CommandFailedError) as ex:
+            cf_cli.service('some-service')
+        assert ex.value.output == 'not found'
+        with pytest.raises(cf_cli.CommandFailedError):
+            cf_cli.env('unrecorded-app')
+        cf_cli.target('some-org', 'some-space')
+    assert not cf_cli.get_command_output.called
+    assert not mock_popen.called
+    assert cf_cli.run_command is live_run_command
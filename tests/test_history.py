@@ -0,0 +1,80 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+
+from apployer.appstack import AppConfig
+from apployer.history import DeploymentHistory, HISTORY_FILE_NAME, KEPT_DURATIONS
+
+
+@pytest.fixture
+def output_path(tmpdir):
+    return tmpdir.join('apployer_out').strpath
+
+
+def test_record_and_load(output_path):
+    history = DeploymentHistory(output_path)
+    history.record_span('push', 10.0, {'phase': 'push', 'app': 'A'})
+    history.record_span('push', 20.0, {'phase': 'push', 'app': 'A'})
+    history.record_span('post_command', 5.0, {'phase': 'post_command', 'app': 'A'})
+    # spans of other operations or outside of applications are ignored
+    history.record_span('cf push', 10.0, {'phase': 'push', 'app': 'A'})
+    history.record_span('push', 10.0, {'phase': 'buildpack'})
+    history.save()
+
+    loaded_history = DeploymentHistory(output_path)
+
+    assert loaded_history.get_phase_durations('A') == {'push': 15.0, 'post_command': 5.0}
+    assert loaded_history.get_expected_duration('A') == 20.0
+    assert loaded_history.get_expected_duration('B') is None
+
+
+def test_record_keeps_recent_durations():
+    history = DeploymentHistory(None)
+    for duration in range(KEPT_DURATIONS + 10):
+        history.record('A', 'push', duration)
+
+    recent_durations = range(10, KEPT_DURATIONS + 10)
+    assert history.get_expected_duration('A') == float(sum(recent_durations)) / KEPT_DURATIONS
+
+
+def test_not_persisted(tmpdir):
+    history = DeploymentHistory(None)
+    history.record('A', 'push', 1.0)
+    history.save()
+
+    assert history.history_path is None
+    assert tmpdir.listdir() == []
+
+
+def test_malformed_history(output_path, tmpdir):
+    tmpdir.join('apployer_out').ensure(HISTORY_FILE_NAME).write('{"A": {"pu')
+
+    assert DeploymentHistory(output_path).get_expected_duration('A') is None
+
+
+def test_sort_longest_first():
+    history = DeploymentHistory(None)
+    history.record('long', 'push', 100.0)
+    history.record('medium', 'push', 30.0)
+    history.record('short', 'push', 10.0)
+    apps = [AppConfig(name) for name in ['short', 'unknown', 'long', 'medium', 'other-unknown']]
+
+    sorted_apps = history.sort_longest_first(apps)
+
+    # apps without history are expected to take the average time (about 47 seconds)
+    assert [app.name for app in sorted_apps] == \
+        ['long', 'unknown', 'other-unknown', 'medium', 'short']
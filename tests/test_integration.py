@@ -0,0 +1,134 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import zipfile
+
+from apployer.cf_cli import CfInfo
+from apployer.deployer import (deploy_appstack, DEPLOYER_OUTPUT, FINGERPRINT_STRATEGY,
+                               UPGRADE_STRATEGY)
+from apployer.history import HISTORY_FILE_NAME
+from .benchmarks.harness import FakeCfEnvironment, make_synthetic_appstack
+
+
+def test_deploy_to_fake_cf(monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir.strpath)
+    artifacts_path = tmpdir.join('artifacts').strpath
+    appstack = make_synthetic_appstack(6, artifacts_path)
+    fake_cf = FakeCfEnvironment(tmpdir.strpath)
+    cf_info = CfInfo('https://api.example.com', 'password')
+
+    with fake_cf.activated():
+        deploy_appstack(cf_info, appstack, artifacts_path, False, UPGRADE_STRATEGY)
+    state = fake_cf.get_state()
+
+    assert sorted(state['apps']) == [app.name for app in appstack.apps]
+    assert state['apps']['app-00003']['env']['VERSION'] == '1.0.3'
+    assert sorted(state['upsis']) == ['app-00000-upsi', 'app-00005-upsi',
+                                      'global-upsi-0', 'global-upsi-1']
+    assert sorted(state['brokers']) == ['app-00000-broker']
+    assert sorted(state['instances']) == ['app-00000-instance']
+    assert [buildpack['filename'] for buildpack in state['buildpacks']] == \
+        ['fake-buildpack-v1.zip']
+    assert state['calls']['push'] == 6
+
+    # versions didn't change, so the second deployment shouldn't push anything
+    appstack.user_provided_services[0].credentials = {'key': 'new-value'}
+    with fake_cf.activated():
+        deploy_appstack(cf_info, appstack, artifacts_path, False, UPGRADE_STRATEGY)
+    state = fake_cf.get_state()
+
+    assert state['calls']['push'] == 6
+    assert state['upsis']['global-upsi-0']['credentials'] == {'key': 'new-value'}
+    # only the first app is bound to the updated service
+    assert state['calls']['restart'] == 1
+
+
+def test_parallel_deploy_to_fake_cf(monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir.strpath)
+    artifacts_path = tmpdir.join('artifacts').strpath
+    appstack = make_synthetic_appstack(12, artifacts_path)
+    fake_cf = FakeCfEnvironment(tmpdir.strpath)
+    cf_info = CfInfo('https://api.example.com', 'password')
+
+    with fake_cf.activated():
+        deploy_appstack(cf_info, appstack, artifacts_path, False, UPGRADE_STRATEGY, parallel=4)
+    state = fake_cf.get_state()
+
+    assert sorted(state['apps']) == [app.name for app in appstack.apps]
+    assert state['calls']['push'] == 12
+    with open(os.path.join(DEPLOYER_OUTPUT, HISTORY_FILE_NAME)) as history_file:
+        history = json.load(history_file)
+    assert sorted(history) == [app.name for app in appstack.apps]
+    assert sorted(history['app-00000']) == ['prepare', 'push']
+
+
+def test_async_staging_deploy_to_fake_cf(monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir.strpath)
+    monkeypatch.setattr('apployer.cf_api.POLL_INTERVAL', 0.01)
+    artifacts_path = tmpdir.join('artifacts').strpath
+    appstack = make_synthetic_appstack(12, artifacts_path)
+    fake_cf = FakeCfEnvironment(tmpdir.strpath)
+    cf_info = CfInfo('https://api.example.com', 'password')
+
+    with fake_cf.activated():
+        deploy_appstack(cf_info, appstack, artifacts_path, False, UPGRADE_STRATEGY, parallel=4,
+                        async_staging=True)
+    state = fake_cf.get_state()
+
+    assert sorted(state['apps']) == [app.name for app in appstack.apps]
+    assert all(app['state'] == 'STARTED' and app['package_state'] == 'STAGED'
+               for app in state['apps'].values())
+    assert sorted(state['brokers']) == ['app-00000-broker', 'app-00010-broker']
+    with open(os.path.join(DEPLOYER_OUTPUT, HISTORY_FILE_NAME)) as history_file:
+        history = json.load(history_file)
+    assert 'staging' in history['app-00000']
+
+
+def test_fingerprint_deploy_to_fake_cf(monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir.strpath)
+    artifacts_path = tmpdir.join('artifacts').strpath
+    appstack = make_synthetic_appstack(6, artifacts_path)
+    fake_cf = FakeCfEnvironment(tmpdir.strpath)
+    cf_info = CfInfo('https://api.example.com', 'password')
+
+    with fake_cf.activated():
+        deploy_appstack(cf_info, appstack, artifacts_path, False, FINGERPRINT_STRATEGY)
+        # configuration of one app changed without a version bump
+        appstack.apps[2].app_properties['env']['SOME_SETTING'] = 'new-value'
+        # push options of another one changed
+        appstack.apps[3].push_options.params = '--no-route'
+        deploy_appstack(cf_info, appstack, artifacts_path, False, FINGERPRINT_STRATEGY)
+    state = fake_cf.get_state()
+
+    # only the app with changed push options was pushed again...
+    assert state['calls']['push'] == 7
+    # ...and the one with changed environment was just updated and restarted
+    assert state['apps']['app-00002']['env']['SOME_SETTING'] == 'new-value'
+    assert state['calls']['restart'] == 1
+
+    # a file was added to an artifact
+    with zipfile.ZipFile(os.path.join(artifacts_path, 'app-00004.zip'), 'a') as artifact:
+        artifact.writestr('config.properties', 'some.setting=1')
+    with fake_cf.activated():
+        deploy_appstack(cf_info, appstack, artifacts_path, False, FINGERPRINT_STRATEGY)
+    state = fake_cf.get_state()
+
+    # only the added file was uploaded, without CF CLI's push
+    assert state['calls']['push'] == 7
+    assert state['apps']['app-00004']['uploaded_files'] == ['config.properties']
+    assert state['apps']['app-00004']['restages'] == 1
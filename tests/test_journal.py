@@ -0,0 +1,109 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+
+from mock import MagicMock
+import pytest
+
+from apployer.journal import DeploymentJournal, JOURNAL_FILE_NAME
+
+
+@pytest.fixture
+def output_path(tmpdir):
+    return tmpdir.join('apployer_out').strpath
+
+
+def test_run_step(output_path):
+    step = MagicMock(return_value=['some-app-guid'])
+    journal = DeploymentJournal(output_path)
+
+    assert journal.run_step('app:A', {'name': 'A'}, step, 'arg', kwarg='kwarg') == ['some-app-guid']
+
+    step.assert_called_once_with('arg', kwarg='kwarg')
+    assert os.path.exists(os.path.join(output_path, JOURNAL_FILE_NAME))
+
+
+def test_resume_skips_completed_steps(output_path):
+    DeploymentJournal(output_path).run_step('app:A', {'name': 'A'}, lambda: ['guid'])
+    step = MagicMock()
+
+    journal = DeploymentJournal(output_path, resume=True)
+
+    assert journal.run_step('app:A', {'name': 'A'}, step) == ['guid']
+    assert not step.called
+
+
+def test_resume_repeats_changed_steps(output_path):
+    DeploymentJournal(output_path).run_step('app:A', {'name': 'A', 'env': 1}, lambda: None)
+    step = MagicMock(return_value=[])
+
+    DeploymentJournal(output_path, resume=True).run_step('app:A', {'name': 'A', 'env': 2}, step)
+
+    assert step.called
+
+
+def test_is_completed(output_path):
+    DeploymentJournal(output_path).run_step('app:A', {'name': 'A'}, lambda: [])
+
+    journal = DeploymentJournal(output_path, resume=True)
+
+    assert journal.is_completed('app:A', {'name': 'A'})
+    assert not journal.is_completed('app:A', {'name': 'changed'})
+    assert not journal.is_completed('app:B', {'name': 'B'})
+
+
+def test_resume_against_another_target(output_path):
+    target = ['https://api.example.com', 'org', 'space']
+    DeploymentJournal(output_path, target=target).run_step('app:A', {'name': 'A'}, lambda: [])
+
+    journal = DeploymentJournal(output_path, resume=True, target=target)
+    assert journal.is_completed('app:A', {'name': 'A'})
+    journal = DeploymentJournal(output_path, resume=True, target=target[:2] + ['other-space'])
+    assert not journal.is_completed('app:A', {'name': 'A'})
+
+
+def test_new_deployment_discards_journal(output_path):
+    DeploymentJournal(output_path).run_step('app:A', {'name': 'A'}, lambda: None)
+    DeploymentJournal(output_path)
+    step = MagicMock()
+
+    DeploymentJournal(output_path, resume=True).run_step('app:A', {'name': 'A'}, step)
+
+    assert step.called
+
+
+def test_resume_with_incomplete_journal_line(output_path):
+    journal = DeploymentJournal(output_path)
+    journal.run_step('app:A', {'name': 'A'}, lambda: None)
+    with open(journal.journal_path, 'a') as journal_file:
+        journal_file.write('{"step": "app:B", "fingerp')
+    step = MagicMock()
+
+    DeploymentJournal(output_path, resume=True).run_step('app:A', {'name': 'A'}, step)
+
+    assert not step.called
+
+
+def test_journal_without_output(tmpdir):
+    step = MagicMock()
+    journal = DeploymentJournal(None)
+
+    journal.run_step('app:A', {'name': 'A'}, step)
+    journal.run_step('app:A', {'name': 'A'}, step)
+
+    assert step.call_count == 2
+    assert not tmpdir.listdir()
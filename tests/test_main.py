@@ -20,6 +20,8 @@ from mock import MagicMock
 import pytest
 
 from apployer.main import _get_filled_appstack, _download_artifacts_from_url, ApployerArgumentError, _seconds_to_time
+from apployer.main import _get_selected_steps, _check_deploy_options, DeploymentOptions, SelectionOptions
+from apployer.appstack import AppConfig, AppStack
 
 appstack_path = 'appstack_path'
 expanded_appstack_path = 'expanded_appstack_path'
@@ -106,3 +108,32 @@ def test_download_artifacts_from_url(monkeypatch):
 ])
 def test_seconds_to_time(string, seconds):
     assert string == _seconds_to_time(seconds)
+
+
+def test_get_selected_steps(monkeypatch):
+    appstack = AppStack(apps=[AppConfig('a'), AppConfig('b', after=['a']), AppConfig('c')])
+    monkeypatch.setattr('apployer.main.template_variables.get_changed_steps',
+                        MagicMock(return_value={'app:a', 'app:c'}))
+
+    assert _get_selected_steps(appstack, False, None, False, False) is None
+    assert _get_selected_steps(appstack, False, 'b, c', True, False) == {'app:a', 'app:b', 'app:c'}
+    assert _get_selected_steps(appstack, True, 'b', True, False) == {'app:a'}
+    with pytest.raises(ApployerArgumentError):
+        _get_selected_steps(appstack, False, 'b,nonexistent', False, False)
+
+
+@pytest.mark.parametrize('dry_run, deployment_changes, selection_changes', [
+    (False, {'snapshot_path': 'snapshot.json'}, {}),
+    (True, {'snapshot_path': 'snapshot.json', 'record_snapshot_path': 'record.json'}, {}),
+    (False, {'parallel': 0}, {}),
+    (False, {}, {'with_deps': True}),
+])
+def test_check_deploy_options_invalid(dry_run, deployment_changes, selection_changes):
+    deployment_options = DeploymentOptions(
+        retry_budget=10, resume=False, record_snapshot_path=None, snapshot_path=None,
+        trace_path=None, parallel=1, async_staging=False)._replace(**deployment_changes)
+    selection_options = SelectionOptions(
+        changed_vars=False, only=None, with_deps=False,
+        with_dependents=False)._replace(**selection_changes)
+    with pytest.raises(ApployerArgumentError):
+        _check_deploy_options(dry_run, deployment_options, selection_options)
@@ -0,0 +1,167 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import hashlib
+from zipfile import ZipFile
+
+from mock import MagicMock
+import pytest
+
+from apployer import native_push
+from apployer.appstack import AppConfig, PushOptions
+from apployer.cf_cli import CommandFailedError
+
+
+@pytest.fixture
+def mock_cf_cli(monkeypatch):
+    mock_cf = MagicMock()
+    monkeypatch.setattr('apployer.native_push.cf_cli', mock_cf)
+    mock_cf.get_app_guid.return_value = 'app-guid'
+    return mock_cf
+
+
+@pytest.fixture
+def mock_cf_api(monkeypatch):
+    cf_api = MagicMock()
+    monkeypatch.setattr('apployer.native_push.cf_api', cf_api)
+    return cf_api
+
+
+def _get_live_env_getter(live_env):
+    return lambda variable_name: live_env.get(variable_name)
+
+
+def test_get_app_fingerprint():
+    app = AppConfig('bla', app_properties={'env': {'VERSION': '1.0'}})
+    fingerprint = native_push.get_app_fingerprint(app, 'artifact-sha1')
+    base_fingerprint = native_push.get_app_fingerprint(app, 'artifact-sha1', include_env=False)
+
+    app.app_properties['env'][native_push.FINGERPRINT_ENV_VAR] = fingerprint
+    app.app_properties['env'][native_push.BASE_FINGERPRINT_ENV_VAR] = base_fingerprint
+    assert native_push.get_app_fingerprint(app, 'artifact-sha1') == fingerprint
+
+    app.app_properties['env']['SOME_SETTING'] = 'new-value'
+    changed_manifest_fingerprint = native_push.get_app_fingerprint(app, 'artifact-sha1')
+    assert changed_manifest_fingerprint != fingerprint
+    assert native_push.get_app_fingerprint(app, 'artifact-sha1', include_env=False) == \
+        base_fingerprint
+
+    app.push_options = PushOptions('--no-start')
+    changed_options_fingerprint = native_push.get_app_fingerprint(app, 'artifact-sha1')
+    assert changed_options_fingerprint != changed_manifest_fingerprint
+    assert native_push.get_app_fingerprint(app, 'artifact-sha1', include_env=False) != \
+        base_fingerprint
+
+    assert native_push.get_app_fingerprint(app, 'changed-sha1') != changed_options_fingerprint
+    assert native_push.get_app_fingerprint(app, 'changed-sha1', include_env=False) != \
+        native_push.get_app_fingerprint(app, 'artifact-sha1', include_env=False)
+
+
+def test_get_changed_env_names():
+    live_env = {'VERSION': '1.0', 'SOME_SETTING': 'old', native_push.FINGERPRINT_ENV_VAR: 'old'}
+    env = {'VERSION': '1.0', 'SOME_SETTING': 'new', 'NEW_SETTING': 'x',
+           native_push.FINGERPRINT_ENV_VAR: 'new'}
+
+    assert native_push.get_changed_env_names(live_env, env) == ['NEW_SETTING', 'SOME_SETTING']
+
+
+@pytest.mark.parametrize('live_base_fingerprint, live_env, env_update_enough', [
+    ('current-base', {'VERSION': '1.0', 'SOME_SETTING': 'old'}, True),
+    ('current-base', {'VERSION': '1.0', 'SOME_SETTING': 'new', 'SET_BY_HAND': 'x'}, False),
+    ('old-base', {'VERSION': '1.0', 'SOME_SETTING': 'old'}, False),
+    (None, {'VERSION': '1.0', 'SOME_SETTING': 'old'}, False),
+])
+def test_is_env_update_enough(mock_cf_cli, mock_cf_api, live_base_fingerprint, live_env,
+                              env_update_enough):
+    mock_cf_api.get_app_env.return_value = live_env
+    app = AppConfig('bla', app_properties={'env': {'VERSION': '1.0', 'SOME_SETTING': 'new'}})
+    native_pusher = native_push.NativePusher(app, _get_live_env_getter(
+        {native_push.BASE_FINGERPRINT_ENV_VAR: live_base_fingerprint}))
+    native_pusher.get_fingerprint = MagicMock(return_value='current-base')
+
+    assert native_pusher.is_env_update_enough('some/fake/location') == env_update_enough
+    native_pusher.get_fingerprint.assert_called_once_with('some/fake/location', include_env=False)
+
+
+def test_is_env_update_enough_no_app():
+    native_pusher = native_push.NativePusher(AppConfig('bla'),
+                                             MagicMock(side_effect=CommandFailedError))
+
+    assert not native_pusher.is_env_update_enough('some/fake/location')
+
+
+@pytest.mark.parametrize('push_params, restarted', [('', True), ('--no-start', False)])
+def test_update_env(mock_cf_cli, mock_cf_api, push_params, restarted):
+    mock_cf_api.get_app_env.return_value = {'VERSION': '1.0', 'SOME_SETTING': 'old',
+                                            'SET_BY_HAND': 'x'}
+    app = AppConfig('bla', app_properties={'env': {'VERSION': '1.0', 'SOME_SETTING': 'new'}},
+                    push_options=PushOptions(params=push_params))
+    native_pusher = native_push.NativePusher(app, _get_live_env_getter({}))
+    native_pusher.get_fingerprint = \
+        lambda _, include_env=True, include_artifact=True: 'full' if include_env else 'base'
+
+    native_pusher.update_env('some/fake/location', include_fingerprints=True)
+
+    mock_cf_api.update_app_env.assert_called_once_with('app-guid', {
+        'VERSION': '1.0', 'SOME_SETTING': 'new', 'SET_BY_HAND': 'x',
+        native_push.FINGERPRINT_ENV_VAR: 'full', native_push.BASE_FINGERPRINT_ENV_VAR: 'base',
+        native_push.CONFIG_FINGERPRINT_ENV_VAR: 'base'})
+    assert mock_cf_cli.restart.called == restarted
+    assert not mock_cf_cli.push.called
+
+
+@pytest.mark.parametrize('live_config_fingerprint, bits_upload_enough', [
+    ('current-config', True),
+    ('old-config', False),
+    (None, False),
+])
+def test_is_bits_upload_enough(live_config_fingerprint, bits_upload_enough):
+    native_pusher = native_push.NativePusher(AppConfig('bla'), _get_live_env_getter(
+        {native_push.CONFIG_FINGERPRINT_ENV_VAR: live_config_fingerprint}))
+    native_pusher.get_fingerprint = MagicMock(return_value='current-config')
+
+    assert native_pusher.is_bits_upload_enough('some/fake/location') == bits_upload_enough
+    native_pusher.get_fingerprint.assert_called_once_with(
+        'some/fake/location', include_env=False, include_artifact=False)
+
+
+@pytest.mark.parametrize('push_params, wait_for_start, restaged, staging_app_guid', [
+    ('', True, True, None),
+    ('', False, True, 'app-guid'),
+    ('--no-start', True, False, None),
+])
+def test_upload_bits(mock_cf_cli, mock_cf_api, tmpdir, push_params, wait_for_start, restaged,
+                     staging_app_guid):
+    mock_cf_api.get_app_env.return_value = {}
+    artifact_path = tmpdir.join('bla.zip').strpath
+    with ZipFile(artifact_path, 'w') as artifact:
+        artifact.writestr('cached.jar', 'cached')
+        artifact.writestr('new.jar', 'new')
+    cached_resource = {'fn': 'cached.jar', 'size': 6, 'mode': '0600',
+                       'sha1': hashlib.sha1('cached').hexdigest()}
+    mock_cf_api.match_resources.return_value = [{'sha1': cached_resource['sha1'], 'size': 6}]
+    app = AppConfig('bla', push_options=PushOptions(params=push_params))
+    native_pusher = native_push.NativePusher(app, _get_live_env_getter({}))
+
+    assert native_pusher.upload_bits(tmpdir.strpath, wait_for_start) == staging_app_guid
+
+    mock_cf_api.upload_app_bits.assert_called_once_with(
+        'app-guid', [cached_resource], artifact_path, ['new.jar'])
+    assert mock_cf_api.update_app_env.called
+    assert mock_cf_api.restage_app.called == restaged
+    assert mock_cf_api.wait_for_app_start.called == (restaged and wait_for_start)
+    assert not mock_cf_cli.push.called
@@ -0,0 +1,183 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from mock import MagicMock
+import pytest
+
+from apployer.app_file import get_file_sha1
+from apployer.appstack import (AppConfig, AppStack, BrokerConfig, PushOptions, ServiceInstance,
+                               UserProvidedService)
+from apployer.deployer import FINGERPRINT_STRATEGY, PUSH_ALL_STRATEGY, UPGRADE_STRATEGY
+from apployer.native_push import (get_app_fingerprint, BASE_FINGERPRINT_ENV_VAR,
+                                  CONFIG_FINGERPRINT_ENV_VAR, FINGERPRINT_ENV_VAR)
+from apployer.plan import LiveApp, LiveState, PlannedAction, make_plan, format_plan
+
+
+def _resource(guid, **entity):
+    return {'metadata': {'guid': guid}, 'entity': entity}
+
+
+CF_API_RESOURCES = {
+    '/v2/organizations?q=name:seedorg': [_resource('org-guid', name='seedorg')],
+    '/v2/spaces?q=name:seedspace&q=organization_guid:org-guid': [
+        _resource('space-guid', name='seedspace')],
+    '/v2/spaces/space-guid/apps': [
+        _resource('app-a-guid', name='app_a',
+                  environment_json={'VERSION': '1.0', 'APPLOYER_FINGERPRINT': 'a-fingerprint',
+                                    'APPLOYER_BASE_FINGERPRINT': 'a-base-fingerprint'}),
+        _resource('app-b-guid', name='app_b', environment_json=None)],
+    '/v2/user_provided_service_instances?q=space_guid:space-guid': [
+        _resource('upsi-guid', name='upsi', credentials={'url': 'old'})],
+    '/v2/user_provided_service_instances/upsi-guid/service_bindings': [
+        _resource('binding-guid', service_instance_guid='upsi-guid', app_guid='app-b-guid')],
+    '/v2/spaces/space-guid/service_instances?return_user_provided_service_instances=true': [
+        _resource('instance-guid', name='instance'), _resource('upsi-guid', name='upsi')],
+    '/v2/service_brokers': [_resource('broker-guid', name='broker')],
+    '/v2/buildpacks': [_resource('bp-guid', name='some-buildpack',
+                                 filename='some-buildpack-v1.zip')],
+    '/v2/security_groups': [],
+}
+
+
+@pytest.fixture
+def live_state(monkeypatch):
+    monkeypatch.setattr('apployer.cf_api.get_all_resources', CF_API_RESOURCES.get)
+    return LiveState.fetch('seedorg', 'seedspace')
+
+
+def test_live_state_fetch(live_state):
+    assert live_state.apps == {
+        'app_a': LiveApp('app-a-guid', {'VERSION': '1.0', 'APPLOYER_FINGERPRINT': 'a-fingerprint',
+                                        'APPLOYER_BASE_FINGERPRINT': 'a-base-fingerprint'}),
+        'app_b': LiveApp('app-b-guid', {})}
+    assert live_state.upsi_credentials == {'upsi': {'url': 'old'}}
+    assert live_state.upsi_bound_apps == {'upsi': ['app-b-guid']}
+    assert live_state.service_instances == {'instance', 'upsi'}
+    assert live_state.brokers == {'broker'}
+    assert live_state.buildpacks == {'some-buildpack': 'some-buildpack-v1.zip'}
+    assert live_state.security_groups == set()
+
+
+def test_live_state_fetch_no_space(monkeypatch):
+    get_all_resources = MagicMock(return_value=[])
+    monkeypatch.setattr('apployer.cf_api.get_all_resources', get_all_resources)
+
+    live_state = LiveState.fetch('seedorg', 'seedspace')
+
+    assert live_state.apps == {}
+    assert get_all_resources.call_count == 4
+
+
+def _get_appstack():
+    return AppStack(
+        apps=[
+            AppConfig('app_a', app_properties={'env': {'VERSION': '1.0'}}),
+            AppConfig('app_b', app_properties={'env': {'VERSION': '0.1'}},
+                      push_options=PushOptions(post_command='echo done'),
+                      broker_config=BrokerConfig(
+                          'new_broker', 'http://new_broker', 'user', 'pass',
+                          service_instances=[ServiceInstance('instance', 'free'),
+                                             ServiceInstance('new_instance', 'free')])),
+            AppConfig('app_c', register_in='app_a')],
+        user_provided_services=[UserProvidedService('upsi', {'url': 'new'}),
+                                UserProvidedService('new_upsi', {})],
+        brokers=[BrokerConfig('broker', 'http://broker', 'user', 'pass')],
+        buildpacks=['some-buildpack'])
+
+
+def test_make_plan(live_state, tmpdir):
+    tmpdir.join('some-buildpack-v2.zip').write('')
+
+    plan = make_plan(_get_appstack(), live_state, tmpdir.strpath, UPGRADE_STRATEGY)
+
+    assert plan == [
+        PlannedAction('user_provided_service', 'upsi', 'update',
+                      'credentials differ, 1 app(s) will be rebound'),
+        PlannedAction('user_provided_service', 'new_upsi', 'create', "doesn't exist"),
+        PlannedAction('broker', 'broker', 'update', 'exists'),
+        PlannedAction('buildpack', 'some-buildpack', 'update',
+                      'some-buildpack-v1.zip -> some-buildpack-v2.zip'),
+        PlannedAction('app', 'app_a', 'skip', 'live version 1.0 is up-to-date'),
+        PlannedAction('app', 'app_b', 'push', 'live version unknown'),
+        PlannedAction('post_command', 'app_b', 'run', 'echo done'),
+        PlannedAction('broker', 'new_broker', 'create', "doesn't exist"),
+        PlannedAction('service_instance', 'instance', 'skip', 'exists'),
+        PlannedAction('service_instance', 'new_instance', 'create', "doesn't exist"),
+        PlannedAction('app', 'app_c', 'push', "doesn't exist"),
+        PlannedAction('registration', 'app_c', 'run', 'in app_a'),
+        PlannedAction('app', 'app_b', 'restart', 'bound user-provided service has changed'),
+    ]
+    assert format_plan(plan).splitlines()[-1] == 'Plan: 11 action(s), 2 entities up-to-date.'
+
+
+def test_make_plan_push_all(live_state, tmpdir):
+    tmpdir.join('some-buildpack-v1.zip').write('')
+    tmpdir.join('app_a-1.0.zip').write('')
+    appstack = AppStack(apps=[AppConfig('app_a', app_properties={'env': {'VERSION': '1.0'}})],
+                        buildpacks=['some-buildpack'])
+
+    plan = make_plan(appstack, live_state, tmpdir.strpath, PUSH_ALL_STRATEGY)
+
+    assert plan == [
+        PlannedAction('buildpack', 'some-buildpack', 'skip', 'up-to-date'),
+        PlannedAction('app', 'app_a', 'push', '1.0 -> 1.0'),
+    ]
+
+
+def test_make_plan_push_all_with_env_drift(tmpdir):
+    app = AppConfig('app_a', app_properties={'env': {'VERSION': '1.0', 'SOME_SETTING': 'new'}})
+    tmpdir.join('app_a-1.0.zip').write('')
+    live_state = LiveState()
+    live_state.apps = {'app_a': LiveApp('app-a-guid', {
+        'VERSION': '1.0', 'SOME_SETTING': 'old',
+        BASE_FINGERPRINT_ENV_VAR: get_app_fingerprint(
+            app, get_file_sha1(tmpdir.join('app_a-1.0.zip').strpath), include_env=False)})}
+
+    assert make_plan(AppStack(apps=[app]), live_state, tmpdir.strpath, PUSH_ALL_STRATEGY) == [
+        PlannedAction('app', 'app_a', 'push', '1.0 -> 1.0')]
+    assert make_plan(AppStack(apps=[app]), live_state, tmpdir.strpath, FINGERPRINT_STRATEGY)[0] \
+        .action == 'update'
+
+
+def test_make_plan_fingerprint(tmpdir):
+    apps = [AppConfig(name, app_properties={'env': {'VERSION': '1.0'}})
+            for name in ('app_a', 'app_b', 'app_c', 'app_d')]
+    for app in apps:
+        tmpdir.join(app.name + '-1.0.zip').write('')
+    artifact_sha1 = get_file_sha1(tmpdir.join('app_a-1.0.zip').strpath)
+    live_state = LiveState()
+    live_envs = {
+        'app_a': {'VERSION': '1.0',
+                  FINGERPRINT_ENV_VAR: get_app_fingerprint(apps[0], artifact_sha1)},
+        'app_b': {'VERSION': '1.0', FINGERPRINT_ENV_VAR: 'old-fingerprint'},
+        'app_c': {'VERSION': '0.9', FINGERPRINT_ENV_VAR: 'old-fingerprint',
+                  BASE_FINGERPRINT_ENV_VAR: get_app_fingerprint(apps[2], artifact_sha1,
+                                                                include_env=False)},
+        'app_d': {'VERSION': '1.0', FINGERPRINT_ENV_VAR: 'old-fingerprint',
+                  CONFIG_FINGERPRINT_ENV_VAR: get_app_fingerprint(apps[3], None,
+                                                                  include_env=False)},
+    }
+    live_state.apps = {name: LiveApp(name + '-guid', env) for name, env in live_envs.items()}
+
+    plan = make_plan(AppStack(apps=apps), live_state, tmpdir.strpath, FINGERPRINT_STRATEGY)
+
+    assert plan[0] == PlannedAction('app', 'app_a', 'skip', 'fingerprint unchanged')
+    assert plan[1].action == 'push'
+    assert plan[1].reason.startswith('fingerprint old-fingerprint -> ')
+    assert plan[2] == PlannedAction('app', 'app_c', 'update',
+                                    'only environment variables changed, will restart')
+    assert plan[3] == PlannedAction('app', 'app_d', 'push',
+                                    'only artifact changed, will upload changed files')
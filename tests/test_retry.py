@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import inspect
+
+from mock import MagicMock
+import pytest
+
+from apployer import cf_api, cf_cli, retry
+from apployer.cf_cli import CommandFailedError
+
+TRANSIENT_OUTPUT = 'FAILED\nServer error, status code: 502, error code: 0, message: '
+CONNECTION_OUTPUT = 'FAILED\nError performing request: dial tcp 10.0.0.1:443: connection refused'
+
+
+@pytest.fixture
+def mock_sleep(monkeypatch):
+    sleep = MagicMock()
+    monkeypatch.setattr('apployer.retry.time.sleep', sleep)
+    return sleep
+
+
+@pytest.fixture
+def policy():
+    return retry.RetryPolicy(max_attempts=3, budget=5)
+
+
+@pytest.mark.parametrize('operation_class, output, retryable', [
+    (retry.IDEMPOTENT_READ, TRANSIENT_OUTPUT, True),
+    (retry.IDEMPOTENT_WRITE, TRANSIENT_OUTPUT, True),
+    (retry.NON_IDEMPOTENT, TRANSIENT_OUTPUT, False),
+    (retry.NON_IDEMPOTENT, CONNECTION_OUTPUT, True),
+    (retry.IDEMPOTENT_READ, 'FAILED\nService instance bla not found', False),
+])
+def test_is_retryable(operation_class, output, retryable):
+    error = CommandFailedError('Command failed: cf something', output=output)
+    assert retry.is_retryable(operation_class, error) == retryable
+
+
+def test_retry_transient_error(policy, mock_sleep):
+    function = MagicMock(__name__='env',
+                         side_effect=[CommandFailedError(output=TRANSIENT_OUTPUT), 'output'])
+
+    assert policy.call(retry.IDEMPOTENT_READ, function, 'app') == 'output'
+
+    assert function.call_count == 2
+    assert mock_sleep.call_count == 1
+    assert policy.retry_counts == {'env': 1}
+
+
+def test_retry_gives_up_after_max_attempts(policy, mock_sleep):
+    function = MagicMock(__name__='env', side_effect=CommandFailedError(output=TRANSIENT_OUTPUT))
+
+    with pytest.raises(CommandFailedError):
+        policy.call(retry.IDEMPOTENT_READ, function)
+
+    assert function.call_count == policy.max_attempts
+    assert policy.total_retries == policy.max_attempts - 1
+
+
+def test_retry_budget_exhausted(mock_sleep):
+    policy = retry.RetryPolicy(max_attempts=10, budget=2)
+    function = MagicMock(__name__='push', side_effect=CommandFailedError(output=TRANSIENT_OUTPUT))
+
+    with pytest.raises(CommandFailedError):
+        policy.call(retry.IDEMPOTENT_WRITE, function)
+
+    assert function.call_count == 3
+    assert policy.retries_left == 0
+
+    policy.reset()
+    assert policy.retries_left == 2
+
+
+def test_no_retry_of_non_transient_error(policy, mock_sleep):
+    function = MagicMock(__name__='service', side_effect=CommandFailedError(output='not found'))
+
+    with pytest.raises(CommandFailedError):
+        policy.call(retry.IDEMPOTENT_READ, function)
+
+    assert function.call_count == 1
+    assert not mock_sleep.called
+
+
+@pytest.mark.parametrize('retry_number', [1, 3, 10])
+def test_get_delay(policy, retry_number):
+    ceiling = min(policy.max_delay, policy.base_delay * 2 ** (retry_number - 1))
+    assert 0 <= policy.get_delay(retry_number) <= ceiling
+
+
+@pytest.mark.parametrize('module', [cf_cli, cf_api])
+def test_all_operations_classified(module):
+    # wait_for_app_start only repeats is_app_started, which is retried on its own
+    primitives = {'login', 'get_command_output', 'run_command', 'wait_for_app_start'}
+    operations = [function for name, function in inspect.getmembers(module, inspect.isfunction)
+                  if not name.startswith('_') and name not in primitives
+                  and function.__module__ == module.__name__]
+    assert operations
+    for operation in operations:
+        assert operation.operation_class in (retry.IDEMPOTENT_READ, retry.IDEMPOTENT_WRITE,
+                                             retry.NON_IDEMPOTENT)
+
+
+def test_retried_cf_cli_command(mock_popen, mock_sleep, monkeypatch):
+    monkeypatch.setattr('apployer.retry._policy', retry.RetryPolicy())
+    mock_popen.set_command('cf restart some_app', stdout=TRANSIENT_OUTPUT, returncode=1)
+
+    with pytest.raises(CommandFailedError):
+        cf_cli.restart('some_app')
+
+    assert retry.get_policy().retry_counts == {'restart': retry.get_policy().max_attempts - 1}
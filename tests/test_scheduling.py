@@ -0,0 +1,117 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import time
+
+from mock import MagicMock
+import pytest
+
+from apployer import scheduling
+from apployer.appstack import AppConfig
+from apployer.app_graph import AppGraph
+from apployer.cf_cli import CommandFailedError
+from apployer.history import DeploymentHistory
+
+
+class FakeStagingPoller(object):
+    """Reports the apps as started on the poll after they've been watched."""
+
+    def __init__(self):
+        self.watched_apps = []
+        self.staged_apps = []
+
+    @property
+    def watched_count(self):
+        return len(self.watched_apps)
+
+    def watch(self, app_guid, app):
+        self.watched_apps.append(app)
+        self.staged_apps.append(app.name)
+
+    def poll(self):
+        started_apps, self.watched_apps = self.watched_apps, []
+        return started_apps
+
+
+class FakeAppSteps(object):
+    """Records the deployment steps of the apps."""
+
+    def __init__(self):
+        self.events = []
+
+    def push(self, app):
+        self.events.append('push ' + app.name)
+        # "C" is pushed with --no-start, there's nothing to wait for
+        return None if app.name == 'C' else app.name + '-guid'
+
+    def finish(self, app):
+        self.events.append('finish ' + app.name)
+        return [app.name + '-affected']
+
+
+def test_map_in_parallel():
+    assert scheduling.map_in_parallel(lambda item: item * 2, [1, 2, 3], 2) == [2, 4, 6]
+
+
+def test_async_staging_deployment(monkeypatch):
+    monkeypatch.setattr('apployer.cf_api.POLL_INTERVAL', 0)
+    apps = [AppConfig(name) for name in ('A', 'B', 'C')] + [AppConfig('D', order=0)]
+    app_graph = AppGraph(apps)
+    app_graph.add_dependency(apps[1], apps[0])
+    app_steps = FakeAppSteps()
+    staging_poller = FakeStagingPoller()
+
+    apps_to_restart = scheduling.AsyncStagingDeployment(
+        app_steps, 2, staging_poller, DeploymentHistory(None)).deploy(
+            app_graph, [apps[3]] + apps[:3])
+
+    assert sorted(apps_to_restart) == ['A-affected', 'B-affected', 'C-affected', 'D-affected']
+    assert staging_poller.staged_apps == ['D', 'A', 'B']
+    # "D" is pinned to the first position, others wait for it
+    assert app_steps.events[:2] == ['push D', 'finish D']
+    assert app_steps.events.index('push B') > app_steps.events.index('finish A')
+
+
+def test_async_staging_deployment_error():
+    apps = [AppConfig('A'), AppConfig('B')]
+    app_graph = AppGraph(apps)
+    app_graph.add_dependency(apps[1], apps[0])
+    app_steps = MagicMock()
+    app_steps.push.side_effect = CommandFailedError('push failed')
+
+    with pytest.raises(CommandFailedError):
+        scheduling.AsyncStagingDeployment(
+            app_steps, 2, FakeStagingPoller(), DeploymentHistory(None)).deploy(app_graph, apps)
+    app_steps.push.assert_called_once_with(apps[0])
+
+
+def test_async_staging_deployment_staging_duration(monkeypatch):
+    monkeypatch.setattr('apployer.cf_api.POLL_INTERVAL', 0)
+    apps = [AppConfig('A')]
+    app_steps = FakeAppSteps()
+    push = app_steps.push
+    def slow_push(app):
+        time.sleep(0.3)
+        return push(app)
+    app_steps.push = slow_push
+    deployment_history = DeploymentHistory(None)
+
+    scheduling.AsyncStagingDeployment(
+        app_steps, 1, FakeStagingPoller(), deployment_history).deploy(AppGraph(apps), apps)
+
+    # the push itself isn't a part of staging
+    assert deployment_history.get_phase_durations('A')['staging'] < 0.2
@@ -0,0 +1,70 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from mock import MagicMock
+import pytest
+
+from apployer.cf_cli import CommandFailedError
+from apployer.staging import StagingPoller
+
+
+def _app_summary(guid, package_state, running_instances=0):
+    return {'guid': guid, 'name': guid + '-name', 'package_state': package_state,
+            'running_instances': running_instances}
+
+
+@pytest.fixture
+def mock_get_space_apps(monkeypatch):
+    mock_get = MagicMock()
+    monkeypatch.setattr('apployer.cf_api.get_space_apps', mock_get)
+    return mock_get
+
+
+def test_poll(mock_get_space_apps):
+    mock_get_space_apps.return_value = [_app_summary('a', 'STAGED', 1),
+                                        _app_summary('b', 'PENDING'),
+                                        _app_summary('c', 'STAGED', 0),
+                                        _app_summary('not-watched', 'STAGED', 1)]
+    poller = StagingPoller('space-guid')
+    for guid in ('a', 'b', 'c'):
+        poller.watch(guid, guid + '-item')
+
+    assert poller.poll() == ['a-item']
+    assert poller.watched_count == 2
+    mock_get_space_apps.assert_called_once_with('space-guid')
+
+
+def test_poll_nothing_watched(mock_get_space_apps):
+    assert StagingPoller('space-guid').poll() == []
+    assert not mock_get_space_apps.called
+
+
+def test_poll_staging_failed(mock_get_space_apps):
+    mock_get_space_apps.return_value = [_app_summary('a', 'FAILED')]
+    poller = StagingPoller('space-guid')
+    poller.watch('a', 'a-item')
+
+    with pytest.raises(CommandFailedError):
+        poller.poll()
+
+
+def test_poll_timeout(mock_get_space_apps):
+    mock_get_space_apps.return_value = [_app_summary('a', 'PENDING')]
+    poller = StagingPoller('space-guid', timeout=-1)
+    poller.watch('a', 'a-item')
+
+    with pytest.raises(CommandFailedError):
+        poller.poll()
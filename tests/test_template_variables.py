@@ -0,0 +1,114 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+
+import pytest
+
+from apployer import template_variables
+from apployer.template_variables import VariableIndex, record_fill, get_changed_steps
+
+EXPANDED_APPSTACK = """apps:
+- app_properties:
+    env:
+      KEYTAB: '{{ hgm_keytab_value }}'
+      PORT: '{{ sentry_port }}'
+  name: hdfs-broker
+  user_provided_services:
+  - credentials:
+      keytab: '{{ hgm_keytab_value }}'
+    name: hdfs-service
+- app_properties:
+    env:
+      HOST: '{{ sentry_host }}:{{ sentry_port }}'
+      USER: '{% if kerberos_host %}{{ kerberos_user }}{% endif %}'
+  name: sentry-broker
+brokers:
+- auth_password: '{{ docker_broker_pass }}'
+  auth_username: admin
+  name: docker
+  url: http://docker.example.com
+domain: '{{ apps_domain }}'
+user_provided_services:
+- credentials:
+    password: '{{ sso_pass }}'
+  name: sso
+"""
+
+
+@pytest.fixture
+def expanded_appstack_path(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir.strpath)
+    expanded_appstack = tmpdir.join('expanded_appstack.yml')
+    expanded_appstack.write(EXPANDED_APPSTACK)
+    return expanded_appstack.strpath
+
+
+def test_variable_index():
+    index = VariableIndex(EXPANDED_APPSTACK)
+
+    assert index.steps == {
+        'hgm_keytab_value': {'app:hdfs-broker'},
+        'sentry_port': {'app:hdfs-broker', 'app:sentry-broker'},
+        'sentry_host': {'app:sentry-broker'},
+        'kerberos_host': {'app:sentry-broker'},
+        'kerberos_user': {'app:sentry-broker'},
+        'docker_broker_pass': {'broker:docker'},
+        'sso_pass': {'user_provided_service:sso'},
+    }
+    assert index.global_variables == {'apps_domain'}
+
+
+def test_get_affected_steps():
+    index = VariableIndex(EXPANDED_APPSTACK)
+
+    assert index.get_affected_steps(['sentry_port', 'sso_pass', 'unused']) == \
+        {'app:hdfs-broker', 'app:sentry-broker', 'user_provided_service:sso'}
+    assert index.get_affected_steps(['sso_pass', 'apps_domain']) is None
+
+
+def test_get_changed_steps(expanded_appstack_path):
+    config = {'hgm_keytab_value': 'old-keytab', 'sso_pass': 'pass', 'apps_domain': 'example.com'}
+    record_fill(expanded_appstack_path, config)
+    record_fill(expanded_appstack_path, dict(config, hgm_keytab_value='new-keytab'))
+
+    assert get_changed_steps() == {'app:hdfs-broker'}
+
+
+def test_get_changed_steps_global_variable(expanded_appstack_path):
+    record_fill(expanded_appstack_path, {'apps_domain': 'example.com'})
+    record_fill(expanded_appstack_path, {'apps_domain': 'example.org'})
+
+    assert get_changed_steps() is None
+
+
+def test_get_changed_steps_expanded_appstack_changed(expanded_appstack_path):
+    record_fill(expanded_appstack_path, {'sso_pass': 'pass'})
+    with open(expanded_appstack_path, 'a') as expanded_appstack_file:
+        expanded_appstack_file.write('buildpacks:\n- new-buildpack\n')
+    record_fill(expanded_appstack_path, {'sso_pass': 'pass'})
+
+    assert get_changed_steps() is None
+
+
+def test_get_changed_steps_single_fill(expanded_appstack_path):
+    record_fill(expanded_appstack_path, {'sso_pass': 'pass'})
+
+    with pytest.raises(IOError):
+        get_changed_steps()
+    # credentials aren't written out
+    with open(template_variables.FILL_RECORD_PATH) as fill_record_file:
+        assert json.load(fill_record_file)['variables']['sso_pass'] != 'pass'
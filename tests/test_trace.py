@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+
+import pytest
+
+from apployer import cf_cli, trace
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = trace.Tracer()
+    monkeypatch.setattr('apployer.trace._tracer', tracer)
+    tracer.start()
+    return tracer
+
+
+def test_span_with_context(tracer):
+    with trace.context(phase='app', app='some-app'):
+        with trace.context(phase='push'):
+            with trace.span('push', attempt=1):
+                pass
+        with trace.span('registration'):
+            pass
+
+    push_event, registration_event = tracer.events
+    assert push_event['name'] == 'push'
+    assert push_event['ph'] == 'X'
+    assert push_event['cat'] == 'push'
+    assert push_event['args'] == {'phase': 'push', 'app': 'some-app', 'attempt': 1}
+    assert registration_event['cat'] == 'app'
+    assert tracer.get_context() == {}
+
+
+def test_span_disabled():
+    tracer = trace.Tracer()
+    with tracer.span('something'):
+        pass
+    assert tracer.events == []
+
+
+def test_span_listener():
+    tracer = trace.Tracer()
+    listener_calls = []
+    listener = lambda *args: listener_calls.append(args)
+    tracer.add_listener(listener)
+
+    with tracer.context(app='some-app'), tracer.span('push'):
+        pass
+    tracer.remove_listener(listener)
+    with tracer.span('push'):
+        pass
+
+    assert [(name, args) for name, _, args in listener_calls] == [('push', {'app': 'some-app'})]
+    # tracing is disabled, so nothing is recorded
+    assert tracer.events == []
+
+
+def test_span_on_error(tracer):
+    with pytest.raises(ValueError):
+        with trace.span('failing'):
+            raise ValueError()
+    assert [event['name'] for event in tracer.events] == ['failing']
+
+
+@pytest.mark.parametrize('command, name', [
+    (['cf', 'auth', 'admin', 'secret-password'], 'cf auth'),
+    ('cf curl /v2/info', 'cf curl'),
+])
+def test_get_command_name(command, name):
+    assert trace.get_command_name(command) == name
+
+
+def test_traced_cf_command(tracer, mock_popen, tmpdir):
+    mock_popen.set_command('cf restart some-app')
+    with trace.context(phase='restart_apps'):
+        cf_cli.restart('some-app')
+
+    trace_path = tmpdir.join('trace.json').strpath
+    tracer.save(trace_path)
+    with open(trace_path) as trace_file:
+        saved_trace = json.load(trace_file)
+    assert [(event['name'], event['cat']) for event in saved_trace['traceEvents']] == \
+        [('cf restart', 'restart_apps')]
@@ -0,0 +1,105 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import json
+
+from mock import MagicMock
+import pytest
+
+from apployer import upsi
+from apployer.appstack import UserProvidedService
+from apployer.cf_cli import CommandFailedError
+
+from .test_cf_api import SERVICE_BINDING
+
+
+@pytest.fixture
+def mock_cf_cli(monkeypatch):
+    mock_cf = MagicMock()
+    monkeypatch.setattr('apployer.upsi.cf_cli', mock_cf)
+    return mock_cf
+
+
+@pytest.fixture
+def mock_cf_api(monkeypatch):
+    cf_api = MagicMock()
+    monkeypatch.setattr('apployer.upsi.cf_api', cf_api)
+    return cf_api
+
+
+@pytest.fixture
+def upsi_deployer():
+    service = UserProvidedService('some-name', {'a': 'b'})
+    return upsi.UpsiDeployer(service)
+
+
+def test_create_user_provided_service(mock_cf_cli, upsi_deployer):
+    mock_cf_cli.get_service_guid.side_effect = CommandFailedError
+
+    upsi_deployer.deploy()
+
+    mock_cf_cli.get_service_guid.assert_called_with(upsi_deployer.service.name)
+    mock_cf_cli.create_user_provided_service.assert_called_with(
+        upsi_deployer.service.name, json.dumps(upsi_deployer.service.credentials))
+
+
+def test_update_user_provided_service_needed(mock_cf_cli, upsi_deployer):
+    service_guid = 'some-fake-guid'
+    app_guids = ['some', 'fake', 'guids']
+    mock_cf_cli.get_service_guid.return_value = service_guid
+    mock_update = MagicMock(return_value=app_guids)
+    upsi_deployer._update = mock_update
+
+    assert upsi_deployer.deploy() == app_guids
+
+    mock_update.assert_called_with(service_guid)
+
+
+def test_update_upsi(mock_cf_api, mock_cf_cli, upsi_deployer):
+    service_guid = 'some-fake-guid'
+    service_bindings = [SERVICE_BINDING]
+    mock_cf_api.get_upsi_bindings.return_value = service_bindings
+    mock_cf_api.get_upsi_credentials.return_value = {'something': 123}
+    upsi_deployer._recreate_bindings = MagicMock()
+
+    assert upsi_deployer._update(service_guid) == [SERVICE_BINDING['entity']['app_guid']]
+
+    mock_cf_api.get_upsi_credentials.assert_called_with(service_guid)
+    mock_cf_api.get_upsi_bindings.assert_called_with(service_guid)
+    mock_cf_cli.update_user_provided_service(
+        upsi_deployer.service.name, json.dumps(upsi_deployer.service.credentials))
+    upsi_deployer._recreate_bindings.assert_called_with(service_bindings)
+
+
+def test_update_upsi_not_needed(mock_cf_api, mock_cf_cli, upsi_deployer):
+    service_guid = 'some-fake-guid'
+    mock_cf_api.get_upsi_credentials.return_value = upsi_deployer.service.credentials
+
+    assert upsi_deployer._update(service_guid) == []
+
+    mock_cf_api.get_upsi_credentials.assert_called_with(service_guid)
+    assert not mock_cf_api.get_upsi_bindings.call_args_list
+    assert not mock_cf_cli.update_user_provided_service.call_args_list
+
+
+def test_rebind_services(mock_cf_api, upsi_deployer):
+    upsi_deployer._recreate_bindings([SERVICE_BINDING])
+
+    mock_cf_api.delete_service_binding.assert_called_with(SERVICE_BINDING)
+    mock_cf_api.create_service_binding.assert_called_with(
+        SERVICE_BINDING['entity']['service_instance_guid'],
+        SERVICE_BINDING['entity']['app_guid'])